@@ -0,0 +1,140 @@
+"""
+換班確認權杖模組 - 將換班請求的內容 (店家、請求者、目標用戶、時段) 以 HMAC 簽名後放進確認按鈕的 postback 資料，
+任何 worker 都能直接驗證並執行，不需查詢換班請求記錄；只需記錄已使用的 nonce 以防止重複使用
+"""
+import os
+import re
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import secrets
+from typing import Optional, NamedTuple, Tuple
+
+# 簽名金鑰，未設置時由呼叫端改用 LINE Channel Secret (所有 worker 相同)
+APPROVAL_TOKEN_SECRET = os.getenv("APPROVAL_TOKEN_SECRET", "")
+# 確認權杖的有效時間（秒）
+APPROVAL_TOKEN_TTL = int(os.getenv("APPROVAL_TOKEN_TTL", str(7 * 24 * 3600)))
+
+TOKEN_VERSION = 1
+# 簽名長度（位元組），取 HMAC-SHA256 的前 128 位元
+SIGNATURE_SIZE = 16
+NONCE_SIZE = 8
+# 版本、到期時間、nonce
+_HEADER = struct.Struct(">BI8s")
+# LINE 用戶 ID (U 加上 32 個十六進位字元) 以 16 位元組儲存
+_LINE_ID_PATTERN = re.compile(r"[UCR][0-9a-f]{32}")
+_LINE_ID_PREFIXES = {0xFD: "U", 0xFE: "C", 0xFF: "R"}
+_MAX_TEXT_SIZE = 0xFC
+
+
+class InvalidApprovalToken(Exception):
+    """
+    確認權杖格式錯誤、簽名不符或已過期
+    """
+
+
+class ShiftApproval(NamedTuple):
+    """
+    確認權杖的內容
+    """
+    tenant_id: str
+    requester_id: str
+    target_id: str
+    date: str
+    slot: str
+    expires_at: int
+    nonce: str
+
+
+def _pack_text(value: str) -> bytes:
+    if _LINE_ID_PATTERN.fullmatch(value):
+        marker = next(key for key, prefix in _LINE_ID_PREFIXES.items() if prefix == value[0])
+        return bytes([marker]) + bytes.fromhex(value[1:])
+    data = value.encode("utf-8")
+    if len(data) > _MAX_TEXT_SIZE:
+        raise ValueError(f"欄位過長: {value[:20]}")
+    return bytes([len(data)]) + data
+
+
+def _unpack_text(data: bytes, offset: int) -> Tuple[str, int]:
+    marker = data[offset]
+    offset += 1
+    if marker in _LINE_ID_PREFIXES:
+        end = offset + 16
+        if end > len(data):
+            raise InvalidApprovalToken("權杖內容不完整")
+        return _LINE_ID_PREFIXES[marker] + data[offset:end].hex(), end
+    end = offset + marker
+    if end > len(data):
+        raise InvalidApprovalToken("權杖內容不完整")
+    return data[offset:end].decode("utf-8"), end
+
+
+class ApprovalSigner:
+    """
+    確認權杖的簽發與驗證
+    """
+    def __init__(self, secret: str, ttl: int = APPROVAL_TOKEN_TTL):
+        if not secret:
+            raise ValueError("未設置確認權杖的簽名金鑰")
+        self._key = hashlib.sha256(b"shift-approval:" + secret.encode("utf-8")).digest()
+        self.ttl = ttl
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+    def issue(self, tenant_id: str, requester_id: str, target_id: str, date: str, slot: str,
+              now: Optional[float] = None) -> str:
+        """
+        簽發確認權杖
+
+        Args:
+            tenant_id: 店家 ID
+            requester_id: 請求者的 LINE ID
+            target_id: 目標用戶的 LINE ID
+            date: 日期 (YYYYMMDD)
+            slot: 時段，例如 08:00
+
+        Returns:
+            URL 安全的 base64 字串 (不含 =，可直接放在 postback 資料中)
+        """
+        expires_at = int((now or time.time()) + self.ttl)
+        payload = _HEADER.pack(TOKEN_VERSION, expires_at, secrets.token_bytes(NONCE_SIZE)) + b"".join(
+            _pack_text(value) for value in (tenant_id or "", requester_id, target_id, date, slot)
+        )
+        return base64.urlsafe_b64encode(payload + self._sign(payload)).rstrip(b"=").decode("ascii")
+
+    def verify(self, token: str, now: Optional[float] = None) -> ShiftApproval:
+        """
+        驗證確認權杖
+
+        Returns:
+            權杖的內容
+
+        Raises:
+            InvalidApprovalToken: 格式錯誤、簽名不符或已過期
+        """
+        try:
+            data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (ValueError, TypeError):
+            raise InvalidApprovalToken("權杖格式錯誤")
+        if len(data) < _HEADER.size + SIGNATURE_SIZE:
+            raise InvalidApprovalToken("權杖格式錯誤")
+        payload, signature = data[:-SIGNATURE_SIZE], data[-SIGNATURE_SIZE:]
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidApprovalToken("簽名不符")
+
+        version, expires_at, nonce = _HEADER.unpack_from(payload)
+        if version != TOKEN_VERSION:
+            raise InvalidApprovalToken(f"不支援的權杖版本: {version}")
+        if expires_at < (now or time.time()):
+            raise InvalidApprovalToken("權杖已過期")
+        values = []
+        offset = _HEADER.size
+        for _ in range(5):
+            value, offset = _unpack_text(payload, offset)
+            values.append(value)
+        tenant_id, requester_id, target_id, date, slot = values
+        return ShiftApproval(tenant_id, requester_id, target_id, date, slot, expires_at, nonce.hex())
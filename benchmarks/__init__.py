@@ -0,0 +1,20 @@
+"""
+效能測試套件 - 以模擬的 LINE webhook 與 Google Calendar 離線量測系統吞吐量與延遲
+"""
+import os
+
+# 匯入 main 所需的環境變數，效能測試不連線到 LINE 與 Google
+BENCHMARK_ENV = {
+    "LINE_CHANNEL_SECRET": "benchmark_secret",
+    "LINE_CHANNEL_ACCESS_TOKEN": "benchmark_token",
+    "GOOGLE_CALENDAR_ID": "benchmark@group.calendar.google.com",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def prepare_environment():
+    """
+    設置未指定的環境變數，需在匯入 main 前呼叫
+    """
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
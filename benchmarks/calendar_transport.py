@@ -0,0 +1,253 @@
+"""
+日曆 HTTP 傳輸測試 - 以本機的模擬 Calendar REST API 比較 googleapiclient 預設的 httplib2 傳輸與共用連線池 (PooledHttp)
+
+模擬 API 以 FakeCalendarService 回應 events.list / events.get，與 Google 相同只在 Accept-Encoding 與 User-Agent
+皆含 gzip 時壓縮回應，並記錄建立的連線數與傳送的位元組數。httplib2 模式每個執行緒各自建立客戶端
+(httplib2.Http 不可跨執行緒使用，與 Tenant 的做法相同)，pooled 模式所有執行緒共用同一個客戶端與連線池。
+
+執行方式 (於專案根目錄):
+    python -m benchmarks.calendar_transport --threads 8 32 --requests 400 --events 42 --latency 0.002
+"""
+import gzip
+import json
+import time
+import argparse
+import threading
+import statistics
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Any, Callable
+
+from benchmarks import prepare_environment
+
+prepare_environment()
+
+import calendar_client
+from fake_calendar import FakeCalendarService
+from http_transport import PooledHttp, CALENDAR_HTTP_POOL_SIZE
+
+# 模擬 API 的日曆 ID
+CALENDAR_ID = "benchmark@group.calendar.google.com"
+# events.list 查詢參數 -> FakeEventsResource.list 參數的型別轉換
+_LIST_PARAMS = {
+    "timeMin": str,
+    "timeMax": str,
+    "q": str,
+    "orderBy": str,
+    "pageToken": str,
+    "syncToken": str,
+    "fields": str,
+    "maxResults": int,
+    "singleEvents": lambda value: value == "true",
+    "showDeleted": lambda value: value == "true",
+}
+
+
+class FakeCalendarHandler(BaseHTTPRequestHandler):
+    """
+    模擬的 Calendar v3 REST API - 支援 events.list 與 events.get，連線保持 (HTTP/1.1 keep-alive)
+    """
+    protocol_version = "HTTP/1.1"
+    # 標頭與內容分兩次寫出，關閉 Nagle 避免與延遲 ACK 互等約 40ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/")]
+        # calendar/v3/calendars/{calendarId}/events[/{eventId}]
+        if len(parts) < 5 or parts[:3] != ["calendar", "v3", "calendars"] or parts[4] != "events":
+            self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+            return
+        events = self.server.calendar.events()
+        if len(parts) == 6:
+            request = events.get(calendarId=parts[3], eventId=parts[5], fields=query.get("fields"))
+        else:
+            params = {key: _LIST_PARAMS[key](value) for key, value in query.items() if key in _LIST_PARAMS}
+            request = events.list(calendarId=parts[3], **params)
+        try:
+            result = request.execute()
+        except Exception as e:
+            status = getattr(getattr(e, "resp", None), "status", 500)
+            self._send(int(status), {"error": {"code": int(status), "message": str(e)}})
+            return
+        self._send(200, result)
+
+    def _send(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        compress = ("gzip" in self.headers.get("Accept-Encoding", "")
+                    and "gzip" in self.headers.get("User-Agent", ""))
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # 送出內容前先記錄，用戶端收到回應時統計已更新
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            self.server.stats["bytes"] += len(body)
+            self.server.stats["gzip"] += 1 if compress else 0
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端已逾時並關閉連線
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_calendar(calendar: FakeCalendarService) -> ThreadingHTTPServer:
+    """
+    在背景執行緒啟動模擬的 Calendar REST API
+
+    Args:
+        calendar: 提供事件資料的模擬日曆
+
+    Returns:
+        HTTP 服務，以 api_endpoint(server) 取得客戶端的 API 網址，server.stats 為統計
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCalendarHandler)
+    server.daemon_threads = True
+    server.calendar = calendar
+    server.stats_lock = threading.Lock()
+    reset_stats(server)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_stats(server: ThreadingHTTPServer):
+    with server.stats_lock:
+        server.stats = {"connections": 0, "requests": 0, "bytes": 0, "gzip": 0}
+
+
+def api_endpoint(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/calendar/v3/"
+
+
+def seed_calendar(events: int, latency: float) -> FakeCalendarService:
+    """
+    建立含一週排班的模擬日曆，事件描述含換班歷史，接近實際的回應大小
+    """
+    calendar = FakeCalendarService(latency=latency)
+    history = "\n".join(f"2025-06-0{day} 10:00 人員{day} 換班給 人員{day + 1}" for day in range(1, 6))
+    calendar.seed_events(CALENDAR_ID, [
+        {
+            "id": f"event{index}",
+            "summary": f"班表: 人員{index % 6}",
+            "description": history,
+            "start": {"dateTime": f"2025-06-{2 + index // 6:02d}T{8 + 2 * (index % 6):02d}:00:00+08:00"},
+            "end": {"dateTime": f"2025-06-{2 + index // 6:02d}T{9 + 2 * (index % 6):02d}:00:00+08:00"},
+        }
+        for index in range(events)
+    ])
+    return calendar
+
+
+def run_transport(server: ThreadingHTTPServer, make_client: Callable[[], Any], per_thread: bool,
+                  threads: int, requests: int) -> Dict[str, Any]:
+    """
+    以多個執行緒查詢一週的排班
+
+    Args:
+        server: 模擬的 Calendar API
+        make_client: 建立 Google API 客戶端
+        per_thread: 是否每個執行緒各自建立客戶端
+        threads: 執行緒數
+        requests: 總請求數
+
+    Returns:
+        統計結果
+    """
+    reset_stats(server)
+    local = threading.local()
+    shared = None if per_thread else make_client()
+    latencies = []
+    lock = threading.Lock()
+
+    def client() -> Any:
+        if shared is not None:
+            return shared
+        service = getattr(local, "service", None)
+        if service is None:
+            service = local.service = make_client()
+        return service
+
+    def one(_):
+        start = time.perf_counter()
+        result = client().events().list(
+            calendarId=CALENDAR_ID,
+            timeMin="2025-06-01T00:00:00+08:00",
+            timeMax="2025-06-30T00:00:00+08:00",
+            singleEvents=True,
+            orderBy="startTime"
+        ).execute()
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+        return len(result.get("items", []))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        counts = list(executor.map(one, range(requests)))
+    total = time.perf_counter() - start
+    latencies.sort()
+    with server.stats_lock:
+        stats = dict(server.stats)
+    return {
+        "requests": requests,
+        "events": counts[0] if counts else 0,
+        "seconds": round(total, 3),
+        "rps": round(requests / total, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "connections": stats["connections"],
+        "gzip_responses": stats["gzip"],
+        "kb_per_response": round(stats["bytes"] / max(stats["requests"], 1) / 1024, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    import httplib2
+
+    parser = argparse.ArgumentParser(description="日曆 HTTP 傳輸測試")
+    parser.add_argument("--threads", type=int, nargs="+", default=[8, 32], help="執行緒數，可指定多個")
+    parser.add_argument("--requests", type=int, default=400, help="每種情境的總請求數")
+    parser.add_argument("--events", type=int, default=42, help="日曆中的事件數")
+    parser.add_argument("--latency", type=float, default=0.002, help="模擬 API 的延遲（秒）")
+    parser.add_argument("--pool-size", type=int, default=CALENDAR_HTTP_POOL_SIZE, help="連線池每個主機的連線數")
+    args = parser.parse_args(argv)
+
+    server = start_fake_calendar(seed_calendar(args.events, args.latency))
+    options = {"api_endpoint": api_endpoint(server)}
+    results = []
+    for threads in args.threads:
+        pooled = PooledHttp(pool_size=args.pool_size)
+        transports = [
+            ("httplib2", lambda: calendar_client.build(http=httplib2.Http(timeout=30), client_options=options), True),
+            ("pooled", lambda: calendar_client.build(http=pooled, client_options=options), False),
+        ]
+        # 暖機，載入 discovery 文件的一次性成本不計入
+        for _, make_client, _ in transports:
+            make_client()
+        for name, make_client, per_thread in transports:
+            result = run_transport(server, make_client, per_thread, threads, args.requests)
+            results.append(dict(result, transport=name, threads=threads))
+        pooled.close()
+    server.shutdown()
+
+    print(json.dumps({"latency": args.latency, "pool_size": args.pool_size, "results": results},
+                     ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
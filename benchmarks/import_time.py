@@ -0,0 +1,129 @@
+"""
+匯入時間量測 - 以 python -X importtime 量測冷啟動時匯入 main 的時間，超過預算或提前載入了應延後匯入的模組時以非零狀態結束
+
+執行方式 (於專案根目錄):
+    python -m benchmarks.import_time                  # 量測並與預算比較
+    python -m benchmarks.import_time --budget-ms 600  # 指定預算
+    python -m benchmarks.import_time --top 20         # 列出最慢的 20 個直接匯入
+    python -m benchmarks.import_time --module src.line_bot  # 量測 LINE Bot 路由模組
+"""
+import os
+import sys
+import argparse
+import subprocess
+from typing import Dict, List, Optional, Any
+
+from benchmarks import BENCHMARK_ENV
+
+# 專案根目錄
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 匯入 main 的時間預算（毫秒）
+DEFAULT_BUDGET_MS = 800
+
+# 載入較慢、應在第一次使用或啟動預熱時才匯入的模組
+DEFERRED_MODULES = (
+    "googleapiclient.discovery",
+    "googleapiclient.errors",
+    "google.oauth2.service_account",
+    "linebot",
+)
+
+
+def parse_importtime(output: str) -> List[Dict[str, Any]]:
+    """
+    解析 -X importtime 的輸出
+
+    Returns:
+        每個模組的名稱、自身時間、累計時間（微秒）與巢狀深度
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        stripped = name.lstrip(" ")
+        entries.append({
+            "module": stripped.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            # 每層巢狀多縮排兩個空白
+            "depth": (len(name) - len(stripped) - 1) // 2,
+        })
+    return entries
+
+
+def measure_import(module: str = "main", repeat: int = 3) -> Dict[str, Any]:
+    """
+    在新的直譯器中量測匯入模組的時間，取多次中最快的一次
+
+    Args:
+        module: 要匯入的模組
+        repeat: 量測次數
+
+    Returns:
+        總時間（毫秒）、各模組的量測結果與已載入的模組名稱
+    """
+    env = dict(os.environ)
+    for key, value in BENCHMARK_ENV.items():
+        env.setdefault(key, value)
+    best = None
+    for _ in range(max(1, repeat)):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"匯入 {module} 失敗:\n{result.stderr[-2000:]}")
+        entries = parse_importtime(result.stderr)
+        root = next((entry for entry in entries if entry["module"] == module and entry["depth"] == 0), None)
+        if root is None:
+            raise RuntimeError(f"找不到 {module} 的匯入時間")
+        if best is None or root["cumulative_us"] < best["total_us"]:
+            best = {"total_us": root["cumulative_us"], "entries": entries}
+
+    return {
+        "module": module,
+        "total_ms": round(best["total_us"] / 1000, 1),
+        "entries": best["entries"],
+        "modules": {entry["module"] for entry in best["entries"]},
+    }
+
+
+def slowest_imports(entries: List[Dict[str, Any]], top: int = 10) -> List[Dict[str, Any]]:
+    """
+    列出根模組最慢的直接匯入
+    """
+    direct = [entry for entry in entries if entry["depth"] == 1]
+    return sorted(direct, key=lambda entry: entry["cumulative_us"], reverse=True)[:top]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="量測匯入 main 的冷啟動時間")
+    parser.add_argument("--module", default="main", help="要量測的模組")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="匯入時間預算（毫秒）")
+    parser.add_argument("--repeat", type=int, default=3, help="量測次數，取最快的一次")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的直接匯入數量")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    result = measure_import(args.module, args.repeat)
+    print(f"匯入 {args.module}: {result['total_ms']}ms (預算 {args.budget_ms}ms)")
+    for entry in slowest_imports(result["entries"], args.top):
+        print(f"  {entry['module']:<40} {entry['cumulative_us'] / 1000:>8.1f}ms")
+
+    exit_code = 0
+    loaded = [name for name in DEFERRED_MODULES if name in result["modules"]]
+    if loaded:
+        print(f"以下模組應延後匯入: {', '.join(loaded)}")
+        exit_code = 1
+    if result["total_ms"] > args.budget_ms:
+        print(f"匯入時間超過預算 {result['total_ms'] - args.budget_ms:.1f}ms")
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
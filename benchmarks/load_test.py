@@ -0,0 +1,322 @@
+"""
+壓力測試 - 以帶簽名的 LINE webhook 請求測試 FastAPI 應用，Google Calendar 與 LINE API 皆以記憶體模擬
+
+執行方式 (於專案根目錄):
+    python -m benchmarks.load_test --requests 500 --concurrency 8 --calendar-latency 0.05
+    python -m benchmarks.load_test --compare --max-regression 20
+
+每次執行的結果附加到 --history 檔案，--compare 會與相同情境的上一次結果比較，
+任一延遲百分位數或吞吐量退步超過門檻時以非零狀態結束，可用於部署前檢查。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Any
+
+import httpx
+
+from benchmarks import prepare_environment
+from fake_calendar import FakeCalendarService
+from benchmarks.webhook_payloads import WebhookPayloadGenerator
+
+# 匯入 main 前先設置必要的環境變數
+prepare_environment()
+
+# 預設的結果紀錄檔
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "load_test.jsonl")
+
+
+class FakeLineResponse:
+    """
+    模擬的 LINE API 回應
+    """
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = "{}" if status_code == 200 else '{"message": "Internal Server Error"}'
+
+    @property
+    def json(self) -> Dict[str, Any]:
+        return json.loads(self.text)
+
+
+class FakeLineHttpClient:
+    """
+    模擬的 LINE API HTTP 客戶端 - 取代 LineBotApi.http_client，可設定延遲與失敗率
+    """
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.timeout = 5
+        self.calls = {}
+        self._random = random.Random(seed)
+
+    def post(self, url: str, headers: Optional[Dict[str, str]] = None, data: Any = None, timeout: Any = None):
+        path = url.split("/v2/bot/", 1)[-1]
+        self.calls[path] = self.calls.get(path, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            return FakeLineResponse(500)
+        return FakeLineResponse(200)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, params: Any = None,
+            stream: bool = False, timeout: Any = None):
+        return self.post(url, headers, timeout=timeout)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    以最近排名法計算百分位數
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    計算延遲統計（毫秒）
+    """
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def configure_app(args: argparse.Namespace):
+    """
+    匯入應用程式，並將 Google Calendar 與 LINE API 換成模擬的後端
+
+    Returns:
+        (main 模組, 模擬日曆, 模擬 LINE 客戶端, 各指令的處理時間)
+    """
+    import main
+
+    calendar = FakeCalendarService(
+        latency=args.calendar_latency,
+        latency_jitter=args.calendar_jitter,
+        failure_rate=args.calendar_failure_rate,
+        seed=args.seed
+    )
+    tenant = main.default_tenant
+    tenant.service_factory = lambda: calendar
+    tenant._clients = threading.local()
+    # 壓力測試量測的是應用程式本身，不受店家請求預算限制
+    tenant.rate_budget.rate = float("inf")
+    tenant.rate_budget.burst = tenant.rate_budget.tokens = 1e12
+
+    line_client = FakeLineHttpClient(args.line_latency, args.line_failure_rate, args.seed)
+    main.line_bot_api.resolve().http_client = line_client
+
+    # 記錄 handle_text_message 各指令的處理時間
+    command_samples = {}
+    handle_text_command = main.handle_text_command
+
+    def timed_handle_text_command(event):
+        started = time.perf_counter()
+        try:
+            return handle_text_command(event)
+        finally:
+            command = main.command_label(event.message.text.strip())
+            command_samples.setdefault(command, []).append(time.perf_counter() - started)
+
+    main.handle_text_command = timed_handle_text_command
+    return main, calendar, line_client, command_samples
+
+
+async def run_load(app: Any, generator: WebhookPayloadGenerator, requests: int, concurrency: int,
+                   batch_size: int, url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    發送 webhook 請求並量測延遲
+
+    Args:
+        app: FastAPI 應用 (url 為空時於同一行程內呼叫)
+        generator: webhook 負載產生器
+        requests: 請求數量
+        concurrency: 同時進行的請求數量
+        batch_size: 每個請求的事件數量
+        url: 已啟動服務的網址
+
+    Returns:
+        原始量測結果
+    """
+    transport = None if url else httpx.ASGITransport(app=app)
+    latencies = []
+    errors = 0
+    events = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url=url or "http://benchmark", timeout=30) as client:
+        async def send():
+            nonlocal errors, events
+            _, body, headers = generator.request(batch_size)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/webhook", content=body.encode("utf-8"), headers=headers)
+                    failed = response.status_code != 200 or response.json().get("message") != "OK"
+                except httpx.HTTPError:
+                    failed = True
+                latencies.append(time.perf_counter() - started)
+            events += batch_size
+            if failed:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[send() for _ in range(requests)])
+        elapsed = time.perf_counter() - started
+
+    return {"latencies": latencies, "errors": errors, "events": events, "elapsed": elapsed}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path: str, entry: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def find_regressions(previous: Dict[str, Any], current: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    比較兩次結果，列出退步超過門檻的項目
+
+    Args:
+        previous: 上一次的結果
+        current: 本次的結果
+        max_regression: 允許的退步百分比
+
+    Returns:
+        退步項目的說明
+    """
+    limit = 1 + max_regression / 100
+    regressions = []
+    pairs = [("webhook", previous["webhook"], current["webhook"])]
+    for command, stats in current["commands"].items():
+        if command in previous["commands"]:
+            pairs.append((f"command {command}", previous["commands"][command], stats))
+    for name, old, new in pairs:
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if old[key] > 0 and new[key] > old[key] * limit:
+                regressions.append(f"{name} {key}: {old[key]} -> {new[key]}")
+    if current["events_per_second"] * limit < previous["events_per_second"]:
+        regressions.append(f"events_per_second: {previous['events_per_second']} -> {current['events_per_second']}")
+    return regressions
+
+
+def print_report(result: Dict[str, Any]):
+    webhook = result["webhook"]
+    print(f"請求數: {webhook['count']}  事件數: {result['events']}  錯誤: {result['errors']}")
+    print(f"吞吐量: {result['requests_per_second']} 請求/秒, {result['events_per_second']} 事件/秒")
+    print(f"webhook 延遲: p50={webhook['p50_ms']}ms p95={webhook['p95_ms']}ms p99={webhook['p99_ms']}ms")
+    for command, stats in sorted(result["commands"].items()):
+        print(f"  {command:<16} n={stats['count']:<5} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    print(f"Google Calendar 請求: {result['calendar_calls']}  失敗: {result['calendar_failures']}")
+    print(f"LINE API 請求: {result['line_calls']}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="LINE webhook 壓力測試")
+    parser.add_argument("--requests", type=int, default=300, help="webhook 請求數量")
+    parser.add_argument("--warmup", type=int, default=20, help="暖機請求數量 (不計入結果)")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時進行的請求數量")
+    parser.add_argument("--batch-size", type=int, default=1, help="每個請求的事件數量")
+    parser.add_argument("--calendar-latency", type=float, default=0.02, help="模擬日曆的請求延遲（秒）")
+    parser.add_argument("--calendar-jitter", type=float, default=0.0, help="模擬日曆延遲的隨機變動（秒）")
+    parser.add_argument("--calendar-failure-rate", type=float, default=0.0, help="模擬日曆的失敗率 (0-1)")
+    parser.add_argument("--line-latency", type=float, default=0.01, help="模擬 LINE API 的請求延遲（秒）")
+    parser.add_argument("--line-failure-rate", type=float, default=0.0, help="模擬 LINE API 的失敗率 (0-1)")
+    parser.add_argument("--seed", type=int, default=42, help="亂數種子")
+    parser.add_argument("--url", default=None, help="已啟動服務的網址，設置時不使用模擬後端")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="結果紀錄檔 (JSONL)")
+    parser.add_argument("--no-record", action="store_true", help="不寫入結果紀錄檔")
+    parser.add_argument("--compare", action="store_true", help="與相同情境的上一次結果比較")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="允許的退步百分比")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    app_module, calendar, line_client, command_samples = configure_app(args)
+    generator = WebhookPayloadGenerator(
+        app_module.LINE_CHANNEL_SECRET,
+        app_module.default_tenant.roster,
+        seed=args.seed
+    )
+
+    if args.warmup:
+        asyncio.run(run_load(app_module.app, generator, args.warmup, args.concurrency, args.batch_size, args.url))
+        command_samples.clear()
+        calendar.calls.clear()
+        calendar.failures = 0
+        line_client.calls.clear()
+
+    raw = asyncio.run(run_load(app_module.app, generator, args.requests, args.concurrency, args.batch_size, args.url))
+    result = {
+        "webhook": summarize(raw["latencies"]),
+        "commands": {command: summarize(samples) for command, samples in command_samples.items()},
+        "events": raw["events"],
+        "errors": raw["errors"],
+        "requests_per_second": round(args.requests / raw["elapsed"], 2),
+        "events_per_second": round(raw["events"] / raw["elapsed"], 2),
+        "calendar_calls": sum(calendar.calls.values()),
+        "calendar_failures": calendar.failures,
+        "line_calls": sum(line_client.calls.values()),
+    }
+    print_report(result)
+
+    # 相同情境的結果才能互相比較
+    scenario = {key: getattr(args, key) for key in (
+        "requests", "concurrency", "batch_size", "calendar_latency", "calendar_jitter",
+        "calendar_failure_rate", "line_latency", "line_failure_rate", "seed", "url")}
+    exit_code = 0
+    if args.compare:
+        previous = [entry for entry in load_history(args.history) if entry["scenario"] == scenario]
+        if previous:
+            regressions = find_regressions(previous[-1]["result"], result, args.max_regression)
+            if regressions:
+                print(f"效能退步超過 {args.max_regression}% (與 {previous[-1].get('commit') or '上一次'} 比較):")
+                for line in regressions:
+                    print(f"  - {line}")
+                exit_code = 1
+            else:
+                print(f"與 {previous[-1].get('commit') or '上一次'} 相比沒有明顯退步")
+        else:
+            print("沒有相同情境的歷史結果可供比較")
+
+    if not args.no_record:
+        append_history(args.history, {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "scenario": scenario,
+            "result": result,
+        })
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
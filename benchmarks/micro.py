@@ -0,0 +1,360 @@
+"""
+微基準測試 - 量測去重、指令處理、排班表渲染與用戶查詢等純 Python 熱點的執行時間與記憶體配置
+
+執行方式 (於專案根目錄):
+    python -m benchmarks.micro                      # 執行並輸出結果
+    python -m benchmarks.micro --save-baseline      # 將結果存為基準
+    python -m benchmarks.micro --compare            # 與基準比較，退步超過門檻時以非零狀態結束
+    python -m benchmarks.micro --filter hash        # 只執行名稱包含 hash 的項目
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+from benchmarks import prepare_environment
+from fake_calendar import FakeCalendarService
+
+prepare_environment()
+
+# 預設的基準檔
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "micro_baseline.json")
+
+# 每輪量測的最短時間（秒），次數依此自動調整
+MIN_ROUND_SECONDS = 0.05
+
+# 發送指令的人員 (鄭銘貴)
+SAMPLE_USER_ID = "U0c63e33715aebc37754bc2cf522ab6fa"
+
+# 指令判斷使用的訊息樣本，涵蓋每個分支與未知指令，{token} 為換班確認權杖
+SAMPLE_TEXTS = [
+    "我希望在20250530 08:00跟你換班 @張書豪-Ragic Customize!",
+    "批准換班:{token}",
+    "新增排班 20250530 08:00-12:00 @鄭銘貴",
+    "批次排班 20250530 13:00 @Eva-家萍",
+    "查詢班表 202506 週五 下午",
+    "月班表 202506",
+    "檢查排班 20250530",
+    "測試日曆",
+    "清理緩存",
+    "幫助",
+    "今天誰上班？",
+]
+
+
+class RecordingLineApi:
+    """
+    取代 LINE API，只記錄送出的訊息
+    """
+    def __init__(self, sent: List[Any]):
+        self.sent = sent
+
+    def reply_message(self, reply_token: str, messages: Any, **kwargs):
+        self.sent.append(messages)
+
+    def push_message(self, to: str, messages: Any, **kwargs):
+        self.sent.append(messages)
+
+    def multicast(self, to: List[str], messages: Any, **kwargs):
+        self.sent.append(messages)
+
+
+def sample_texts(main: Any) -> List[str]:
+    """
+    填入換班確認權杖後的訊息樣本 (張書豪-Ragic Customize! 請 SAMPLE_USER_ID 接手)
+    """
+    token = main.approval_signer.issue("benchmark", "kent1027", SAMPLE_USER_ID, "20250530", "08:00")
+    return [text.format(token=token) for text in SAMPLE_TEXTS]
+
+
+def command_tenant(main: Any) -> Any:
+    """
+    建立以模擬日曆為後端的店家，不受店家請求預算限制
+    """
+    from tenants import Tenant
+
+    calendar = FakeCalendarService()
+    tenant = Tenant("benchmark", "benchmark_calendar", dict(main.USER_MAPPING), lambda: calendar)
+    tenant.rate_budget.rate = float("inf")
+    tenant.rate_budget.burst = tenant.rate_budget.tokens = 1e12
+    main.setup_tenant(tenant)
+    return tenant
+
+
+@contextmanager
+def recorded_line(main: Any, tenant: Any):
+    """
+    以記錄訊息的 LINE API 與指定店家執行 main 的指令處理，結束後還原
+    """
+    from tenants import TenantRegistry
+
+    sent = []
+    original = (main.safe_send_message, main.line_bot_api, main.tenant_registry)
+    main.safe_send_message = lambda method, *args, **kwargs: sent.append(args[1])
+    main.line_bot_api = RecordingLineApi(sent)
+    main.tenant_registry = TenantRegistry(tenant)
+    try:
+        yield sent
+    finally:
+        main.safe_send_message, main.line_bot_api, main.tenant_registry = original
+
+
+def command_dispatch(main: Any, tenant: Any, text: str) -> List[str]:
+    """
+    以 main.handle_text_command 處理一則訊息
+
+    Returns:
+        送出的訊息文字
+    """
+    event = SimpleNamespace(
+        message=SimpleNamespace(text=text),
+        reply_token="benchmark_reply_token",
+        source=SimpleNamespace(type="user", user_id=SAMPLE_USER_ID),
+        webhook_event_id=None
+    )
+    with recorded_line(main, tenant) as sent:
+        main.handle_text_command(event)
+    return [getattr(message, "text", None) or getattr(message, "alt_text", None) for message in sent]
+
+
+def week_events(shifts_per_day: int = 6) -> List[Dict[str, Any]]:
+    """
+    產生一週的排班事件
+    """
+    start = datetime(2025, 6, 2, 8, 0)
+    events = []
+    for day in range(7):
+        for slot in range(shifts_per_day):
+            begin = start + timedelta(days=day, hours=2 * slot)
+            events.append({
+                "id": f"event{day}_{slot}",
+                "etag": f'"{day}{slot}"',
+                "summary": f"班表: 人員{slot}",
+                "start": {"dateTime": begin.isoformat() + "+08:00"},
+                "end": {"dateTime": (begin + timedelta(hours=2)).isoformat() + "+08:00"},
+            })
+    return events
+
+
+def build_cases(selected: Optional[str] = None) -> List[Tuple[str, Callable[[], Callable[[], Any]]]]:
+    """
+    建立量測項目，每個項目為 (名稱, 準備函數)，準備函數回傳要量測的零參數函數
+    """
+    import main
+    from schedule_renderer import WeeklyScheduleRenderer
+    from time_model import TimeModel
+    from user_manager import UserManager
+    from shared_state import MemoryStore
+
+    def hash_dict():
+        operation = {"calendar_id": "c1", "type": "create_or_update", "date": "20250530",
+                     "time": "08:00", "user_a": "鄭銘貴", "user_b": ""}
+        return lambda: main.generate_hash(operation)
+
+    def hash_text():
+        return lambda: main.generate_hash("U0c63e33715aebc37754bc2cf522ab6fa_已成功為 鄭銘貴 新增排班")
+
+    def purge_records(size: int):
+        def setup():
+            # 記錄皆未過期，量測每次清除都要掃描所有記錄的成本
+            now = time.time()
+            records = MemoryStore()
+            records.update({f"hash{i}": now for i in range(size)})
+            return lambda: records.purge(3600, force=True)
+        return setup
+
+    def claim():
+        records = MemoryStore()
+        keys = [f"hash{i}" for i in range(1000)]
+        return lambda: [records.claim(key, 10) for key in keys]
+
+    def dispatch():
+        tenant = command_tenant(main)
+        texts = sample_texts(main)
+        return lambda: [command_dispatch(main, tenant, text) for text in texts]
+
+    def label():
+        return lambda: [main.command_label(text) for text in SAMPLE_TEXTS]
+
+    # 與應用程式相同，事件在查詢時已解析為排班
+    def flex_build():
+        renderer = WeeklyScheduleRenderer()
+        events = TimeModel().parse_shifts(week_events())
+        return lambda: renderer.build_contents(events)
+
+    def flex_cached():
+        renderer = WeeklyScheduleRenderer()
+        events = TimeModel().parse_shifts(week_events())
+        renderer.render(events)
+        return lambda: renderer.render(events)
+
+    def user_manager_lookup(by_name: bool):
+        def setup():
+            path = os.path.join(tempfile.mkdtemp(), "users.db")
+            manager = UserManager(db_path=path)
+            for i in range(50):
+                manager.add_user(f"U{i:032d}", f"用戶{i}", i % 5 == 0)
+            if by_name:
+                return lambda: manager.get_user_id_by_name("用戶49")
+            return lambda: manager.get_user_name(f"U{49:032d}")
+        return setup
+
+    def roster_lookup():
+        tenant = main.default_tenant
+        last_id = list(tenant.roster.values())[-1]
+        return lambda: tenant.user_name(last_id)
+
+    cases = [
+        ("generate_hash[dict]", hash_dict),
+        ("generate_hash[str]", hash_text),
+        ("store_purge[10k]", purge_records(10_000)),
+        ("store_purge[100k]", purge_records(100_000)),
+        ("store_claim[1k]", claim),
+        ("command_dispatch[handle_text_command]", dispatch),
+        ("command_label", label),
+        ("weekly_flex[build]", flex_build),
+        ("weekly_flex[cached_render]", flex_cached),
+        ("user_manager.get_user_name", user_manager_lookup(False)),
+        ("user_manager.get_user_id_by_name", user_manager_lookup(True)),
+        ("tenant.user_name", roster_lookup),
+    ]
+    if selected:
+        cases = [case for case in cases if selected in case[0]]
+    return cases
+
+
+def measure(func: Callable[[], Any], repeat: int = 5, min_time: float = MIN_ROUND_SECONDS) -> Dict[str, float]:
+    """
+    量測函數的執行時間與記憶體配置
+
+    Args:
+        func: 零參數函數
+        repeat: 量測輪數
+        min_time: 每輪的最短時間（秒）
+
+    Returns:
+        每次呼叫的時間（微秒）與記憶體配置統計
+    """
+    # 依單次執行時間決定每輪的呼叫次數
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - started >= min_time / 5 or loops >= 1_000_000:
+            break
+        loops *= 10
+    loops = max(1, int(loops * (min_time / max(time.perf_counter() - started, 1e-9))))
+
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(loops):
+                func()
+            timings.append((time.perf_counter() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    # 記憶體配置另外量測，避免 tracemalloc 影響計時
+    alloc_loops = min(loops, 100)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(alloc_loops):
+            func()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename") if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    timings.sort()
+    return {
+        "loops": loops,
+        "min_us": round(timings[0] * 1e6, 3),
+        "median_us": round(timings[len(timings) // 2] * 1e6, 3),
+        "retained_bytes_per_op": round(allocated / alloc_loops, 1),
+        "retained_blocks_per_op": round(blocks / alloc_loops, 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(baseline: Dict[str, Dict[str, float]], results: Dict[str, Dict[str, float]],
+            max_regression: float) -> List[str]:
+    """
+    與基準比較中位數時間，列出退步超過門檻的項目
+    """
+    limit = 1 + max_regression / 100
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base and stats["median_us"] > base["median_us"] * limit:
+            change = (stats["median_us"] / base["median_us"] - 1) * 100
+            regressions.append(f"{name}: {base['median_us']}us -> {stats['median_us']}us (+{change:.1f}%)")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="純 Python 熱點的微基準測試")
+    parser.add_argument("--filter", default=None, help="只執行名稱包含此字串的項目")
+    parser.add_argument("--repeat", type=int, default=5, help="量測輪數")
+    parser.add_argument("--min-time", type=float, default=MIN_ROUND_SECONDS, help="每輪的最短時間（秒）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準檔 (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="將結果存為基準")
+    parser.add_argument("--compare", action="store_true", help="與基準比較")
+    parser.add_argument("--max-regression", type=float, default=25.0, help="允許的退步百分比")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = {}
+    for name, setup in build_cases(args.filter):
+        results[name] = measure(setup(), args.repeat, args.min_time)
+        if not args.json:
+            stats = results[name]
+            print(f"{name:<36} median={stats['median_us']:>12.3f}us  min={stats['min_us']:>12.3f}us  "
+                  f"retained={stats['retained_bytes_per_op']:>8.1f}B/op  peak={stats['peak_kb']:>8.1f}KB")
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"找不到基準檔: {args.baseline}，請先以 --save-baseline 建立")
+            return 2
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(baseline, results, args.max_regression)
+        if regressions:
+            print(f"效能退步超過 {args.max_regression}%:")
+            for line in regressions:
+                print(f"  - {line}")
+            exit_code = 1
+        else:
+            print("與基準相比沒有明顯退步")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"已儲存基準: {args.baseline}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+多 worker 擴展測試 - 以不同 worker 數量啟動服務 (SHARED_STATE_BACKEND=sqlite)，以相同負載量測吞吐量
+
+Google Calendar 使用記憶體模擬後端 (CALENDAR_BACKEND=fake)，LINE API 指向本機的模擬服務，不需連線。
+已安裝 gunicorn 時以 gunicorn -k uvicorn.workers.UvicornWorker 啟動，否則使用 uvicorn --workers。
+
+執行方式 (於專案根目錄):
+    python -m benchmarks.multiworker --workers 1 2 4 --requests 400 --concurrency 16
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import importlib.util
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Any
+
+import httpx
+
+from benchmarks import BENCHMARK_ENV, prepare_environment
+from benchmarks.load_test import run_load, summarize
+from benchmarks.webhook_payloads import WebhookPayloadGenerator
+
+prepare_environment()
+
+# 專案根目錄
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 等待服務啟動的最長時間（秒）
+STARTUP_TIMEOUT = 60
+
+
+class FakeLineHandler(BaseHTTPRequestHandler):
+    """
+    模擬的 LINE Messaging API - 所有請求皆回傳 200 與空的 JSON
+    """
+    latency = 0.0
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_line(latency: float) -> ThreadingHTTPServer:
+    """
+    在背景執行緒啟動模擬的 LINE API
+
+    Returns:
+        HTTP 服務，以 server.server_address 取得網址
+    """
+    handler = type("LatencyFakeLineHandler", (FakeLineHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(workers: int, port: int) -> List[str]:
+    """
+    啟動服務的指令，優先使用 gunicorn
+    """
+    if importlib.util.find_spec("gunicorn") is not None:
+        return [sys.executable, "-m", "gunicorn", "main:app", "-k", "uvicorn.workers.UvicornWorker",
+                "-w", str(workers), "-b", f"127.0.0.1:{port}", "--log-level", "warning"]
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning"]
+
+
+def start_server(workers: int, env: Dict[str, str]) -> Any:
+    """
+    啟動服務並等待所有 worker 就緒
+
+    Returns:
+        (服務行程, 網址)
+    """
+    port = free_port()
+    process = subprocess.Popen(server_command(workers, port), cwd=PROJECT_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服務啟動失敗:\n{process.stderr.read()[-2000:]}")
+        try:
+            if httpx.get(f"{url}/readyz", timeout=1).status_code == 200:
+                # 各 worker 各自預熱，等待一小段時間讓其餘 worker 也完成
+                time.sleep(0.5 * workers)
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("等待服務就緒逾時")
+
+
+def run_scenario(workers: int, args: argparse.Namespace, env: Dict[str, str],
+                 roster: Dict[str, str]) -> Dict[str, Any]:
+    """
+    以指定的 worker 數量量測一次
+    """
+    process, url = start_server(workers, env)
+    try:
+        generator = WebhookPayloadGenerator(BENCHMARK_ENV["LINE_CHANNEL_SECRET"], roster, seed=args.seed)
+        if args.warmup:
+            asyncio.run(run_load(None, generator, args.warmup, args.concurrency, args.batch_size, url))
+        raw = asyncio.run(run_load(None, generator, args.requests, args.concurrency, args.batch_size, url))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        "workers": workers,
+        "webhook": summarize(raw["latencies"]),
+        "errors": raw["errors"],
+        "events_per_second": round(raw["events"] / raw["elapsed"], 2),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="多 worker 擴展測試")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="要量測的 worker 數量")
+    parser.add_argument("--requests", type=int, default=400, help="webhook 請求數量")
+    parser.add_argument("--warmup", type=int, default=20, help="暖機請求數量 (不計入結果)")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時進行的請求數量")
+    parser.add_argument("--batch-size", type=int, default=1, help="每個請求的事件數量")
+    parser.add_argument("--calendar-latency", type=float, default=0.02, help="模擬日曆的請求延遲（秒）")
+    parser.add_argument("--line-latency", type=float, default=0.01, help="模擬 LINE API 的請求延遲（秒）")
+    parser.add_argument("--seed", type=int, default=42, help="亂數種子")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    import main as app_module
+    roster = app_module.default_tenant.roster
+
+    line_server = start_fake_line(args.line_latency)
+    state_dir = tempfile.mkdtemp(prefix="multiworker_")
+    results = []
+    try:
+        for workers in args.workers:
+            env = dict(os.environ)
+            env.update({
+                "CALENDAR_BACKEND": "fake",
+                "CALENDAR_FAKE_LATENCY": str(args.calendar_latency),
+                "LINE_API_ENDPOINT": "http://%s:%d" % line_server.server_address,
+                "SHARED_STATE_BACKEND": "sqlite",
+                "SHARED_STATE_PATH": os.path.join(state_dir, f"shared_state_{workers}.db"),
+                "DB_PATH": os.path.join(state_dir, "users.db"),
+                # 量測應用程式本身，不受店家請求預算限制
+                "TENANT_RATE_LIMIT": "1000000",
+                "TENANT_RATE_BURST": "1000000",
+                "HEALTH_PROBE_INTERVAL": "0",
+            })
+            result = run_scenario(workers, args, env, roster)
+            results.append(result)
+            print(f"workers={workers:<3} events/s={result['events_per_second']:>8.2f}  "
+                  f"p50={result['webhook']['p50_ms']:>7.1f}ms  p99={result['webhook']['p99_ms']:>7.1f}ms  "
+                  f"errors={result['errors']}")
+    finally:
+        line_server.shutdown()
+
+    if len(results) > 1:
+        base = results[0]["events_per_second"]
+        for result in results[1:]:
+            print(f"{result['workers']} workers 相對 {results[0]['workers']} worker: "
+                  f"{result['events_per_second'] / base:.2f}x")
+    print(json.dumps(results, ensure_ascii=False))
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
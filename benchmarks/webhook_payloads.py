@@ -0,0 +1,145 @@
+"""
+LINE webhook 負載產生模組 - 產生帶有正確簽名的文字指令、postback 與多事件批次請求
+"""
+import json
+import hmac
+import uuid
+import base64
+import random
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+
+# 文字指令權重，依實際使用比例設定
+DEFAULT_COMMAND_WEIGHTS = {
+    "week_calendar": 4,
+    "query_shift": 3,
+    "add_shift": 2,
+    "shift_request": 2,
+    "help": 1,
+    "postback": 1,
+}
+
+
+def sign_body(channel_secret: str, body: str) -> str:
+    """
+    計算 X-Line-Signature 簽名
+
+    Args:
+        channel_secret: LINE Channel Secret
+        body: 請求體
+
+    Returns:
+        Base64 編碼的 HMAC-SHA256 簽名
+    """
+    digest = hmac.new(channel_secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+class WebhookPayloadGenerator:
+    """
+    webhook 負載產生器 - 依權重隨機產生指令，每個事件都有唯一的 webhookEventId 與 replyToken
+    """
+    def __init__(self, channel_secret: str, roster: Dict[str, str], weights: Optional[Dict[str, int]] = None,
+                 start_date: Optional[datetime] = None, seed: Optional[int] = None):
+        """
+        Args:
+            channel_secret: LINE Channel Secret
+            roster: 人員名單 {"用戶名稱": "LINE_USER_ID"}
+            weights: 指令權重
+            start_date: 產生排班指令的起始日期
+            seed: 亂數種子
+        """
+        self.channel_secret = channel_secret
+        self.roster = list(roster.items())
+        self.weights = weights or DEFAULT_COMMAND_WEIGHTS
+        self.start_date = start_date or datetime.now()
+        self._random = random.Random(seed)
+        self._sequence = 0
+
+    def text_event(self, text: str, user_id: str) -> Dict[str, Any]:
+        """
+        建立文字訊息事件
+        """
+        event = self._base_event("message", user_id)
+        event["replyToken"] = uuid.uuid4().hex
+        event["message"] = {"id": str(self._next()), "type": "text", "text": text}
+        return event
+
+    def postback_event(self, data: str, user_id: str) -> Dict[str, Any]:
+        """
+        建立 postback 事件
+        """
+        event = self._base_event("postback", user_id)
+        event["replyToken"] = uuid.uuid4().hex
+        event["postback"] = {"data": data}
+        return event
+
+    def command(self, kind: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        產生指定種類的指令事件
+
+        Returns:
+            (指令種類, 事件)
+        """
+        name, user_id = self._random.choice(self.roster)
+        target, _ = self._random.choice(self.roster)
+        day = self.start_date + timedelta(days=self._random.randrange(0, 28))
+        hour = self._random.randrange(8, 21)
+        if kind == "week_calendar":
+            return kind, self.text_event("測試日曆", user_id)
+        if kind == "query_shift":
+            return kind, self.text_event(f"查詢班表 {day.strftime('%Y%m')}", user_id)
+        if kind == "add_shift":
+            # 每次使用不同的時段，避免被日曆操作去重略過
+            minute = self._next() % 60
+            return kind, self.text_event(
+                f"新增排班 {day.strftime('%Y%m%d')} {hour:02d}:{minute:02d}-{hour + 2:02d}:{minute:02d} @{target}", user_id)
+        if kind == "shift_request":
+            return kind, self.text_event(f"我希望在{day.strftime('%Y%m%d')} {hour:02d}:00跟你換班 @{target}", user_id)
+        if kind == "postback":
+            return kind, self.postback_event(f"action=noop&seq={self._next()}", user_id)
+        return "help", self.text_event("幫助", user_id)
+
+    def random_command(self) -> Tuple[str, Dict[str, Any]]:
+        kinds = list(self.weights.keys())
+        kind = self._random.choices(kinds, weights=[self.weights[k] for k in kinds])[0]
+        return self.command(kind)
+
+    def request(self, batch_size: int = 1) -> Tuple[List[str], str, Dict[str, str]]:
+        """
+        產生一個 webhook 請求
+
+        Args:
+            batch_size: 請求中的事件數量
+
+        Returns:
+            (各事件的指令種類, 請求體, 請求頭)
+        """
+        kinds = []
+        events = []
+        for _ in range(batch_size):
+            kind, event = self.random_command()
+            kinds.append(kind)
+            events.append(event)
+        body = json.dumps({"destination": "Ubenchmark", "events": events}, ensure_ascii=False)
+        headers = {
+            "Content-Type": "application/json",
+            "X-Line-Signature": sign_body(self.channel_secret, body),
+            "X-Line-Request-ID": uuid.uuid4().hex,
+        }
+        return kinds, body, headers
+
+    def _base_event(self, event_type: str, user_id: str) -> Dict[str, Any]:
+        return {
+            "type": event_type,
+            "mode": "active",
+            "timestamp": int(datetime.now().timestamp() * 1000),
+            "source": {"type": "user", "userId": user_id},
+            "webhookEventId": uuid.uuid4().hex.upper()[:26],
+            "deliveryContext": {"isRedelivery": False},
+        }
+
+    def _next(self) -> int:
+        self._sequence += 1
+        return self._sequence
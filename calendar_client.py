@@ -0,0 +1,93 @@
+"""
+Google Calendar 客戶端模組 - 以專案內附、固定版本的 discovery 文件建立客戶端，不需連線下載，解析結果在行程內共用
+
+discovery 文件位於 discovery/calendar.v3.json (revision 20231020，取自 google-api-python-client 2.108.0)，
+升級時以 https://calendar-json.googleapis.com/$discovery/rest?version=v3 的內容取代並執行測試
+"""
+import os
+import json
+import threading
+from typing import Dict, Optional, Any, Tuple
+
+from http_transport import use_pooled_transport, authorized_http
+
+# discovery 文件所在的目錄
+DISCOVERY_DIR = os.getenv("DISCOVERY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery"))
+
+# 已解析的 discovery 文件: (服務名稱, 版本) -> 文件
+_documents = {}
+_lock = threading.Lock()
+
+
+def discovery_document(service_name: str = "calendar", version: str = "v3") -> Dict[str, Any]:
+    """
+    取得已解析的 discovery 文件，第一次使用時從檔案載入
+
+    Args:
+        service_name: 服務名稱
+        version: API 版本
+
+    Returns:
+        discovery 文件
+    """
+    key = (service_name, version)
+    document = _documents.get(key)
+    if document is None:
+        with _lock:
+            document = _documents.get(key)
+            if document is None:
+                path = os.path.join(DISCOVERY_DIR, f"{service_name}.{version}.json")
+                with open(path, "r", encoding="utf-8") as f:
+                    document = json.load(f)
+                _documents[key] = document
+    return document
+
+
+def build(service_name: str = "calendar", version: str = "v3", credentials: Any = None,
+          http: Any = None, client_options: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    以內附的 discovery 文件建立 Google API 客戶端，取代 googleapiclient.discovery.build
+
+    Args:
+        service_name: 服務名稱
+        version: API 版本
+        credentials: 服務帳號憑證
+        http: 自訂的 http 物件，與 credentials 擇一
+        client_options: googleapiclient 的客戶端選項，例如以 api_endpoint 指定 API 網址
+
+    Returns:
+        Google API 客戶端
+    """
+    from googleapiclient.discovery import build_from_document
+
+    document = discovery_document(service_name, version)
+    # 啟用共用連線池時以連線池傳輸取代每個客戶端各自的 httplib2.Http
+    if http is None and credentials is not None and use_pooled_transport():
+        http = authorized_http(credentials)
+        credentials = None
+    # build_from_document 只會在文件中補上相同的預設參數，多個客戶端共用同一份文件不影響結果
+    service = build_from_document(document, credentials=credentials, http=http, client_options=client_options)
+    return cache_resources(service, tuple(document.get("resources", {})))
+
+
+def cache_resources(service: Any, names: Tuple[str, ...]) -> Any:
+    """
+    重複使用子資源物件 - 每次呼叫 service.events() 都會重新產生所有 API 方法，
+    子資源只與客戶端共用同一個 http 物件，不含其他狀態，可安全重複使用
+    """
+    for name in names:
+        accessor = getattr(service, name, None)
+        if accessor is not None:
+            setattr(service, name, _cached(accessor))
+    return service
+
+
+def _cached(accessor: Any) -> Any:
+    resource = None
+
+    def get_resource():
+        nonlocal resource
+        if resource is None:
+            resource = accessor()
+        return resource
+    return get_resource
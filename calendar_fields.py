@@ -0,0 +1,41 @@
+"""
+日曆欄位遮罩模組 - 每個 Google Calendar API 呼叫點以 fields 參數 (partial response) 只取回用到的欄位，
+不再下載建立者、提醒、htmlLink 與越來越長的描述等內容，減少回應大小與 JSON 解析時間
+
+呼叫點使用新欄位時必須同時加入對應的遮罩，否則取回的事件不含該欄位
+"""
+from typing import Any
+
+# 呼叫點 -> 欄位遮罩
+FIELD_MASKS = {
+    # 新增排班、換班前找出同一時段的事件 (日期查詢)
+    "slot_lookup": "items(id,summary,start,end,etag),nextPageToken",
+    # 一週排班表
+    "week_schedule": "items(id,summary,start,etag,updated),nextPageToken",
+    # 本地鏡像同步，需要 status 判斷已刪除的事件
+    "mirror_sync": "items(id,status,summary,start,end,etag,updated),nextPageToken,nextSyncToken",
+    # 更新事件前取得描述，以附加換班歷史
+    "event_history": "id,etag,description",
+    # 寫入後回傳的事件，用於更新本地鏡像與排班索引
+    "write_result": "id,status,summary,start,end,etag,updated",
+    # 健康檢查量測延遲的最小查詢
+    "probe": "items(id)",
+    # CalendarManager 查詢用戶的排班
+    "shift_lookup": "items(id,summary,start,end,description),nextPageToken",
+}
+
+
+def events_request(service: Any, method: str, site: str, **params) -> Any:
+    """
+    建立 events 資源的請求，並套用呼叫點的欄位遮罩
+
+    Args:
+        service: Google Calendar 客戶端
+        method: events 資源的方法，例如 list、get、patch
+        site: 呼叫點名稱 (FIELD_MASKS 的 key)
+        **params: API 參數
+
+    Returns:
+        尚未執行的請求
+    """
+    return getattr(service.events(), method)(fields=FIELD_MASKS[site], **params)
@@ -4,31 +4,59 @@
 import os
 import datetime
 from typing import Dict, List, Optional, Any, Tuple
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import fake_calendar
+import calendar_client
+from calendar_fields import events_request
+from time_model import TimeModel, DEFAULT_TIMEZONE
 
 # Google Calendar API 設定
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE", "./service-account.json")
 CALENDAR_ID = os.getenv("GOOGLE_CALENDAR_ID", "primary")
 
+def build(service_name: str, version: str, credentials: Any = None):
+    """
+    建立 Google API 客戶端 - 使用內附的 discovery 文件，不需連線下載
+    """
+    return calendar_client.build(service_name, version, credentials=credentials)
+
+def load_credentials(path: str, scopes: List[str]):
+    """
+    從服務帳號金鑰檔建立憑證
+    """
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(path, scopes=scopes)
+
 class CalendarManager:
     """
     日曆管理類 - 處理 Google Calendar 整合
     """
-    def __init__(self, calendar_id: str = CALENDAR_ID):
+    def __init__(self, calendar_id: str = CALENDAR_ID, timezone: str = DEFAULT_TIMEZONE):
         self.calendar_id = calendar_id
-        self.service = self._get_calendar_service()
+        # 日期與時間皆以店家的當地時間解讀
+        self.time = TimeModel(timezone)
+        # 第一次使用時才建立 Google Calendar 服務，避免匯入與初始化時等待
+        self._service = None
+    
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = self._get_calendar_service()
+        return self._service
+    
+    @service.setter
+    def service(self, service):
+        self._service = service
     
     def _get_calendar_service(self):
         """
         獲取 Google Calendar 服務
         """
+        # 設置 CALENDAR_BACKEND=fake 時使用與 main.py 共用的模擬日曆
+        if fake_calendar.use_fake_backend():
+            return fake_calendar.shared_service()
         try:
-            credentials = service_account.Credentials.from_service_account_file(
-                SERVICE_ACCOUNT_FILE, scopes=SCOPES
-            )
+            credentials = load_credentials(SERVICE_ACCOUNT_FILE, SCOPES)
             service = build('calendar', 'v3', credentials=credentials)
             return service
         except Exception as e:
@@ -53,11 +81,6 @@ class CalendarManager:
             return None
         
         try:
-            # 解析日期和時間
-            year = int(date_str[:4])
-            month = int(date_str[4:6])
-            day = int(date_str[6:])
-            
             # 解析時間
             hour, minute = map(int, time_str.split(':'))
             
@@ -74,16 +97,14 @@ class CalendarManager:
                 if hour < 12:
                     hour += 12
             
-            # 創建日期時間對象
-            start_time = datetime.datetime(year, month, day, hour, minute, 0)
+            # 創建日期時間對象 (當地時間)
+            start_time = self.time.localize(date_str, f"{hour:02d}:{minute:02d}")
             end_time = start_time + datetime.timedelta(hours=1)  # 假設排班時長為 1 小時
             
-            # 轉換為 ISO 格式
-            time_min = start_time.isoformat() + 'Z'
-            time_max = end_time.isoformat() + 'Z'
-            
-            # 查詢日曆事件
-            events_result = self.service.events().list(
+            # 查詢當地的整天，再比對與時段重疊的事件
+            time_min, time_max = self.time.day_bounds(date_str)
+            events_result = events_request(
+                self.service, "list", "shift_lookup",
                 calendarId=self.calendar_id,
                 timeMin=time_min,
                 timeMax=time_max,
@@ -92,7 +113,7 @@ class CalendarManager:
                 orderBy='startTime'
             ).execute()
             
-            events = events_result.get('items', [])
+            events = [event for event in events_result.get('items', []) if self._overlaps(event, start_time, end_time)]
             
             if not events:
                 return None
@@ -110,6 +131,18 @@ class CalendarManager:
             print(f"獲取排班資訊失敗: {e}")
             return None
     
+    def _overlaps(self, event: Dict[str, Any], start_time: datetime.datetime, end_time: datetime.datetime) -> bool:
+        """
+        事件是否與當地時段重疊，全天事件不列入
+        """
+        start = event.get('start', {}).get('dateTime')
+        if not start:
+            return False
+        event_start = self.time.to_local(start)
+        end = event.get('end', {}).get('dateTime')
+        event_end = self.time.to_local(end) if end else event_start
+        return event_start < end_time and (event_end > start_time or event_start == start_time)
+    
     def swap_shifts(self, user_a_id: str, user_b_id: str, date_str: str, time_period: str, time_str: str) -> bool:
         """
         交換兩位用戶的排班
@@ -137,7 +170,7 @@ class CalendarManager:
                 print("無法獲取完整的排班資訊")
                 return False
             
-            # 交換排班資訊
+            # 交換排班資訊 (update 以 body 取代整個事件，需取得完整事件，不使用欄位遮罩)
             # 更新用戶 A 的排班
             user_a_event = self.service.events().get(
                 calendarId=self.calendar_id,
@@ -161,7 +194,7 @@ class CalendarManager:
             user_b_event['description'] = temp_description
             
             # 添加換班記錄
-            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            now = self.time.now().strftime("%Y-%m-%d %H:%M:%S")
             swap_record = f"\n[換班記錄] {now}: 與 {user_b_id} 交換"
             user_a_event['description'] += swap_record
             
@@ -207,11 +240,6 @@ class CalendarManager:
             return None
         
         try:
-            # 解析日期和時間
-            year = int(date_str[:4])
-            month = int(date_str[4:6])
-            day = int(date_str[6:])
-            
             # 解析時間
             hour, minute = map(int, time_str.split(':'))
             
@@ -228,8 +256,8 @@ class CalendarManager:
                 if hour < 12:
                     hour += 12
             
-            # 創建日期時間對象
-            start_time = datetime.datetime(year, month, day, hour, minute, 0)
+            # 創建日期時間對象 (當地時間)
+            start_time = self.time.localize(date_str, f"{hour:02d}:{minute:02d}")
             end_time = start_time + datetime.timedelta(hours=1)  # 假設排班時長為 1 小時
             
             # 創建事件
@@ -238,11 +266,11 @@ class CalendarManager:
                 'description': f"用戶 ID: {user_id}\n{description}",
                 'start': {
                     'dateTime': start_time.isoformat(),
-                    'timeZone': 'Asia/Taipei',
+                    'timeZone': self.time.name,
                 },
                 'end': {
                     'dateTime': end_time.isoformat(),
-                    'timeZone': 'Asia/Taipei',
+                    'timeZone': self.time.name,
                 },
             }
             
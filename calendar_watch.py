@@ -0,0 +1,427 @@
+"""
+日曆推播模組 - 處理 Google Calendar events.watch 推播通道與本地事件鏡像
+"""
+import os
+import time
+import uuid
+import threading
+from typing import Dict, List, Optional, Any, Callable, Tuple
+from structured_log import get_logger
+from calendar_fields import FIELD_MASKS
+from time_model import TimeModel
+
+logger = get_logger("calendar_watch")
+
+# 推播通道設定
+CHANNEL_TTL_SECONDS = int(os.getenv("CALENDAR_WATCH_TTL", "604800"))  # Google 上限為 7 天
+RENEW_MARGIN_SECONDS = int(os.getenv("CALENDAR_WATCH_RENEW_MARGIN", "3600"))  # 到期前 1 小時續訂
+
+
+def event_staff_name(event: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    從事件摘要取得排班人員名稱
+    """
+    if not event or event.get('status') == 'cancelled':
+        return None
+    summary = event.get('summary', '')
+    if not summary.startswith('班表: '):
+        return None
+    return summary.replace('班表: ', '', 1)
+
+
+def event_start_label(event: Optional[Dict[str, Any]], time_model: TimeModel) -> str:
+    """
+    取得事件開始時間的顯示文字 (店家的當地時間)
+    """
+    start = (event or {}).get('start', {}).get('dateTime', '')
+    if not start:
+        return ''
+    return time_model.to_local(start).strftime("%Y/%m/%d %H:%M")
+
+
+class EventMirror:
+    """
+    本地事件鏡像 - 以 syncToken 增量同步 Google Calendar 事件
+    """
+    def __init__(self, service_factory: Callable[[], Any], calendar_id: str,
+                 execute: Optional[Callable[[Any], Any]] = None, time_model: Optional[TimeModel] = None):
+        self.service_factory = service_factory
+        self.calendar_id = calendar_id
+        self.execute = execute or _execute
+        # 未含時差的事件時間視為店家的當地時間
+        self.time = time_model or TimeModel()
+        self.events = {}
+        self.sync_token = None
+        self.synced_at = None
+        self.version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_synced(self) -> bool:
+        """
+        是否已完成至少一次同步
+        """
+        return self.sync_token is not None
+
+    def full_sync(self) -> List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        完整同步所有事件
+
+        Returns:
+            變更列表，每項為 (舊事件, 新事件)
+        """
+        items, sync_token = self._list_all()
+        with self._lock:
+            old_events = self.events
+            new_events = {item['id']: item for item in items if item.get('status') != 'cancelled'}
+            changes = []
+            for event_id in set(old_events) | set(new_events):
+                old, new = old_events.get(event_id), new_events.get(event_id)
+                if old is None or new is None or old.get('etag') != new.get('etag'):
+                    changes.append((old, new))
+            self.events = new_events
+            self._mark_synced(sync_token, changes)
+        return changes
+
+    def incremental_sync(self) -> List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        以 syncToken 增量同步，syncToken 失效 (410) 時改為完整同步
+
+        Returns:
+            變更列表，每項為 (舊事件, 新事件)
+        """
+        if not self.is_synced:
+            return self.full_sync()
+        from googleapiclient.errors import HttpError
+        try:
+            items, sync_token = self._list_all(self.sync_token)
+        except HttpError as e:
+            if getattr(e, 'resp', None) is not None and e.resp.status == 410:
+                logger.info("syncToken 已失效，改為完整同步")
+                return self.full_sync()
+            raise
+
+        with self._lock:
+            changes = []
+            for item in items:
+                old = self.events.get(item['id'])
+                if item.get('status') == 'cancelled':
+                    self.events.pop(item['id'], None)
+                    if old is not None:
+                        changes.append((old, None))
+                else:
+                    self.events[item['id']] = item
+                    changes.append((old, item))
+            self._mark_synced(sync_token, changes)
+        return changes
+
+    def apply(self, event: Optional[Dict[str, Any]]) -> Optional[int]:
+        """
+        將本地寫入的結果直接套用到鏡像，避免等待推播前讀到舊資料
+
+        Returns:
+            套用後的版本，事件無效時為 None
+        """
+        if not event or 'id' not in event:
+            return None
+        with self._lock:
+            if event.get('status') == 'cancelled':
+                self.events.pop(event['id'], None)
+            else:
+                self.events[event['id']] = event
+            self.version += 1
+            return self.version
+
+    def snapshot(self) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        取得所有事件與對應的版本，同步或寫入進行中也不會取得不一致的內容
+
+        Returns:
+            (事件列表, 版本)
+        """
+        with self._lock:
+            return list(self.events.values()), self.version
+
+    def list_events(self, time_min: str, time_max: str) -> List[Dict[str, Any]]:
+        """
+        從鏡像查詢時間範圍內的事件，依開始時間排序
+
+        Args:
+            time_min: 範圍起點 (RFC3339)
+            time_max: 範圍終點 (RFC3339)
+
+        Returns:
+            事件列表
+        """
+        low = self.time.to_local(time_min)
+        high = self.time.to_local(time_max)
+        with self._lock:
+            matched = []
+            for event in self.events.values():
+                start = event.get('start', {}).get('dateTime')
+                if not start:
+                    continue
+                start_time = self.time.to_local(start)
+                end = event.get('end', {}).get('dateTime')
+                end_time = self.time.to_local(end) if end else start_time
+                if end_time > low and start_time < high:
+                    matched.append((start_time, event))
+        matched.sort(key=lambda item: item[0])
+        return [event for _, event in matched]
+
+    def _list_all(self, sync_token: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        逐頁列出事件並取得下一次同步用的 syncToken
+        """
+        service = self.service_factory()
+        if not service:
+            raise RuntimeError("無法連接 Google Calendar 服務")
+        items = []
+        page_token = None
+        while True:
+            params = {'calendarId': self.calendar_id, 'singleEvents': True, 'fields': FIELD_MASKS['mirror_sync']}
+            if sync_token:
+                params['syncToken'] = sync_token
+            if page_token:
+                params['pageToken'] = page_token
+            result = self.execute(service.events().list(**params))
+            items.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return items, result.get('nextSyncToken')
+
+    def _mark_synced(self, sync_token: Optional[str], changes: List[Any]):
+        self.sync_token = sync_token
+        self.synced_at = time.time()
+        if changes:
+            self.version += 1
+
+
+class WatchChannelManager:
+    """
+    推播通道管理類 - 建立、驗證與續訂 events.watch 通道
+    """
+    def __init__(self, service_factory: Callable[[], Any], calendar_id: str, address: str,
+                 token: Optional[str] = None, ttl_seconds: int = CHANNEL_TTL_SECONDS,
+                 renew_margin_seconds: int = RENEW_MARGIN_SECONDS,
+                 execute: Optional[Callable[[Any], Any]] = None):
+        self.service_factory = service_factory
+        self.execute = execute or _execute
+        self.calendar_id = calendar_id
+        self.address = address
+        self.token = token
+        self.ttl_seconds = ttl_seconds
+        self.renew_margin_seconds = renew_margin_seconds
+        self.channel = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_active(self) -> bool:
+        """
+        通道是否仍在有效期內
+        """
+        return self.channel is not None and self.channel['expiration'] > time.time()
+
+    def start(self) -> Optional[Dict[str, Any]]:
+        """
+        建立新的推播通道
+
+        Returns:
+            通道資訊字典或 None
+        """
+        service = self.service_factory()
+        if not service:
+            logger.error("無法建立推播通道: Google Calendar 服務未初始化")
+            return None
+
+        body = {
+            'id': str(uuid.uuid4()),
+            'type': 'web_hook',
+            'address': self.address,
+            'params': {'ttl': str(self.ttl_seconds)}
+        }
+        if self.token:
+            body['token'] = self.token
+
+        result = self.execute(service.events().watch(calendarId=self.calendar_id, body=body))
+        expiration = result.get('expiration')
+        channel = {
+            'id': result.get('id', body['id']),
+            'resource_id': result.get('resourceId'),
+            'expiration': int(expiration) / 1000 if expiration else time.time() + self.ttl_seconds,
+        }
+        with self._lock:
+            old_channel, self.channel = self.channel, channel
+        logger.info("推播通道已建立", extra={"channel_id": channel['id']})
+
+        # 新通道建立後再停止舊通道，避免漏接通知
+        if old_channel:
+            self._stop(service, old_channel)
+        return channel
+
+    def stop(self):
+        """
+        停止目前的推播通道
+        """
+        with self._lock:
+            channel, self.channel = self.channel, None
+        if channel:
+            service = self.service_factory()
+            if service:
+                self._stop(service, channel)
+
+    def needs_renewal(self, now: Optional[float] = None) -> bool:
+        """
+        是否需要續訂通道
+        """
+        now = time.time() if now is None else now
+        return self.channel is None or self.channel['expiration'] - now <= self.renew_margin_seconds
+
+    def renew_if_needed(self, now: Optional[float] = None) -> bool:
+        """
+        通道即將到期時續訂
+
+        Returns:
+            是否已續訂
+        """
+        if not self.needs_renewal(now):
+            return False
+        return self.start() is not None
+
+    def owns(self, channel_id: str) -> bool:
+        """
+        通道 ID 是否為目前的通道
+        """
+        channel = self.channel
+        return channel is not None and channel['id'] == channel_id
+
+    def verify(self, channel_id: str, token: Optional[str]) -> bool:
+        """
+        驗證通知是否來自目前的通道
+        """
+        if not self.owns(channel_id):
+            return False
+        return not self.token or token == self.token
+
+    def _stop(self, service: Any, channel: Dict[str, Any]):
+        try:
+            self.execute(service.channels().stop(body={'id': channel['id'], 'resourceId': channel['resource_id']}))
+        except Exception as e:
+            logger.warning("停止推播通道時發生錯誤: %s", e)
+
+
+class PushNotifier:
+    """
+    LINE 推播通知 - 將排班異動通知發送給相關人員
+    """
+    def __init__(self, send: Callable[[str, str], Any]):
+        self.send = send
+
+    def notify(self, user_id: str, text: str):
+        self.send(user_id, text)
+
+
+class RecordingNotifier:
+    """
+    本地測試用通知器 - 只記錄通知內容，不實際發送
+    """
+    def __init__(self):
+        self.messages = []
+
+    def notify(self, user_id: str, text: str):
+        self.messages.append((user_id, text))
+
+
+class CalendarNotificationService:
+    """
+    日曆變更通知服務 - 處理推播通知、刷新鏡像並通知受影響的人員
+    """
+    def __init__(self, mirror: EventMirror, channels: WatchChannelManager, notifier: Any,
+                 resolve_user: Callable[[str], Optional[str]],
+                 listeners: Optional[List[Callable[[List[Any]], Any]]] = None):
+        self.mirror = mirror
+        self.channels = channels
+        self.notifier = notifier
+        self.resolve_user = resolve_user
+        self.listeners = listeners or []
+
+    @property
+    def is_live(self) -> bool:
+        """
+        鏡像是否可直接作為讀取來源 (已同步且推播通道有效)
+        """
+        return self.mirror.is_synced and self.channels.is_active
+
+    def add_listener(self, listener: Callable[[List[Any]], Any]):
+        """
+        註冊事件變更的監聽函數
+        """
+        self.listeners.append(listener)
+
+    def handle(self, headers: Dict[str, str]) -> Dict[str, Any]:
+        """
+        處理 Google Calendar 推播通知
+
+        Args:
+            headers: 通知的 HTTP 標頭
+
+        Returns:
+            處理結果字典
+        """
+        channel_id = headers.get('x-goog-channel-id', '')
+        token = headers.get('x-goog-channel-token')
+        state = headers.get('x-goog-resource-state', '')
+
+        if not self.channels.verify(channel_id, token):
+            logger.info("忽略未知通道的通知", extra={"channel_id": channel_id})
+            return {'status': 'ignored'}
+
+        if state == 'sync':
+            # 通道建立時的第一則通知，確保鏡像已完成完整同步
+            if not self.mirror.is_synced:
+                self.mirror.full_sync()
+            return {'status': 'synced', 'changes': 0}
+
+        changes = self.mirror.incremental_sync()
+        if changes:
+            for listener in self.listeners:
+                listener(changes)
+            self.notify_staff(changes)
+        return {'status': 'updated', 'changes': len(changes)}
+
+    def notify_staff(self, changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> int:
+        """
+        將排班異動通知受影響的人員，每人合併為一則訊息
+
+        Returns:
+            發送的通知數量
+        """
+        pending = {}
+        for old, new in changes:
+            old_name, new_name = event_staff_name(old), event_staff_name(new)
+            old_label, new_label = event_start_label(old, self.mirror.time), event_start_label(new, self.mirror.time)
+            if old_name == new_name and old_label == new_label:
+                continue
+            if new_name and old_name and old_name != new_name:
+                line = f"{new_label} 班表由 {old_name} 改為 {new_name}"
+            elif new_name and old_name:
+                line = f"{new_name} 的班表改為 {new_label} (原為 {old_label})"
+            elif new_name:
+                line = f"新增排班: {new_label} {new_name}"
+            else:
+                line = f"排班已取消: {old_label} {old_name}"
+            for name in {old_name, new_name}:
+                user_id = self.resolve_user(name) if name else None
+                if user_id:
+                    pending.setdefault(user_id, []).append(line)
+
+        for user_id, lines in pending.items():
+            try:
+                self.notifier.notify(user_id, "排班異動通知\n" + "\n".join(lines))
+            except Exception as e:
+                logger.error("發送排班異動通知時發生錯誤: %s", e)
+        return len(pending)
+
+
+def _execute(request: Any) -> Any:
+    return request.execute()
@@ -0,0 +1,201 @@
+"""
+斷路器模組 - 外部服務 (Google Calendar、LINE) 在統計時間內的失敗率超過門檻時暫停呼叫，直接拋出 CircuitOpenError，
+不再等待逾時；暫停一段時間後放行少量試探請求 (half-open)，成功即恢復，失敗則繼續暫停
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Optional, Any, Callable
+
+from metrics import registry, error_status
+from structured_log import get_logger
+
+# 失敗率門檻 (0~1)，統計時間內的請求數達到 BREAKER_MIN_CALLS 後才判斷
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+# 失敗率的統計時間（秒）
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60"))
+# 斷路後暫停呼叫的時間（秒），之後進入 half-open 放行試探請求
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# half-open 時同時放行的試探請求數
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = registry.gauge("circuit_breaker_state", "斷路器狀態 (0 closed，1 half-open，2 open)", ("breaker",))
+BREAKER_REJECTIONS = registry.counter("circuit_breaker_rejections_total", "斷路器暫停期間直接拒絕的呼叫次數", ("breaker",))
+
+logger = get_logger("circuit_breaker")
+
+
+class CircuitOpenError(Exception):
+    """
+    斷路器暫停呼叫中
+    """
+    def __init__(self, name: str, retry_at: float):
+        super().__init__(f"{name} 暫時無法連線，斷路器暫停呼叫中")
+        self.name = name
+        self.retry_at = retry_at
+
+
+def is_service_failure(error: Exception) -> bool:
+    """
+    是否為外部服務本身的問題 - 5xx、429 與連線錯誤、逾時等沒有狀態碼的例外；
+    其他 4xx 是請求內容的問題 (例如 reply token 無效)，不計入失敗率
+    """
+    status = error_status(error)
+    if status.isdigit():
+        return int(status) >= 500 or status == "429"
+    return not isinstance(error, CircuitOpenError)
+
+
+class CircuitBreaker:
+    """
+    以統計時間內的失敗率判斷的斷路器
+    """
+    def __init__(self, name: str, failure_rate: float = BREAKER_FAILURE_RATE, min_calls: int = BREAKER_MIN_CALLS,
+                 window: float = BREAKER_WINDOW, open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_calls: int = BREAKER_HALF_OPEN_CALLS,
+                 is_failure: Callable[[Exception], bool] = is_service_failure):
+        """
+        Args:
+            name: 名稱，用於日誌與監控指標，例如 calendar:default
+            failure_rate: 失敗率門檻
+            min_calls: 判斷失敗率所需的最少請求數
+            window: 失敗率的統計時間（秒）
+            open_seconds: 斷路後暫停呼叫的時間（秒）
+            half_open_calls: half-open 時同時放行的試探請求數
+            is_failure: 判斷例外是否計入失敗率
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (時間, 是否失敗)
+        self._calls = deque()
+        self._lock = threading.Lock()
+        BREAKER_STATE.set_function(lambda: _STATE_VALUES[self.state], breaker=name)
+
+    @property
+    def state(self) -> str:
+        """
+        目前狀態，暫停時間已過的 open 視為 half-open
+        """
+        with self._lock:
+            return self._current_state(time.time())
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    @property
+    def retry_at(self) -> float:
+        """
+        暫停結束、可再次試探的時間
+        """
+        return self._opened_at + self.open_seconds
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now >= self.retry_at:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def before_call(self, now: Optional[float] = None):
+        """
+        呼叫前檢查，暫停中或 half-open 的試探名額已滿時拋出 CircuitOpenError
+        """
+        now = now or time.time()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+        BREAKER_REJECTIONS.inc(breaker=self.name)
+        raise CircuitOpenError(self.name, max(self.retry_at, now))
+
+    def release(self):
+        """
+        放行後未實際呼叫外部服務 (例如本地的請求預算不足)，歸還 half-open 的試探名額
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self, now: Optional[float] = None):
+        now = now or time.time()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED, now)
+                return
+            self._record(now, False)
+
+    def record_failure(self, now: Optional[float] = None):
+        now = now or time.time()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN, now)
+                return
+            self._record(now, True)
+            failures = sum(1 for _, failed in self._calls if failed)
+            if self._state == CLOSED and len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self._transition(OPEN, now)
+
+    def record_error(self, error: Exception, now: Optional[float] = None):
+        """
+        記錄呼叫拋出的例外，只有外部服務本身的問題計入失敗率
+        """
+        if self.is_failure(error):
+            self.record_failure(now)
+        else:
+            self.record_success(now)
+
+    def _record(self, now: float, failed: bool):
+        self._calls.append((now, failed))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _transition(self, state: str, now: float):
+        logger.warning("斷路器狀態變更", extra={"breaker": self.name, "from": self._state, "to": state})
+        self._state = state
+        self._probes = 0
+        self._calls.clear()
+        if state == OPEN:
+            self._opened_at = now
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        經過斷路器呼叫函數
+
+        Raises:
+            CircuitOpenError: 暫停呼叫中
+        """
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_error(e)
+            raise
+        self.record_success()
+        return result
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        包裝函數，每次呼叫都經過斷路器
+        """
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        wrapper.__wrapped__ = func
+        return wrapper
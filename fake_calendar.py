@@ -0,0 +1,463 @@
+"""
+模擬 Google Calendar 模組 - 在記憶體中模擬 Calendar v3 的 events 資源，可設定延遲與失敗率，用於離線測試與壓力測試
+
+設置 CALENDAR_BACKEND=fake 時，main.py 與 CalendarManager 皆改用同一個模擬日曆，不需連線到 Google
+"""
+import os
+import copy
+import time
+import uuid
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Any, Callable, Tuple
+from zoneinfo import ZoneInfo
+
+
+# 日曆後端: google (預設) 或 fake
+CALENDAR_BACKEND = os.getenv("CALENDAR_BACKEND", "google").lower()
+# 模擬日曆的延遲（秒）、延遲變動範圍（秒）與失敗率 (0-1)
+CALENDAR_FAKE_LATENCY = float(os.getenv("CALENDAR_FAKE_LATENCY", "0"))
+CALENDAR_FAKE_JITTER = float(os.getenv("CALENDAR_FAKE_JITTER", "0"))
+CALENDAR_FAKE_FAILURE_RATE = float(os.getenv("CALENDAR_FAKE_FAILURE_RATE", "0"))
+
+# 每頁預設事件數與上限 (與 Google Calendar 一致)
+DEFAULT_PAGE_SIZE = 250
+MAX_PAGE_SIZE = 2500
+# 單一批次請求的上限 (與 Google API 一致)
+MAX_BATCH_SIZE = 1000
+
+# q 參數搜尋的欄位
+SEARCH_FIELDS = ("summary", "description", "location")
+
+
+class FakeRequest:
+    """
+    模擬的 API 請求 - 與 googleapiclient 的 HttpRequest 相同，呼叫 execute() 才會執行，
+    可透過 headers 設定 If-Match / If-None-Match，指定 fields 時只回傳遮罩內的欄位
+    """
+    def __init__(self, service: "FakeCalendarService", method_id: str, func: Callable[["FakeRequest"], Any],
+                 fields: Optional[str] = None):
+        self.service = service
+        self.methodId = method_id
+        self.headers = {}
+        self.fields = fields
+        self._func = func
+
+    def execute(self, num_retries: int = 0) -> Any:
+        return self.service._call(self.methodId, self._run)
+
+    def _run(self) -> Any:
+        self.service.requested_fields.append((self.methodId, self.fields))
+        result = self._func(self)
+        return _apply_fields(result, _parse_fields(self.fields)) if self.fields else result
+
+
+class FakeBatchRequest:
+    """
+    模擬的批次請求 - 與 BatchHttpRequest 相同，所有請求只計算一次往返延遲
+    """
+    def __init__(self, service: "FakeCalendarService", callback: Optional[Callable] = None):
+        self.service = service
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, callback: Optional[Callable] = None, request_id: Optional[str] = None):
+        if len(self._requests) >= MAX_BATCH_SIZE:
+            raise ValueError(f"批次請求最多 {MAX_BATCH_SIZE} 個")
+        self._requests.append((request_id or str(len(self._requests) + 1), request, callback))
+
+    def execute(self):
+        from googleapiclient.errors import HttpError
+        self.service.batches += 1
+        self.service._delay()
+        for request_id, request, callback in self._requests:
+            response, exception = None, None
+            try:
+                response = self.service._call(request.methodId, request._run, delay=False)
+            except HttpError as e:
+                exception = e
+            handler = callback or self.callback
+            if handler is not None:
+                handler(request_id, response, exception)
+
+
+class FakeEventsResource:
+    """
+    模擬的 events 資源
+    """
+    def __init__(self, service: "FakeCalendarService"):
+        self.service = service
+
+    def list(self, calendarId: str, timeMin: Optional[str] = None, timeMax: Optional[str] = None,
+             q: Optional[str] = None, singleEvents: bool = False, orderBy: Optional[str] = None,
+             maxResults: int = DEFAULT_PAGE_SIZE, pageToken: Optional[str] = None,
+             syncToken: Optional[str] = None, showDeleted: bool = False, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.events.list", lambda request: self.service._list(
+            calendarId, timeMin, timeMax, q, orderBy, maxResults, pageToken, syncToken, showDeleted),
+            kwargs.get("fields"))
+
+    def get(self, calendarId: str, eventId: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.events.get",
+                           lambda request: self.service._get(calendarId, eventId, request.headers), kwargs.get("fields"))
+
+    def insert(self, calendarId: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.events.insert",
+                           lambda request: self.service._insert(calendarId, body), kwargs.get("fields"))
+
+    def update(self, calendarId: str, eventId: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.events.update",
+                           lambda request: self.service._update(calendarId, eventId, body, request.headers),
+                           kwargs.get("fields"))
+
+    def patch(self, calendarId: str, eventId: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.events.patch",
+                           lambda request: self.service._patch(calendarId, eventId, body, request.headers),
+                           kwargs.get("fields"))
+
+    def delete(self, calendarId: str, eventId: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.events.delete",
+                           lambda request: self.service._delete(calendarId, eventId, request.headers))
+
+    def watch(self, calendarId: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        def watch(request):
+            return {
+                "kind": "api#channel",
+                "id": body.get("id"),
+                "resourceId": f"resource-{calendarId}",
+                "expiration": str(int((time.time() + 7 * 86400) * 1000))
+            }
+        return FakeRequest(self.service, "calendar.events.watch", watch)
+
+
+class FakeChannelsResource:
+    """
+    模擬的 channels 資源
+    """
+    def __init__(self, service: "FakeCalendarService"):
+        self.service = service
+
+    def stop(self, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, "calendar.channels.stop", lambda request: None)
+
+
+class FakeCalendarService:
+    """
+    模擬的 Google Calendar 服務 - 可取代 build('calendar', 'v3') 建立的客戶端
+    """
+    def __init__(self, latency: float = 0.0, latency_jitter: float = 0.0, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            latency: 每次請求的延遲（秒），批次請求只計算一次
+            latency_jitter: 延遲的隨機變動範圍（秒）
+            failure_rate: 請求回傳 503 錯誤的機率 (0-1)
+            seed: 亂數種子，用於重現測試結果
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.calls = {}
+        # 已執行請求的 (方法, fields 參數)
+        self.requested_fields = []
+        self.failures = 0
+        self.batches = 0
+        self._random = random.Random(seed)
+        self._calendars = {}
+        # 變更紀錄，用於 syncToken 增量同步: (日曆 ID, 事件 ID) -> 最後變更序號
+        self._changed_at = {}
+        self._sequence = 0
+        # 早於此序號的 syncToken 視為失效
+        self._min_sync_sequence = 0
+        self._lock = threading.Lock()
+
+    def events(self) -> FakeEventsResource:
+        return FakeEventsResource(self)
+
+    def channels(self) -> FakeChannelsResource:
+        return FakeChannelsResource(self)
+
+    def new_batch_http_request(self, callback: Optional[Callable] = None) -> FakeBatchRequest:
+        return FakeBatchRequest(self, callback)
+
+    def seed_events(self, calendar_id: str, events: List[Dict[str, Any]]):
+        """
+        直接加入事件，不計入請求次數
+        """
+        for event in events:
+            self._store(calendar_id, dict(copy.deepcopy(event), id=event.get("id") or uuid.uuid4().hex))
+
+    def all_events(self, calendar_id: str) -> List[Dict[str, Any]]:
+        """
+        取得日曆中所有未刪除的事件
+        """
+        return [event for event in self._calendars.get(calendar_id, {}).values() if event.get("status") != "cancelled"]
+
+    def expire_sync_tokens(self):
+        """
+        使目前所有的 syncToken 失效，下一次增量同步會收到 410，需重新完整同步
+        """
+        with self._lock:
+            self._sequence += 1
+            self._min_sync_sequence = self._sequence
+
+    def _delay(self):
+        delay = self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _call(self, method_id: str, func: Callable[[], Any], delay: bool = True) -> Any:
+        self.calls[method_id] = self.calls.get(method_id, 0) + 1
+        if delay:
+            self._delay()
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.failures += 1
+            raise _http_error(503, "Backend Error")
+        # 回傳副本，避免呼叫端修改到儲存的事件
+        return copy.deepcopy(func())
+
+    def _list(self, calendar_id: str, time_min: Optional[str], time_max: Optional[str], q: Optional[str],
+              order_by: Optional[str], max_results: int, page_token: Optional[str], sync_token: Optional[str],
+              show_deleted: bool) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self._calendars.get(calendar_id, {}).values())
+            sequence = self._sequence
+            min_sync_sequence = self._min_sync_sequence
+        if sync_token:
+            # 增量同步不可搭配查詢條件，並會包含已刪除的事件
+            if time_min or time_max or q or order_by:
+                raise _http_error(400, "Bad Request")
+            since = _sync_sequence(sync_token)
+            if since is None or since < min_sync_sequence:
+                raise _http_error(410, "Gone")
+            events = [event for event in events if self._changed_at.get((calendar_id, event["id"]), 0) > since]
+        else:
+            if not show_deleted:
+                events = [event for event in events if event.get("status") != "cancelled"]
+            low = _parse(time_min) if time_min else None
+            high = _parse(time_max) if time_max else None
+            if low is not None or high is not None:
+                events = [event for event in events if _overlaps(event, low, high)]
+            if q:
+                terms = q.lower().split()
+                events = [event for event in events if all(term in _search_text(event) for term in terms)]
+        if order_by == "startTime":
+            events.sort(key=lambda event: _parse(event["start"]["dateTime"]) if "dateTime" in event.get("start", {}) else _EPOCH)
+        else:
+            events.sort(key=lambda event: event.get("updated", ""))
+
+        offset = int(page_token) if page_token else 0
+        page_size = max(1, min(max_results, MAX_PAGE_SIZE))
+        page = events[offset:offset + page_size]
+        result = {"kind": "calendar#events", "etag": f'"{sequence}"', "items": page}
+        if offset + page_size < len(events):
+            result["nextPageToken"] = str(offset + page_size)
+        else:
+            result["nextSyncToken"] = f"s{sequence}"
+        return result
+
+    def _get(self, calendar_id: str, event_id: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        event = self._calendars.get(calendar_id, {}).get(event_id)
+        if event is None or event.get("status") == "cancelled":
+            raise _http_error(404, "Not Found")
+        if headers and headers.get("If-None-Match") == event["etag"]:
+            raise _http_error(304, "Not Modified")
+        return event
+
+    def _insert(self, calendar_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        event = dict(copy.deepcopy(body), id=body.get("id") or uuid.uuid4().hex)
+        existing = self._calendars.get(calendar_id, {}).get(event["id"])
+        if existing is not None and existing.get("status") != "cancelled":
+            raise _http_error(409, "The requested identifier already exists.")
+        return self._store(calendar_id, event)
+
+    def _update(self, calendar_id: str, event_id: str, body: Dict[str, Any],
+                headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        self._check_precondition(calendar_id, event_id, headers)
+        return self._store(calendar_id, dict(copy.deepcopy(body), id=event_id))
+
+    def _patch(self, calendar_id: str, event_id: str, body: Dict[str, Any],
+               headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        current = self._check_precondition(calendar_id, event_id, headers)
+        merged = _merge(copy.deepcopy(current), copy.deepcopy(body))
+        return self._store(calendar_id, dict(merged, id=event_id))
+
+    def _delete(self, calendar_id: str, event_id: str, headers: Optional[Dict[str, str]] = None):
+        event = self._calendars.get(calendar_id, {}).get(event_id)
+        if event is not None and event.get("status") == "cancelled":
+            raise _http_error(410, "Resource has been deleted")
+        self._check_precondition(calendar_id, event_id, headers)
+        self._store(calendar_id, {"id": event_id, "status": "cancelled"})
+        return None
+
+    def _check_precondition(self, calendar_id: str, event_id: str,
+                            headers: Optional[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        取得現有事件，並檢查 If-Match 的 ETag 是否相符
+        """
+        current = self._get(calendar_id, event_id)
+        expected = (headers or {}).get("If-Match")
+        if expected and expected != "*" and expected != current["etag"]:
+            raise _http_error(412, "Precondition Failed")
+        return current
+
+    def _store(self, calendar_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._sequence += 1
+            event.setdefault("status", "confirmed")
+            _normalize_times(event)
+            event["etag"] = f'"{self._sequence}"'
+            event["updated"] = datetime.now(timezone.utc).isoformat()
+            self._calendars.setdefault(calendar_id, {})[event["id"]] = event
+            self._changed_at[(calendar_id, event["id"])] = self._sequence
+            return event
+
+
+# 應用程式共用的模擬日曆
+_shared_service = None
+_shared_lock = threading.Lock()
+
+
+def use_fake_backend() -> bool:
+    """
+    是否以模擬日曆取代 Google Calendar
+    """
+    return CALENDAR_BACKEND == "fake"
+
+
+def shared_service() -> FakeCalendarService:
+    """
+    取得應用程式共用的模擬日曆，延遲與失敗率由環境變數設定
+    """
+    global _shared_service
+    with _shared_lock:
+        if _shared_service is None:
+            _shared_service = FakeCalendarService(
+                latency=CALENDAR_FAKE_LATENCY,
+                latency_jitter=CALENDAR_FAKE_JITTER,
+                failure_rate=CALENDAR_FAKE_FAILURE_RATE
+            )
+        return _shared_service
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _http_error(status: int, reason: str) -> Exception:
+    import httplib2
+    from googleapiclient.errors import HttpError
+    return HttpError(httplib2.Response({"status": status, "reason": reason}), reason.encode())
+
+
+def _sync_sequence(sync_token: str) -> Optional[int]:
+    if not sync_token.startswith("s") or not sync_token[1:].isdigit():
+        return None
+    return int(sync_token[1:])
+
+
+def _merge(target: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    patch 語意: 只更新指定的欄位，巢狀物件逐層合併，陣列整個取代
+    """
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            target[key] = _merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def _parse_fields(text: str) -> Dict[str, Any]:
+    """
+    解析 fields 參數為欄位樹，例如 items(id,start),nextPageToken -> {"items": {"id": None, "start": None}, ...}，
+    None 表示取回該欄位的全部內容
+    """
+    tree, _ = _parse_selection(text, 0)
+    return tree
+
+
+def _parse_selection(text: str, position: int) -> Tuple[Dict[str, Any], int]:
+    tree = {}
+    name = ""
+    while position < len(text):
+        char = text[position]
+        if char == "(":
+            subtree, position = _parse_selection(text, position + 1)
+            _add_field(tree, name, subtree)
+            name = ""
+        elif char == ")":
+            break
+        elif char == ",":
+            if name.strip():
+                _add_field(tree, name, None)
+            name = ""
+        else:
+            name += char
+        position += 1
+    if name.strip():
+        _add_field(tree, name, None)
+    return tree, position
+
+
+def _add_field(tree: Dict[str, Any], path: str, subtree: Optional[Dict[str, Any]]):
+    # a/b 表示巢狀欄位
+    parts = path.strip().split("/")
+    for part in parts[:-1]:
+        if part in tree and tree[part] is None:
+            return
+        tree = tree.setdefault(part, {})
+    if parts[-1] in tree and tree[parts[-1]] is None:
+        return
+    tree[parts[-1]] = subtree
+
+
+def _apply_fields(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    """
+    只保留欄位樹中的欄位，列表中的每個項目各自套用
+    """
+    if tree is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [_apply_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _apply_fields(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+
+def _search_text(event: Dict[str, Any]) -> str:
+    return " ".join(str(event.get(field, "")) for field in SEARCH_FIELDS).lower()
+
+
+def _normalize_times(event: Dict[str, Any]):
+    """
+    與 Google Calendar 相同，將指定 timeZone 的當地時間轉換為含時差的 RFC3339 時間
+    """
+    for key in ("start", "end"):
+        value = event.get(key)
+        if not value or "dateTime" not in value:
+            continue
+        parsed = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=ZoneInfo(value.get("timeZone") or "UTC"))
+        event[key] = dict(value, dateTime=parsed.isoformat())
+
+
+def _parse(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _overlaps(event: Dict[str, Any], low: Optional[datetime], high: Optional[datetime]) -> bool:
+    start = event.get("start", {}).get("dateTime")
+    if not start:
+        return False
+    start_time = _parse(start)
+    end = event.get("end", {}).get("dateTime")
+    end_time = _parse(end) if end else start_time
+    if low is not None and end_time <= low:
+        return False
+    if high is not None and start_time >= high:
+        return False
+    return True
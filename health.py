@@ -0,0 +1,115 @@
+"""
+健康檢查模組 - 記錄啟動預熱進度與外部服務 (Google Calendar、LINE) 的探測結果，提供 /healthz 與 /readyz 使用
+"""
+import os
+import time
+import threading
+from typing import Dict, Any, Callable
+
+from metrics import registry
+from structured_log import get_logger
+
+# 外部服務探測間隔（秒），0 表示不定期探測
+HEALTH_PROBE_INTERVAL = int(os.getenv("HEALTH_PROBE_INTERVAL", "60"))
+
+PROBE_LATENCY = registry.gauge("dependency_probe_seconds", "外部服務最近一次探測的延遲（秒）", ("dependency",))
+PROBE_UP = registry.gauge("dependency_up", "外部服務最近一次探測是否成功 (1 成功，0 失敗)", ("dependency",))
+
+logger = get_logger("health")
+
+
+class HealthMonitor:
+    """
+    健康狀態 - 啟動預熱完成後才視為就緒；外部服務的探測結果只作為資訊回報，
+    因為所有執行個體共用同一個外部服務，不應因外部服務異常而全部停止接收流量
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.warmed_at = None
+        self._steps = {}
+        self._probes = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self) -> bool:
+        return self.warmed_at is not None
+
+    def add_probe(self, name: str, func: Callable[[], Any]):
+        """
+        註冊外部服務探測，函數拋出例外表示探測失敗
+        """
+        self._probes[name] = func
+
+    def run_step(self, name: str, func: Callable[[], Any]) -> bool:
+        """
+        執行一個預熱步驟並記錄耗時，函數回傳 None 或拋出例外表示失敗
+
+        Returns:
+            是否成功
+        """
+        started = time.perf_counter()
+        error = None
+        try:
+            if func() is None:
+                error = "未取得結果"
+        except Exception as e:
+            error = str(e)
+        step = {"ok": error is None, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+        if error is not None:
+            step["error"] = error
+            logger.warning("預熱步驟失敗: %s", name, extra={"step": name, "error": error})
+        with self._lock:
+            self._steps[name] = step
+        return error is None
+
+    def mark_warm(self):
+        """
+        標記啟動預熱完成
+        """
+        self.warmed_at = time.time()
+        logger.info("服務已就緒", extra={"warm_up_seconds": round(self.warmed_at - self.started_at, 3)})
+
+    def probe_all(self) -> Dict[str, Dict[str, Any]]:
+        """
+        依序探測所有外部服務並記錄延遲
+        """
+        for name, func in list(self._probes.items()):
+            started = time.perf_counter()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = str(e)
+            elapsed = time.perf_counter() - started
+            result = {"ok": error is None, "latency_ms": round(elapsed * 1000, 1), "checked_at": time.time()}
+            if error is not None:
+                result["error"] = error
+                logger.warning("外部服務探測失敗: %s", name, extra={"dependency": name, "error": error})
+            PROBE_LATENCY.set(elapsed, dependency=name)
+            PROBE_UP.set(1 if error is None else 0, dependency=name)
+            with self._lock:
+                self._results[name] = result
+        return self.dependencies()
+
+    def dependencies(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            results = {name: dict(result) for name, result in self._results.items()}
+        for result in results.values():
+            result["age_seconds"] = round(now - result.pop("checked_at"), 1)
+        return results
+
+    def liveness(self) -> Dict[str, Any]:
+        return {"status": "ok", "uptime_seconds": round(time.time() - self.started_at, 1)}
+
+    def readiness(self) -> Dict[str, Any]:
+        dependencies = self.dependencies()
+        with self._lock:
+            steps = {name: dict(step) for name, step in self._steps.items()}
+        return {
+            "status": "ready" if self.is_ready else "warming_up",
+            "warm_up": steps,
+            "dependencies": dependencies,
+            "degraded": sorted(name for name, result in dependencies.items() if not result["ok"]),
+        }
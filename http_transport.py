@@ -0,0 +1,164 @@
+"""
+HTTP 傳輸模組 - 以 urllib3 的連線池取代 googleapiclient 預設的 httplib2 傳輸：
+httplib2.Http 不可跨執行緒使用、每個客戶端各自連線，連線池則由所有執行緒共用，保持連線 (keep-alive) 重複使用，
+並要求 gzip 壓縮回應、可設定逾時與連線層級的重試
+
+介面與 httplib2.Http.request 相容，googleapiclient 與 google_auth_httplib2 不需修改即可使用
+"""
+import os
+import threading
+from typing import Dict, Optional, Any, Tuple
+
+# 日曆客戶端的 HTTP 傳輸: httplib2 (預設) 或 pooled (共用連線池)
+CALENDAR_HTTP_TRANSPORT = os.getenv("CALENDAR_HTTP_TRANSPORT", "httplib2").lower()
+# 每個主機保留的連線數上限，超過時的連線用完即關閉
+CALENDAR_HTTP_POOL_SIZE = int(os.getenv("CALENDAR_HTTP_POOL_SIZE", "10"))
+# 建立連線與讀取回應的逾時（秒）
+CALENDAR_HTTP_CONNECT_TIMEOUT = float(os.getenv("CALENDAR_HTTP_CONNECT_TIMEOUT", "5"))
+CALENDAR_HTTP_READ_TIMEOUT = float(os.getenv("CALENDAR_HTTP_READ_TIMEOUT", "30"))
+# 連線失敗的重試次數；狀態碼 (429、5xx) 的重試仍由呼叫端 (outbox、斷路器) 決定
+CALENDAR_HTTP_RETRIES = int(os.getenv("CALENDAR_HTTP_RETRIES", "2"))
+
+# 連線失敗時可安全重試的方法，POST 可能已送達伺服器，不重試
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS", "PATCH"})
+
+_shared = None
+_lock = threading.Lock()
+
+
+class PooledHttp:
+    """
+    與 httplib2.Http 相容的 HTTP 傳輸，底層為執行緒安全的 urllib3.PoolManager
+    """
+    def __init__(self, pool_size: int = CALENDAR_HTTP_POOL_SIZE,
+                 connect_timeout: float = CALENDAR_HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = CALENDAR_HTTP_READ_TIMEOUT,
+                 retries: int = CALENDAR_HTTP_RETRIES):
+        """
+        Args:
+            pool_size: 每個主機保留的連線數上限
+            connect_timeout: 建立連線的逾時（秒）
+            read_timeout: 讀取回應的逾時（秒）
+            retries: 連線失敗的重試次數
+        """
+        import urllib3
+
+        self.timeout = urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+        self.retries = urllib3.Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=0,
+            redirect=5,
+            allowed_methods=IDEMPOTENT_METHODS,
+            backoff_factor=0.2,
+            raise_on_redirect=False,
+            raise_on_status=False
+        )
+        self.pool = urllib3.PoolManager(num_pools=4, maxsize=pool_size, retries=self.retries, timeout=self.timeout)
+
+    def request(self, uri: str, method: str = "GET", body: Any = None, headers: Optional[Dict[str, str]] = None,
+                redirections: int = 5, connection_type: Any = None, **kwargs) -> Tuple[Any, bytes]:
+        """
+        送出請求，簽名與 httplib2.Http.request 相同
+
+        Returns:
+            (httplib2.Response, 回應內容)，gzip 回應已解壓縮
+
+        Raises:
+            TimeoutError: 連線或讀取逾時
+            ConnectionError: 重試後仍無法連線
+        """
+        import httplib2
+        import urllib3
+
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        headers.setdefault("accept-encoding", "gzip")
+        # Google API 只在 User-Agent 含有 gzip 時壓縮回應
+        user_agent = headers.get("user-agent", "")
+        if "gzip" not in user_agent:
+            headers["user-agent"] = f"{user_agent} (gzip)".strip()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        try:
+            response = self.pool.request(
+                method,
+                uri,
+                body=body,
+                headers=headers,
+                redirect=redirections > 0,
+                retries=self.retries,
+                timeout=self.timeout,
+                preload_content=True,
+                decode_content=True
+            )
+        except urllib3.exceptions.MaxRetryError as e:
+            # NewConnectionError 繼承自 ConnectTimeoutError，需先判斷
+            if (isinstance(e.reason, urllib3.exceptions.TimeoutError)
+                    and not isinstance(e.reason, urllib3.exceptions.NewConnectionError)):
+                raise TimeoutError(str(e.reason)) from e
+            raise ConnectionError(str(e.reason)) from e
+        except urllib3.exceptions.TimeoutError as e:
+            raise TimeoutError(str(e)) from e
+        except urllib3.exceptions.HTTPError as e:
+            raise ConnectionError(str(e)) from e
+
+        info = {key.lower(): value for key, value in response.headers.items()}
+        # 內容已解壓縮，與 httplib2 相同改以 -content-encoding 保留原本的編碼
+        if "content-encoding" in info:
+            info["-content-encoding"] = info.pop("content-encoding")
+            info.pop("content-length", None)
+        info["status"] = str(response.status)
+        result = httplib2.Response(info)
+        result.reason = response.reason
+        return result, response.data
+
+    @property
+    def connections_created(self) -> int:
+        """
+        建立過的連線數，連線重複使用時不會增加
+        """
+        pools = self.pool.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def close(self):
+        """
+        關閉連線池中的所有連線
+        """
+        self.pool.clear()
+
+
+def shared_transport() -> PooledHttp:
+    """
+    取得行程內共用的連線池傳輸，第一次使用時建立
+    """
+    global _shared
+    if _shared is None:
+        with _lock:
+            if _shared is None:
+                _shared = PooledHttp()
+    return _shared
+
+
+def use_pooled_transport() -> bool:
+    """
+    日曆客戶端是否使用共用連線池
+    """
+    return CALENDAR_HTTP_TRANSPORT == "pooled"
+
+
+def authorized_http(credentials: Any, transport: Optional[PooledHttp] = None) -> Any:
+    """
+    以憑證包裝連線池傳輸，請求自動加上存取權杖，權杖更新也經過同一個連線池
+
+    Args:
+        credentials: 服務帳號憑證
+        transport: 連線池傳輸，預設為共用的連線池
+
+    Returns:
+        google_auth_httplib2.AuthorizedHttp
+    """
+    import google_auth_httplib2
+
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=transport or shared_transport())
@@ -40,8 +40,9 @@ def init_database():
     初始化資料庫
     """
     try:
-        # 初始化用戶管理器
+        # 初始化用戶管理器 (資料表預設在第一次查詢時才建立，此處直接建立)
         user_manager = UserManager()
+        user_manager.init_db()
         print("用戶資料庫初始化成功")
         return True
     except Exception as e:
@@ -4,37 +4,53 @@ LINE Bot 模組 - 處理 LINE Messaging API 整合
 import os
 import re
 import json
+from urllib.parse import parse_qs
 from typing import Dict, List, Optional, Tuple, Any
 from fastapi import APIRouter, Request, HTTPException, Depends, Header
 from fastapi.responses import JSONResponse
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage, 
-    TemplateSendMessage, ConfirmTemplate, MessageAction,
-    PostbackEvent, PostbackAction
-)
 
 from .calendar_manager import CalendarManager
 from .user_manager import UserManager, is_admin
+from approval_tokens import ApprovalSigner, InvalidApprovalToken, APPROVAL_TOKEN_SECRET, APPROVAL_TOKEN_TTL
+from line_client import LazyClient
+from shared_state import open_store
 
 # 從環境變數獲取 LINE 頻道密鑰
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET", "")
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
 
-# 初始化 LINE Bot API 和 Webhook 處理器
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+def create_line_bot_api():
+    """建立 LineBotApi"""
+    # line-bot-sdk 匯入時一併載入所有訊息模型與 requests，第一次使用時才匯入
+    from linebot import LineBotApi
+    
+    return LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+
+def create_webhook_handler():
+    """建立 WebhookHandler 並註冊文字訊息與按鈕回調的處理函數"""
+    from linebot import WebhookHandler
+    from linebot.models import MessageEvent, TextMessage, PostbackEvent
+    
+    webhook_handler = WebhookHandler(LINE_CHANNEL_SECRET)
+    webhook_handler.add(MessageEvent, message=TextMessage)(handle_text_message)
+    webhook_handler.add(PostbackEvent)(handle_postback)
+    return webhook_handler
+
+# 初始化 LINE Bot API 和 Webhook 處理器 (第一次使用時才建立)
+line_bot_api = LazyClient(create_line_bot_api)
+handler = LazyClient(create_webhook_handler)
+# 換班確認權杖的簽名
+approval_signer = ApprovalSigner(APPROVAL_TOKEN_SECRET or LINE_CHANNEL_SECRET)
 
 # 創建 FastAPI 路由器
 router = APIRouter()
 
-# 初始化日曆管理器和用戶管理器
+# 初始化日曆管理器和用戶管理器 (Google Calendar 服務與資料表在第一次使用時才建立)
 calendar_manager = CalendarManager()
 user_manager = UserManager()
 
-# 換班請求暫存
-shift_requests = {}
+# 已使用的換班確認權杖 (nonce)
+used_approval_tokens = open_store("approval_tokens")
 
 # 正則表達式模式 - 匹配換班請求
 SHIFT_REQUEST_PATTERN = r"我希望在(\d{8})([早中下晚]午|上|下)(\d{1,2}:\d{2})跟你換班"
@@ -44,6 +60,8 @@ async def line_callback(request: Request, x_line_signature: Optional[str] = Head
     """
     LINE Webhook 回調處理
     """
+    from linebot.exceptions import InvalidSignatureError
+    
     if not x_line_signature:
         raise HTTPException(status_code=400, detail="X-Line-Signature header is missing")
     
@@ -59,11 +77,12 @@ async def line_callback(request: Request, x_line_signature: Optional[str] = Head
     
     return JSONResponse(content={"status": "OK"})
 
-@handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
     """
     處理文本消息事件
     """
+    from linebot.models import TextSendMessage
+    
     user_id = event.source.user_id
     text = event.message.text
     reply_token = event.reply_token
@@ -97,6 +116,8 @@ def handle_shift_request(event, match):
     """
     處理換班請求
     """
+    from linebot.models import TextSendMessage, TemplateSendMessage, ConfirmTemplate, PostbackAction
+    
     user_id = event.source.user_id
     reply_token = event.reply_token
     
@@ -147,17 +168,8 @@ def handle_shift_request(event, match):
         )
         return
     
-    # 儲存換班請求
-    request_id = f"{user_id}_{target_user_id}_{date_str}_{time_period}_{time_str}"
-    shift_requests[request_id] = {
-        "requester_id": user_id,
-        "target_id": target_user_id,
-        "date": date_str,
-        "time_period": time_period,
-        "time": time_str,
-        "requester_shift": user_a_shift,
-        "target_shift": user_b_shift
-    }
+    # 換班請求以簽名權杖放在確認按鈕中，不需暫存
+    token = approval_signer.issue("", user_id, target_user_id, date_str, f"{time_period} {time_str}")
     
     # 向請求者發送確認訊息
     line_bot_api.reply_message(
@@ -174,11 +186,11 @@ def handle_shift_request(event, match):
         actions=[
             PostbackAction(
                 label="同意換班",
-                data=f"action=approve&request_id={request_id}"
+                data=f"action=approve&token={token}"
             ),
             PostbackAction(
                 label="拒絕換班",
-                data=f"action=reject&request_id={request_id}"
+                data=f"action=reject&token={token}"
             )
         ]
     )
@@ -188,30 +200,42 @@ def handle_shift_request(event, match):
         TemplateSendMessage(alt_text="換班請求", template=confirm_template)
     )
 
-@handler.add(PostbackEvent)
 def handle_postback(event):
     """
     處理按鈕回調事件
     """
+    from linebot.models import TextSendMessage
+    
     user_id = event.source.user_id
     reply_token = event.reply_token
     
     # 解析回調數據
-    data = event.postback.data
-    params = dict(item.split("=") for item in data.split("&"))
+    params = {key: values[0] for key, values in parse_qs(event.postback.data or "").items()}
     
     action = params.get("action")
-    request_id = params.get("request_id")
     
-    if not request_id or request_id not in shift_requests:
+    # 換班請求內容來自簽名的確認權杖
+    request = None
+    try:
+        approval = approval_signer.verify(params.get("token", ""))
+        time_period, _, time_str = approval.slot.partition(" ")
+        request = {
+            "requester_id": approval.requester_id,
+            "target_id": approval.target_id,
+            "date": approval.date,
+            "time_period": time_period,
+            "time": time_str
+        }
+    except InvalidApprovalToken:
+        pass
+    
+    if not request:
         line_bot_api.reply_message(
             reply_token,
             TextSendMessage(text="無效的請求或請求已過期。")
         )
         return
     
-    request = shift_requests[request_id]
-    
     # 檢查回覆者是否為目標用戶
     if user_id != request["target_id"]:
         line_bot_api.reply_message(
@@ -220,6 +244,14 @@ def handle_postback(event):
         )
         return
     
+    # 確認權杖只能使用一次
+    if not used_approval_tokens.claim(approval.nonce, APPROVAL_TOKEN_TTL):
+        line_bot_api.reply_message(
+            reply_token,
+            TextSendMessage(text="此換班請求已經處理過。")
+        )
+        return
+    
     # 格式化日期和時間
     date_str = request["date"]
     formatted_date = f"{date_str[:4]}/{date_str[4:6]}/{date_str[6:]}"
@@ -237,7 +269,16 @@ def handle_postback(event):
                 time_period, 
                 time_str
             )
-            
+        except Exception as e:
+            # 換班失敗時釋放權杖，可以再按一次同意
+            used_approval_tokens.release(approval.nonce)
+            line_bot_api.reply_message(
+                reply_token,
+                TextSendMessage(text=f"換班操作失敗：{str(e)}")
+            )
+            return
+        
+        try:
             # 通知兩位用戶
             requester_name = user_manager.get_user_name(request["requester_id"])
             target_name = user_manager.get_user_name(request["target_id"])
@@ -277,9 +318,6 @@ def handle_postback(event):
             request["requester_id"],
             TextSendMessage(text=f"{target_name} 已拒絕您在 {formatted_date} {time_period}{time_str} 的換班請求。")
         )
-    
-    # 刪除請求
-    del shift_requests[request_id]
 
 def extract_mentioned_users(text):
     """
@@ -303,6 +341,8 @@ def show_help(reply_token):
     """
     顯示幫助信息
     """
+    from linebot.models import TextSendMessage
+    
     help_text = (
         "📅 排班換班助手 - 指令說明\n\n"
         "1. 換班請求：\n"
@@ -0,0 +1,47 @@
+"""
+LINE 客戶端模組 - 匯入 line-bot-sdk 的任何子模組都會一併載入所有訊息模型與 requests，
+LineBotApi 與 WebhookHandler 改在第一次使用 (或啟動預熱) 時才匯入並建立
+"""
+import threading
+from typing import Any, Callable
+
+
+class LazyClient:
+    """
+    延遲建立的客戶端 - 第一次存取屬性時以 factory 建立實際的物件，之後的屬性直接轉給該物件
+
+    取得的屬性會快取在此物件上，同一個方法每次取得的都是同一個物件 (safe_send_message 以此比對方法)
+    """
+    def __init__(self, factory: Callable[[], Any]):
+        """
+        Args:
+            factory: 建立實際物件的函數，只會呼叫一次
+        """
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def resolve(self) -> Any:
+        """
+        取得實際的物件，第一次呼叫時建立
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    @property
+    def created(self) -> bool:
+        """
+        實際的物件是否已建立
+        """
+        return self._client is not None
+
+    def __getattr__(self, name: str) -> Any:
+        # 只在一般的屬性查找失敗時呼叫；初始化完成前不轉送，避免遞迴
+        if name in ("_factory", "_client", "_lock"):
+            raise AttributeError(name)
+        value = getattr(self.resolve(), name)
+        setattr(self, name, value)
+        return value
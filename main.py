@@ -3,48 +3,186 @@ import re
 import json
 import hashlib
 import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from zoneinfo import ZoneInfo
 from datetime import datetime, timedelta
+from urllib.parse import parse_qs
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError, LineBotApiError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage,
-    TemplateSendMessage, ConfirmTemplate, MessageAction,
-    FlexSendMessage, BubbleContainer, BoxComponent,
-    TextComponent, ButtonComponent, SeparatorComponent,
-    URIAction, ImageComponent, IconComponent
-)
-import google.oauth2.service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from fastapi.responses import JSONResponse, Response
+from schedule_renderer import WeeklyScheduleRenderer
+from calendar_fields import events_request
+from shifts import shifts_to_rows, shifts_from_rows
+from calendar_watch import EventMirror, WatchChannelManager, PushNotifier, CalendarNotificationService
+from tenants import Tenant, TenantRegistry, UnknownTenantError, TENANTS_CONFIG
+from schedule_index import ScheduleIndex, WEEKDAY_NAMES, DEFAULT_TIMEZONE, parse_band
+from shift_conflicts import ConflictChecker, ShiftConflictError, shift_end
+from metrics import registry, instrument, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from structured_log import setup_logging, get_logger, bind_correlation_id
+from tracing import traced, start_span, KIND_SERVER, KIND_CLIENT
+from health import HealthMonitor, HEALTH_PROBE_INTERVAL
+from reply_manager import ReplyManager
+from reminders import ShiftReminderScheduler, REMINDER_SYNC_INTERVAL, REMINDER_HORIZON_HOURS
+from write_coalescer import CalendarWriteBuffer, SlotMutation
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from outbox import CalendarOutbox, OutboxDispatcher, CALENDAR_OUTBOX, OUTBOX_POLL_INTERVAL, OUTBOX_ENTRIES
+from approval_tokens import ApprovalSigner, InvalidApprovalToken, APPROVAL_TOKEN_SECRET, APPROVAL_TOKEN_TTL
+from line_client import LazyClient
+import fake_calendar
+import calendar_client
+import shared_state
 
 # ====== 環境變數設定 ======
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET", "")
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
 GOOGLE_CALENDAR_ID = os.getenv("GOOGLE_CALENDAR_ID", "")
+# Google Calendar 推播通知網址 (例如 https://您的服務網址/calendar/notifications)，未設置則不啟用推播
+CALENDAR_WATCH_ADDRESS = os.getenv("CALENDAR_WATCH_ADDRESS", "")
+CALENDAR_WATCH_TOKEN = os.getenv("CALENDAR_WATCH_TOKEN", "")
+# 日曆查詢結果在店家快取中的存活時間（秒）
+CALENDAR_READ_TTL = int(os.getenv("CALENDAR_READ_TTL", "30"))
+# 排班查詢 API 的存取權杖，設置後需以 Authorization: Bearer <權杖> 呼叫
+SCHEDULE_API_TOKEN = os.getenv("SCHEDULE_API_TOKEN", "")
+# 監控指標端點的存取權杖，設置後需以 Authorization: Bearer <權杖> 呼叫 /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# LINE Messaging API 網址，預設為官方網址，效能測試時可指向模擬的服務
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "")
+# 服務啟動後是否在背景預先建立 Google Calendar 客戶端
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1").lower() in ("1", "true", "yes")
+
+# 日誌以佇列交由背景執行緒輸出，DEBUG_MODE 控制是否輸出除錯日誌
+setup_logging()
+logger = get_logger()
 
 # 確認環境變數已設置
 if not LINE_CHANNEL_SECRET or not LINE_CHANNEL_ACCESS_TOKEN:
     raise ValueError("請設置 LINE_CHANNEL_SECRET 和 LINE_CHANNEL_ACCESS_TOKEN 環境變數")
 
 if not GOOGLE_CALENDAR_ID:
-    print("警告: 未設置 GOOGLE_CALENDAR_ID 環境變數，Google Calendar 功能將無法正常運作")
+    logger.warning("未設置 GOOGLE_CALENDAR_ID 環境變數，Google Calendar 功能將無法正常運作")
 
 # ====== LINE Bot 設定 ======
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+def create_line_bot_api():
+    """建立 LineBotApi，回覆與推播加上監控指標、追蹤 span 與斷路器"""
+    # line-bot-sdk 匯入時一併載入所有訊息模型與 requests，第一次使用或啟動預熱時才匯入
+    from linebot import LineBotApi
+    
+    if LINE_API_ENDPOINT:
+        api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT)
+    else:
+        api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+    
+    # 記錄 LINE 回覆與推播的延遲、錯誤與追蹤 span (safe_send_message 以同一物件比對方法，不受影響)
+    api.reply_message = traced("line reply", KIND_CLIENT)(
+        instrument(api.reply_message, LINE_API_LATENCY, LINE_API_ERRORS, method="reply"))
+    api.push_message = traced("line push", KIND_CLIENT)(
+        instrument(api.push_message, LINE_API_LATENCY, LINE_API_ERRORS, method="push"))
+    
+    # LINE 異常時暫停發送，不再等待逾時 (在監控指標之外，暫停期間的拒絕不計入 API 延遲與錯誤)
+    api.reply_message = line_breaker.wrap(api.reply_message)
+    api.push_message = line_breaker.wrap(api.push_message)
+    api.multicast = line_breaker.wrap(api.multicast)
+    return api
+
+def create_webhook_handler():
+    """建立 WebhookHandler 並註冊文字訊息與按鈕回應的處理函數"""
+    from linebot import WebhookHandler
+    from linebot.models import MessageEvent, TextMessage, PostbackEvent
+    
+    webhook_handler = WebhookHandler(LINE_CHANNEL_SECRET)
+    webhook_handler.add(MessageEvent, message=TextMessage)(handle_text_message)
+    webhook_handler.add(PostbackEvent)(handle_postback)
+    return webhook_handler
+
+line_breaker = CircuitBreaker("line")
+line_bot_api = LazyClient(create_line_bot_api)
+handler = LazyClient(create_webhook_handler)
+# 換班確認權杖的簽名，所有 worker 使用相同的金鑰
+approval_signer = ApprovalSigner(APPROVAL_TOKEN_SECRET or LINE_CHANNEL_SECRET)
+
+# ====== 監控指標 ======
+WEBHOOK_LATENCY = registry.histogram("webhook_handling_seconds", "LINE webhook 處理時間（秒）", ("outcome",))
+COMMAND_LATENCY = registry.histogram("line_command_seconds", "各指令的處理時間（秒）", ("command",))
+LINE_API_LATENCY = registry.histogram("line_api_request_seconds", "LINE Messaging API 請求延遲（秒）", ("method",))
+LINE_API_ERRORS = registry.counter("line_api_request_errors_total", "LINE Messaging API 請求錯誤次數", ("method", "status"))
+DEDUP_LOOKUPS = registry.counter("dedup_lookups_total", "去重檢查次數，result 為 hit (重複) 或 miss", ("cache", "result"))
+DEDUP_ENTRIES = registry.gauge("dedup_entries", "去重記錄數量", ("cache",))
+TENANT_CACHE_ENTRIES = registry.gauge("tenant_cache_entries", "店家查詢快取項目數量", ("tenant",))
+
+# 處理較慢的指令時先回覆處理中訊息或顯示載入動畫，避免 reply token 失效
+reply_manager = ReplyManager(line_bot_api)
+
+# ====== 過期資料標記 ======
+# 日曆斷路器暫停呼叫時，查詢改用最後一次取得的資料，回覆時附上資料時間 (epoch 秒)
+stale_data_as_of = contextvars.ContextVar("stale_data_as_of", default=None)
+
+@contextmanager
+def stale_data_scope():
+    """每個事件各自記錄是否使用了過期的資料"""
+    token = stale_data_as_of.set(None)
+    try:
+        yield
+    finally:
+        stale_data_as_of.reset(token)
+
+def mark_stale(as_of):
+    """記錄本次指令使用了過期的資料，多次使用時保留最舊的時間"""
+    current = stale_data_as_of.get()
+    if current is None or as_of < current:
+        stale_data_as_of.set(as_of)
+
+def with_stale_notice(message):
+    """本次指令使用了過期的資料時，在文字訊息後附上資料時間"""
+    from linebot.models import TextSendMessage
+    as_of = stale_data_as_of.get()
+    if as_of is None or not isinstance(message, TextSendMessage):
+        return message
+    as_of_text = datetime.fromtimestamp(as_of, ZoneInfo(DEFAULT_TIMEZONE)).strftime('%m/%d %H:%M')
+    return TextSendMessage(text=f"{message.text}\n\n(Google Calendar 暫時無法連線，資料為 {as_of_text} 的紀錄)")
 
 # ====== 換班請求正則表達式 ======
 # 匹配格式: "我希望在YYYYMMDD HH:MM (24小時制)跟你換班 @用戶名"
 SHIFT_REQUEST_PATTERN = r"我希望在(\d{8})\s+(\d{2}):(\d{2})跟你換班\s*@(.+)"
 
-# 匹配格式: "新增排班 YYYYMMDD HH:MM @用戶名"
-ADD_SHIFT_PATTERN = r"新增排班\s+(\d{8})\s+(\d{2}):(\d{2})\s*@(.+)"
+# 匹配格式: "新增排班 YYYYMMDD HH:MM[-HH:MM] @用戶名"
+ADD_SHIFT_PATTERN = r"新增排班\s+(\d{8})\s+(\d{2}):(\d{2})(?:-(\d{2}):(\d{2}))?\s*@(.+)"
+
+# 匹配格式: "批次排班 YYYYMMDD HH:MM[-HH:MM] @用戶名"
+BATCH_SHIFT_PATTERN = r"批次排班\s+(\d{8})\s+(\d{2}):(\d{2})(?:-(\d{2}):(\d{2}))?\s*@(.+)"
+
+# 匹配格式: "檢查排班 YYYYMMDD"
+COVERAGE_CHECK_PATTERN = r"檢查排班\s+(\d{8})$"
 
-# 匹配格式: "批次排班 YYYYMMDD HH:MM @用戶名"
-BATCH_SHIFT_PATTERN = r"批次排班\s+(\d{8})\s+(\d{2}):(\d{2})\s*@(.+)"
+# 匹配格式: "查詢班表 YYYYMM [週X] [早上|下午|晚上] [@用戶名]"
+QUERY_SHIFT_PATTERN = r"查詢班表\s+(\d{6})(?:\s+週([一二三四五六日]))?(?:\s+(早上|下午|晚上))?(?:\s*@(.+))?$"
+
+# 匹配格式: "月班表 YYYYMM [週X] [早上|下午|晚上]"
+MONTH_SCHEDULE_PATTERN = r"月班表\s+(\d{6})(?:\s+週([一二三四五六日]))?(?:\s+(早上|下午|晚上))?$"
+
+# 指令名稱，依訊息開頭判斷，用於監控指標的 command 標籤
+COMMAND_PREFIXES = (
+    ("我希望在", "shift_request"),
+    ("批准換班:", "approve_shift"),
+    ("拒絕換班:", "reject_shift"),
+    ("新增排班", "add_shift"),
+    ("批次排班", "batch_shift"),
+    ("檢查排班", "coverage_check"),
+    ("查詢班表", "query_shift"),
+    ("月班表", "month_schedule"),
+    ("查看用戶映射", "user_mapping"),
+    ("測試日曆", "week_calendar"),
+    ("清理緩存", "clear_cache"),
+    ("幫助", "help"),
+)
+
+def command_label(text):
+    """取得訊息對應的指令名稱"""
+    for prefix, label in COMMAND_PREFIXES:
+        if text.startswith(prefix):
+            return label
+    return "other"
 
 # ====== 用戶管理 ======
 # 初始化用戶映射表 - 用戶名稱與 LINE ID 對應關係
@@ -57,20 +195,28 @@ USER_MAPPING = {
     "鄭銘貴": "U0c63e33715aebc37754bc2cf522ab6fa"
 }
 
-# 用於存儲換班請求
-shift_requests = {}
+# 最近發送的換班請求，用於提醒重複發送 (設置 SHARED_STATE_BACKEND=sqlite 時由多個 worker 共用，以下記錄相同)
+# 換班請求的內容放在確認按鈕的簽名權杖中，不需另外儲存
+recent_shift_requests = shared_state.open_store("shift_requests")
+# 已使用的換班確認權杖 (nonce)，防止同一個請求被重複批准或拒絕
+used_approval_tokens = shared_state.open_store("approval_tokens")
 
 # ====== 去重機制 ======
 # 存儲已處理的 webhook 請求
-processed_webhook_requests = {}
+processed_webhook_requests = shared_state.open_store("webhook_requests")
 # 存儲已發送的訊息，格式: {message_hash: timestamp}
-sent_messages = {}
+sent_messages = shared_state.open_store("sent_messages")
 # 存儲已處理的日曆操作，格式: {operation_hash: timestamp}
-processed_calendar_operations = {}
+processed_calendar_operations = shared_state.open_store("calendar_operations")
 # 訊息和操作的過期時間（秒）
 MESSAGE_EXPIRY = 3600  # 1小時
 OPERATION_EXPIRY = 86400  # 24小時
 
+# 去重記錄數量在輸出指標時才計算
+DEDUP_ENTRIES.set_function(lambda: len(processed_webhook_requests), cache="webhook")
+DEDUP_ENTRIES.set_function(lambda: len(sent_messages), cache="message")
+DEDUP_ENTRIES.set_function(lambda: len(processed_calendar_operations), cache="calendar_operation")
+
 def generate_hash(data):
     """生成數據的雜湊值"""
     if isinstance(data, dict):
@@ -83,80 +229,86 @@ def is_duplicate_webhook(request_id, body_text):
     # 生成請求的唯一標識
     request_hash = generate_hash(f"{request_id}_{body_text}")
     
-    # 檢查是否已處理過此請求
-    if request_hash in processed_webhook_requests:
-        # 檢查請求是否在短時間內重複
-        last_time = processed_webhook_requests[request_hash]
-        if time.time() - last_time < 10:  # 10秒內的重複請求視為重複
-            print(f"檢測到重複的 webhook 請求: {request_id}")
-            return True
-    
-    # 記錄此請求
-    processed_webhook_requests[request_hash] = time.time()
+    # 記錄此請求，10秒內已處理過的請求視為重複 (檢查與記錄為單一原子操作，多個 worker 同時收到時只有一個會處理)
+    if not processed_webhook_requests.claim(request_hash, 10):
+        logger.info("檢測到重複的 webhook 請求", extra={"request_id": request_id})
+        DEDUP_LOOKUPS.inc(cache="webhook", result="hit")
+        return True
+    DEDUP_LOOKUPS.inc(cache="webhook", result="miss")
     
     # 清理過期的請求記錄
-    clean_expired_records(processed_webhook_requests, 300)  # 5分鐘後過期
+    processed_webhook_requests.purge(300)  # 5分鐘後過期
     
     return False
 
+@traced("dedup.message")
 def is_duplicate_message(user_id, message_text):
     """檢查訊息是否重複發送"""
     # 生成訊息的唯一標識
     message_hash = generate_hash(f"{user_id}_{message_text}")
     
-    # 檢查是否已發送過此訊息
-    if message_hash in sent_messages:
-        # 檢查訊息是否在短時間內重複
-        last_time = sent_messages[message_hash]
-        if time.time() - last_time < MESSAGE_EXPIRY:
-            print(f"檢測到重複的訊息: {message_text[:30]}...")
-            return True
-    
-    # 記錄此訊息
-    sent_messages[message_hash] = time.time()
+    # 記錄此訊息，有效期內已發送過的訊息視為重複
+    if not sent_messages.claim(message_hash, MESSAGE_EXPIRY):
+        logger.debug("檢測到重複的訊息", extra={"text": message_text[:30]})
+        DEDUP_LOOKUPS.inc(cache="message", result="hit")
+        return True
+    DEDUP_LOOKUPS.inc(cache="message", result="miss")
     
     # 清理過期的訊息記錄
-    clean_expired_records(sent_messages, MESSAGE_EXPIRY)
+    sent_messages.purge(MESSAGE_EXPIRY)
     
     return False
 
-def is_duplicate_calendar_operation(operation_type, date_str, time_str, user_a, user_b=""):
-    """檢查日曆操作是否重複"""
-    # 生成操作的唯一標識
-    operation_data = {
+def calendar_operation_hash(operation_type, date_str, time_str, user_a, user_b="", calendar_id=""):
+    """生成日曆操作的唯一標識"""
+    return generate_hash({
+        "calendar_id": calendar_id,
         "type": operation_type,
         "date": date_str,
         "time": time_str,
         "user_a": user_a,
         "user_b": user_b
-    }
-    operation_hash = generate_hash(operation_data)
-    
-    # 檢查是否已執行過此操作
-    if operation_hash in processed_calendar_operations:
-        # 檢查操作是否在有效期內重複
-        last_time = processed_calendar_operations[operation_hash]
-        if time.time() - last_time < OPERATION_EXPIRY:
-            print(f"檢測到重複的日曆操作: {operation_type} {date_str} {time_str}")
-            return True
+    })
+
+@traced("dedup.calendar_operation")
+def is_duplicate_calendar_operation(operation_type, date_str, time_str, user_a, user_b="", calendar_id=""):
+    """檢查日曆操作是否重複"""
+    operation_hash = calendar_operation_hash(operation_type, date_str, time_str, user_a, user_b, calendar_id)
     
-    # 記錄此操作
-    processed_calendar_operations[operation_hash] = time.time()
+    # 記錄此操作，有效期內已執行過的操作視為重複
+    if not processed_calendar_operations.claim(operation_hash, OPERATION_EXPIRY):
+        logger.info("檢測到重複的日曆操作", extra={"operation": operation_type, "date": date_str, "time": time_str})
+        DEDUP_LOOKUPS.inc(cache="calendar_operation", result="hit")
+        return True
+    DEDUP_LOOKUPS.inc(cache="calendar_operation", result="miss")
     
     # 清理過期的操作記錄
-    clean_expired_records(processed_calendar_operations, OPERATION_EXPIRY)
+    processed_calendar_operations.purge(OPERATION_EXPIRY)
     
     return False
 
-def clean_expired_records(records_dict, expiry_seconds):
-    """清理過期的記錄"""
-    current_time = time.time()
-    expired_keys = [k for k, v in records_dict.items() if current_time - v > expiry_seconds]
-    for key in expired_keys:
-        del records_dict[key]
+def release_calendar_operation(operation_type, date_str, time_str, user_a, user_b="", calendar_id=""):
+    """寫入失敗或因衝突未寫入時取消操作記錄，重試時不會被當作重複操作略過"""
+    processed_calendar_operations.release(calendar_operation_hash(operation_type, date_str, time_str, user_a, user_b, calendar_id))
 
 def safe_send_message(method, *args, **kwargs):
     """安全發送訊息，避免重複發送"""
+    from linebot.exceptions import LineBotApiError
+    from linebot.models import FlexSendMessage
+    
+    # event_source 只用於 reply token 失效時改用 push message，不可傳給 LINE API
+    event_source = kwargs.pop("event_source", None)
+    
+    # reply token 已用於處理中訊息或已失效時，直接改用 push message
+    push_to = reply_manager.redirect(args[0]) if method == line_bot_api.reply_message else None
+    if len(args) > 1:
+        args = (args[0], with_stale_notice(args[1])) + args[2:]
+    
+    def send():
+        if push_to:
+            return line_bot_api.push_message(push_to, args[1], **kwargs)
+        return method(*args, **kwargs)
+    
     # 提取用戶 ID 和訊息內容
     user_id = None
     message_text = None
@@ -187,32 +339,36 @@ def safe_send_message(method, *args, **kwargs):
     
     # 如果無法提取訊息內容，直接發送
     if not user_id or not message_text:
-        return method(*args, **kwargs)
+        return send()
     
     # 檢查是否重複發送
     if is_duplicate_message(user_id, message_text):
-        print(f"跳過重複訊息: {message_text[:30]}...")
+        logger.info("跳過重複訊息", extra={"text": message_text[:30]})
         return None
     
     # 發送訊息
     try:
-        return method(*args, **kwargs)
+        return send()
+    except CircuitOpenError:
+        logger.warning("LINE 暫時無法連線，訊息未送出", extra={"text": message_text[:30]})
+        sent_messages.pop(generate_hash(f"{user_id}_{message_text}"), None)
+        return None
     except LineBotApiError as e:
         if hasattr(e, "status_code") and e.status_code == 429:
-            print("LINE 發訊息已達本月上限，訊息未送出。")
+            logger.error("LINE 發訊息已達本月上限，訊息未送出")
             return None
         
-        print(f"發送訊息時發生錯誤: {str(e)}")
+        logger.warning("發送訊息時發生錯誤: %s", e)
         # 其他例外 fallback or raise
         ...
 
         
         # 如果是 reply token 無效的錯誤，嘗試使用 push message
-        if "Invalid reply token" in str(e) and method == line_bot_api.reply_message:
-            print("嘗試使用 push message 替代 reply message")
+        if "Invalid reply token" in str(e) and method == line_bot_api.reply_message and not push_to:
+            logger.info("嘗試使用 push message 替代 reply message")
+            reply_manager.record_failed_reply(args[0])
             
             # 從 event 中獲取用戶 ID
-            event_source = kwargs.get("event_source")
             if event_source and hasattr(event_source, "user_id"):
                 user_id = event_source.user_id
                 
@@ -220,17 +376,20 @@ def safe_send_message(method, *args, **kwargs):
                 try:
                     return line_bot_api.push_message(user_id, args[1])
                 except Exception as push_error:
-                    print(f"使用 push message 發送訊息時發生錯誤: {str(push_error)}")
+                    logger.error("使用 push message 發送訊息時發生錯誤: %s", push_error)
         
         # 如果發送失敗，從記錄中移除此訊息
         message_hash = generate_hash(f"{user_id}_{message_text}")
-        if message_hash in sent_messages:
-            del sent_messages[message_hash]
+        sent_messages.pop(message_hash, None)
         raise
 
 # ====== Google Calendar API 設定 ======
-def get_calendar_service():
-    """獲取 Google Calendar 服務"""
+def build_calendar_service():
+    """建立 Google Calendar 服務"""
+    # 設置 CALENDAR_BACKEND=fake 時使用記憶體中的模擬日曆
+    if fake_calendar.use_fake_backend():
+        logger.info("使用模擬 Google Calendar 服務")
+        return fake_calendar.shared_service()
     try:
         # 嘗試從環境變數中獲取服務帳號憑證
         service_account_info = None
@@ -239,127 +398,226 @@ def get_calendar_service():
         service_account_file = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE")
         if service_account_file and os.path.exists(service_account_file):
             try:
-                print(f"嘗試從檔案讀取服務帳號憑證: {service_account_file}")
+                logger.debug("嘗試從檔案讀取服務帳號憑證", extra={"path": service_account_file})
                 with open(service_account_file, 'r') as f:
                     service_account_info = json.load(f)
-                print("成功從檔案讀取服務帳號憑證")
+                logger.debug("成功從檔案讀取服務帳號憑證")
             except Exception as e:
-                print(f"從檔案讀取服務帳號憑證時發生錯誤: {str(e)}")
+                logger.error("從檔案讀取服務帳號憑證時發生錯誤: %s", e)
         
         # 如果檔案讀取失敗，嘗試從 GOOGLE_SERVICE_ACCOUNT_JSON 讀取 JSON 字串
         if not service_account_info:
             service_account_json = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON", "{}")
             try:
-                print("嘗試從環境變數 GOOGLE_SERVICE_ACCOUNT_JSON 讀取服務帳號憑證")
+                logger.debug("嘗試從環境變數 GOOGLE_SERVICE_ACCOUNT_JSON 讀取服務帳號憑證")
                 service_account_info = json.loads(service_account_json)
                 if not service_account_info:
-                    print("警告: GOOGLE_SERVICE_ACCOUNT_JSON 環境變數為空或格式不正確")
+                    logger.warning("GOOGLE_SERVICE_ACCOUNT_JSON 環境變數為空或格式不正確")
             except Exception as e:
-                print(f"解析 GOOGLE_SERVICE_ACCOUNT_JSON 時發生錯誤: {str(e)}")
+                logger.error("解析 GOOGLE_SERVICE_ACCOUNT_JSON 時發生錯誤: %s", e)
         
         if not service_account_info:
-            print("錯誤: 無法獲取服務帳號憑證，請檢查 GOOGLE_SERVICE_ACCOUNT_FILE 或 GOOGLE_SERVICE_ACCOUNT_JSON 環境變數")
+            logger.error("無法獲取服務帳號憑證，請檢查 GOOGLE_SERVICE_ACCOUNT_FILE 或 GOOGLE_SERVICE_ACCOUNT_JSON 環境變數")
             return None
             
+        # Google API 的憑證模組載入較慢，第一次建立服務時才匯入
+        import google.oauth2.service_account
+        
         # 使用服務帳號憑證創建 credentials
         credentials = google.oauth2.service_account.Credentials.from_service_account_info(
             service_account_info,
             scopes=['https://www.googleapis.com/auth/calendar']
         )
         
-        # 創建 Google Calendar 服務
-        service = build('calendar', 'v3', credentials=credentials)
-        print(f"成功創建 Google Calendar 服務，使用日曆 ID: {GOOGLE_CALENDAR_ID}")
+        # 以內附的 discovery 文件創建 Google Calendar 服務，不需連線下載
+        service = calendar_client.build('calendar', 'v3', credentials=credentials)
+        logger.info("成功創建 Google Calendar 服務")
         return service
     except Exception as e:
-        print(f"獲取 Google Calendar 服務時發生錯誤: {str(e)}")
+        logger.error("獲取 Google Calendar 服務時發生錯誤: %s", e)
         return None
 
-def get_calendar_events(date_str):
-    """獲取指定日期的日曆事件"""
-    service = get_calendar_service()
+@traced()
+def get_calendar_service(tenant=None):
+    """獲取店家的 Google Calendar 服務 (每個店家各自重複使用已建立的客戶端)"""
+    return (tenant or default_tenant).get_service()
+
+def record_calendar_write(tenant, date_str, event):
+    """寫入日曆後更新店家的本地鏡像與排班索引，並清除受影響的查詢快取"""
+    version = tenant.mirror.apply(event)
+    # 索引只差這一次寫入時直接更新，否則 (期間有同步或其他寫入) 由 get_schedule_index 重建
+    if version is not None and tenant.schedule_index.version == version - 1:
+        tenant.schedule_index.upsert(event, version=version)
+    tenant.cache.invalidate(f"shifts:{date_str}")
+    tenant.cache.invalidate(f"shifts:week:{tenant.time.today()}")
+
+def get_event_description(tenant, service, event_id):
+    """取得事件目前的描述 (時段查詢的欄位遮罩不含描述)"""
+    event = tenant.execute(events_request(service, "get", "event_history", calendarId=tenant.calendar_id, eventId=event_id))
+    return event.get('description', '')
+
+def list_events_with_fallback(tenant, cache_key, request):
+    """
+    執行事件查詢，解析為排班後寫入快取，另外保存最後一次的結果；日曆斷路器暫停呼叫時改用最後一次的結果並標記資料時間
+    """
+    try:
+        shifts = tenant.time.parse_shifts(tenant.execute(request).get('items', []))
+    except CircuitOpenError:
+        last = tenant.cache.get(f"last:{cache_key}")
+        if last is None:
+            raise
+        mark_stale(last["fetched_at"])
+        return shifts_from_rows(last["events"])
+    rows = shifts_to_rows(shifts)
+    tenant.cache.set(cache_key, rows, ttl=CALENDAR_READ_TTL)
+    tenant.cache.set(f"last:{cache_key}", {"events": rows, "fetched_at": time.time()})
+    return shifts
+
+def cached_shifts(tenant, cache_key):
+    """從查詢快取取得排班，沒有快取時回傳 None"""
+    rows = tenant.cache.get(cache_key)
+    return shifts_from_rows(rows) if rows is not None else None
+
+@traced()
+def get_calendar_events(date_str, tenant=None):
+    """獲取指定日期的排班 (shifts.Shift)"""
+    tenant = tenant or default_tenant
+    service = get_calendar_service(tenant)
     if not service:
         return None
         
     try:
-        # 將日期字符串轉換為 datetime 對象
-        date = datetime.strptime(date_str, "%Y%m%d")
+        # 時間範圍為店家當地的整天
+        time_min, time_max = tenant.time.day_bounds(date_str)
+        
+        logger.debug("查詢日曆事件", extra={"date": date_str, "tenant": tenant.tenant_id})
         
-        # 設置時間範圍為整天
-        time_min = date.replace(hour=0, minute=0, second=0).isoformat() + 'Z'
-        time_max = date.replace(hour=23, minute=59, second=59).isoformat() + 'Z'
+        # 推播通道有效時，直接從本地鏡像讀取
+        if tenant.notifications.is_live:
+            return tenant.time.parse_shifts(tenant.mirror.list_events(time_min, time_max))
         
-        print(f"查詢日曆事件: 日期={date_str}, 日曆ID={GOOGLE_CALENDAR_ID}")
+        cache_key = f"shifts:{date_str}"
+        events = cached_shifts(tenant, cache_key)
+        if events is not None:
+            return events
         
         # 獲取事件
-        events_result = service.events().list(
-            calendarId=GOOGLE_CALENDAR_ID,
+        events = list_events_with_fallback(tenant, cache_key, events_request(
+            service, "list", "slot_lookup",
+            calendarId=tenant.calendar_id,
             timeMin=time_min,
             timeMax=time_max,
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
-        
-        events = events_result.get('items', [])
-        print(f"找到 {len(events)} 個事件")
+        ))
+        logger.debug("找到日曆事件", extra={"count": len(events), "tenant": tenant.tenant_id})
         return events
     except Exception as e:
-        print(f"獲取日曆事件時發生錯誤: {str(e)}")
+        logger.error("獲取日曆事件時發生錯誤: %s", e, extra={"date": date_str, "tenant": tenant.tenant_id})
         return None
 
-def get_week_calendar_events():
-    """獲取一週內的日曆事件"""
-    service = get_calendar_service()
+@traced()
+def get_week_calendar_events(tenant=None):
+    """獲取一週內的排班 (shifts.Shift)"""
+    tenant = tenant or default_tenant
+    service = get_calendar_service(tenant)
     if not service:
         return None
         
     try:
-        # 設置時間範圍為今天到一週後
-        now = datetime.utcnow()
-        time_min = now.replace(hour=0, minute=0, second=0).isoformat() + 'Z'
-        time_max = (now + timedelta(days=7)).replace(hour=23, minute=59, second=59).isoformat() + 'Z'
+        # 時間範圍為店家當地的今天到一週後
+        today = tenant.time.today()
+        time_min, time_max = tenant.time.week_bounds(today)
+        
+        logger.debug("查詢一週內日曆事件", extra={"time_min": time_min, "time_max": time_max, "tenant": tenant.tenant_id})
         
-        print(f"查詢一週內日曆事件: 從={time_min}, 到={time_max}")
+        # 推播通道有效時，直接從本地鏡像讀取
+        if tenant.notifications.is_live:
+            return tenant.time.parse_shifts(tenant.mirror.list_events(time_min, time_max))
+        
+        cache_key = f"shifts:week:{today}"
+        events = cached_shifts(tenant, cache_key)
+        if events is not None:
+            return events
         
         # 獲取事件
-        events_result = service.events().list(
-            calendarId=GOOGLE_CALENDAR_ID,
+        events = list_events_with_fallback(tenant, cache_key, events_request(
+            service, "list", "week_schedule",
+            calendarId=tenant.calendar_id,
             timeMin=time_min,
             timeMax=time_max,
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
-        
-        events = events_result.get('items', [])
-        print(f"找到 {len(events)} 個事件")
+        ))
+        logger.debug("找到日曆事件", extra={"count": len(events), "tenant": tenant.tenant_id})
         return events
     except Exception as e:
-        print(f"獲取一週內日曆事件時發生錯誤: {str(e)}")
+        logger.error("獲取一週內日曆事件時發生錯誤: %s", e, extra={"tenant": tenant.tenant_id})
         return None
 
-def create_or_update_event(date_str, time_str, user_name, description=None, admin_user_name="系統"):
-    """創建或更新日曆事件"""
+@traced()
+def create_or_update_event(date_str, time_str, user_name, description=None, admin_user_name="系統", tenant=None, end_time_str=None, on_done=None, notify_to=None):
+    """
+    創建或更新日曆事件
+    啟用 outbox 時記錄變更後立即回傳，寫入失敗時通知 notify_to；
+    啟用寫入合併且指定 on_done 時放入寫入緩衝並回傳 (None, 訊息)，寫入後以 on_done(是否成功, 訊息) 通知
+    """
+    tenant = tenant or default_tenant
+    
+    # 寫入日曆前先檢查排班衝突，無法檢查時記錄到 outbox，於寫入時再檢查
+    date_time = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H:%M")
+    conflicts = check_conflicts(lambda: get_conflict_checker(tenant).check_add(user_name, date_time, shift_end(date_time, end_time_str)))
+    unchecked = conflicts is None
+    conflicts = conflicts or []
+    if any(conflict.blocking for conflict in conflicts):
+        return False, describe_conflicts(tenant, conflicts)
+    
     # 檢查是否重複操作
-    if is_duplicate_calendar_operation("create_or_update", date_str, time_str, user_name):
-        print(f"跳過重複的日曆創建/更新操作: {date_str} {time_str} {user_name}")
+    if is_duplicate_calendar_operation("create_or_update", date_str, time_str, user_name, calendar_id=tenant.calendar_id):
+        logger.info("跳過重複的日曆創建/更新操作", extra={"date": date_str, "time": time_str, "staff": user_name})
         return True, "重複操作，已跳過"
+    
+    def release():
+        release_calendar_operation("create_or_update", date_str, time_str, user_name, calendar_id=tenant.calendar_id)
+    
+    # 非阻擋的衝突 (例如休息時間不足) 附在寫入結果後
+    def with_conflicts(message):
+        return f"{message}，{describe_conflicts(tenant, conflicts)}" if conflicts else message
+    
+    # 以 outbox 或寫入緩衝延後寫入
+    now_text = tenant.time.now().strftime('%Y-%m-%d %H:%M')
+    mutation = SlotMutation(
+        user_name,
+        f"換班歷史: {now_text} - 更新為 {user_name} (操作者: {admin_user_name})",
+        description=description or f"排班人員: {user_name}\n排班管理員: {admin_user_name}\n創建時間: {now_text}",
+        end_time=shift_end(date_time, end_time_str).isoformat()
+    )
+    def notify(success, message):
+        if not success:
+            release()
+        on_done(success, with_conflicts(message) if success else message)
+    
+    deferred = defer_slot_write(tenant, date_str, time_str, mutation, on_done=notify if on_done else None,
+                                notify_to=notify_to, unchecked=unchecked)
+    if deferred == "outbox":
+        return True, with_conflicts("已記錄，稍後寫入日曆")
+    if deferred == "buffer":
+        return None, "已排入日曆寫入"
         
-    service = get_calendar_service()
+    service = get_calendar_service(tenant)
     if not service:
+        release()
         return False, "無法連接 Google Calendar 服務"
         
     try:
-        # 將日期和時間字符串轉換為 datetime 對象
-        date_time = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H:%M")
-        
-        # 設置事件開始和結束時間 (假設每個班次為 1 小時)
+        # 設置事件開始和結束時間 (未指定結束時間時使用預設班次長度)
         start_time = date_time.isoformat()
-        end_time = date_time.replace(hour=date_time.hour + 1).isoformat()
+        end_time = shift_end(date_time, end_time_str).isoformat()
         
         # 設置事件標題和描述
         summary = f"班表: {user_name}"
         if not description:
-            description = f"排班人員: {user_name}\n排班管理員: {admin_user_name}\n創建時間: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+            description = f"排班人員: {user_name}\n排班管理員: {admin_user_name}\n創建時間: {tenant.time.now().strftime('%Y-%m-%d %H:%M')}"
         
         # 創建事件
         event = {
@@ -367,142 +625,538 @@ def create_or_update_event(date_str, time_str, user_name, description=None, admi
             'description': description,
             'start': {
                 'dateTime': start_time,
-                'timeZone': 'Asia/Taipei',
+                'timeZone': tenant.time.name,
             },
             'end': {
                 'dateTime': end_time,
-                'timeZone': 'Asia/Taipei',
+                'timeZone': tenant.time.name,
             },
         }
         
-        print(f"準備創建或更新事件: 日期={date_str}, 時間={time_str}, 用戶={user_name}")
+        logger.debug("準備創建或更新事件", extra={"date": date_str, "time": time_str, "staff": user_name})
         
         # 檢查是否已有相同時間的事件
-        events = get_calendar_events(date_str)
-        existing_event = None
-        
-        if events:
-            for e in events:
-                start = e.get('start', {}).get('dateTime', '')
-                if start:
-                    event_start_time = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                    # 檢查時間是否完全相同
-                    if event_start_time.hour == date_time.hour and event_start_time.minute == date_time.minute:
-                        existing_event = e
-                        break
+        events = get_calendar_events(date_str, tenant)
+        # 以當地時間的時段 key 比對，不受日曆回傳的時差格式影響
+        existing_shift = tenant.time.find_slot(events, date_str, time_str) if events else None
         
         # 更新或創建事件
-        if existing_event:
-            print(f"找到現有事件，ID: {existing_event['id']}")
+        if existing_shift:
+            logger.debug("找到現有事件", extra={"event_id": existing_shift.id})
             # 更新現有事件的描述，添加換班歷史
-            old_description = existing_event.get('description', '')
+            old_description = get_event_description(tenant, service, existing_shift.id)
             # 檢查是否已經有相同的換班歷史記錄
-            history_entry = f"換班歷史: {datetime.now().strftime('%Y-%m-%d %H:%M')} - 更新為 {user_name} (操作者: {admin_user_name})"
+            history_entry = f"換班歷史: {tenant.time.now().strftime('%Y-%m-%d %H:%M')} - 更新為 {user_name} (操作者: {admin_user_name})"
             if history_entry not in old_description:
                 new_description = f"{old_description}\n{history_entry}"
                 event['description'] = new_description
                 
-                service.events().update(
-                    calendarId=GOOGLE_CALENDAR_ID,
-                    eventId=existing_event['id'],
+                updated_event = tenant.execute(events_request(
+                    service, "patch", "write_result",
+                    calendarId=tenant.calendar_id,
+                    eventId=existing_shift.id,
                     body=event
-                ).execute()
-                print("事件更新成功")
+                ))
+                record_calendar_write(tenant, date_str, updated_event)
+                logger.info("事件更新成功", extra={"date": date_str, "time": time_str, "staff": user_name})
+                if conflicts:
+                    return True, f"事件更新成功，{describe_conflicts(tenant, conflicts)}"
                 return True, "事件更新成功"
             else:
-                print("跳過重複的換班歷史記錄")
+                logger.info("跳過重複的換班歷史記錄")
                 return True, "跳過重複的換班歷史記錄"
         else:
-            print("未找到現有事件，創建新事件")
-            service.events().insert(
-                calendarId=GOOGLE_CALENDAR_ID,
+            logger.debug("未找到現有事件，創建新事件")
+            created_event = tenant.execute(events_request(
+                service, "insert", "write_result",
+                calendarId=tenant.calendar_id,
                 body=event
-            ).execute()
-            print("新事件創建成功")
+            ))
+            record_calendar_write(tenant, date_str, created_event)
+            logger.info("新事件創建成功", extra={"date": date_str, "time": time_str, "staff": user_name})
             return True, "新事件創建成功"
         
     except Exception as e:
-        print(f"創建或更新日曆事件時發生錯誤: {str(e)}")
+        logger.error("創建或更新日曆事件時發生錯誤: %s", e, extra={"date": date_str, "time": time_str})
+        release()
         return False, f"創建或更新日曆事件時發生錯誤: {str(e)}"
 
-def swap_shifts(date_str, time_str, user_a, user_b):
-    """交換兩個用戶的班次"""
+@traced()
+def swap_shifts(date_str, time_str, user_a, user_b, tenant=None, on_done=None, notify_to=None):
+    """
+    交換兩個用戶的班次
+    啟用 outbox 時記錄變更後立即回傳 True，寫入失敗時通知 notify_to；
+    啟用寫入合併且指定 on_done 時放入寫入緩衝並回傳 None，寫入後以 on_done(是否成功, 訊息) 通知
+    """
+    tenant = tenant or default_tenant
     # 檢查是否重複操作
-    if is_duplicate_calendar_operation("swap", date_str, time_str, user_a, user_b):
-        print(f"跳過重複的班次交換操作: {date_str} {time_str} {user_a} -> {user_b}")
+    if is_duplicate_calendar_operation("swap", date_str, time_str, user_a, user_b, calendar_id=tenant.calendar_id):
+        logger.info("跳過重複的班次交換操作", extra={"date": date_str, "time": time_str, "from_staff": user_a, "to_staff": user_b})
         return True
+    
+    def release():
+        # 未寫入日曆時取消操作記錄，批准者可以再按一次
+        release_calendar_operation("swap", date_str, time_str, user_a, user_b, calendar_id=tenant.calendar_id)
+    
+    def done(success, message=None):
+        if not success:
+            release()
+        on_done(success, message)
         
-    service = get_calendar_service()
+    # 寫入日曆前確認接手人員在該時段沒有其他排班，無法檢查時記錄到 outbox，於寫入時再檢查
+    conflicts = check_conflicts(lambda: validate_swap(tenant, date_str, time_str, user_b))
+    if conflicts:
+        logger.info("換班衝突: %s", describe_conflicts(tenant, conflicts))
+        release()
+        return False
+    
+    # 以 outbox 或寫入緩衝延後寫入，同一時段短時間內的變更 (例如新增排班後立即批准換班) 合併為一次寫入
+    now_text = tenant.time.now().strftime('%Y-%m-%d %H:%M')
+    mutation = SlotMutation(
+        user_b,
+        f"換班歷史: {now_text} - 從 {user_a} 換班給 {user_b}",
+        description=f"排班人員: {user_b}\n換班歷史: {now_text} - 從 {user_a} 換班"
+    )
+    deferred = defer_slot_write(tenant, date_str, time_str, mutation, on_done=done if on_done else None,
+                                notify_to=notify_to, unchecked=conflicts is None)
+    if deferred == "outbox":
+        return True
+    if deferred == "buffer":
+        return None
+        
+    service = get_calendar_service(tenant)
     if not service:
+        release()
         return False
         
     try:
-        print(f"準備交換班次: 日期={date_str}, 時間={time_str}, 從用戶={user_a} 到用戶={user_b}")
+        logger.debug("準備交換班次", extra={"date": date_str, "time": time_str, "from_staff": user_a, "to_staff": user_b})
         
         # 獲取指定日期的所有事件
-        events = get_calendar_events(date_str)
+        events = get_calendar_events(date_str, tenant)
         if not events:
-            print("未找到事件，創建新事件")
+            logger.debug("未找到事件，創建新事件")
             # 如果沒有事件，則為兩個用戶創建新事件
-            create_or_update_event(date_str, time_str, user_b, 
-                                  f"排班人員: {user_b}\n換班歷史: {datetime.now().strftime('%Y-%m-%d %H:%M')} - 從 {user_a} 換班")
-            return True
+            success, _ = create_or_update_event(date_str, time_str, user_b, 
+                                  f"排班人員: {user_b}\n換班歷史: {tenant.time.now().strftime('%Y-%m-%d %H:%M')} - 從 {user_a} 換班", tenant=tenant)
+            if not success:
+                release()
+            return bool(success)
             
-        # 將日期和時間字符串轉換為 datetime 對象
-        target_time = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H:%M")
-        
-        # 查找目標時間的事件
-        target_event = None
-        for event in events:
-            start = event.get('start', {}).get('dateTime', '')
-            if start:
-                event_time = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                if event_time.hour == target_time.hour and event_time.minute == target_time.minute:
-                    target_event = event
-                    break
+        # 查找目標時段的事件
+        target_shift = tenant.time.find_slot(events, date_str, time_str)
         
         # 更新事件
-        if target_event:
-            print(f"找到目標事件，ID: {target_event['id']}")
+        if target_shift:
+            logger.debug("找到目標事件", extra={"event_id": target_shift.id})
             # 獲取原始排班人員
-            original_user = target_event.get('summary', '').replace('班表: ', '')
-            
-            # 更新事件
-            target_event['summary'] = f"班表: {user_b}"
+            original_user = target_shift.staff
             
             # 添加換班歷史
-            old_description = target_event.get('description', '')
+            old_description = get_event_description(tenant, service, target_shift.id)
             # 檢查是否已經有相同的換班歷史記錄
-            history_entry = f"換班歷史: {datetime.now().strftime('%Y-%m-%d %H:%M')} - 從 {original_user} 換班給 {user_b}"
+            history_entry = f"換班歷史: {tenant.time.now().strftime('%Y-%m-%d %H:%M')} - 從 {original_user} 換班給 {user_b}"
             if history_entry not in old_description:
                 new_description = f"{old_description}\n{history_entry}"
-                target_event['description'] = new_description
                 
-                service.events().update(
-                    calendarId=GOOGLE_CALENDAR_ID,
-                    eventId=target_event['id'],
-                    body=target_event
-                ).execute()
-                print("班次交換成功")
+                # 只更新變更的欄位，不修改查詢快取中的事件
+                updated_event = tenant.execute(events_request(
+                    service, "patch", "write_result",
+                    calendarId=tenant.calendar_id,
+                    eventId=target_shift.id,
+                    body={'summary': f"班表: {user_b}", 'description': new_description}
+                ))
+                record_calendar_write(tenant, date_str, updated_event)
+                logger.info("班次交換成功", extra={"date": date_str, "time": time_str, "from_staff": user_a, "to_staff": user_b})
             else:
-                print("跳過重複的換班歷史記錄")
+                logger.info("跳過重複的換班歷史記錄")
         else:
-            print("未找到目標事件，創建新事件")
+            logger.debug("未找到目標事件，創建新事件")
             # 如果沒有找到事件，則創建新事件
-            create_or_update_event(date_str, time_str, user_b, 
-                                  f"排班人員: {user_b}\n換班歷史: {datetime.now().strftime('%Y-%m-%d %H:%M')} - 從 {user_a} 換班")
+            success, _ = create_or_update_event(date_str, time_str, user_b, 
+                                  f"排班人員: {user_b}\n換班歷史: {tenant.time.now().strftime('%Y-%m-%d %H:%M')} - 從 {user_a} 換班", tenant=tenant)
+            if not success:
+                release()
+                return False
         
         return True
     except Exception as e:
-        print(f"交換班次時發生錯誤: {str(e)}")
+        logger.error("交換班次時發生錯誤: %s", e, extra={"date": date_str, "time": time_str})
+        release()
         return False
 
+# ====== 日曆寫入合併 ======
+def calendar_slot(tenant, date_str, time_str):
+    """寫入緩衝的時段 key"""
+    return (tenant.tenant_id, tenant.calendar_id, date_str, time_str)
+
+def defer_slot_write(tenant, date_str, time_str, mutation, on_done=None, notify_to=None, unchecked=False):
+    """
+    延後寫入時段變更
+
+    Args:
+        unchecked: 是否無法在指令當下檢查排班衝突，是時記錄到 outbox，於寫入時檢查
+
+    Returns:
+        啟用 outbox、日曆斷路器暫停呼叫或無法檢查衝突時記錄到 outbox 並回傳 "outbox"；啟用寫入合併且指定 on_done 時放入寫入緩衝並回傳 "buffer"；
+        否則回傳 None，由呼叫端立即寫入
+    """
+    slot = calendar_slot(tenant, date_str, time_str)
+    # 日曆斷路器暫停呼叫或無法檢查衝突時，即使未啟用 outbox 也先記錄變更，由派送器寫入
+    if CALENDAR_OUTBOX or tenant.breaker.is_open or unchecked:
+        # 寫入緩衝的等待時間作為派送前的等待時間，期間同一時段的變更合併寫入
+        calendar_outbox.enqueue(slot, mutation, notify=notify_to, delay=max(calendar_write_buffer.window, 0))
+        return "outbox"
+    if on_done and calendar_write_buffer.enabled:
+        calendar_write_buffer.submit(slot, mutation, on_done)
+        return "buffer"
+    return None
+
+def write_slot(slot, write):
+    """將合併後的變更寫入時段的日曆事件，只查詢與寫入一次"""
+    tenant_id, _, date_str, time_str = slot
+    # 店家已從設定移除時不寫入預設店家的日曆，outbox 視為永久錯誤
+    tenant = tenant_registry.find(tenant_id)
+    if tenant is None:
+        raise UnknownTenantError(f"找不到店家: {tenant_id}")
+    service = get_calendar_service(tenant)
+    if not service:
+        return False, "無法連接 Google Calendar 服務"
+    
+    date_time = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H:%M")
+    with stale_data_scope():
+        events = get_calendar_events(date_str, tenant)
+        stale = stale_data_as_of.get() is not None
+    # 斷路期間不寫入 (也不以過期的資料判斷時段是否已有事件)，由 outbox 在斷路器恢復試探後重新派送
+    if stale or (events is None and tenant.breaker.is_open):
+        raise CircuitOpenError(tenant.breaker.name, tenant.breaker.retry_at)
+    # 無法確認時段是否已有事件時不寫入，避免重複建立事件
+    if events is None:
+        return False, "無法取得日曆事件"
+    # 寫入時再檢查衝突，延後寫入的變更可能在指令當下無法檢查；索引無法建立時 (斷路) 由 outbox 稍後重新派送
+    end = datetime.fromisoformat(write.end_time) if write.end_time else None
+    conflicts = [conflict for conflict in get_conflict_checker(tenant).check_swap(write.staff, date_time, end) if conflict.blocking]
+    if conflicts:
+        raise ShiftConflictError(describe_conflicts(tenant, conflicts))
+    existing_shift = tenant.time.find_slot(events, date_str, time_str)
+    
+    if existing_shift:
+        # 只更新變更的欄位
+        event = {'summary': f"班表: {write.staff}"}
+        old_description = get_event_description(tenant, service, existing_shift.id)
+        entries = [entry for entry in write.history if entry not in old_description]
+        if entries:
+            event['description'] = "\n".join([old_description] + entries)
+        if write.end_time:
+            event['end'] = {'dateTime': write.end_time, 'timeZone': tenant.time.name}
+        written = tenant.execute(events_request(
+            service, "patch", "write_result",
+            calendarId=tenant.calendar_id,
+            eventId=existing_shift.id,
+            body=event
+        ))
+        message = "事件更新成功"
+    else:
+        # 第一筆變更的描述已包含其換班歷史
+        description = "\n".join([write.description or f"排班人員: {write.staff}"] + write.history[1:])
+        event = {
+            'summary': f"班表: {write.staff}",
+            'description': description,
+            'start': {
+                'dateTime': date_time.isoformat(),
+                'timeZone': tenant.time.name,
+            },
+            'end': {
+                'dateTime': write.end_time or shift_end(date_time).isoformat(),
+                'timeZone': tenant.time.name,
+            },
+        }
+        written = tenant.execute(events_request(
+            service, "insert", "write_result",
+            calendarId=tenant.calendar_id,
+            body=event
+        ))
+        message = "新事件創建成功"
+    record_calendar_write(tenant, date_str, written)
+    logger.info("合併寫入日曆事件", extra={"date": date_str, "time": time_str, "staff": write.staff, "mutations": write.mutations})
+    if write.mutations > 1:
+        message = f"{message}，已與同時段的其他變更合併寫入 (目前排班人員: {write.staff})"
+    return True, message
+
+# 同一時段的寫入緩衝，CALENDAR_WRITE_COALESCE_WINDOW 為 0 時不啟用
+calendar_write_buffer = CalendarWriteBuffer(write_slot)
+
+async def write_coalesce_loop():
+    """定期寫入到期的時段"""
+    interval = min(calendar_write_buffer.window / 4, 0.5)
+    while True:
+        await asyncio.sleep(interval)
+        if len(calendar_write_buffer):
+            await asyncio.to_thread(calendar_write_buffer.flush_due)
+
+# ====== 日曆寫入 outbox ======
+# 設置 CALENDAR_OUTBOX 時，排班與換班記錄到共享狀態資料庫後立即回覆，由背景派送器寫入日曆
+calendar_outbox = CalendarOutbox(shared_state.database())
+
+def notify_dead_letter(batch, error):
+    """變更重試後仍無法寫入日曆時通知指令的發送者"""
+    from linebot.models import TextSendMessage
+    _, _, date_str, time_str = batch.slot
+    text = f"{date_str} {time_str} 的排班變更無法寫入 Google Calendar，請聯繫管理員 ({error[:100]})"
+    for to in sorted({to for to in batch.notify if to}):
+        safe_send_message(line_bot_api.push_message, to, TextSendMessage(text=text))
+
+outbox_dispatcher = OutboxDispatcher(calendar_outbox, write_slot, on_dead=notify_dead_letter)
+
+if CALENDAR_OUTBOX:
+    OUTBOX_ENTRIES.set_function(lambda: calendar_outbox.counts()["pending"], status="pending")
+    OUTBOX_ENTRIES.set_function(lambda: calendar_outbox.counts()["dead"], status="dead")
+
+async def outbox_loop():
+    """持續派送 outbox 中到期的變更，沒有可派送的時段時等待一段時間"""
+    while True:
+        result = {}
+        # 本行程沒有待派送的變更時 (未記錄過變更，或已全部派送) 只檢查旗標，不查詢資料庫
+        if calendar_outbox.active:
+            try:
+                result = await asyncio.to_thread(outbox_dispatcher.run_once)
+            except Exception as e:
+                logger.error("派送日曆寫入時發生錯誤: %s", e)
+        if not any(result.values()):
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+# ====== 多店家設定 ======
+# 預設店家使用 GOOGLE_CALENDAR_ID 與 USER_MAPPING，其他店家由 TENANTS_CONFIG 設定
+default_tenant = Tenant("default", GOOGLE_CALENDAR_ID, USER_MAPPING, build_calendar_service, name="預設店家")
+tenant_registry = TenantRegistry(default_tenant)
+try:
+    tenant_registry.load_config(TENANTS_CONFIG, build_calendar_service)
+except Exception as e:
+    logger.error("載入多店家設定時發生錯誤: %s", e)
+
+def setup_tenant(tenant):
+    """為店家建立本地事件鏡像、推播通道與排班表渲染器"""
+    def push_text(to, text):
+        from linebot.models import TextSendMessage
+        safe_send_message(line_bot_api.push_message, to, TextSendMessage(text=text))
+    
+    # 本地事件鏡像，推播通道有效時作為讀取來源
+    tenant.mirror = EventMirror(tenant.get_service, tenant.calendar_id, execute=tenant.execute,
+                                time_model=tenant.time)
+    tenant.channels = WatchChannelManager(
+        tenant.get_service,
+        tenant.calendar_id,
+        CALENDAR_WATCH_ADDRESS,
+        token=CALENDAR_WATCH_TOKEN or None,
+        execute=tenant.execute
+    )
+    tenant.notifications = CalendarNotificationService(
+        tenant.mirror,
+        tenant.channels,
+        PushNotifier(push_text),
+        resolve_user=tenant.roster.get
+    )
+    # 一週排班表渲染器，事件未變更時重複查看只需查詢快取
+    tenant.renderer = WeeklyScheduleRenderer(timezone=tenant.time.name)
+    # 排班區間索引，範圍查詢直接在本地計算
+    tenant.schedule_index = ScheduleIndex(tenant.time.name)
+    TENANT_CACHE_ENTRIES.set_function(lambda: len(tenant.cache), tenant=tenant.tenant_id)
+
+for tenant in tenant_registry.all():
+    setup_tenant(tenant)
+
+# ====== 排班範圍查詢 ======
+# 單則 LINE 文字訊息最多列出的排班數
+MAX_QUERY_LINES = 60
+
+@traced()
+def get_schedule_index(tenant=None):
+    """取得店家的排班索引，本地鏡像有變更時才重建"""
+    tenant = tenant or default_tenant
+    mirror = tenant.mirror
+    # 推播通道未啟用時，以 syncToken 增量同步保持鏡像更新
+    if not tenant.notifications.is_live:
+        try:
+            if not mirror.is_synced:
+                mirror.full_sync()
+            elif time.time() - mirror.synced_at > CALENDAR_READ_TTL:
+                mirror.incremental_sync()
+        except CircuitOpenError:
+            # 日曆斷路器暫停呼叫時使用最後一次同步的鏡像
+            if not mirror.is_synced:
+                raise
+            mark_stale(mirror.synced_at)
+    if tenant.schedule_index.version != mirror.version:
+        # 在鏡像的鎖內取得事件與版本，避免與同步或寫入同時進行時以不一致的內容重建
+        events, version = mirror.snapshot()
+        tenant.schedule_index.rebuild(events, version=version)
+    return tenant.schedule_index
+
+def query_month_shifts(tenant, month_str, weekday_name=None, band_name=None, staff=None):
+    """查詢指定月份的排班"""
+    index = get_schedule_index(tenant)
+    start, end = index.month_range(int(month_str[:4]), int(month_str[4:]))
+    weekday = WEEKDAY_NAMES.index(weekday_name) if weekday_name else None
+    return index, index.query(start=start, end=end, staff=staff, weekday=weekday, band=parse_band(band_name))
+
+def format_shift_lines(index, shifts, show_staff=True):
+    """將排班轉換為文字列表"""
+    lines = []
+    for shift in shifts[:MAX_QUERY_LINES]:
+        start = index.local_time(shift.start)
+        end = index.local_time(shift.end)
+        line = f"{start.strftime('%Y/%m/%d')} (週{WEEKDAY_NAMES[shift.weekday]}) {start.strftime('%H:%M')}-{end.strftime('%H:%M')}"
+        if show_staff:
+            line += f" {shift.staff}"
+        lines.append(line)
+    if len(shifts) > MAX_QUERY_LINES:
+        lines.append(f"...共 {len(shifts)} 筆，僅列出前 {MAX_QUERY_LINES} 筆")
+    return "\n".join(lines)
+
+# ====== 排班衝突檢查 ======
+def get_conflict_checker(tenant=None):
+    """取得以店家排班索引為基礎的衝突檢查器"""
+    return ConflictChecker(get_schedule_index(tenant))
+
+@traced()
+def validate_swap(tenant, date_str, time_str, to_user):
+    """檢查接手人員在換班時段是否已有其他排班，回傳阻止換班的衝突"""
+    start = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H:%M")
+    return [conflict for conflict in get_conflict_checker(tenant).check_swap(to_user, start) if conflict.blocking]
+
+def check_conflicts(check):
+    """
+    執行排班衝突檢查
+
+    Returns:
+        衝突列表；無法檢查時 (例如鏡像尚未同步且日曆斷路器暫停呼叫) 回傳 None，
+        呼叫端將變更記錄到 outbox，於寫入日曆時再檢查
+    """
+    try:
+        return check()
+    except Exception as e:
+        logger.warning("無法檢查排班衝突，改於寫入時檢查: %s", e)
+        return None
+
+def describe_conflicts(tenant, conflicts):
+    """將排班衝突轉換為文字說明"""
+    index = tenant.schedule_index
+    lines = []
+    for conflict in conflicts:
+        period = f"{index.local_time(conflict.start).strftime('%Y/%m/%d %H:%M')}-{index.local_time(conflict.end).strftime('%H:%M')}"
+        if conflict.kind == "overlap":
+            lines.append(f"{conflict.staff} 在 {period} 已有排班")
+        else:
+            lines.append(f"原排班人員 {conflict.staff} ({period}) 將被取代")
+    return "；".join(lines)
+
+# ====== 日曆推播通知 ======
+# 推播通道續訂檢查間隔（秒）
+CALENDAR_WATCH_CHECK_INTERVAL = 600
+
+async def calendar_watch_loop():
+    """定期續訂各店家的推播通道，通道建立後先完整同步本地鏡像"""
+    while True:
+        for tenant in tenant_registry.all():
+            try:
+                renewed = await asyncio.to_thread(tenant.channels.renew_if_needed)
+                if renewed and not tenant.mirror.is_synced:
+                    await asyncio.to_thread(tenant.mirror.full_sync)
+            except Exception as e:
+                logger.error("續訂日曆推播通道時發生錯誤: %s", e, extra={"tenant": tenant.tenant_id})
+        await asyncio.sleep(CALENDAR_WATCH_CHECK_INTERVAL)
+
+# ====== 啟動預熱與健康檢查 ======
+# 啟動預熱完成前 /readyz 回傳 503，流量只會導向快取已預熱的執行個體
+health = HealthMonitor()
+
+def require(value, message):
+    """預熱與探測步驟未取得結果時視為失敗"""
+    if value is None:
+        raise RuntimeError(message)
+    return value
+
+def warm_up():
+    """預先建立 LINE 客戶端、各店家的 Google Calendar 客戶端、人員索引與本週事件快取，完成後標記為就緒"""
+    health.run_step("line_client", lambda: (line_bot_api.resolve(), handler.resolve()))
+    for tenant in tenant_registry.all():
+        health.run_step(f"{tenant.tenant_id}:calendar_client", tenant.get_service)
+        health.run_step(f"{tenant.tenant_id}:directory", tenant.directory)
+        health.run_step(f"{tenant.tenant_id}:week_events", lambda: get_week_calendar_events(tenant))
+    health.mark_warm()
+
+def probe_google_calendar():
+    """以最小的查詢量測 Google Calendar 的延遲"""
+    service = require(get_calendar_service(default_tenant), "Google Calendar 服務未建立")
+    default_tenant.execute(events_request(service, "list", "probe", calendarId=default_tenant.calendar_id, maxResults=1))
+
+def probe_line():
+    """以取得機器人資訊量測 LINE Messaging API 的延遲"""
+    line_bot_api.get_bot_info(timeout=5)
+
+health.add_probe("google_calendar", probe_google_calendar)
+health.add_probe("line", probe_line)
+
+async def health_check_loop():
+    """先執行啟動預熱，之後定期探測外部服務"""
+    if STARTUP_WARMUP:
+        await asyncio.to_thread(warm_up)
+    else:
+        health.mark_warm()
+    while HEALTH_PROBE_INTERVAL > 0:
+        await asyncio.to_thread(health.probe_all)
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+
+# ====== 排班提醒 ======
+def send_reminder(to, text):
+    """發送排班提醒，多位收件人時以 multicast 一次送出"""
+    from linebot.models import TextSendMessage
+    
+    # line-bot-sdk 3.5 會把 retry_key 留在共用的請求標頭中，因此不使用重試金鑰
+    if len(to) == 1:
+        return line_bot_api.push_message(to[0], TextSendMessage(text=text))
+    return line_bot_api.multicast(to, TextSendMessage(text=text))
+
+# 設置 SHIFT_REMINDER_HOURS 時啟用，排程保存在共享狀態中，重新啟動後恢復
+reminder_scheduler = ShiftReminderScheduler(
+    send_reminder,
+    shared_state.open_store("reminders"),
+    shared_state.open_store("reminders_sent")
+)
+
+def sync_reminders():
+    """依各店家未來的排班更新提醒排程"""
+    for tenant in tenant_registry.all():
+        try:
+            index = get_schedule_index(tenant)
+            now = datetime.now(index.tz)
+            shifts = index.query(start=now, end=now + timedelta(hours=REMINDER_HORIZON_HOURS))
+            reminders = reminder_scheduler.plan(tenant.tenant_id, shifts, tenant.roster.get, index.local_time)
+            scheduled, cancelled = reminder_scheduler.sync(tenant.tenant_id, reminders)
+            logger.info("已更新排班提醒", extra={"tenant": tenant.tenant_id, "scheduled": scheduled, "cancelled": cancelled})
+        except Exception as e:
+            logger.error("更新排班提醒時發生錯誤: %s", e, extra={"tenant": tenant.tenant_id})
+
+async def reminder_loop():
+    """每秒取出到期的提醒並發送，定期從日曆更新排程"""
+    restored = await asyncio.to_thread(reminder_scheduler.restore)
+    logger.info("已恢復排班提醒排程", extra={"reminders": restored})
+    synced_at = 0
+    while True:
+        if time.time() - synced_at >= REMINDER_SYNC_INTERVAL:
+            synced_at = time.time()
+            await asyncio.to_thread(sync_reminders)
+        due = reminder_scheduler.pop_due()
+        if due:
+            await asyncio.to_thread(reminder_scheduler.deliver, due)
+        await asyncio.sleep(1)
+
 # ====== 權限檢查 ======
-def is_admin(user_id):
+def is_admin(user_id, tenant=None):
     """檢查用戶是否為管理員"""
     # 在實際應用中，您可能需要從數據庫或配置文件中讀取管理員列表
-    # 這裡簡單地假設所有已知用戶都是管理員
-    return user_id in USER_MAPPING.values()
+    # 這裡簡單地假設店家人員名單中的已知用戶都是管理員
+    return (tenant or default_tenant).is_member(user_id)
 
 # ====== FastAPI 應用 ======
 app = FastAPI()
@@ -516,12 +1170,119 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_calendar_watch():
+    # 設置推播網址時才啟用日曆推播通道；通道與日曆鏡像都在行程內，多個 worker 時無法確定通知送到哪一個，改以快取存活時間更新
+    if CALENDAR_WATCH_ADDRESS and shared_state.is_shared():
+        logger.warning("多個 worker 共用狀態時不啟用日曆推播通道，日曆查詢以 CALENDAR_READ_TTL 更新")
+    elif CALENDAR_WATCH_ADDRESS:
+        asyncio.create_task(calendar_watch_loop())
+
+@app.on_event("startup")
+async def start_reminders():
+    if reminder_scheduler.enabled:
+        asyncio.create_task(reminder_loop())
+
+@app.on_event("startup")
+async def start_write_coalescing():
+    if calendar_write_buffer.enabled:
+        asyncio.create_task(write_coalesce_loop())
+
+@app.on_event("startup")
+async def start_outbox():
+    # 重新啟動後繼續派送上次未完成的變更；未啟用 outbox 時派送日曆斷路期間記錄的變更
+    asyncio.create_task(outbox_loop())
+
+@app.on_event("shutdown")
+async def flush_calendar_writes():
+    # 關閉前寫入緩衝中尚未到期的時段
+    await asyncio.to_thread(calendar_write_buffer.flush_due, force=True)
+
+@app.on_event("startup")
+async def start_health_checks():
+    # 在背景執行緒預熱，服務可立即開始接收請求
+    asyncio.create_task(health_check_loop())
+
 @app.get("/")
 async def root():
     return {"message": "LINE Bot 服務正在運行"}
 
+@app.get("/healthz")
+async def healthz():
+    # 存活檢查，不呼叫外部服務
+    return health.liveness()
+
+@app.get("/readyz")
+async def readyz():
+    # 就緒檢查，啟動預熱完成前回傳 503
+    return JSONResponse(content=health.readiness(), status_code=200 if health.is_ready else 503)
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    # Prometheus 監控指標
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(content=registry.expose(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/schedule/query")
+async def schedule_query(request: Request, start: str, end: str, tenant: str = None, staff: str = None,
+                         weekday: int = None, band: str = None):
+    # 排班範圍查詢 API，日期格式為 YYYYMMDD，結束日期不含
+    if SCHEDULE_API_TOKEN and request.headers.get("Authorization", "") != f"Bearer {SCHEDULE_API_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    target_tenant = tenant_registry.find(tenant) if tenant else tenant_registry.default
+    if target_tenant is None:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+    try:
+        index = get_schedule_index(target_tenant)
+        range_start = datetime.strptime(start, "%Y%m%d").replace(tzinfo=index.tz)
+        range_end = datetime.strptime(end, "%Y%m%d").replace(tzinfo=index.tz)
+        time_band = parse_band(band)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid query parameters")
+    except Exception as e:
+        logger.error("查詢排班時發生錯誤: %s", e)
+        raise HTTPException(status_code=503, detail="Calendar unavailable")
+    
+    query_start = time.perf_counter()
+    shifts = index.query(start=range_start, end=range_end, staff=staff, weekday=weekday, band=time_band)
+    elapsed_ms = (time.perf_counter() - query_start) * 1000
+    
+    return JSONResponse(content={
+        "tenant": target_tenant.tenant_id,
+        "count": len(shifts),
+        "elapsed_ms": round(elapsed_ms, 3),
+        "shifts": [
+            {
+                "id": shift.event_id,
+                "staff": shift.staff,
+                "start": index.local_time(shift.start).isoformat(),
+                "end": index.local_time(shift.end).isoformat()
+            }
+            for shift in shifts
+        ]
+    })
+
+@app.post("/calendar/notifications")
+async def calendar_notification(request: Request):
+    # Google Calendar 推播通知只有標頭，沒有請求體
+    headers = {k.lower(): v for k, v in request.headers.items()}
+    try:
+        # 依通道 ID 找出對應的店家
+        channel_id = headers.get("x-goog-channel-id", "")
+        tenant = next((t for t in tenant_registry.all() if t.channels.owns(channel_id)), default_tenant)
+        result = tenant.notifications.handle(headers)
+        return JSONResponse(content=result)
+    except Exception as e:
+        logger.error("處理日曆推播通知時發生錯誤: %s", e)
+        # 返回 200，鏡像將在下一則通知時重新同步
+        return JSONResponse(content={"status": "error"})
+
 @app.post("/webhook")
 async def webhook(request: Request):
+    from linebot.exceptions import InvalidSignatureError
+    
     # 獲取請求頭和請求體
     signature = request.headers.get("X-Line-Signature", "")
     body = await request.body()
@@ -529,42 +1290,61 @@ async def webhook(request: Request):
     
     # 生成請求 ID
     request_id = request.headers.get("X-Line-Request-ID", "unknown")
+    started = time.perf_counter()
     
     # 檢查是否為重複請求
     if is_duplicate_webhook(request_id, body_text):
+        WEBHOOK_LATENCY.observe(time.perf_counter() - started, outcome="duplicate")
         return JSONResponse(content={"message": "Duplicate webhook request"})
     
-    print(f"收到 webhook 請求: {request_id}")
+    logger.info("收到 webhook 請求", extra={"request_id": request_id})
     
+    outcome = "ok"
     try:
-        # 處理 webhook 事件
-        handler.handle(body_text, signature)
+        # 處理 webhook 事件，日誌以請求 ID 關聯，各事件處理時再改用 webhookEventId
+        with bind_correlation_id(request_id):
+            with start_span("POST /webhook", KIND_SERVER, {"line.request_id": request_id}):
+                handler.handle(body_text, signature)
         
         # 返回成功響應
         return JSONResponse(content={"message": "OK"})
     except InvalidSignatureError:
-        print("無效的簽名")
+        outcome = "invalid_signature"
+        logger.warning("無效的簽名")
         raise HTTPException(status_code=400, detail="Invalid signature")
     except Exception as e:
-        print(f"處理 webhook 時發生錯誤: {str(e)}")
+        outcome = "error"
+        logger.exception("處理 webhook 時發生錯誤: %s", e)
         # 即使出錯也返回 200，避免 LINE 重試
         return JSONResponse(content={"message": f"Error: {str(e)}"})
+    finally:
+        WEBHOOK_LATENCY.observe(time.perf_counter() - started, outcome=outcome)
 
 # ====== LINE Bot 事件處理 ======
-@handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
+    # 記錄各指令的處理時間與追蹤 span，日誌以 webhookEventId 關聯
+    command = command_label(event.message.text.strip())
+    with bind_correlation_id(getattr(event, "webhook_event_id", None)):
+        with start_span(f"command {command}", attributes={"line.command": command}):
+            with COMMAND_LATENCY.time(command=command), reply_manager.track(event, command), stale_data_scope():
+                handle_text_command(event)
+
+def handle_text_command(event):
+    from linebot.exceptions import LineBotApiError
+    from linebot.models import TextSendMessage, TemplateSendMessage, ConfirmTemplate, PostbackAction
+    
     # 獲取用戶訊息
     text = event.message.text.strip()
     reply_token = event.reply_token
     user_id = event.source.user_id
     
     try:
+        # 依群組/聊天室取得店家及其人員名單
+        tenant = tenant_registry.resolve(event.source)
+        roster = tenant.roster
+        
         # 獲取用戶名稱
-        user_name = None
-        for name, id in USER_MAPPING.items():
-            if id == user_id:
-                user_name = name
-                break
+        user_name = tenant.user_name(user_id)
         
         # 如果用戶不在映射表中，則無法使用大部分功能
         if not user_name:
@@ -579,16 +1359,27 @@ def handle_text_message(event):
 - 測試日曆
   查看未來一週的排班表
 
+- 查詢班表 YYYYMM [週X] [早上/下午/晚上] [@用戶名]
+  查看自己或指定用戶在該月的排班
+  例如：查詢班表 202506 週五 下午
+
 - 查看用戶映射
   查看系統中已知的用戶名稱和ID對應關係
 
 【僅限管理員】
-- 新增排班 YYYYMMDD HH:MM @用戶名
-  例如：新增排班 20250530 08:00 @張書豪-Ragic Customize!
+- 新增排班 YYYYMMDD HH:MM[-HH:MM] @用戶名
+  例如：新增排班 20250530 08:00-12:00 @張書豪-Ragic Customize!
 
-- 批次排班 YYYYMMDD HH:MM @用戶名
+- 批次排班 YYYYMMDD HH:MM[-HH:MM] @用戶名
   為指定用戶在指定日期時間新增排班
 
+- 檢查排班 YYYYMMDD
+  列出該日營業時段內無人值班的時段
+
+- 月班表 YYYYMM [週X] [早上/下午/晚上]
+  查看該月所有人員的排班
+  例如：月班表 202506 週五 下午
+
 - 清理緩存
   清理系統緩存，解決可能的重複訊息問題"""
                 try:
@@ -652,9 +1443,9 @@ def handle_text_message(event):
                 return
             
             # 檢查目標用戶是否存在
-            target_user_id = USER_MAPPING.get(target_user)
+            target_user_id = roster.get(target_user)
             if not target_user_id:
-                known_users = list(USER_MAPPING.keys())
+                known_users = list(roster.keys())
                 user_list = "\n".join([f"- {name}" for name in known_users])
                 try:
                     safe_send_message(
@@ -667,37 +1458,37 @@ def handle_text_message(event):
                     line_bot_api.push_message(user_id, TextSendMessage(text=f"找不到用戶 '{target_user}'，請確認用戶名稱正確。\n\n已知用戶列表:\n{user_list}"))
                 return
             
-            # 生成請求 ID
-            request_id = f"{user_id}_{date_str}_{hour}_{minute}_{target_user}"
+            # 確認目標用戶在該時段沒有其他排班
+            try:
+                conflicts = validate_swap(tenant, date_str, f"{hour}:{minute}", target_user)
+            except Exception as e:
+                logger.error("檢查排班衝突時發生錯誤: %s", e)
+                conflicts = []
+            if conflicts:
+                reply_text = f"無法發送換班請求: {describe_conflicts(tenant, conflicts)}"
+                try:
+                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=reply_text), event_source=event.source)
+                except Exception as e:
+                    line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+                return
             
-            # 檢查是否為重複請求
-            if request_id in shift_requests and shift_requests[request_id]["status"] == "pending":
-                last_request_time = shift_requests[request_id].get("timestamp", 0)
-                if time.time() - last_request_time < 300:  # 5分鐘內的重複請求
-                    try:
-                        safe_send_message(
-                            line_bot_api.reply_message,
-                            reply_token,
-                            TextSendMessage(text=f"您已經發送過相同的換班請求給 {target_user}，請等待回應"),
-                            event_source=event.source
-                        )
-                    except Exception as e:
-                        line_bot_api.push_message(user_id, TextSendMessage(text=f"您已經發送過相同的換班請求給 {target_user}，請等待回應"))
-                    return
+            # 檢查是否為重複請求 (5分鐘內)
+            request_id = f"{user_id}_{date_str}_{hour}_{minute}_{target_user}"
+            if not recent_shift_requests.claim(request_id, 300):
+                try:
+                    safe_send_message(
+                        line_bot_api.reply_message,
+                        reply_token,
+                        TextSendMessage(text=f"您已經發送過相同的換班請求給 {target_user}，請等待回應"),
+                        event_source=event.source
+                    )
+                except Exception as e:
+                    line_bot_api.push_message(user_id, TextSendMessage(text=f"您已經發送過相同的換班請求給 {target_user}，請等待回應"))
+                return
+            recent_shift_requests.purge(300)
             
-            # 儲存換班請求
-            request_data = {
-                "request_id": request_id,
-                "requester_id": user_id,
-                "requester_name": user_name,
-                "target_id": target_user_id,
-                "target_name": target_user,
-                "date": date_str,
-                "time": f"{hour}:{minute}",
-                "status": "pending",
-                "timestamp": time.time()
-            }
-            shift_requests[request_id] = request_data
+            # 換班請求以簽名權杖放在確認按鈕中，任何 worker 都能直接驗證並處理
+            token = approval_signer.issue(tenant.tenant_id, user_id, target_user_id, date_str, f"{hour}:{minute}")
             
             # 回覆請求者
             try:
@@ -720,85 +1511,29 @@ def handle_text_message(event):
                     template=ConfirmTemplate(
                         text=confirm_message,
                         actions=[
-                            MessageAction(label="批准", text=f"批准換班:{request_id}"),
-                            MessageAction(label="拒絕", text=f"拒絕換班:{request_id}")
+                            PostbackAction(label="批准", data=f"action=approve_shift&token={token}"),
+                            PostbackAction(label="拒絕", data=f"action=reject_shift&token={token}")
                         ]
                     )
                 )
             )
             
         elif text.startswith("批准換班:") or text.startswith("拒絕換班:"):
-            # 處理換班回應
-            parts = text.split(":", 1)
-            if len(parts) != 2:
-                try:
-                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="無效的回應格式"), event_source=event.source)
-                except Exception as e:
-                    line_bot_api.push_message(user_id, TextSendMessage(text="無效的回應格式"))
-                return
-                
-            action, request_id = parts
-            request = shift_requests.get(request_id)
-            
-            if not request:
-                try:
-                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="找不到對應的換班請求，可能已過期或已處理"), event_source=event.source)
-                except Exception as e:
-                    line_bot_api.push_message(user_id, TextSendMessage(text="找不到對應的換班請求，可能已過期或已處理"))
-                return
-                
-            if request["target_id"] != user_id:
-                try:
-                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="您無權回應此換班請求"), event_source=event.source)
-                except Exception as e:
-                    line_bot_api.push_message(user_id, TextSendMessage(text="您無權回應此換班請求"))
-                return
-                
-            if request["status"] != "pending":
-                try:
-                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=f"此換班請求已經被{request['status']}，無法重複處理"), event_source=event.source)
-                except Exception as e:
-                    line_bot_api.push_message(user_id, TextSendMessage(text=f"此換班請求已經被{request['status']}，無法重複處理"))
-                return
-                
-            if action == "批准換班":
-                request["status"] = "approved"
-                request["response_time"] = time.time()
-                success = swap_shifts(request["date"], request["time"], request["requester_name"], request["target_name"])
-                
-                if success:
-                    try:
-                        safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="您已批准換班請求，Google Calendar 已更新"), event_source=event.source)
-                    except Exception as e:
-                        line_bot_api.push_message(user_id, TextSendMessage(text="您已批准換班請求，Google Calendar 已更新"))
-                else:
-                    try:
-                        safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="您已批准換班請求，但 Google Calendar 更新失敗，請聯繫管理員"), event_source=event.source)
-                    except Exception as e:
-                        line_bot_api.push_message(user_id, TextSendMessage(text="您已批准換班請求，但 Google Calendar 更新失敗，請聯繫管理員"))
-                
-                safe_send_message(line_bot_api.push_message, request["requester_id"], TextSendMessage(text=f"{request['target_name']} 已批准您在 {request['date']} {request['time']} 的換班請求"))
-            else:  # 拒絕換班
-                request["status"] = "rejected"
-                request["response_time"] = time.time()
-                try:
-                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="您已拒絕換班請求"), event_source=event.source)
-                except Exception as e:
-                    line_bot_api.push_message(user_id, TextSendMessage(text="您已拒絕換班請求"))
-                
-                safe_send_message(line_bot_api.push_message, request["requester_id"], TextSendMessage(text=f"{request['target_name']} 已拒絕您在 {request['date']} {request['time']} 的換班請求"))
+            # 以文字回應換班請求，格式: 批准換班:<確認權杖>
+            action, token = text.split(":", 1)
+            respond_shift_request(event, action == "批准換班", token.strip())
         
         # 新功能：新增排班 (與批次排班邏輯合併)
         elif match := re.match(ADD_SHIFT_PATTERN, text) or re.match(BATCH_SHIFT_PATTERN, text):
             # 檢查是否為管理員
-            if not is_admin(user_id):
+            if not is_admin(user_id, tenant):
                 try:
                     safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="抱歉，只有管理員可以使用此功能"), event_source=event.source)
                 except Exception as e:
                     line_bot_api.push_message(user_id, TextSendMessage(text="抱歉，只有管理員可以使用此功能"))
                 return
                 
-            date_str, hour, minute, target_user = match.groups()
+            date_str, hour, minute, end_hour, end_minute, target_user = match.groups()
             
             # 驗證日期格式
             try:
@@ -818,6 +1553,12 @@ def handle_text_message(event):
                 if hour_int < 0 or hour_int > 23 or minute_int < 0 or minute_int > 59:
                     raise ValueError("時間格式錯誤")
                 formatted_time = f"{hour}:{minute}"
+                end_time_str = None
+                if end_hour is not None:
+                    if int(end_hour) > 23 or int(end_minute) > 59:
+                        raise ValueError("時間格式錯誤")
+                    end_time_str = f"{end_hour}:{end_minute}"
+                    formatted_time = f"{formatted_time}-{end_time_str}"
             except ValueError:
                 try:
                     safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="時間格式錯誤，請使用24小時制，例如：08:00 或 18:30"), event_source=event.source)
@@ -826,8 +1567,8 @@ def handle_text_message(event):
                 return
             
             # 檢查目標用戶是否存在
-            if target_user not in USER_MAPPING:
-                known_users = list(USER_MAPPING.keys())
+            if target_user not in roster:
+                known_users = list(roster.keys())
                 user_list = "\n".join([f"- {name}" for name in known_users])
                 try:
                     safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=f"找不到用戶 '{target_user}'，請確認用戶名稱正確。\n\n已知用戶列表:\n{user_list}"), event_source=event.source)
@@ -835,20 +1576,101 @@ def handle_text_message(event):
                     line_bot_api.push_message(user_id, TextSendMessage(text=f"找不到用戶 '{target_user}'，請確認用戶名稱正確。\n\n已知用戶列表:\n{user_list}"))
                 return
             
+            # 回覆結果，啟用寫入合併時於寫入日曆後回覆
+            def reply_result(success, result_message):
+                if success:
+                    reply_text = f"已成功為 {target_user} 在 {formatted_date} {formatted_time} 新增/更新排班。 ({result_message})"
+                else:
+                    reply_text = f"為 {target_user} 新增/更新排班失敗: {result_message}"
+                    
+                try:
+                    safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=reply_text), event_source=event.source)
+                except Exception as e:
+                    line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+            
             # 創建排班
             success, result_message = create_or_update_event(
                 date_str, 
                 f"{hour}:{minute}", 
                 target_user, 
-                admin_user_name=user_name # 傳遞操作者名稱
+                admin_user_name=user_name, # 傳遞操作者名稱
+                tenant=tenant,
+                end_time_str=end_time_str,
+                on_done=reply_result,
+                notify_to=user_id
             )
+            if success is not None:
+                reply_result(success, result_message)
             
-            # 回覆結果
-            if success:
-                reply_text = f"已成功為 {target_user} 在 {formatted_date} {formatted_time} 新增/更新排班。 ({result_message})"
+        elif match := re.match(QUERY_SHIFT_PATTERN, text):
+            # 查詢自己或指定用戶的月排班
+            month_str, weekday_name, band_name, target_user = match.groups()
+            target_user = target_user.strip() if target_user else user_name
+            if target_user not in roster:
+                reply_text = f"找不到用戶 '{target_user}'，請確認用戶名稱正確。"
             else:
-                reply_text = f"為 {target_user} 新增/更新排班失敗: {result_message}"
-                
+                try:
+                    index, shifts = query_month_shifts(tenant, month_str, weekday_name, band_name, staff=target_user)
+                    if shifts:
+                        reply_text = f"{target_user} 在 {month_str[:4]}/{month_str[4:]} 的排班 ({len(shifts)} 筆):\n" + format_shift_lines(index, shifts, show_staff=False)
+                    else:
+                        reply_text = f"{target_user} 在 {month_str[:4]}/{month_str[4:]} 沒有符合條件的排班"
+                except ValueError:
+                    reply_text = "月份格式錯誤，請使用YYYYMM格式，例如：202506"
+                except Exception as e:
+                    reply_text = f"查詢排班時發生錯誤: {str(e)}"
+            
+            try:
+                safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=reply_text), event_source=event.source)
+            except Exception as e:
+                line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+            
+        elif match := re.match(MONTH_SCHEDULE_PATTERN, text):
+            # 管理員功能：查看整月所有人員的排班
+            if not is_admin(user_id, tenant):
+                reply_text = "抱歉，只有管理員可以使用此功能"
+            else:
+                month_str, weekday_name, band_name = match.groups()
+                try:
+                    index, shifts = query_month_shifts(tenant, month_str, weekday_name, band_name)
+                    if shifts:
+                        reply_text = f"{month_str[:4]}/{month_str[4:]} 排班 ({len(shifts)} 筆):\n" + format_shift_lines(index, shifts)
+                    else:
+                        reply_text = f"{month_str[:4]}/{month_str[4:]} 沒有符合條件的排班"
+                except ValueError:
+                    reply_text = "月份格式錯誤，請使用YYYYMM格式，例如：202506"
+                except Exception as e:
+                    reply_text = f"查詢排班時發生錯誤: {str(e)}"
+            
+            try:
+                safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=reply_text), event_source=event.source)
+            except Exception as e:
+                line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+            
+        elif match := re.match(COVERAGE_CHECK_PATTERN, text):
+            # 管理員功能：檢查指定日期營業時段內的人力空檔
+            if not is_admin(user_id, tenant):
+                reply_text = "抱歉，只有管理員可以使用此功能"
+            else:
+                date_str = match.group(1)
+                try:
+                    day = datetime.strptime(date_str, "%Y%m%d")
+                    checker = get_conflict_checker(tenant)
+                    gaps = checker.daily_coverage_gaps(day)
+                    index = checker.index
+                    if gaps:
+                        gap_lines = "\n".join(
+                            f"- {index.local_time(start).strftime('%H:%M')}-{index.local_time(end).strftime('%H:%M')}"
+                            for start, end in gaps
+                        )
+                        reply_text = f"{day.strftime('%Y/%m/%d')} 以下時段無人值班:\n{gap_lines}"
+                    else:
+                        reply_text = f"{day.strftime('%Y/%m/%d')} 營業時段皆有人值班"
+                except ValueError:
+                    reply_text = "日期格式錯誤，請使用YYYYMMDD格式，例如：20250530"
+                except Exception as e:
+                    reply_text = f"檢查排班時發生錯誤: {str(e)}"
+            
             try:
                 safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=reply_text), event_source=event.source)
             except Exception as e:
@@ -856,7 +1678,7 @@ def handle_text_message(event):
             
         elif text == "查看用戶映射":
             # 管理員功能：查看當前用戶映射
-            mapping_text = "\n".join([f"{name}: {id}" for name, id in USER_MAPPING.items()])
+            mapping_text = "\n".join([f"{name}: {id}" for name, id in roster.items()])
             try:
                 safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=f"當前用戶映射:\n{mapping_text}"), event_source=event.source)
             except Exception as e:
@@ -864,155 +1686,21 @@ def handle_text_message(event):
             
         elif text == "測試日曆":
             # 測試 Google Calendar 連接，並列出一週內的排班
-            service = get_calendar_service()
+            service = get_calendar_service(tenant)
             if service:
                 try:
                     # 獲取一週內的事件
-                    events = get_week_calendar_events()
+                    events = get_week_calendar_events(tenant)
                     
-                    if not events:
+                    # 渲染排班表 (事件未變更時直接取用快取的 Flex Message)
+                    flex_message = tenant.renderer.render(events) if events else None
+                    
+                    if not flex_message:
                         try:
                             safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text="Google Calendar 連接成功，但未找到未來一週內的排班"), event_source=event.source)
                         except Exception as e:
                             line_bot_api.push_message(user_id, TextSendMessage(text="Google Calendar 連接成功，但未找到未來一週內的排班"))
                     else:
-                        # 按日期分組事件
-                        events_by_date = {}
-                        for event in events:
-                            start = event.get('start', {}).get('dateTime', '')
-                            if start:
-                                event_time = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                                date_str = event_time.strftime("%Y/%m/%d")
-                                time_str = event_time.strftime("%H:%M")
-                                
-                                if date_str not in events_by_date:
-                                    events_by_date[date_str] = []
-                                
-                                summary = event.get('summary', '未知班表')
-                                event_user_name = summary.replace('班表: ', '')
-                                events_by_date[date_str].append({
-                                    'time': time_str,
-                                    'user': event_user_name
-                                })
-                        
-                        # 創建 Flex Message 表格
-                        flex_contents = []
-                        
-                        # 添加標題
-                        flex_contents.append({
-                            "type": "box",
-                            "layout": "vertical",
-                            "contents": [
-                                {
-                                    "type": "text",
-                                    "text": "未來一週排班表",
-                                    "weight": "bold",
-                                    "size": "xl",
-                                    "color": "#1DB446",
-                                    "align": "center"
-                                },
-                                {
-                                    "type": "separator",
-                                    "margin": "md"
-                                }
-                            ]
-                        })
-                        
-                        # 添加每天的排班
-                        for date_str in sorted(events_by_date.keys()):
-                            # 添加日期標題
-                            date_box = {
-                                "type": "box",
-                                "layout": "vertical",
-                                "margin": "md",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": date_str,
-                                        "weight": "bold",
-                                        "size": "lg",
-                                        "color": "#555555"
-                                    }
-                                ]
-                            }
-                            flex_contents.append(date_box)
-                            
-                            # 添加表頭
-                            header_box = {
-                                "type": "box",
-                                "layout": "horizontal",
-                                "margin": "sm",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "時間",
-                                        "size": "sm",
-                                        "color": "#aaaaaa",
-                                        "flex": 2
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": "人員",
-                                        "size": "sm",
-                                        "color": "#aaaaaa",
-                                        "flex": 5
-                                    }
-                                ]
-                            }
-                            flex_contents.append(header_box)
-                            
-                            # 添加排班項目
-                            for event in sorted(events_by_date[date_str], key=lambda x: x['time']):
-                                event_box = {
-                                    "type": "box",
-                                    "layout": "horizontal",
-                                    "contents": [
-                                        {
-                                            "type": "text",
-                                            "text": event['time'],
-                                            "size": "sm",
-                                            "color": "#555555",
-                                            "flex": 2
-                                        },
-                                        {
-                                            "type": "text",
-                                            "text": event['user'],
-                                            "size": "sm",
-                                            "color": "#555555",
-                                            "flex": 5,
-                                            "wrap": True
-                                        }
-                                    ]
-                                }
-                                flex_contents.append(event_box)
-                            
-                            # 添加分隔線
-                            flex_contents.append({
-                                "type": "separator",
-                                "margin": "md"
-                            })
-                        
-                        # 創建 Flex Message
-                        bubble = {
-                            "type": "bubble",
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": flex_contents
-                            },
-                            "styles": {
-                                "footer": {
-                                    "separator": True
-                                }
-                            }
-                        }
-                        
-                        # 發送 Flex Message
-                        flex_message = FlexSendMessage(
-                            alt_text="未來一週排班表",
-                            contents=bubble
-                        )
-                        
                         try:
                             safe_send_message(
                                 line_bot_api.reply_message,
@@ -1021,7 +1709,7 @@ def handle_text_message(event):
                                 event_source=event.source
                             )
                         except Exception as e:
-                            print(f"創建 Flex Message 時發生錯誤: {str(e)}")
+                            logger.error("創建 Flex Message 時發生錯誤: %s", e)
                             # 如果 Flex Message 發送失敗，嘗試直接推送
                             try:
                                 line_bot_api.push_message(
@@ -1029,7 +1717,7 @@ def handle_text_message(event):
                                     flex_message
                                 )
                             except Exception as push_error:
-                                print(f"使用 push message 發送 Flex Message 時發生錯誤: {str(push_error)}")
+                                logger.error("使用 push message 發送 Flex Message 時發生錯誤: %s", push_error)
                 except Exception as e:
                     try:
                         safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=f"Google Calendar 連接成功，但查詢事件時發生錯誤: {str(e)}"), event_source=event.source)
@@ -1051,6 +1739,8 @@ def handle_text_message(event):
             processed_webhook_requests.clear()
             sent_messages.clear()
             processed_calendar_operations.clear()
+            tenant.renderer.clear()
+            tenant.cache.clear()
             
             try:
                 safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=f"緩存清理完成！\n清理前:\n- Webhook 請求: {old_webhook_count}\n- 訊息: {old_message_count}\n- 日曆操作: {old_operation_count}"), event_source=event.source)
@@ -1068,16 +1758,27 @@ def handle_text_message(event):
 - 測試日曆
   查看未來一週的排班表
 
+- 查詢班表 YYYYMM [週X] [早上/下午/晚上] [@用戶名]
+  查看自己或指定用戶在該月的排班
+  例如：查詢班表 202506 週五 下午
+
 - 查看用戶映射
   查看系統中已知的用戶名稱和ID對應關係
 
 【僅限管理員】
-- 新增排班 YYYYMMDD HH:MM @用戶名
-  例如：新增排班 20250530 08:00 @張書豪-Ragic Customize!
+- 新增排班 YYYYMMDD HH:MM[-HH:MM] @用戶名
+  例如：新增排班 20250530 08:00-12:00 @張書豪-Ragic Customize!
 
-- 批次排班 YYYYMMDD HH:MM @用戶名
+- 批次排班 YYYYMMDD HH:MM[-HH:MM] @用戶名
   為指定用戶在指定日期時間新增排班
 
+- 檢查排班 YYYYMMDD
+  列出該日營業時段內無人值班的時段
+
+- 月班表 YYYYMM [週X] [早上/下午/晚上]
+  查看該月所有人員的排班
+  例如：月班表 202506 週五 下午
+
 - 清理緩存
   清理系統緩存，解決可能的重複訊息問題"""
             
@@ -1094,9 +1795,116 @@ def handle_text_message(event):
                 line_bot_api.push_message(user_id, TextSendMessage(text="未知指令，請輸入「幫助」查看可用指令"))
             
     except LineBotApiError as e:
-        print(f"處理訊息時發生錯誤: {str(e)}")
+        logger.error("處理訊息時發生錯誤: %s", e)
     except Exception as e:
-        print(f"處理訊息時發生未知錯誤: {str(e)}")
+        logger.exception("處理訊息時發生未知錯誤: %s", e)
+
+# postback 動作對應的指令名稱
+POSTBACK_COMMANDS = {
+    "approve_shift": "approve_shift",
+    "reject_shift": "reject_shift",
+}
+
+def handle_postback(event):
+    from linebot.exceptions import LineBotApiError
+    
+    # 換班確認按鈕，其他 postback 不處理
+    params = parse_qs(event.postback.data or "")
+    command = POSTBACK_COMMANDS.get(params.get("action", [""])[0])
+    if not command:
+        return
+    with bind_correlation_id(getattr(event, "webhook_event_id", None)):
+        with start_span(f"command {command}", attributes={"line.command": command}):
+            with COMMAND_LATENCY.time(command=command), reply_manager.track(event, command), stale_data_scope():
+                try:
+                    respond_shift_request(event, command == "approve_shift", params.get("token", [""])[0])
+                except LineBotApiError as e:
+                    logger.error("處理按鈕回應時發生錯誤: %s", e)
+                except Exception as e:
+                    logger.exception("處理按鈕回應時發生未知錯誤: %s", e)
+
+def respond_shift_request(event, approve, token):
+    """
+    批准或拒絕換班請求，請求內容來自確認權杖，不需查詢換班請求記錄
+
+    Args:
+        event: LINE 事件 (按鈕回應或文字訊息)
+        approve: True 為批准，False 為拒絕
+        token: 確認權杖
+    """
+    from linebot.models import TextSendMessage
+    
+    reply_token = event.reply_token
+    user_id = event.source.user_id
+    
+    def reply(text):
+        try:
+            safe_send_message(line_bot_api.reply_message, reply_token, TextSendMessage(text=text), event_source=event.source)
+        except Exception as e:
+            line_bot_api.push_message(user_id, TextSendMessage(text=text))
+    
+    try:
+        request = approval_signer.verify(token)
+    except InvalidApprovalToken as e:
+        logger.info("換班確認權杖無效: %s", e)
+        reply("找不到對應的換班請求，可能已過期或已處理")
+        return
+    
+    if request.target_id != user_id:
+        reply("您無權回應此換班請求")
+        return
+    
+    # 權杖所屬的店家已不存在時拒絕，不改由預設店家處理
+    request_tenant = tenant_registry.find(request.tenant_id)
+    if request_tenant is None:
+        logger.warning("換班確認權杖的店家不存在: %s", request.tenant_id)
+        reply("找不到對應的換班請求，可能已過期或已處理")
+        return
+    requester_name = request_tenant.user_name(request.requester_id)
+    target_name = request_tenant.user_name(request.target_id)
+    if not requester_name or not target_name:
+        reply("換班請求中的人員已不在名單中，請聯繫管理員")
+        return
+    
+    unchecked = False
+    if approve:
+        # 寫入日曆前確認批准者在該時段沒有其他排班，無法檢查時由 swap_shifts 記錄到 outbox，於寫入時檢查
+        conflicts = check_conflicts(lambda: validate_swap(request_tenant, request.date, request.slot, target_name))
+        unchecked = conflicts is None
+        if conflicts:
+            reply(f"無法批准換班: {describe_conflicts(request_tenant, conflicts)}")
+            return
+    
+    # 權杖只能使用一次，多個 worker 同時收到時只有一個會處理；寫入日曆失敗時釋放，批准者可再按一次
+    if not used_approval_tokens.claim(request.nonce, APPROVAL_TOKEN_TTL):
+        reply("此換班請求已經被處理，無法重複處理")
+        return
+    used_approval_tokens.purge(APPROVAL_TOKEN_TTL)
+    
+    if approve:
+        # 啟用寫入合併時於寫入日曆後回覆
+        def reply_swap(success, message=None):
+            if success and (CALENDAR_OUTBOX or request_tenant.breaker.is_open or unchecked):
+                reply("您已批准換班請求，Google Calendar 將於稍後更新")
+            elif success:
+                reply("您已批准換班請求，Google Calendar 已更新")
+            else:
+                used_approval_tokens.release(request.nonce)
+                reply("Google Calendar 更新失敗，換班尚未完成，請稍後再按一次批准")
+                return
+            safe_send_message(line_bot_api.push_message, request.requester_id, TextSendMessage(text=f"{target_name} 已批准您在 {request.date} {request.slot} 的換班請求"))
+        
+        try:
+            success = swap_shifts(request.date, request.slot, requester_name, target_name, tenant=request_tenant,
+                                  on_done=reply_swap, notify_to=user_id)
+        except Exception:
+            used_approval_tokens.release(request.nonce)
+            raise
+        if success is not None:
+            reply_swap(success)
+    else:
+        reply("您已拒絕換班請求")
+        safe_send_message(line_bot_api.push_message, request.requester_id, TextSendMessage(text=f"{target_name} 已拒絕您在 {request.date} {request.slot} 的換班請求"))
 
 # ====== 啟動應用 ======
 if __name__ == "__main__":
@@ -0,0 +1,318 @@
+"""
+日曆寫入 outbox 模組 - 指令先將時段變更寫入 SQLite 後立即回覆，背景派送器依時段順序合併變更並寫入日曆；
+失敗時以指數退避重試，超過重試次數或無法重試的變更移到 dead letter。服務當機或重新啟動後，未完成的變更會繼續派送
+"""
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Any, Callable, Hashable, NamedTuple, Tuple
+
+from metrics import registry, error_status
+from structured_log import get_logger
+from write_coalescer import SlotMutation, SlotWrite, merge_mutations, WRITES_SAVED
+from circuit_breaker import CircuitOpenError
+
+# 是否以 outbox 寫入日曆 (指令立即回覆，背景寫入)
+CALENDAR_OUTBOX = os.getenv("CALENDAR_OUTBOX", "0").lower() in ("1", "true", "yes")
+# 每次派送最多處理的時段數
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+# 最多嘗試次數，超過後移到 dead letter
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# 重試等待時間（秒）: 第 n 次失敗後等待 base * 2^(n-1)，最多 max
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+# 派送中的時段租約（秒），worker 在寫入途中停止時，租約到期後由其他 worker 重新派送
+OUTBOX_LEASE_SECONDS = 60
+# 沒有待派送變更時的輪詢間隔（秒）
+OUTBOX_POLL_INTERVAL = 0.5
+
+# 請求本身有誤、重試也不會成功的狀態碼
+PERMANENT_STATUSES = {"400", "404", "409", "410"}
+
+OUTBOX_DISPATCHES = registry.counter("calendar_outbox_dispatch_total", "outbox 派送結果，outcome 為 ok、retry、dead 或 deferred", ("outcome",))
+OUTBOX_ENTRIES = registry.gauge("calendar_outbox_entries", "outbox 中的變更數，status 為 pending 或 dead", ("status",))
+
+logger = get_logger("outbox")
+
+
+class OutboxBatch(NamedTuple):
+    """
+    同一時段一次派送的變更
+    """
+    slot: Tuple[str, ...]
+    ids: List[int]
+    mutations: List[SlotMutation]
+    # 寫入失敗移到 dead letter 時通知的 LINE ID (與變更一一對應，可為 None)
+    notify: List[Optional[str]]
+    # 已嘗試次數 (批次中最多的一筆)
+    attempts: int
+
+
+def backoff(attempts: int, base: float = OUTBOX_BACKOFF_BASE, maximum: float = OUTBOX_BACKOFF_MAX) -> float:
+    """
+    第 attempts 次失敗後的重試等待時間（秒）
+    """
+    return min(maximum, base * 2 ** (attempts - 1))
+
+
+class CalendarOutbox:
+    """
+    SQLite 日曆寫入 outbox - 同一時段的變更依寫入順序派送，派送中的時段以租約鎖定，多個 worker 不會同時寫入同一時段；
+    寫入成功後才刪除記錄，因此為至少一次 (at-least-once) 派送
+    """
+    def __init__(self, database: Any, max_attempts: int = OUTBOX_MAX_ATTEMPTS, lease: float = OUTBOX_LEASE_SECONDS):
+        """
+        Args:
+            database: shared_state.SQLiteDatabase
+            max_attempts: 最多嘗試次數
+            lease: 派送中的時段租約（秒）
+        """
+        self.database = database
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._ready = False
+        self._ready_lock = threading.Lock()
+        # 是否可能有待派送的變更: 本行程記錄過變更，或資料庫已存在 (可能有上次未完成的變更)；
+        # claim 發現沒有待派送的變更時設為 False，之後本行程記錄變更時才再設為 True
+        self.active = os.path.exists(getattr(database, "path", ""))
+        self._active_lock = threading.Lock()
+
+    def _connection(self) -> Any:
+        conn = self.database.connection()
+        # 第一次使用時才建立資料表，未啟用 outbox 時不建立資料庫檔案
+        if not self._ready:
+            with self._ready_lock:
+                conn.execute('''
+                CREATE TABLE IF NOT EXISTS calendar_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    slot TEXT NOT NULL,
+                    mutation TEXT NOT NULL,
+                    notify TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    leased_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+                ''')
+                conn.execute("CREATE INDEX IF NOT EXISTS calendar_outbox_slot ON calendar_outbox (status, slot, id)")
+                self._ready = True
+        return conn
+
+    def enqueue(self, slot: Tuple[str, ...], mutation: SlotMutation, notify: Optional[str] = None,
+                delay: float = 0, now: Optional[float] = None) -> int:
+        """
+        記錄時段變更
+
+        Args:
+            slot: 時段，例如 (店家 ID, 日曆 ID, 日期, 時間)
+            mutation: 變更
+            notify: 寫入失敗時通知的 LINE ID
+            delay: 開始派送前的等待時間（秒），期間同一時段的變更會合併寫入
+
+        Returns:
+            記錄 ID
+        """
+        now = now or time.time()
+        with self._active_lock:
+            cursor = self._connection().execute(
+                "INSERT INTO calendar_outbox (slot, mutation, notify, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(list(slot), ensure_ascii=False), json.dumps(mutation._asdict(), ensure_ascii=False),
+                 notify, now + delay, now)
+            )
+            self.active = True
+        return cursor.lastrowid
+
+    def next_available(self) -> Optional[float]:
+        """
+        待派送的變更最早可取得的時間 (派送時間與租約到期時間較晚者)，只讀取、不鎖定資料庫
+
+        Returns:
+            epoch 秒，沒有待派送的變更時為 None
+        """
+        row = self._connection().execute(
+            "SELECT MIN(MAX(available_at, COALESCE(leased_until, 0))) FROM calendar_outbox WHERE status = 'pending'"
+        ).fetchone()
+        return row[0]
+
+    def claim(self, limit: int = OUTBOX_BATCH_SIZE, now: Optional[float] = None) -> List[OutboxBatch]:
+        """
+        取得可派送的時段並加上租約 - 時段最早的一筆變更已到派送時間且不在派送中時，取出該時段所有待派送的變更
+
+        Returns:
+            依最早變更的順序排列的批次
+        """
+        now = now or time.time()
+        # 先以唯讀查詢確認有到期的變更，避免每次輪詢都取得寫入鎖
+        with self._active_lock:
+            available_at = self.next_available()
+            self.active = available_at is not None
+        if available_at is None or available_at > now:
+            return []
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            slots = [row[0] for row in conn.execute('''
+                SELECT slot FROM calendar_outbox
+                WHERE id IN (SELECT MIN(id) FROM calendar_outbox WHERE status = 'pending' GROUP BY slot)
+                  AND available_at <= ? AND (leased_until IS NULL OR leased_until <= ?)
+                ORDER BY id LIMIT ?
+            ''', (now, now, limit))]
+            batches = []
+            for slot in slots:
+                rows = conn.execute(
+                    "SELECT id, mutation, notify, attempts FROM calendar_outbox WHERE status = 'pending' AND slot = ? ORDER BY id",
+                    (slot,)
+                ).fetchall()
+                conn.execute(
+                    "UPDATE calendar_outbox SET leased_until = ? WHERE status = 'pending' AND slot = ? AND id <= ?",
+                    (now + self.lease, slot, rows[-1][0])
+                )
+                batches.append(OutboxBatch(
+                    tuple(json.loads(slot)),
+                    [row[0] for row in rows],
+                    [SlotMutation(**json.loads(row[1])) for row in rows],
+                    [row[2] for row in rows],
+                    max(row[3] for row in rows),
+                ))
+            conn.execute("COMMIT")
+            return batches
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, batch: OutboxBatch):
+        """
+        寫入成功，刪除批次的記錄
+        """
+        self._connection().execute(
+            f"DELETE FROM calendar_outbox WHERE id IN ({','.join('?' * len(batch.ids))})", batch.ids
+        )
+
+    def fail(self, batch: OutboxBatch, error: str, permanent: bool = False, now: Optional[float] = None) -> bool:
+        """
+        寫入失敗，依嘗試次數安排重試或移到 dead letter
+
+        Args:
+            error: 錯誤訊息
+            permanent: 重試也不會成功的錯誤
+
+        Returns:
+            是否已移到 dead letter
+        """
+        now = now or time.time()
+        attempts = batch.attempts + 1
+        dead = permanent or attempts >= self.max_attempts
+        placeholders = ','.join('?' * len(batch.ids))
+        self._connection().execute(
+            f'''UPDATE calendar_outbox SET status = ?, attempts = ?, available_at = ?, leased_until = NULL, last_error = ?
+                WHERE id IN ({placeholders})''',
+            ["dead" if dead else "pending", attempts, now + backoff(attempts), error[:500]] + batch.ids
+        )
+        return dead
+
+    def defer(self, batch: OutboxBatch, available_at: float):
+        """
+        暫時無法寫入 (日曆斷路器暫停呼叫中)，延後派送且不計入嘗試次數
+        """
+        self._connection().execute(
+            f"UPDATE calendar_outbox SET available_at = ?, leased_until = NULL WHERE id IN ({','.join('?' * len(batch.ids))})",
+            [available_at] + batch.ids
+        )
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        列出 dead letter 中的變更
+        """
+        rows = self._connection().execute(
+            "SELECT id, slot, mutation, attempts, last_error, created_at FROM calendar_outbox WHERE status = 'dead' ORDER BY id LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [{"id": row[0], "slot": json.loads(row[1]), "mutation": json.loads(row[2]), "attempts": row[3],
+                 "error": row[4], "created_at": row[5]} for row in rows]
+
+    def requeue(self, ids: List[int], now: Optional[float] = None) -> int:
+        """
+        將 dead letter 中的變更重新排入派送
+
+        Returns:
+            重新排入的記錄數
+        """
+        if not ids:
+            return 0
+        cursor = self._connection().execute(
+            f'''UPDATE calendar_outbox SET status = 'pending', attempts = 0, available_at = ?, leased_until = NULL
+                WHERE status = 'dead' AND id IN ({','.join('?' * len(ids))})''',
+            [now or time.time()] + list(ids)
+        )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """
+        各狀態的記錄數
+        """
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM calendar_outbox GROUP BY status").fetchall()
+        return {"pending": 0, "dead": 0, **dict(rows)}
+
+
+class OutboxDispatcher:
+    """
+    outbox 派送器 - 取出到期的時段，將同一時段的變更合併為一次寫入
+    """
+    def __init__(self, outbox: CalendarOutbox, write: Callable[[Hashable, SlotWrite], Tuple[bool, str]],
+                 on_dead: Optional[Callable[[OutboxBatch, str], Any]] = None, batch_size: int = OUTBOX_BATCH_SIZE):
+        """
+        Args:
+            outbox: 日曆寫入 outbox
+            write: 寫入函數 (時段, 合併後的寫入)，回傳 (是否成功, 訊息)
+            on_dead: 批次移到 dead letter 時呼叫 (批次, 錯誤訊息)
+            batch_size: 每次派送最多處理的時段數
+        """
+        self.outbox = outbox
+        self.write = write
+        self.on_dead = on_dead
+        self.batch_size = batch_size
+
+    def run_once(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        派送一次
+
+        Returns:
+            各結果的時段數 (ok、retry、dead、deferred)
+        """
+        result = {"ok": 0, "retry": 0, "dead": 0, "deferred": 0}
+        for batch in self.outbox.claim(self.batch_size, now=now):
+            permanent = False
+            try:
+                success, message = self.write(batch.slot, merge_mutations(batch.mutations))
+            except CircuitOpenError as e:
+                # 斷路器恢復試探前不重試，也不計入嘗試次數
+                self.outbox.defer(batch, e.retry_at)
+                OUTBOX_DISPATCHES.inc(outcome="deferred")
+                result["deferred"] += 1
+                continue
+            except Exception as e:
+                success, message = False, str(e)
+                permanent = error_status(e) in PERMANENT_STATUSES
+            if success:
+                self.outbox.complete(batch)
+                WRITES_SAVED.inc(len(batch.ids) - 1)
+                outcome = "ok"
+            elif self.outbox.fail(batch, message, permanent=permanent, now=now):
+                outcome = "dead"
+                logger.error("日曆寫入移到 dead letter: %s", message,
+                             extra={"slot": "/".join(batch.slot), "mutations": len(batch.ids), "attempts": batch.attempts + 1})
+                if self.on_dead:
+                    try:
+                        self.on_dead(batch, message)
+                    except Exception as e:
+                        logger.error("通知寫入失敗時發生錯誤: %s", e)
+            else:
+                outcome = "retry"
+                logger.warning("日曆寫入失敗，稍後重試: %s", message,
+                               extra={"slot": "/".join(batch.slot), "attempts": batch.attempts + 1})
+            OUTBOX_DISPATCHES.inc(outcome=outcome)
+            result[outcome] += 1
+        return result
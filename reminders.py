@@ -0,0 +1,294 @@
+"""
+排班提醒模組 - 依排班索引計算即將開始的班次，以階層式時間輪排程「班次將於 N 小時後開始」的提醒；
+同一秒到期、內容相同的提醒合併為一次 multicast，排程保存在共享狀態中，重新啟動後可恢復
+"""
+import os
+import re
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Callable, Iterable, Tuple
+
+from structured_log import get_logger
+
+# 提前提醒的小時數，以逗號分隔 (例如 12,2)，未設置時不啟用提醒
+SHIFT_REMINDER_HOURS = os.getenv("SHIFT_REMINDER_HOURS", "")
+# 從日曆同步提醒排程的間隔（秒）
+REMINDER_SYNC_INTERVAL = int(os.getenv("REMINDER_SYNC_INTERVAL", "300"))
+# 排程未來多少小時內開始的班次
+REMINDER_HORIZON_HOURS = int(os.getenv("REMINDER_HORIZON_HOURS", "48"))
+# 重新啟動後，逾期未超過此秒數的提醒仍會補發
+REMINDER_GRACE_SECONDS = 300
+
+# LINE multicast 每次最多的收件人數
+MULTICAST_LIMIT = 500
+# multicast 只接受 LINE 用戶 ID
+_LINE_USER_ID_PATTERN = re.compile(r"U[0-9a-f]{32}")
+
+logger = get_logger("reminders")
+
+
+def reminder_hours(value: str = SHIFT_REMINDER_HOURS) -> List[float]:
+    """
+    解析提前提醒的小時數，由大到小排序
+    """
+    hours = {float(item) for item in value.split(",") if item.strip()}
+    return sorted((hour for hour in hours if hour > 0), reverse=True)
+
+
+class TimerWheel:
+    """
+    階層式時間輪 - 第一層每格 tick 秒，往上每層一格為下一層一圈的長度；
+    新增與取消皆為 O(1)，時間推進到上層的格子時將其中的計時器逐層下放，到達第一層的格子即到期
+    """
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, now: Optional[float] = None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # 各層一格的 tick 數
+        self._spans = [slots ** level for level in range(levels)]
+        self._current = int((now or time.time()) / tick)
+        # key -> (層, 格)；_due 為排程時已到期、等待下一次推進時取出的計時器；
+        # _overflow 為超過時間輪範圍的計時器，最上層每轉一圈重新放置
+        self._timers = {}
+        self._due = {}
+        self._overflow = {}
+
+    def schedule(self, key: str, due_at: float, payload: Any = None):
+        """
+        新增計時器，相同 key 的計時器會被取代
+        """
+        self.cancel(key)
+        self._place(key, int(due_at / self.tick), payload)
+
+    def cancel(self, key: str) -> bool:
+        """
+        取消計時器
+
+        Returns:
+            計時器是否存在
+        """
+        location = self._timers.pop(key, None)
+        if location is None:
+            return self._due.pop(key, None) is not None or self._overflow.pop(key, None) is not None
+        level, slot = location
+        del self._wheels[level][slot][key]
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Tuple[str, float, Any]]:
+        """
+        推進到目前時間並取出到期的計時器
+
+        Returns:
+            [(key, 到期時間, payload)]，依到期時間排序
+        """
+        target = int((now or time.time()) / self.tick)
+        expired = [(key, due_tick * self.tick, payload) for key, (due_tick, payload) in self._due.items()]
+        self._due = {}
+        rotation = self._spans[-1] * self.slots
+        while self._current < target:
+            if not self._timers and not self._overflow:
+                self._current = target
+                break
+            self._current += 1
+            if self._overflow and self._current % rotation == 0:
+                overflow = self._overflow
+                self._overflow = {}
+                for key, (due_tick, payload) in overflow.items():
+                    self._place(key, due_tick, payload, cascading=True)
+            # 先下放上層的格子，落在目前第一層格子的計時器才能在同一次推進中取出
+            for level in range(self.levels - 1, 0, -1):
+                if self._current % self._spans[level] == 0:
+                    self._cascade(level, (self._current // self._spans[level]) % self.slots)
+            bucket = self._wheels[0][self._current % self.slots]
+            if bucket:
+                for key, (due_tick, payload) in bucket.items():
+                    del self._timers[key]
+                    expired.append((key, due_tick * self.tick, payload))
+                bucket.clear()
+        expired.sort(key=lambda item: item[1])
+        return expired
+
+    def keys(self) -> List[str]:
+        return list(self._timers) + list(self._due) + list(self._overflow)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._timers or key in self._due or key in self._overflow
+
+    def __len__(self) -> int:
+        return len(self._timers) + len(self._due) + len(self._overflow)
+
+    def _place(self, key: str, due_tick: int, payload: Any, cascading: bool = False):
+        # 下放時到期的計時器放在目前的第一層格子，在同一次推進中取出
+        if due_tick <= self._current and not cascading:
+            self._due[key] = (due_tick, payload)
+            return
+        if due_tick <= self._current:
+            slot = self._current % self.slots
+            self._wheels[0][slot][key] = (due_tick, payload)
+            self._timers[key] = (0, slot)
+            return
+        # 以距離到期的格數決定層級：到期時間所在的格子距目前位置不到一圈時，該格在到期前最後一次下放，
+        # 不使用剛好一圈的格子 (與目前位置同一格，下放時可能正在處理)
+        for level in range(self.levels):
+            span = self._spans[level]
+            if due_tick // span - self._current // span < self.slots:
+                break
+        else:
+            # 超過時間輪範圍，最上層每轉一圈重新放置
+            self._overflow[key] = (due_tick, payload)
+            return
+        slot = (due_tick // span) % self.slots
+        self._wheels[level][slot][key] = (due_tick, payload)
+        self._timers[key] = (level, slot)
+
+    def _cascade(self, level: int, slot: int):
+        bucket = self._wheels[level][slot]
+        if not bucket:
+            return
+        timers = list(bucket.items())
+        bucket.clear()
+        for key, (due_tick, payload) in timers:
+            del self._timers[key]
+            self._place(key, due_tick, payload, cascading=True)
+
+
+class ShiftReminderScheduler:
+    """
+    排班提醒排程 - 排程保存在 store (key -> 提醒)，時間輪只存在記憶體中；
+    多個 worker 各自排程時，以 sent_store 確保每則提醒只送出一次
+    """
+    def __init__(self, send: Callable[[List[str], str], Any], store: Any, sent_store: Any,
+                 hours: Optional[List[float]] = None, wheel: Optional[TimerWheel] = None):
+        """
+        Args:
+            send: 發送函數 (收件人列表, 訊息)
+            store: 提醒排程的儲存
+            sent_store: 已送出提醒的記錄
+            hours: 提前提醒的小時數
+            wheel: 時間輪
+        """
+        self.send = send
+        self.store = store
+        self.sent_store = sent_store
+        self.hours = reminder_hours() if hours is None else hours
+        self.wheel = wheel if wheel is not None else TimerWheel()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hours)
+
+    def restore(self, now: Optional[float] = None) -> int:
+        """
+        從儲存恢復排程，逾期太久的提醒直接刪除
+
+        Returns:
+            恢復的提醒數
+        """
+        now = now or time.time()
+        restored = 0
+        with self._lock:
+            for key, reminder in list(self.store.items()):
+                if reminder["due_at"] < now - REMINDER_GRACE_SECONDS:
+                    self.store.pop(key, None)
+                    continue
+                self.wheel.schedule(key, reminder["due_at"], reminder)
+                restored += 1
+        return restored
+
+    def plan(self, tenant_id: str, shifts: Iterable[Any], resolve_user: Callable[[str], Optional[str]],
+             local_time: Callable[[int], datetime], now: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        計算班次的提醒
+
+        Args:
+            tenant_id: 店家 ID
+            shifts: 排班 (schedule_index.IndexedShift)
+            resolve_user: 人員名稱轉換為 LINE ID
+            local_time: epoch 秒轉換為當地時間
+
+        Returns:
+            key -> 提醒 (due_at, to, text)
+        """
+        now = now or time.time()
+        reminders = {}
+        for shift in shifts:
+            user_id = resolve_user(shift.staff)
+            if not user_id:
+                continue
+            start = local_time(shift.start).strftime("%Y/%m/%d %H:%M")
+            for hour in self.hours:
+                due_at = shift.start - hour * 3600
+                if due_at <= now:
+                    continue
+                label = f"{hour:g}"
+                reminders[f"{tenant_id}:{shift.event_id}:{user_id}:{label}"] = {
+                    "due_at": due_at,
+                    "to": user_id,
+                    "text": f"提醒：您在 {start} 的班次將於 {label} 小時後開始",
+                }
+        return reminders
+
+    def sync(self, tenant_id: str, reminders: Dict[str, Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        以最新的提醒取代店家尚未到期的排程，已刪除或時間變更的班次會取消舊的提醒
+
+        Returns:
+            (新增或更新數, 取消數)
+        """
+        prefix = f"{tenant_id}:"
+        scheduled = cancelled = 0
+        with self._lock:
+            for key in self.wheel.keys():
+                if key.startswith(prefix) and key not in reminders:
+                    self.wheel.cancel(key)
+                    self.store.pop(key, None)
+                    cancelled += 1
+            for key, reminder in reminders.items():
+                existing = self.store.get(key)
+                if key in self.wheel and existing == reminder:
+                    continue
+                self.store[key] = reminder
+                self.wheel.schedule(key, reminder["due_at"], reminder)
+                scheduled += 1
+        return scheduled, cancelled
+
+    def pop_due(self, now: Optional[float] = None) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """
+        取出到期的提醒
+        """
+        with self._lock:
+            return self.wheel.advance(now)
+
+    def deliver(self, due: List[Tuple[str, float, Dict[str, Any]]]) -> int:
+        """
+        送出到期的提醒 - 同一秒到期且內容相同的提醒合併為 multicast
+
+        Returns:
+            發送次數
+        """
+        batches = {}
+        for key, due_at, reminder in due:
+            self.store.pop(key, None)
+            # 其他 worker 已送出的提醒不重複發送
+            if not self.sent_store.claim(key, REMINDER_HORIZON_HOURS * 3600):
+                continue
+            if not _LINE_USER_ID_PATTERN.fullmatch(reminder["to"]):
+                logger.warning("略過非 LINE 用戶 ID 的提醒", extra={"key": key})
+                continue
+            batches.setdefault((int(due_at), reminder["text"]), []).append((key, reminder["to"]))
+        self.sent_store.purge(REMINDER_HORIZON_HOURS * 3600)
+
+        sends = 0
+        for (_, text), entries in batches.items():
+            recipients = sorted({to for _, to in entries})
+            for offset in range(0, len(recipients), MULTICAST_LIMIT):
+                chunk = recipients[offset:offset + MULTICAST_LIMIT]
+                try:
+                    self.send(chunk, text)
+                    sends += 1
+                except Exception as e:
+                    logger.error("發送排班提醒失敗: %s", e, extra={"recipients": len(chunk)})
+        return sends
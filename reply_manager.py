@@ -0,0 +1,199 @@
+"""
+回覆管理模組 - 追蹤每個事件 reply token 的使用時間，預估處理時間超過預算時先回覆處理中訊息
+(一對一聊天則顯示載入動畫)，完成後再以 push message 送出結果，並記錄各種回覆方式的次數
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, Iterator
+
+
+from metrics import registry
+from structured_log import get_logger
+
+# 預估在事件發生後多少秒內無法回覆時，先送出處理中訊息或載入動畫
+REPLY_TOKEN_BUDGET = float(os.getenv("REPLY_TOKEN_BUDGET", "10"))
+# reply token 視為已失效的時間（秒），超過時直接改用 push message，不再嘗試回覆
+REPLY_TOKEN_MAX_AGE = float(os.getenv("REPLY_TOKEN_MAX_AGE", "50"))
+# 群組與聊天室無法顯示載入動畫，改回覆此訊息
+REPLY_ACK_TEXT = os.getenv("REPLY_ACK_TEXT", "處理中，完成後會再通知您")
+# 預估處理時間的平滑係數
+ESTIMATE_ALPHA = 0.2
+
+# 載入動畫的顯示時間限制（秒），LINE 只接受 5 的倍數
+LOADING_MIN_SECONDS = 5
+LOADING_MAX_SECONDS = 60
+
+# 回覆方式:
+#   reply          在預算內直接回覆
+#   loading_reply  顯示載入動畫後仍在 reply token 有效時回覆
+#   loading_push   顯示載入動畫後 reply token 已失效，改用 push
+#   ack_push       先回覆處理中訊息，結果以 push 送出
+#   expired_push   未預期的延遲，reply token 已失效，改用 push
+#   failed_push    回覆失敗 (reply token 無效) 後改用 push
+REPLY_PATHS = registry.counter("line_reply_path_total", "各指令的回覆方式次數", ("command", "path"))
+
+logger = get_logger("reply_manager")
+
+
+class CommandEstimator:
+    """
+    依各指令最近的處理時間預估下一次的處理時間 (指數移動平均加上兩倍的平均偏差)
+    """
+    def __init__(self, alpha: float = ESTIMATE_ALPHA):
+        self.alpha = alpha
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, command: str, seconds: float):
+        with self._lock:
+            stats = self._stats.get(command)
+            if stats is None:
+                self._stats[command] = [seconds, 0.0]
+                return
+            mean, deviation = stats
+            stats[1] = deviation + self.alpha * (abs(seconds - mean) - deviation)
+            stats[0] = mean + self.alpha * (seconds - mean)
+
+    def estimate(self, command: str) -> float:
+        """
+        預估處理時間（秒），沒有紀錄時為 0
+        """
+        stats = self._stats.get(command)
+        if stats is None:
+            return 0.0
+        return stats[0] + 2 * stats[1]
+
+
+class ResponseState:
+    """
+    單一事件的回覆狀態
+    """
+    __slots__ = ("command", "source", "received_at", "mode", "delivered")
+
+    def __init__(self, command: str, source: Any, received_at: float):
+        self.command = command
+        self.source = source
+        self.received_at = received_at
+        # direct: 直接回覆，loading: 已顯示載入動畫，ack: reply token 已用於處理中訊息
+        self.mode = "direct"
+        self.delivered = False
+
+
+def push_target(source: Any) -> Optional[str]:
+    """
+    push message 的對象 - 群組或聊天室的事件送回原群組，否則送給用戶
+    """
+    for attribute in ("group_id", "room_id", "user_id"):
+        value = getattr(source, attribute, None)
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+
+class ReplyManager:
+    """
+    reply token 期限管理
+    """
+    def __init__(self, line_bot_api: Any, budget: float = REPLY_TOKEN_BUDGET, max_age: float = REPLY_TOKEN_MAX_AGE,
+                 ack_text: str = REPLY_ACK_TEXT, estimator: Optional[CommandEstimator] = None):
+        self.line_bot_api = line_bot_api
+        self.budget = budget
+        self.max_age = max_age
+        self.ack_text = ack_text
+        self.estimator = estimator or CommandEstimator()
+        self._states = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, event: Any, command: str) -> Iterator[ResponseState]:
+        """
+        處理事件期間追蹤 reply token，結束後以實際處理時間更新預估
+
+        Args:
+            event: LINE 事件
+            command: 指令名稱
+        """
+        started = time.perf_counter()
+        state = self.begin(event, command)
+        try:
+            yield state
+        finally:
+            self.estimator.observe(command, time.perf_counter() - started)
+            with self._lock:
+                self._states.pop(getattr(event, "reply_token", None), None)
+
+    def begin(self, event: Any, command: str, now: Optional[float] = None) -> ResponseState:
+        """
+        開始處理事件，預估完成時 reply token 已超過預算時先回覆處理中訊息或顯示載入動畫
+        """
+        now = now or time.time()
+        timestamp = getattr(event, "timestamp", None)
+        received_at = timestamp / 1000 if isinstance(timestamp, (int, float)) else now
+        state = ResponseState(command, event.source, received_at)
+        reply_token = getattr(event, "reply_token", None)
+        if not isinstance(reply_token, str):
+            return state
+
+        projected = now - received_at + self.estimator.estimate(command)
+        if projected > self.budget:
+            if getattr(event.source, "type", None) == "user" and self._show_loading(event.source.user_id, projected):
+                state.mode = "loading"
+            else:
+                state.mode = "ack"
+                from linebot.models import TextSendMessage
+                try:
+                    self.line_bot_api.reply_message(reply_token, TextSendMessage(text=self.ack_text))
+                except Exception as e:
+                    logger.warning("回覆處理中訊息失敗: %s", e, extra={"command": command})
+            logger.info("預估處理時間超過回覆期限", extra={"command": command, "mode": state.mode,
+                                                     "projected_seconds": round(projected, 2)})
+        with self._lock:
+            self._states[reply_token] = state
+        return state
+
+    def _show_loading(self, user_id: str, projected: float) -> bool:
+        # line-bot-sdk 3.5 的 LineBotApi 尚未提供載入動畫的方法，直接呼叫 API
+        seconds = min(LOADING_MAX_SECONDS, max(LOADING_MIN_SECONDS, -(-int(projected) // 5) * 5))
+        try:
+            self.line_bot_api._post(
+                "/v2/bot/chat/loading/start",
+                data=json.dumps({"chatId": user_id, "loadingSeconds": seconds}),
+                timeout=self.line_bot_api.http_client.timeout
+            )
+            return True
+        except Exception as e:
+            logger.warning("顯示載入動畫失敗: %s", e)
+            return False
+
+    def redirect(self, reply_token: str, now: Optional[float] = None) -> Optional[str]:
+        """
+        送出回覆前呼叫，reply token 已用於處理中訊息或已失效時回傳 push message 的對象
+
+        Returns:
+            push message 的對象，仍可回覆時為 None
+        """
+        state = self._states.get(reply_token)
+        if state is None:
+            return None
+        now = now or time.time()
+        expired = now - state.received_at > self.max_age
+        if state.mode == "ack":
+            path, target = "ack_push", push_target(state.source)
+        elif expired:
+            path, target = ("loading_push" if state.mode == "loading" else "expired_push"), push_target(state.source)
+        else:
+            path, target = ("loading_reply" if state.mode == "loading" else "reply"), None
+        if not state.delivered:
+            state.delivered = True
+            REPLY_PATHS.inc(command=state.command, path=path)
+        return target
+
+    def record_failed_reply(self, reply_token: str):
+        """
+        記錄回覆失敗後改用 push message
+        """
+        state = self._states.get(reply_token)
+        REPLY_PATHS.inc(command=state.command if state else "other", path="failed_push")
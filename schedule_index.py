@@ -0,0 +1,218 @@
+"""
+排班索引模組 - 以排序陣列建立排班區間索引，支援依人員、星期、時段與日期範圍查詢
+"""
+import bisect
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterable, NamedTuple, Tuple
+from zoneinfo import ZoneInfo
+
+from time_model import DEFAULT_TIMEZONE
+from shifts import Shift
+
+# 時段定義 (起始分鐘, 結束分鐘)，以當地時間計算
+TIME_BANDS = {
+    "早上": (6 * 60, 12 * 60),
+    "下午": (12 * 60, 18 * 60),
+    "晚上": (18 * 60, 24 * 60),
+}
+
+# 星期名稱 (0 為星期一)
+WEEKDAY_NAMES = "一二三四五六日"
+
+
+class IndexedShift(NamedTuple):
+    """
+    索引中的排班區間
+    """
+    start: int  # 開始時間 (epoch 秒)
+    end: int  # 結束時間 (epoch 秒)
+    staff: str  # 排班人員名稱
+    event_id: str
+    weekday: int  # 當地時間的星期 (0 為星期一)
+    minute_of_day: int  # 當地時間的開始分鐘
+
+
+def parse_band(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    解析時段，可為「早上/下午/晚上」或「HH:MM-HH:MM」
+
+    Returns:
+        (起始分鐘, 結束分鐘) 或 None
+    """
+    if not value:
+        return None
+    if value in TIME_BANDS:
+        return TIME_BANDS[value]
+    start, end = value.split("-", 1)
+    start_hour, start_minute = map(int, start.split(":"))
+    end_hour, end_minute = map(int, end.split(":"))
+    return start_hour * 60 + start_minute, end_hour * 60 + end_minute
+
+
+class ScheduleIndex:
+    """
+    排班區間索引 - 以開始時間排序的陣列與每位人員的排序陣列回答區間查詢
+    """
+    def __init__(self, timezone: str = DEFAULT_TIMEZONE):
+        self.tz = ZoneInfo(timezone)
+        self.version = None
+        self._shifts = []  # 依開始時間排序
+        self._starts = []
+        self._by_staff = {}  # 人員名稱 -> 依開始時間排序的排班
+        self._staff_starts = {}
+        self._by_id = {}
+        self._max_duration = 0
+        self._lock = threading.Lock()
+
+    def rebuild(self, events: Iterable[Dict[str, Any]], version: Any = None):
+        """
+        以事件重建索引
+
+        Args:
+            events: Google Calendar 事件
+            version: 事件來源的版本，用於判斷是否需要重建
+        """
+        shifts = []
+        for event in events:
+            shift = self._to_shift(event)
+            if shift is not None:
+                shifts.append(shift)
+        shifts.sort()
+
+        by_staff = {}
+        for shift in shifts:
+            by_staff.setdefault(shift.staff, []).append(shift)
+
+        with self._lock:
+            self._shifts = shifts
+            self._starts = [shift.start for shift in shifts]
+            self._by_staff = by_staff
+            self._staff_starts = {staff: [shift.start for shift in items] for staff, items in by_staff.items()}
+            self._by_id = {shift.event_id: shift for shift in shifts}
+            self._max_duration = max((shift.end - shift.start for shift in shifts), default=0)
+            self.version = version
+
+    def upsert(self, event: Dict[str, Any], version: Any = None):
+        """
+        新增或更新單一事件，不需重建整個索引
+
+        Args:
+            event: Google Calendar 事件
+            version: 更新後事件來源的版本
+        """
+        shift = self._to_shift(event)
+        with self._lock:
+            self._remove_locked(event.get('id', ''))
+            if shift is not None:
+                index = bisect.bisect_left(self._shifts, shift)
+                self._shifts.insert(index, shift)
+                self._starts.insert(index, shift.start)
+                staff_shifts = self._by_staff.setdefault(shift.staff, [])
+                staff_index = bisect.bisect_left(staff_shifts, shift)
+                staff_shifts.insert(staff_index, shift)
+                self._staff_starts.setdefault(shift.staff, []).insert(staff_index, shift.start)
+                self._by_id[shift.event_id] = shift
+                self._max_duration = max(self._max_duration, shift.end - shift.start)
+            self.version = version
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              staff: Optional[str] = None, weekday: Optional[int] = None,
+              band: Optional[Tuple[int, int]] = None) -> List[IndexedShift]:
+        """
+        查詢與時間範圍重疊的排班
+
+        Args:
+            start: 範圍起點 (含)，None 表示不限
+            end: 範圍終點 (不含)，None 表示不限
+            staff: 只查詢此人員
+            weekday: 只查詢此星期 (0 為星期一)
+            band: 只查詢開始時間落在此時段 (起始分鐘, 結束分鐘) 的排班
+
+        Returns:
+            依開始時間排序的排班列表
+        """
+        with self._lock:
+            if staff is not None:
+                shifts = self._by_staff.get(staff, [])
+                starts = self._staff_starts.get(staff, [])
+            else:
+                shifts, starts = self._shifts, self._starts
+            low = self._epoch(start) if start is not None else None
+            high = self._epoch(end) if end is not None else None
+
+            # 只有開始時間晚於 (起點 - 最長班次) 的排班可能與範圍重疊
+            first = bisect.bisect_right(starts, low - self._max_duration) if low is not None else 0
+            last = bisect.bisect_left(starts, high) if high is not None else len(starts)
+            candidates = shifts[first:last]
+
+        results = []
+        for shift in candidates:
+            if low is not None and shift.end <= low:
+                continue
+            if weekday is not None and shift.weekday != weekday:
+                continue
+            if band is not None and not band[0] <= shift.minute_of_day < band[1]:
+                continue
+            results.append(shift)
+        return results
+
+    def month_range(self, year: int, month: int) -> Tuple[datetime, datetime]:
+        """
+        取得當地時間的月份範圍
+        """
+        start = datetime(year, month, 1, tzinfo=self.tz)
+        end = datetime(year + 1, 1, 1, tzinfo=self.tz) if month == 12 else datetime(year, month + 1, 1, tzinfo=self.tz)
+        return start, end
+
+    def local_time(self, epoch: int) -> datetime:
+        """
+        將 epoch 秒轉換為當地時間
+        """
+        return datetime.fromtimestamp(epoch, self.tz)
+
+    def staff_names(self) -> List[str]:
+        return sorted(self._by_staff)
+
+    def __len__(self):
+        return len(self._shifts)
+
+    def _to_shift(self, event: Dict[str, Any]) -> Optional[IndexedShift]:
+        """
+        將事件轉換為排班區間，非排班事件回傳 None
+        """
+        shift = Shift.from_event(event, self.tz)
+        if shift is None or not shift.is_shift:
+            return None
+        local_start = self.local_time(shift.start)
+        return IndexedShift(
+            start=shift.start,
+            end=shift.end,
+            staff=shift.staff,
+            event_id=shift.id,
+            weekday=local_start.weekday(),
+            minute_of_day=local_start.hour * 60 + local_start.minute
+        )
+
+    def _remove_locked(self, event_id: str):
+        """
+        移除事件對應的排班
+        """
+        shift = self._by_id.pop(event_id, None)
+        if shift is None:
+            return
+        position = bisect.bisect_left(self._shifts, shift)
+        del self._shifts[position]
+        del self._starts[position]
+        staff_shifts = self._by_staff[shift.staff]
+        staff_index = bisect.bisect_left(staff_shifts, shift)
+        del staff_shifts[staff_index]
+        del self._staff_starts[shift.staff][staff_index]
+        if not staff_shifts:
+            del self._by_staff[shift.staff]
+            del self._staff_starts[shift.staff]
+
+    def _epoch(self, value: datetime) -> int:
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=self.tz)
+        return int(value.timestamp())
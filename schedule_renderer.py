@@ -0,0 +1,289 @@
+"""
+排班表渲染模組 - 將一週排班 (shifts.Shift) 轉換為 LINE Flex Message，並快取渲染結果
+"""
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple, Union
+from zoneinfo import ZoneInfo
+from structured_log import get_logger
+from shifts import Shift
+from time_model import DEFAULT_TIMEZONE
+
+logger = get_logger("schedule_renderer")
+
+# LINE Flex Message 限制
+MAX_BUBBLE_BYTES = 30 * 1024  # 單一 bubble 的 JSON 上限為 30KB
+MAX_CAROUSEL_BUBBLES = 12  # carousel 最多 12 個 bubble
+MAX_CAROUSEL_BYTES = 50 * 1024  # carousel 的 JSON 上限為 50KB
+
+# 快取保留的渲染結果數量
+RENDER_CACHE_SIZE = 32
+
+
+class WeeklyScheduleRenderer:
+    """
+    一週排班表渲染器 - 以事件集合的版本為鍵快取渲染後的 Flex Message
+    """
+    def __init__(self, title: str = "未來一週排班表", max_bubble_bytes: int = MAX_BUBBLE_BYTES,
+                 cache_size: int = RENDER_CACHE_SIZE, timezone: str = DEFAULT_TIMEZONE):
+        self.title = title
+        # 傳入未解析的日曆事件時使用的時區
+        self.tz = ZoneInfo(timezone)
+        self.max_bubble_bytes = max_bubble_bytes
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def events_version(shifts: List[Shift], etag: Optional[str] = None) -> str:
+        """
+        計算排班集合的版本
+
+        Args:
+            shifts: 排班列表
+            etag: 事件列表回應的 ETag (若有則直接使用)
+
+        Returns:
+            版本字串，排班內容有任何變更時版本即不同
+        """
+        if etag:
+            return etag
+        parts = []
+        for shift in shifts:
+            parts.append("%s:%s:%s:%s" % (shift.id, shift.etag or '', shift.start, shift.staff))
+        return hashlib.md5("|".join(parts).encode()).hexdigest()
+
+    def render(self, events: List[Union[Shift, Dict[str, Any]]], etag: Optional[str] = None) -> Optional[Any]:
+        """
+        渲染一週排班表
+
+        Args:
+            events: 排班列表 (也接受未解析的 Google Calendar 事件)
+            etag: 事件列表回應的 ETag
+
+        Returns:
+            Flex Message，若沒有可顯示的排班則為 None
+        """
+        events = self._shifts(events)
+        version = self.events_version(events, etag)
+        cached = self._cache.get(version)
+        if cached is not None:
+            self._cache.move_to_end(version)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        contents = self.build_contents(events)
+        message = None
+        if contents is not None:
+            # line-bot-sdk 匯入時一併載入所有訊息模型，第一次渲染時才匯入
+            from linebot.models import FlexSendMessage
+            message = FlexSendMessage(alt_text=self.title, contents=contents)
+
+        self._cache[version] = message
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return message
+
+    def build_contents(self, events: List[Union[Shift, Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        建立 Flex Message 內容，超過 bubble 大小上限時自動拆分為 carousel
+
+        Args:
+            events: 排班列表 (也接受未解析的 Google Calendar 事件)
+
+        Returns:
+            bubble 或 carousel 字典，若沒有可顯示的排班則為 None
+        """
+        events_by_date = self._group_by_date(self._shifts(events))
+        if not events_by_date:
+            return None
+
+        # 每一天的排班為一個區塊，區塊為拆分的最小單位
+        sections = []
+        for date_str in sorted(events_by_date.keys()):
+            rows = [self._event_row(item) for item in sorted(events_by_date[date_str], key=lambda x: x['time'])]
+            sections.extend(self._split_section(date_str, rows))
+
+        bubbles = []
+        current = []
+        for section in sections:
+            if current and self._size(self._bubble(current + [section])) > self.max_bubble_bytes:
+                bubbles.append(self._bubble(current))
+                current = []
+            current.append(section)
+        if current:
+            bubbles.append(self._bubble(current))
+
+        if len(bubbles) == 1:
+            return bubbles[0]
+
+        if len(bubbles) > MAX_CAROUSEL_BUBBLES:
+            logger.warning("排班表超過 %d 個 bubble，僅顯示前 %d 個", MAX_CAROUSEL_BUBBLES, MAX_CAROUSEL_BUBBLES)
+            bubbles = bubbles[:MAX_CAROUSEL_BUBBLES]
+        carousel = {"type": "carousel", "contents": bubbles}
+        while len(carousel["contents"]) > 1 and self._size(carousel) > MAX_CAROUSEL_BYTES:
+            carousel["contents"].pop()
+        return carousel
+
+    def clear(self):
+        """
+        清空渲染快取
+        """
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _shifts(self, events: List[Union[Shift, Dict[str, Any]]]) -> List[Shift]:
+        """
+        未解析的日曆事件以渲染器的時區解析為排班
+        """
+        shifts = [event if isinstance(event, Shift) else Shift.from_event(event, self.tz) for event in events]
+        return [shift for shift in shifts if shift is not None]
+
+    def _group_by_date(self, shifts: List[Shift]) -> Dict[str, List[Dict[str, str]]]:
+        """
+        按日期分組排班，日期與時間取自當地時間的時段 key
+        """
+        events_by_date = {}
+        for shift in shifts:
+            day, start = shift.slot.split(" ")
+            date_str = f"{day[:4]}/{day[4:6]}/{day[6:]}"
+            events_by_date.setdefault(date_str, []).append({
+                'time': start,
+                'user': shift.staff or '未知班表'
+            })
+        return events_by_date
+
+    def _split_section(self, date_str: str, rows: List[Dict[str, Any]]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        將單日區塊拆分為不超過 bubble 大小上限的多個區塊
+        """
+        sections = []
+        current = []
+        for row in rows:
+            if current and self._size(self._bubble([(date_str, current + [row])])) > self.max_bubble_bytes:
+                sections.append((date_str, current))
+                current = []
+            current.append(row)
+        sections.append((date_str, current))
+        return sections
+
+    def _bubble(self, sections: List[Tuple[str, List[Dict[str, Any]]]]) -> Dict[str, Any]:
+        """
+        以多個單日區塊組成一個 bubble
+        """
+        flex_contents = [{
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": self.title,
+                    "weight": "bold",
+                    "size": "xl",
+                    "color": "#1DB446",
+                    "align": "center"
+                },
+                {
+                    "type": "separator",
+                    "margin": "md"
+                }
+            ]
+        }]
+
+        for date_str, rows in sections:
+            # 日期標題
+            flex_contents.append({
+                "type": "box",
+                "layout": "vertical",
+                "margin": "md",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": date_str,
+                        "weight": "bold",
+                        "size": "lg",
+                        "color": "#555555"
+                    }
+                ]
+            })
+            # 表頭
+            flex_contents.append({
+                "type": "box",
+                "layout": "horizontal",
+                "margin": "sm",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": "時間",
+                        "size": "sm",
+                        "color": "#aaaaaa",
+                        "flex": 2
+                    },
+                    {
+                        "type": "text",
+                        "text": "人員",
+                        "size": "sm",
+                        "color": "#aaaaaa",
+                        "flex": 5
+                    }
+                ]
+            })
+            flex_contents.extend(rows)
+            # 分隔線
+            flex_contents.append({
+                "type": "separator",
+                "margin": "md"
+            })
+
+        return {
+            "type": "bubble",
+            "body": {
+                "type": "box",
+                "layout": "vertical",
+                "contents": flex_contents
+            },
+            "styles": {
+                "footer": {
+                    "separator": True
+                }
+            }
+        }
+
+    @staticmethod
+    def _event_row(item: Dict[str, str]) -> Dict[str, Any]:
+        """
+        建立單一排班項目列
+        """
+        return {
+            "type": "box",
+            "layout": "horizontal",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": item['time'],
+                    "size": "sm",
+                    "color": "#555555",
+                    "flex": 2
+                },
+                {
+                    "type": "text",
+                    "text": item['user'],
+                    "size": "sm",
+                    "color": "#555555",
+                    "flex": 5,
+                    "wrap": True
+                }
+            ]
+        }
+
+    @staticmethod
+    def _size(contents: Dict[str, Any]) -> int:
+        """
+        計算 Flex 內容序列化後的位元組數
+        """
+        return len(json.dumps(contents, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
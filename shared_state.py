@@ -0,0 +1,277 @@
+"""
+共享狀態模組 - 換班請求、去重記錄與店家查詢快取的儲存後端
+
+預設 (memory) 存放在行程內，只適用單一 worker；設置 SHARED_STATE_BACKEND=sqlite 時存放在 WAL 模式的 SQLite 檔案，
+同一台機器上的多個 worker 行程 (例如 gunicorn -k uvicorn.workers.UvicornWorker -w N) 共用同一份狀態
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import List, Optional, Any, Iterator, Tuple
+
+# 共享狀態後端: memory (預設，單一 worker) 或 sqlite (多個 worker 共用)
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "./shared_state.db")
+
+# 資料庫被其他行程鎖定時的等待時間（秒）
+SQLITE_BUSY_TIMEOUT = 5.0
+# 清除過期記錄的最短間隔（秒），記錄是否過期仍以時間戳記判斷，不受清除時機影響
+PURGE_INTERVAL = 60
+
+
+def is_shared() -> bool:
+    """
+    是否使用多個 worker 共用的後端
+    """
+    return SHARED_STATE_BACKEND == "sqlite"
+
+
+class MemoryStore(dict):
+    """
+    行程內的記錄 - 與 dict 相同，另外提供原子的去重記錄
+    """
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+
+    def claim(self, key: str, window: float, now: Optional[float] = None) -> bool:
+        """
+        記錄 key 並以目前時間作為值；window 秒內已記錄過時不更新
+
+        Returns:
+            是否為第一次記錄 (False 表示重複)
+        """
+        now = now or time.time()
+        with self._lock:
+            last = dict.get(self, key)
+            if last is not None and now - last < window:
+                return False
+            self[key] = now
+            return True
+
+    def purge(self, expiry: float, now: Optional[float] = None, force: bool = False) -> int:
+        """
+        清除超過 expiry 秒的記錄 (值為時間戳記)，距離上次清除未滿 PURGE_INTERVAL 時略過
+
+        Returns:
+            清除的記錄數
+        """
+        now = now or time.time()
+        if not force and now - self._purged_at < PURGE_INTERVAL:
+            return 0
+        with self._lock:
+            self._purged_at = now
+            expired = [key for key, value in self.items() if now - value > expiry]
+            for key in expired:
+                del self[key]
+        return len(expired)
+
+    def release(self, key: str):
+        """
+        取消 claim 的記錄，處理失敗時讓同一個 key 可以再次記錄
+        """
+        with self._lock:
+            dict.pop(self, key, None)
+
+
+class SQLiteDatabase:
+    """
+    SQLite 共享資料庫 - 每個行程的每個執行緒各自連線，WAL 模式讓讀取不會被寫入阻擋
+    """
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # fork 後不可沿用父行程的連線
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS shared_state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS shared_state_updated ON shared_state (namespace, updated_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteStore(MutableMapping):
+    """
+    SQLite 記錄 - 與 MemoryStore 介面相同，值以 JSON 儲存，多個行程可同時讀寫
+    """
+    def __init__(self, database: SQLiteDatabase, namespace: str):
+        self.database = database
+        self.namespace = namespace
+        self._purged_at = 0.0
+
+    def __getitem__(self, key: str) -> Any:
+        row = self.database.connection().execute(
+            "SELECT value FROM shared_state WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key: str, value: Any):
+        self.database.connection().execute(
+            "INSERT OR REPLACE INTO shared_state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value, ensure_ascii=False), time.time())
+        )
+
+    def __delitem__(self, key: str):
+        cursor = self.database.connection().execute(
+            "DELETE FROM shared_state WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return self.database.connection().execute(
+            "SELECT 1 FROM shared_state WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.database.connection().execute(
+            "SELECT key FROM shared_state WHERE namespace = ?", (self.namespace,)
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self.database.connection().execute(
+            "SELECT COUNT(*) FROM shared_state WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        rows = self.database.connection().execute(
+            "SELECT key, value FROM shared_state WHERE namespace = ?", (self.namespace,)
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def clear(self):
+        self.database.connection().execute("DELETE FROM shared_state WHERE namespace = ?", (self.namespace,))
+
+    def claim(self, key: str, window: float, now: Optional[float] = None) -> bool:
+        """
+        與 MemoryStore.claim 相同，以單一 upsert 完成，多個行程同時記錄時只有一個成功
+        """
+        now = now or time.time()
+        cursor = self.database.connection().execute('''
+            INSERT INTO shared_state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            WHERE shared_state.updated_at <= ?
+        ''', (self.namespace, key, json.dumps(now), now, now - window))
+        return cursor.rowcount == 1
+
+    def purge(self, expiry: float, now: Optional[float] = None, force: bool = False) -> int:
+        """
+        與 MemoryStore.purge 相同
+        """
+        now = now or time.time()
+        if not force and now - self._purged_at < PURGE_INTERVAL:
+            return 0
+        self._purged_at = now
+        cursor = self.database.connection().execute(
+            "DELETE FROM shared_state WHERE namespace = ? AND updated_at < ?", (self.namespace, now - expiry)
+        )
+        return cursor.rowcount
+
+    def release(self, key: str):
+        """
+        與 MemoryStore.release 相同
+        """
+        self.database.connection().execute(
+            "DELETE FROM shared_state WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+
+
+class SQLiteCache:
+    """
+    SQLite 查詢快取 - 與 tenants.TenantCache 介面相同，寫入後其他 worker 的快取失效也會立即生效；
+    超過容量時淘汰最早寫入的項目
+    """
+    def __init__(self, database: SQLiteDatabase, namespace: str, max_entries: int):
+        self.database = database
+        self.namespace = namespace
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Any:
+        row = self.database.connection().execute(
+            "SELECT value, expires_at FROM shared_state WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.invalidate(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        conn = self.database.connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO shared_state (namespace, key, value, updated_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value, ensure_ascii=False), now, now + ttl if ttl else None)
+        )
+        conn.execute('''
+            DELETE FROM shared_state WHERE namespace = ? AND key IN (
+                SELECT key FROM shared_state WHERE namespace = ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.namespace, self.namespace, self.max_entries))
+
+    def invalidate(self, key: str):
+        self.database.connection().execute(
+            "DELETE FROM shared_state WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+
+    def clear(self):
+        self.database.connection().execute("DELETE FROM shared_state WHERE namespace = ?", (self.namespace,))
+
+    def __len__(self) -> int:
+        return self.database.connection().execute(
+            "SELECT COUNT(*) FROM shared_state WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def database() -> SQLiteDatabase:
+    """
+    取得共用的 SQLite 資料庫
+    """
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = SQLiteDatabase(SHARED_STATE_PATH)
+        return _database
+
+
+def open_store(namespace: str) -> Any:
+    """
+    依設定建立記錄
+
+    Args:
+        namespace: 記錄名稱，例如 shift_requests
+
+    Returns:
+        MemoryStore 或 SQLiteStore
+    """
+    if is_shared():
+        return SQLiteStore(database(), namespace)
+    return MemoryStore()
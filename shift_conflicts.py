@@ -0,0 +1,176 @@
+"""
+排班衝突檢查模組 - 在本地排班索引上檢查重疊、重複排班與人力空檔
+"""
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, NamedTuple, Tuple
+from schedule_index import ScheduleIndex, IndexedShift
+
+# 未指定結束時間時的預設班次長度（分鐘）
+DEFAULT_SHIFT_MINUTES = int(os.getenv("DEFAULT_SHIFT_MINUTES", "60"))
+
+# 需要有人值班的時段，用於人力空檔檢查
+COVERAGE_HOURS = os.getenv("COVERAGE_HOURS", "08:00-22:00")
+
+
+class Conflict(NamedTuple):
+    """
+    排班衝突
+    """
+    kind: str  # overlap: 人員重複排班, slot_taken: 時段已由他人排班
+    staff: str
+    start: int
+    end: int
+    event_id: str
+
+    @property
+    def blocking(self) -> bool:
+        """
+        是否必須阻止寫入
+        """
+        return self.kind == "overlap"
+
+
+class ShiftConflictError(Exception):
+    """
+    寫入時發現排班衝突 (延後寫入的變更在派送時才檢查)，重試也不會成功
+    """
+    status_code = 409
+
+
+def shift_end(start: datetime, end_time_str: Optional[str] = None) -> datetime:
+    """
+    計算班次結束時間
+
+    Args:
+        start: 班次開始時間
+        end_time_str: 結束時間 (HH:MM)，早於開始時間時視為隔天；None 表示使用預設班次長度
+
+    Returns:
+        班次結束時間
+    """
+    if not end_time_str:
+        return start + timedelta(minutes=DEFAULT_SHIFT_MINUTES)
+    hour, minute = map(int, end_time_str.split(':'))
+    end = start.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if end <= start:
+        end += timedelta(days=1)
+    return end
+
+
+class ConflictChecker:
+    """
+    排班衝突檢查器 - 每次檢查只需在排序陣列上二分搜尋
+    """
+    def __init__(self, index: ScheduleIndex):
+        self.index = index
+
+    def overlaps(self, staff: str, start: datetime, end: datetime,
+                 ignore_event_id: Optional[str] = None) -> List[IndexedShift]:
+        """
+        查詢人員在時間範圍內已有的排班
+        """
+        return [
+            shift for shift in self.index.query(start=start, end=end, staff=staff)
+            if shift.event_id != ignore_event_id
+        ]
+
+    def slot_holder(self, start: datetime) -> Optional[IndexedShift]:
+        """
+        查詢在同一開始時間已有的排班
+        """
+        epoch = int(self._aware(start).timestamp())
+        for shift in self.index.query(start=start, end=start + timedelta(seconds=1)):
+            if shift.start == epoch:
+                return shift
+        return None
+
+    def check_add(self, staff: str, start: datetime, end: datetime) -> List[Conflict]:
+        """
+        檢查新增排班，同一時段的既有排班將被取代
+
+        Returns:
+            衝突列表
+        """
+        conflicts = []
+        holder = self.slot_holder(start)
+        ignore_event_id = holder.event_id if holder else None
+        if holder and holder.staff != staff:
+            conflicts.append(Conflict("slot_taken", holder.staff, holder.start, holder.end, holder.event_id))
+        for shift in self.overlaps(staff, start, end, ignore_event_id):
+            conflicts.append(Conflict("overlap", shift.staff, shift.start, shift.end, shift.event_id))
+        return conflicts
+
+    def check_swap(self, to_staff: str, start: datetime, end: Optional[datetime] = None) -> List[Conflict]:
+        """
+        檢查換班，接手的人員不得在同一時間已有其他排班
+
+        Args:
+            to_staff: 接手班次的人員
+            start: 班次開始時間
+            end: 班次結束時間，None 表示使用既有班次的結束時間或預設班次長度
+
+        Returns:
+            衝突列表
+        """
+        holder = self.slot_holder(start)
+        if end is None:
+            end = self.index.local_time(holder.end) if holder else shift_end(start)
+        ignore_event_id = holder.event_id if holder else None
+        return [
+            Conflict("overlap", shift.staff, shift.start, shift.end, shift.event_id)
+            for shift in self.overlaps(to_staff, start, end, ignore_event_id)
+        ]
+
+    def coverage_gaps(self, start: datetime, end: datetime, min_staff: int = 1) -> List[Tuple[int, int]]:
+        """
+        查詢時間範圍內值班人數不足的空檔
+
+        Returns:
+            空檔列表，每項為 (開始 epoch 秒, 結束 epoch 秒)
+        """
+        low = int(self._aware(start).timestamp())
+        high = int(self._aware(end).timestamp())
+        edges = []
+        for shift in self.index.query(start=start, end=end):
+            edges.append((max(shift.start, low), 1))
+            edges.append((min(shift.end, high), -1))
+        edges.sort()
+
+        gaps = []
+        staffed = 0
+        cursor = low
+        for moment, delta in edges:
+            if staffed < min_staff and moment > cursor:
+                gaps.append((cursor, moment))
+            staffed += delta
+            cursor = moment
+        if cursor < high:
+            gaps.append((cursor, high))
+        return self._merge(gaps)
+
+    def daily_coverage_gaps(self, day: datetime, hours: str = COVERAGE_HOURS, min_staff: int = 1) -> List[Tuple[int, int]]:
+        """
+        查詢單日營業時段內的人力空檔
+
+        Args:
+            day: 日期 (當地時間)
+            hours: 營業時段 (HH:MM-HH:MM)
+        """
+        opening, closing = hours.split('-', 1)
+        start = self._aware(day).replace(hour=int(opening[:2]), minute=int(opening[3:5]), second=0, microsecond=0)
+        end = shift_end(start, closing)
+        return self.coverage_gaps(start, end, min_staff)
+
+    def _aware(self, value: datetime) -> datetime:
+        return value if value.tzinfo is not None else value.replace(tzinfo=self.index.tz)
+
+    @staticmethod
+    def _merge(gaps: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        merged = []
+        for gap in gaps:
+            if merged and merged[-1][1] >= gap[0]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], gap[1]))
+            else:
+                merged.append(gap)
+        return merged
@@ -0,0 +1,114 @@
+"""
+排班模型模組 - Google Calendar 事件在 API 邊界解析一次為精簡的 Shift，查詢快取、時段比對、排班索引與排班表共用，
+不再各自重複解析事件的時間字串；快取以列 (list) 保存，可寫入共享狀態的 JSON
+"""
+from datetime import datetime, tzinfo
+from typing import Dict, List, Optional, Any, Iterable
+
+# 時段 key 的格式 (當地時間)
+SLOT_FORMAT = "%Y%m%d %H:%M"
+# 排班事件標題的前綴
+SHIFT_PREFIX = "班表: "
+# 事件沒有結束時間時的預設長度（秒）
+DEFAULT_DURATION = 3600
+
+
+class Shift:
+    """
+    排班 - 日曆事件中用到的欄位，時間為 epoch 秒
+    """
+    __slots__ = ("id", "etag", "start", "end", "staff", "slot", "is_shift")
+
+    def __init__(self, id: str, etag: Optional[str], start: int, end: int, staff: str, slot: str,
+                 is_shift: bool = True):
+        """
+        Args:
+            id: 事件 ID
+            etag: 事件的 ETag
+            start: 開始時間 (epoch 秒)
+            end: 結束時間 (epoch 秒)
+            staff: 排班人員名稱 (非排班事件為事件標題)
+            slot: 時段 key (當地時間的 YYYYMMDD HH:MM)
+            is_shift: 是否為排班事件 (標題以「班表: 」開頭)
+        """
+        self.id = id
+        self.etag = etag
+        self.start = start
+        self.end = end
+        self.staff = staff
+        self.slot = slot
+        self.is_shift = is_shift
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any], tz: tzinfo) -> Optional["Shift"]:
+        """
+        解析日曆事件，已刪除與全天事件回傳 None
+
+        Args:
+            event: Google Calendar 事件
+            tz: 當地時區，未含時差的時間視為當地時間
+        """
+        if event.get('status') == 'cancelled':
+            return None
+        start = event.get('start', {}).get('dateTime')
+        if not start:
+            return None
+        start_time = _parse(start, tz)
+        end = event.get('end', {}).get('dateTime')
+        start_epoch = int(start_time.timestamp())
+        end_epoch = int(_parse(end, tz).timestamp()) if end else start_epoch + DEFAULT_DURATION
+        summary = event.get('summary', '')
+        return cls(
+            event.get('id', ''),
+            event.get('etag'),
+            start_epoch,
+            end_epoch,
+            summary[len(SHIFT_PREFIX):] if summary.startswith(SHIFT_PREFIX) else summary,
+            start_time.astimezone(tz).strftime(SLOT_FORMAT),
+            summary.startswith(SHIFT_PREFIX)
+        )
+
+    def to_row(self) -> List[Any]:
+        """
+        轉換為可寫入 JSON 的列
+        """
+        return [self.id, self.etag, self.start, self.end, self.staff, self.slot, self.is_shift]
+
+    @classmethod
+    def from_row(cls, row: List[Any]) -> "Shift":
+        return cls(*row)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Shift):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+
+    def __repr__(self) -> str:
+        return f"Shift(id={self.id!r}, slot={self.slot!r}, staff={self.staff!r})"
+
+
+def parse_shifts(events: Iterable[Dict[str, Any]], tz: tzinfo) -> List[Shift]:
+    """
+    解析事件列表，略過已刪除與全天事件
+    """
+    shifts = []
+    for event in events:
+        shift = Shift.from_event(event, tz)
+        if shift is not None:
+            shifts.append(shift)
+    return shifts
+
+
+def shifts_to_rows(shifts: Iterable[Shift]) -> List[List[Any]]:
+    return [shift.to_row() for shift in shifts]
+
+
+def shifts_from_rows(rows: Iterable[List[Any]]) -> List[Shift]:
+    return [Shift.from_row(row) for row in rows]
+
+
+def _parse(value: str, tz: tzinfo) -> datetime:
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz)
+    return parsed
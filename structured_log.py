@@ -0,0 +1,173 @@
+"""
+結構化日誌模組 - 以佇列將 JSON 日誌交由背景執行緒輸出，請求路徑上不會因寫入 stdout 而阻塞
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional, Any
+
+# DEBUG_MODE 為 1/true 時輸出 DEBUG 等級日誌，LOG_LEVEL 可直接指定等級
+DEBUG_MODE = os.getenv("DEBUG_MODE", "0").lower() in ("1", "true", "yes")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if DEBUG_MODE else "INFO").upper()
+# DEBUG 日誌的取樣比例 (0-1)，避免大量請求時洗版
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1" if DEBUG_MODE else "0.1"))
+# 日誌佇列容量，佇列已滿時丟棄日誌而不等待
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# 應用程式日誌的根名稱
+ROOT_LOGGER = "lineswift"
+
+# 目前請求的關聯 ID (LINE webhookEventId 或 X-Line-Request-ID)
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+# LogRecord 的內建屬性，其餘屬性視為結構化欄位
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    JSON 格式化器 - 每筆日誌輸出為一行 JSON
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "correlation_id", None)
+        if request_id:
+            entry["correlation_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and key not in entry and key != "correlation_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    取樣過濾器 - 只保留部分 DEBUG 日誌，INFO 以上全部保留
+    """
+    def __init__(self, rate: float = LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    非阻塞佇列處理器 - 佇列已滿時丟棄日誌並計數
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在呼叫端執行緒先取得關聯 ID 並展開訊息，背景執行緒無法讀取請求的 contextvars
+        record = copy.copy(record)
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = correlation_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, sample_rate: float = LOG_DEBUG_SAMPLE_RATE,
+                  stream: Any = None) -> logging.Logger:
+    """
+    設定應用程式日誌，重複呼叫時只會設定一次
+
+    Args:
+        level: 日誌等級
+        sample_rate: DEBUG 日誌的取樣比例
+        stream: 輸出目標，預設為 stdout
+
+    Returns:
+        應用程式的根日誌記錄器
+    """
+    global _listener
+    logger = logging.getLogger(ROOT_LOGGER)
+    if _listener is not None:
+        return logger
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return logger
+
+
+def shutdown_logging():
+    """
+    停止背景輸出執行緒，輸出佇列中剩餘的日誌
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """
+    取得應用程式日誌記錄器
+
+    Args:
+        name: 模組名稱，例如 "calendar_watch"
+    """
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}" if name else ROOT_LOGGER)
+
+
+@contextmanager
+def bind_correlation_id(value: Optional[str]):
+    """
+    在區塊內設定關聯 ID，value 為空時沿用目前的關聯 ID
+
+    Example:
+        with bind_correlation_id(event.webhook_event_id):
+            handle_text_command(event)
+    """
+    token = correlation_id.set(value or correlation_id.get())
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
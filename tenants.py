@@ -0,0 +1,324 @@
+"""
+多店家模組 - 依 LINE 群組/聊天室將請求路由到各店家的日曆、人員名單與資源
+"""
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable
+from metrics import registry, error_status
+from tracing import start_span, KIND_CLIENT
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from time_model import TimeModel, DEFAULT_TIMEZONE
+import shared_state
+
+# 多店家設定 (JSON 字串或 JSON 檔案路徑)，未設置時只有預設店家
+TENANTS_CONFIG = os.getenv("TENANTS_CONFIG", "")
+# 每個店家的 Google Calendar 請求預算
+TENANT_RATE_LIMIT = float(os.getenv("TENANT_RATE_LIMIT", "5"))  # 每秒請求數
+TENANT_RATE_BURST = int(os.getenv("TENANT_RATE_BURST", "10"))
+TENANT_RATE_TIMEOUT = float(os.getenv("TENANT_RATE_TIMEOUT", "5"))  # 等待預算的最長秒數
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "256"))
+
+# Google Calendar 請求的監控指標
+CALENDAR_LATENCY = registry.histogram(
+    "calendar_request_seconds", "Google Calendar API 請求延遲（秒）", ("tenant", "method"))
+CALENDAR_ERRORS = registry.counter(
+    "calendar_request_errors_total", "Google Calendar API 請求錯誤次數", ("tenant", "method", "status"))
+
+
+class RateLimitExceeded(Exception):
+    """
+    店家的請求預算已用盡
+    """
+
+
+class UnknownTenantError(Exception):
+    """
+    找不到指定的店家 (例如設定中已移除)，不應改用預設店家處理
+    """
+    status_code = 404
+
+
+class RateBudget:
+    """
+    請求預算 - 以權杖桶限制單一店家的 API 請求速率
+    """
+    def __init__(self, rate: float = TENANT_RATE_LIMIT, burst: int = TENANT_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, cost: float = 1) -> float:
+        """
+        嘗試取得預算
+
+        Returns:
+            0 表示取得成功，否則為需要等待的秒數
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0
+            return (cost - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, cost: float = 1, timeout: float = TENANT_RATE_TIMEOUT):
+        """
+        取得預算，超過等待時間則拋出 RateLimitExceeded
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(cost)
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                self.rejected += 1
+                raise RateLimitExceeded("Google Calendar 請求已達此店家的速率上限")
+            time.sleep(wait)
+
+
+class TenantCache:
+    """
+    店家快取分區 - 有容量上限與存活時間的 LRU 快取，店家之間互不影響
+    """
+    def __init__(self, max_entries: int = TENANT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def request_method(request: Any) -> str:
+    """
+    取得 Google Calendar 請求的方法名稱
+
+    Returns:
+        例如 events.list、events.insert，無法判斷時為 unknown
+    """
+    method_id = getattr(request, 'methodId', None)
+    if not isinstance(method_id, str):
+        return "unknown"
+    return method_id.split('.', 1)[1] if method_id.startswith('calendar.') else method_id
+
+
+class Tenant:
+    """
+    店家 - 擁有獨立的日曆、人員名單、API 客戶端、快取分區與請求預算
+    """
+    def __init__(self, tenant_id: str, calendar_id: str, roster: Dict[str, str],
+                 service_factory: Callable[[], Any], name: Optional[str] = None,
+                 sources: Optional[List[str]] = None, rate_limit: float = TENANT_RATE_LIMIT,
+                 rate_burst: int = TENANT_RATE_BURST, cache_size: int = TENANT_CACHE_SIZE,
+                 timezone: str = DEFAULT_TIMEZONE):
+        self.tenant_id = tenant_id
+        self.name = name or tenant_id
+        self.calendar_id = calendar_id
+        self.roster = roster
+        self.sources = list(sources or [])
+        # 店家時區的時間模型，日曆查詢範圍與時段比對皆以當地時間計算
+        self.time = TimeModel(timezone)
+        self.service_factory = service_factory
+        self.rate_budget = RateBudget(rate_limit, rate_burst)
+        # Google Calendar 異常時暫停此店家的請求，不再等待逾時
+        self.breaker = CircuitBreaker(f"calendar:{tenant_id}")
+        # 多個 worker 共用狀態時，查詢快取也放在共享後端，寫入後的快取失效對所有 worker 生效
+        if shared_state.is_shared():
+            self.cache = shared_state.SQLiteCache(shared_state.database(), f"cache:{tenant_id}", cache_size)
+        else:
+            self.cache = TenantCache(cache_size)
+        # 每個執行緒各自持有一個客戶端，避免共用非執行緒安全的 http 物件
+        self._clients = threading.local()
+        # LINE ID 對應人員名稱的反向索引，第一次使用時建立
+        self._directory = None
+
+    def get_service(self) -> Any:
+        """
+        取得此店家的 Google Calendar 客戶端，建立後重複使用
+        """
+        service = getattr(self._clients, 'service', None)
+        if service is None:
+            service = self.service_factory()
+            if service is not None:
+                self._clients.service = service
+        return service
+
+    def execute(self, request: Any) -> Any:
+        """
+        在店家的請求預算內執行 Google Calendar 請求，並記錄延遲與錯誤
+
+        Raises:
+            RateLimitExceeded: 請求預算已用盡
+            CircuitOpenError: 斷路器暫停呼叫中
+        """
+        method = request_method(request)
+        with start_span(f"calendar {method}", KIND_CLIENT, {"tenant": self.tenant_id}):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                CALENDAR_ERRORS.inc(tenant=self.tenant_id, method=method, status="circuit_open")
+                raise
+            try:
+                self.rate_budget.acquire()
+            except RateLimitExceeded:
+                # 本地的預算限制不代表日曆異常
+                self.breaker.release()
+                CALENDAR_ERRORS.inc(tenant=self.tenant_id, method=method, status="rate_limited")
+                raise
+            started = time.perf_counter()
+            try:
+                result = request.execute()
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                self.breaker.record_error(e)
+                CALENDAR_ERRORS.inc(tenant=self.tenant_id, method=method, status=error_status(e))
+                raise
+            finally:
+                CALENDAR_LATENCY.observe(time.perf_counter() - started, tenant=self.tenant_id, method=method)
+
+    def user_name(self, user_id: str) -> Optional[str]:
+        """
+        通過 LINE ID 獲取人員名稱
+        """
+        return self.directory().get(user_id)
+
+    def directory(self) -> Dict[str, str]:
+        """
+        取得 LINE ID 對應人員名稱的索引 (同一 ID 對應多個名稱時取名單中的第一個)
+        """
+        if self._directory is None:
+            self._directory = {roster_id: name for name, roster_id in reversed(list(self.roster.items()))}
+        return self._directory
+
+    def is_member(self, user_id: str) -> bool:
+        """
+        檢查用戶是否在此店家的人員名單中
+        """
+        return user_id in self.roster.values()
+
+
+class TenantRegistry:
+    """
+    店家註冊表 - 將 LINE 群組/聊天室 ID 對應到店家
+    """
+    def __init__(self, default: Tenant):
+        self.default = default
+        self._tenants = {default.tenant_id: default}
+        self._by_source = {}
+        for source_id in default.sources:
+            self._by_source[source_id] = default
+
+    def register(self, tenant: Tenant) -> Tenant:
+        """
+        註冊店家
+        """
+        self._tenants[tenant.tenant_id] = tenant
+        for source_id in tenant.sources:
+            self._by_source[source_id] = tenant
+        return tenant
+
+    def find(self, tenant_id: Optional[str]) -> Optional[Tenant]:
+        """
+        通過店家 ID 取得店家，找不到時回傳 None；用於權杖、outbox 等已記錄店家的請求
+        """
+        return self._tenants.get(tenant_id) if tenant_id else None
+
+    def resolve(self, source: Any) -> Tenant:
+        """
+        依 LINE 事件來源 (群組、聊天室或用戶) 取得店家
+
+        Args:
+            source: LINE 事件的 source 物件
+
+        Returns:
+            對應的店家，私聊時依用戶所屬店家判斷，否則為預設店家
+        """
+        for attr in ('group_id', 'room_id'):
+            source_id = getattr(source, attr, None)
+            if isinstance(source_id, str) and source_id in self._by_source:
+                return self._by_source[source_id]
+
+        user_id = getattr(source, 'user_id', None)
+        if isinstance(user_id, str) and user_id:
+            if self.default.is_member(user_id):
+                return self.default
+            for tenant in self._tenants.values():
+                if tenant.is_member(user_id):
+                    return tenant
+        return self.default
+
+    def all(self) -> List[Tenant]:
+        return list(self._tenants.values())
+
+    def load_config(self, config: Any, service_factory: Callable[[], Any]) -> List[Tenant]:
+        """
+        從設定載入店家
+
+        Args:
+            config: 設定字典，或 JSON 字串，或 JSON 檔案路徑
+            service_factory: Google Calendar 客戶端建立函數，每個店家各自建立客戶端
+
+        Returns:
+            載入的店家列表
+        """
+        if isinstance(config, str):
+            if not config:
+                return []
+            if os.path.exists(config):
+                with open(config, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+            else:
+                config = json.loads(config)
+
+        loaded = []
+        for item in config.get('tenants', []):
+            tenant = Tenant(
+                tenant_id=item['id'],
+                calendar_id=item['calendar_id'],
+                roster=item.get('roster', {}),
+                service_factory=service_factory,
+                name=item.get('name'),
+                sources=item.get('sources', []),
+                rate_limit=float(item.get('rate_limit', TENANT_RATE_LIMIT)),
+                rate_burst=int(item.get('rate_burst', TENANT_RATE_BURST)),
+                cache_size=int(item.get('cache_size', TENANT_CACHE_SIZE)),
+                timezone=item.get('timezone', DEFAULT_TIMEZONE)
+            )
+            loaded.append(self.register(tenant))
+        return loaded
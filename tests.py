@@ -2,13 +2,55 @@
 測試模組 - 用於測試 LINE Bot 與 Google Calendar 整合
 """
 import os
+import time
+import queue
+import tempfile
+import logging
 import unittest
 import json
+import io
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from urllib.parse import parse_qs
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
+from linebot.models import TextSendMessage
 from main import app
 from src.user_manager import UserManager
 from src.calendar_manager import CalendarManager
+from schedule_renderer import WeeklyScheduleRenderer
+from calendar_watch import EventMirror, WatchChannelManager, RecordingNotifier, CalendarNotificationService
+from tenants import Tenant, TenantRegistry, RateBudget, RateLimitExceeded
+from schedule_index import ScheduleIndex, parse_band
+from shift_conflicts import ConflictChecker, shift_end
+from metrics import MetricsRegistry, instrument
+import structured_log
+from structured_log import JsonFormatter, SamplingFilter, NonBlockingQueueHandler, bind_correlation_id
+from health import HealthMonitor
+from tracing import Tracer, SimpleSpanProcessor, InMemoryExporter, JsonlFileExporter, STATUS_ERROR
+import fake_calendar
+import calendar_client
+from shared_state import MemoryStore, SQLiteDatabase, SQLiteStore, SQLiteCache
+from approval_tokens import ApprovalSigner, InvalidApprovalToken
+from reply_manager import ReplyManager, CommandEstimator, REPLY_PATHS
+from line_client import LazyClient
+from reminders import TimerWheel, ShiftReminderScheduler
+from write_coalescer import CalendarWriteBuffer, SlotMutation, merge_mutations
+from outbox import CalendarOutbox, OutboxDispatcher, backoff
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN, is_service_failure
+from time_model import TimeModel
+from calendar_fields import FIELD_MASKS
+import shifts
+from shifts import Shift, shifts_to_rows, shifts_from_rows
+from schedule_index import IndexedShift
+from fake_calendar import FakeCalendarService
+from benchmarks.webhook_payloads import WebhookPayloadGenerator
+from benchmarks.load_test import find_regressions, percentile
+from benchmarks import micro
+from benchmarks.import_time import measure_import, DEFERRED_MODULES
+from benchmarks.calendar_transport import start_fake_calendar, seed_calendar, api_endpoint, CALENDAR_ID
+import http_transport
+from http_transport import PooledHttp
 
 # 測試客戶端
 client = TestClient(app)
@@ -135,40 +177,21 @@ class TestLineBot(unittest.TestCase):
         """
         測試按鈕回調處理
         """
-        from src.line_bot import handle_postback, shift_requests
+        from src.line_bot import handle_postback, approval_signer
         
         # 設置模擬對象
         mock_user_manager.get_user_name.side_effect = lambda user_id: "用戶A" if user_id == "user_a" else "用戶B"
         mock_calendar_manager.swap_shifts.return_value = True
         
-        # 模擬請求數據
-        request_id = "user_a_user_b_20250530_早上_08:00"
-        shift_requests[request_id] = {
-            "requester_id": "user_a",
-            "target_id": "user_b",
-            "date": "20250530",
-            "time_period": "早上",
-            "time": "08:00",
-            "requester_shift": {
-                "id": "event_a",
-                "summary": "用戶A排班",
-                "description": "測試描述A"
-            },
-            "target_shift": {
-                "id": "event_b",
-                "summary": "用戶B排班",
-                "description": "測試描述B"
-            }
-        }
-        
         # 模擬回調事件 - 同意換班
         event_approve = MagicMock()
         event_approve.source.user_id = "user_b"
-        event_approve.postback.data = f"action=approve&request_id={request_id}"
+        event_approve.postback.data = f"action=approve&token={approval_signer.issue('', 'user_a', 'user_b', '20250530', '早上 08:00')}"
         event_approve.reply_token = "reply_approve"
         
         # 調用函數 - 同意換班
-        handle_postback(event_approve)
+        with patch("src.line_bot.used_approval_tokens", MemoryStore()):
+            handle_postback(event_approve)
         
         # 驗證日曆更新被調用
         mock_calendar_manager.swap_shifts.assert_called_once_with(
@@ -183,33 +206,15 @@ class TestLineBot(unittest.TestCase):
         mock_line_bot_api.reset_mock()
         mock_calendar_manager.reset_mock()
         
-        # 重新添加請求
-        shift_requests[request_id] = {
-            "requester_id": "user_a",
-            "target_id": "user_b",
-            "date": "20250530",
-            "time_period": "早上",
-            "time": "08:00",
-            "requester_shift": {
-                "id": "event_a",
-                "summary": "用戶A排班",
-                "description": "測試描述A"
-            },
-            "target_shift": {
-                "id": "event_b",
-                "summary": "用戶B排班",
-                "description": "測試描述B"
-            }
-        }
-        
         # 模擬回調事件 - 拒絕換班
         event_reject = MagicMock()
         event_reject.source.user_id = "user_b"
-        event_reject.postback.data = f"action=reject&request_id={request_id}"
+        event_reject.postback.data = f"action=reject&token={approval_signer.issue('', 'user_a', 'user_b', '20250530', '早上 08:00')}"
         event_reject.reply_token = "reply_reject"
         
         # 調用函數 - 拒絕換班
-        handle_postback(event_reject)
+        with patch("src.line_bot.used_approval_tokens", MemoryStore()):
+            handle_postback(event_reject)
         
         # 驗證日曆更新未被調用
         mock_calendar_manager.swap_shifts.assert_not_called()
@@ -385,5 +390,2538 @@ class TestUserManager(unittest.TestCase):
         # 驗證結果
         self.assertEqual(user_id, "user_d")
 
+class TestWeeklyScheduleRenderer(unittest.TestCase):
+    """
+    一週排班表渲染器測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        self.events = [
+            {
+                "id": "event_b",
+                "etag": "\"2\"",
+                "summary": "班表: 用戶B",
+                "start": {"dateTime": "2025-05-30T12:00:00Z"}
+            },
+            {
+                "id": "event_a",
+                "etag": "\"1\"",
+                "summary": "班表: 用戶A",
+                "start": {"dateTime": "2025-05-30T08:00:00Z"}
+            },
+            {
+                "id": "event_c",
+                "etag": "\"3\"",
+                "summary": "班表: 用戶C",
+                "start": {"dateTime": "2025-05-31T08:00:00Z"}
+            }
+        ]
+    
+    def test_render_groups_and_sorts(self):
+        """
+        測試按日期分組並依時間排序
+        """
+        renderer = WeeklyScheduleRenderer()
+        contents = renderer.build_contents(self.events)
+        
+        # 驗證結果
+        self.assertEqual(contents["type"], "bubble")
+        texts = json.dumps(contents, ensure_ascii=False)
+        self.assertLess(texts.index("2025/05/30"), texts.index("2025/05/31"))
+        self.assertLess(texts.index("用戶A"), texts.index("用戶B"))
+    
+    def test_render_uses_cache(self):
+        """
+        測試相同事件集合直接取用快取
+        """
+        renderer = WeeklyScheduleRenderer()
+        first = renderer.render(self.events)
+        second = renderer.render(list(self.events))
+        
+        # 驗證結果
+        self.assertIs(first, second)
+        self.assertEqual(renderer.hits, 1)
+        self.assertEqual(renderer.misses, 1)
+        
+        # 事件變更後重新渲染
+        changed = [dict(self.events[0], etag="\"9\"", summary="班表: 用戶D")] + self.events[1:]
+        third = renderer.render(changed)
+        self.assertIsNot(first, third)
+        self.assertEqual(renderer.misses, 2)
+    
+    def test_render_splits_into_carousel(self):
+        """
+        測試超過 bubble 大小上限時拆分為 carousel
+        """
+        renderer = WeeklyScheduleRenderer(max_bubble_bytes=1200)
+        contents = renderer.build_contents(self.events)
+        
+        # 驗證結果
+        self.assertEqual(contents["type"], "carousel")
+        self.assertGreater(len(contents["contents"]), 1)
+        for bubble in contents["contents"]:
+            self.assertEqual(bubble["type"], "bubble")
+    
+    def test_render_without_timed_events(self):
+        """
+        測試沒有可顯示的排班時回傳 None
+        """
+        renderer = WeeklyScheduleRenderer()
+        self.assertIsNone(renderer.render([{"id": "all_day", "start": {"date": "2025-05-30"}}]))
+
+class TestCalendarWatch(unittest.TestCase):
+    """
+    日曆推播通知測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        # 模擬 Google Calendar 服務
+        self.mock_service = MagicMock()
+        self.mock_events = MagicMock()
+        self.mock_service.events.return_value = self.mock_events
+        self.mock_events.watch.return_value.execute.return_value = {
+            "id": "channel123",
+            "resourceId": "resource123",
+            "expiration": str(int((time.time() + 3 * 86400) * 1000))
+        }
+        self.mock_events.list.return_value.execute.return_value = {
+            "items": [
+                {
+                    "id": "event_a",
+                    "etag": "\"1\"",
+                    "summary": "班表: 用戶A",
+                    "start": {"dateTime": "2025-05-30T08:00:00+08:00"},
+                    "end": {"dateTime": "2025-05-30T09:00:00+08:00"}
+                }
+            ],
+            "nextSyncToken": "sync1"
+        }
+        
+        self.mirror = EventMirror(lambda: self.mock_service, "calendar123")
+        self.channels = WatchChannelManager(lambda: self.mock_service, "calendar123", "https://example.com/calendar/notifications", token="secret")
+        self.notifier = RecordingNotifier()
+        self.service = CalendarNotificationService(
+            self.mirror,
+            self.channels,
+            self.notifier,
+            resolve_user=lambda name: {"用戶A": "user_a", "用戶B": "user_b"}.get(name)
+        )
+        self.channels.start()
+        self.mirror.full_sync()
+    
+    def headers(self, state="exists", token="secret"):
+        return {
+            "x-goog-channel-id": "channel123",
+            "x-goog-channel-token": token,
+            "x-goog-resource-state": state
+        }
+    
+    def test_notification_refreshes_mirror_and_notifies_staff(self):
+        """
+        測試外部修改排班後刷新鏡像並通知受影響人員
+        """
+        self.mock_events.list.return_value.execute.return_value = {
+            "items": [
+                {
+                    "id": "event_a",
+                    "etag": "\"2\"",
+                    "summary": "班表: 用戶B",
+                    "start": {"dateTime": "2025-05-30T08:00:00+08:00"},
+                    "end": {"dateTime": "2025-05-30T09:00:00+08:00"}
+                }
+            ],
+            "nextSyncToken": "sync2"
+        }
+        
+        result = self.service.handle(self.headers())
+        
+        # 驗證結果
+        self.assertEqual(result, {"status": "updated", "changes": 1})
+        self.assertEqual(self.mirror.sync_token, "sync2")
+        self.mock_events.list.assert_called_with(calendarId="calendar123", singleEvents=True, syncToken="sync1",
+                                                 fields=FIELD_MASKS["mirror_sync"])
+        self.assertEqual(sorted(user_id for user_id, _ in self.notifier.messages), ["user_a", "user_b"])
+        self.assertIn("由 用戶A 改為 用戶B", self.notifier.messages[0][1])
+        
+        # 驗證讀取直接由鏡像提供
+        self.assertTrue(self.service.is_live)
+        events = self.mirror.list_events("2025-05-30T00:00:00+08:00", "2025-05-31T00:00:00+08:00")
+        self.assertEqual([e["summary"] for e in events], ["班表: 用戶B"])
+    
+    def test_cancelled_event_is_removed(self):
+        """
+        測試取消的事件從鏡像移除
+        """
+        self.mock_events.list.return_value.execute.return_value = {
+            "items": [{"id": "event_a", "status": "cancelled"}],
+            "nextSyncToken": "sync2"
+        }
+        
+        self.service.handle(self.headers())
+        
+        # 驗證結果
+        self.assertNotIn("event_a", self.mirror.events)
+        self.assertEqual(self.notifier.messages[0][0], "user_a")
+        self.assertIn("排班已取消", self.notifier.messages[0][1])
+    
+    def test_unknown_channel_is_ignored(self):
+        """
+        測試忽略權杖不符的通知
+        """
+        result = self.service.handle(self.headers(token="wrong"))
+        
+        # 驗證結果
+        self.assertEqual(result, {"status": "ignored"})
+        self.assertEqual(self.notifier.messages, [])
+    
+    def test_channel_renewal(self):
+        """
+        測試通道到期前續訂並停止舊通道
+        """
+        self.assertFalse(self.channels.renew_if_needed())
+        
+        # 模擬接近到期
+        renewed = self.channels.renew_if_needed(now=self.channels.channel["expiration"] - 60)
+        
+        # 驗證結果
+        self.assertTrue(renewed)
+        self.assertEqual(self.mock_events.watch.call_count, 2)
+        self.mock_service.channels.return_value.stop.assert_called_once()
+
+class TestTenants(unittest.TestCase):
+    """
+    多店家路由測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        self.factory = MagicMock(side_effect=lambda: MagicMock())
+        self.default = Tenant("default", "calendar_default", {"用戶A": "user_a"}, self.factory)
+        self.registry = TenantRegistry(self.default)
+        self.registry.load_config(json.dumps({
+            "tenants": [
+                {
+                    "id": "store_b",
+                    "calendar_id": "calendar_b",
+                    "sources": ["group_b"],
+                    "roster": {"用戶B": "user_b"},
+                    "cache_size": 2
+                }
+            ]
+        }), self.factory)
+    
+    def test_resolve_by_source(self):
+        """
+        測試依群組與用戶取得店家
+        """
+        store_b = self.registry.find("store_b")
+        
+        # 驗證結果
+        self.assertIs(self.registry.resolve(MagicMock(group_id="group_b", user_id="user_a")), store_b)
+        self.assertIs(self.registry.resolve(MagicMock(spec=["user_id"], user_id="user_b")), store_b)
+        self.assertIs(self.registry.resolve(MagicMock(spec=["user_id"], user_id="user_a")), self.default)
+        self.assertIs(self.registry.resolve(MagicMock(group_id="unknown", user_id="unknown")), self.default)
+        self.assertEqual(store_b.user_name("user_b"), "用戶B")
+    
+    def test_cache_partitions_are_isolated(self):
+        """
+        測試店家快取分區互不影響
+        """
+        store_b = self.registry.find("store_b")
+        self.default.cache.set("events:20250530", ["default"])
+        for day in range(10):
+            store_b.cache.set(f"events:202505{day:02d}", [day])
+        
+        # 驗證結果
+        self.assertEqual(len(store_b.cache), 2)
+        self.assertEqual(self.default.cache.get("events:20250530"), ["default"])
+    
+    def test_service_is_reused(self):
+        """
+        測試店家重複使用已建立的客戶端
+        """
+        service = self.default.get_service()
+        
+        # 驗證結果
+        self.assertIs(self.default.get_service(), service)
+        self.assertIsNot(self.registry.find("store_b").get_service(), service)
+        self.assertEqual(self.factory.call_count, 2)
+    
+    def test_find_does_not_fall_back(self):
+        """
+        測試以店家 ID 嚴格查詢時，未知的店家不會改用預設店家
+        """
+        # 驗證結果
+        self.assertEqual(self.registry.find("store_b").tenant_id, "store_b")
+        self.assertIs(self.registry.find(self.default.tenant_id), self.default)
+        self.assertIsNone(self.registry.find("removed_store"))
+        self.assertIsNone(self.registry.find(None))
+    
+    def test_rate_budget(self):
+        """
+        測試請求預算用盡時拒絕請求
+        """
+        budget = RateBudget(rate=1, burst=2)
+        budget.acquire(timeout=0)
+        budget.acquire(timeout=0)
+        
+        # 驗證結果
+        with self.assertRaises(RateLimitExceeded):
+            budget.acquire(timeout=0)
+        self.assertEqual(budget.rejected, 1)
+    
+    def test_calendar_reads_use_tenant_calendar(self):
+        """
+        測試日曆查詢使用店家的日曆與快取
+        """
+        import main
+        
+        service = MagicMock()
+        service.events.return_value.list.return_value.execute.return_value = {"items": [
+            {"id": "event_b", "start": {"dateTime": "2025-05-30T08:00:00+08:00"}}
+        ]}
+        tenant = Tenant("store_c", "calendar_c", {}, lambda: service)
+        main.setup_tenant(tenant)
+        
+        events = main.get_calendar_events("20250530", tenant)
+        main.get_calendar_events("20250530", tenant)
+        
+        # 驗證結果
+        self.assertEqual([shift.id for shift in events], ["event_b"])
+        service.events.return_value.list.assert_called_once()
+        self.assertEqual(service.events.return_value.list.call_args.kwargs["calendarId"], "calendar_c")
+
+class TestScheduleIndex(unittest.TestCase):
+    """
+    排班區間索引測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        def shift(event_id, name, start, end):
+            return {
+                "id": event_id,
+                "summary": f"班表: {name}",
+                "start": {"dateTime": start},
+                "end": {"dateTime": end}
+            }
+        
+        # 2025/06/06 與 2025/06/13 為星期五
+        self.index = ScheduleIndex()
+        self.index.rebuild([
+            shift("e1", "用戶A", "2025-06-06T13:00:00+08:00", "2025-06-06T17:00:00+08:00"),
+            shift("e2", "用戶B", "2025-06-06T08:00:00+08:00", "2025-06-06T12:00:00+08:00"),
+            shift("e3", "用戶A", "2025-06-13T14:00:00+08:00", "2025-06-13T18:00:00+08:00"),
+            shift("e4", "用戶B", "2025-05-31T22:00:00+08:00", "2025-06-01T06:00:00+08:00"),
+            shift("e5", "用戶C", "2025-07-01T08:00:00+08:00", "2025-07-01T12:00:00+08:00"),
+            {"id": "other", "summary": "會議", "start": {"dateTime": "2025-06-06T09:00:00+08:00"}}
+        ], version=1)
+    
+    def test_month_query(self):
+        """
+        測試月份查詢包含跨月的夜班
+        """
+        start, end = self.index.month_range(2025, 6)
+        shifts = self.index.query(start=start, end=end)
+        
+        # 驗證結果
+        self.assertEqual([s.event_id for s in shifts], ["e4", "e2", "e1", "e3"])
+        self.assertEqual(len(self.index), 5)
+    
+    def test_query_by_staff_weekday_and_band(self):
+        """
+        測試依人員、星期與時段查詢
+        """
+        start, end = self.index.month_range(2025, 6)
+        
+        # 六月星期五下午的排班
+        friday_afternoon = self.index.query(start=start, end=end, weekday=4, band=parse_band("下午"))
+        self.assertEqual([s.event_id for s in friday_afternoon], ["e1", "e3"])
+        
+        # 用戶B 在六月的排班
+        user_b = self.index.query(start=start, end=end, staff="用戶B")
+        self.assertEqual([s.event_id for s in user_b], ["e4", "e2"])
+        
+        # 自訂時段
+        morning = self.index.query(band=parse_band("07:00-09:00"))
+        self.assertEqual([s.event_id for s in morning], ["e2", "e5"])
+    
+    def test_index_follows_mirror_version(self):
+        """
+        測試寫入後索引只差一個版本時直接更新，期間有其他變更時改以鏡像快照重建，不會漏掉事件
+        """
+        import main
+        def shift(event_id, name, hour):
+            return {"id": event_id, "summary": f"班表: {name}",
+                    "start": {"dateTime": f"2025-06-02T{hour:02d}:00:00+08:00"},
+                    "end": {"dateTime": f"2025-06-02T{hour + 2:02d}:00:00+08:00"}}
+        mirror = EventMirror(MagicMock(), "calendar")
+        mirror.apply(shift("e1", "用戶A", 8))
+        tenant = MagicMock(mirror=mirror, schedule_index=ScheduleIndex())
+        tenant.notifications.is_live = True
+        index = main.get_schedule_index(tenant)
+        
+        main.record_calendar_write(tenant, "20250602", shift("e2", "用戶B", 12))
+        upserted = [s.event_id for s in index.query()]
+        # 同步帶入的變更 (未經 record_calendar_write) 之後再寫入，索引落後兩個版本
+        mirror.apply(shift("e3", "用戶C", 16))
+        main.record_calendar_write(tenant, "20250602", shift("e4", "用戶A", 18))
+        stale_version = index.version
+        events, version = mirror.snapshot()
+        
+        # 驗證結果
+        self.assertEqual(upserted, ["e1", "e2"])
+        self.assertEqual(stale_version, 2)
+        self.assertEqual((len(events), version), (4, 4))
+        self.assertEqual([s.event_id for s in main.get_schedule_index(tenant).query()], ["e1", "e2", "e3", "e4"])
+        self.assertEqual(index.version, 4)
+    
+    def test_schedule_query_endpoint(self):
+        """
+        測試排班查詢 API
+        """
+        import main
+        
+        with patch("main.get_schedule_index", return_value=self.index):
+            response = client.get("/schedule/query", params={"start": "20250601", "end": "20250701", "staff": "用戶A"})
+        
+        # 驗證結果
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(response.json()["shifts"][0]["start"], "2025-06-06T13:00:00+08:00")
+
+class TestShiftConflicts(unittest.TestCase):
+    """
+    排班衝突檢查測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        self.events = [
+            {
+                "id": "e1",
+                "summary": "班表: 用戶A",
+                "start": {"dateTime": "2025-05-30T08:00:00+08:00"},
+                "end": {"dateTime": "2025-05-30T12:00:00+08:00"}
+            },
+            {
+                "id": "e2",
+                "summary": "班表: 用戶B",
+                "start": {"dateTime": "2025-05-30T13:00:00+08:00"},
+                "end": {"dateTime": "2025-05-30T17:00:00+08:00"}
+            }
+        ]
+        self.index = ScheduleIndex()
+        self.index.rebuild(self.events)
+        self.checker = ConflictChecker(self.index)
+    
+    def test_shift_end(self):
+        """
+        測試班次結束時間 (23:00 開始的班次不再出錯)
+        """
+        start = datetime(2025, 5, 30, 23, 0)
+        
+        # 驗證結果
+        self.assertEqual(shift_end(start), datetime(2025, 5, 31, 0, 0))
+        self.assertEqual(shift_end(start, "07:00"), datetime(2025, 5, 31, 7, 0))
+        self.assertEqual(shift_end(datetime(2025, 5, 30, 8, 0), "12:00"), datetime(2025, 5, 30, 12, 0))
+    
+    def test_check_add(self):
+        """
+        測試新增排班的衝突檢查
+        """
+        # 用戶A 在 10:00 已有排班
+        conflicts = self.checker.check_add("用戶A", datetime(2025, 5, 30, 10, 0), datetime(2025, 5, 30, 11, 0))
+        self.assertEqual([(c.kind, c.event_id) for c in conflicts], [("overlap", "e1")])
+        self.assertTrue(conflicts[0].blocking)
+        
+        # 更新自己的同一班次不算衝突
+        self.assertEqual(self.checker.check_add("用戶A", datetime(2025, 5, 30, 8, 0), datetime(2025, 5, 30, 12, 0)), [])
+        
+        # 取代他人的班次時回報但不阻止
+        conflicts = self.checker.check_add("用戶C", datetime(2025, 5, 30, 13, 0), datetime(2025, 5, 30, 17, 0))
+        self.assertEqual([(c.kind, c.staff) for c in conflicts], [("slot_taken", "用戶B")])
+        self.assertFalse(conflicts[0].blocking)
+    
+    def test_check_swap(self):
+        """
+        測試換班時接手人員已有重疊排班
+        """
+        conflicts = self.checker.check_swap("用戶B", datetime(2025, 5, 30, 8, 0))
+        self.assertEqual(conflicts, [])
+        
+        # 用戶A 接手 13:00 的班次，與自己 12:00 結束的班次沒有重疊
+        self.assertEqual(self.checker.check_swap("用戶A", datetime(2025, 5, 30, 13, 0)), [])
+        
+        # 用戶B 接手 11:00-14:00 的班次，與自己 13:00 的班次重疊
+        self.index.upsert({
+            "id": "e3",
+            "summary": "班表: 用戶C",
+            "start": {"dateTime": "2025-05-30T11:00:00+08:00"},
+            "end": {"dateTime": "2025-05-30T14:00:00+08:00"}
+        })
+        conflicts = self.checker.check_swap("用戶B", datetime(2025, 5, 30, 11, 0))
+        self.assertEqual([c.event_id for c in conflicts], ["e2"])
+    
+    def test_coverage_gaps(self):
+        """
+        測試營業時段內的人力空檔
+        """
+        gaps = self.checker.daily_coverage_gaps(datetime(2025, 5, 30), "08:00-18:00")
+        
+        # 驗證結果
+        self.assertEqual(
+            [(self.index.local_time(s).strftime("%H:%M"), self.index.local_time(e).strftime("%H:%M")) for s, e in gaps],
+            [("12:00", "13:00"), ("17:00", "18:00")]
+        )
+    
+    def test_create_event_rejects_double_booking(self):
+        """
+        測試重複排班時不寫入日曆
+        """
+        import main
+        
+        service = MagicMock()
+        tenant = Tenant("store_conflict", "calendar_conflict", {"用戶A": "user_a"}, lambda: service)
+        main.setup_tenant(tenant)
+        # 模擬已同步的本地鏡像
+        tenant.mirror.events = {event["id"]: event for event in self.events}
+        tenant.mirror.sync_token = "sync1"
+        tenant.mirror.synced_at = time.time()
+        
+        success, message = main.create_or_update_event("20250530", "10:00", "用戶A", tenant=tenant)
+        
+        # 驗證結果
+        self.assertFalse(success)
+        self.assertIn("已有排班", message)
+        service.events.return_value.insert.assert_not_called()
+        service.events.return_value.update.assert_not_called()
+        service.events.return_value.patch.assert_not_called()
+
+class TestMetrics(unittest.TestCase):
+    """
+    監控指標測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        self.registry = MetricsRegistry()
+    
+    def test_histogram_exposition(self):
+        """
+        測試直方圖的 Prometheus 文字格式
+        """
+        latency = self.registry.histogram("test_seconds", "測試延遲", ("command",), buckets=(0.1, 1.0))
+        latency.observe(0.05, command="幫助")
+        latency.observe(0.5, command="幫助")
+        latency.observe(3, command="幫助")
+        
+        text = self.registry.expose()
+        
+        # 驗證結果
+        self.assertIn("# TYPE test_seconds histogram", text)
+        self.assertIn('test_seconds_bucket{command="幫助",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{command="幫助",le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{command="幫助",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_count{command="幫助"} 3', text)
+    
+    def test_instrument_records_errors(self):
+        """
+        測試包裝函數記錄延遲與錯誤狀態碼
+        """
+        latency = self.registry.histogram("call_seconds", "呼叫延遲", ("method",))
+        errors = self.registry.counter("call_errors_total", "呼叫錯誤", ("method", "status"))
+        error = Exception("Too Many Requests")
+        error.status_code = 429
+        func = instrument(MagicMock(side_effect=error), latency, errors, method="push")
+        
+        with self.assertRaises(Exception):
+            func("user_a", "訊息")
+        
+        # 驗證結果
+        self.assertEqual(latency.count(method="push"), 1)
+        self.assertEqual(errors.value(method="push", status="429"), 1)
+    
+    def test_tenant_execute_records_calendar_method(self):
+        """
+        測試店家執行 Google Calendar 請求時依方法記錄延遲
+        """
+        from tenants import CALENDAR_LATENCY
+        
+        tenant = Tenant("store_metrics", "calendar_metrics", {}, lambda: None)
+        request = MagicMock(methodId="calendar.events.list")
+        request.execute.return_value = {"items": []}
+        
+        tenant.execute(request)
+        
+        # 驗證結果
+        self.assertEqual(CALENDAR_LATENCY.count(tenant="store_metrics", method="events.list"), 1)
+    
+    def test_metrics_endpoint(self):
+        """
+        測試 /metrics 端點輸出 webhook 與去重指標
+        """
+        client.post("/webhook", data="{}", headers={"X-Line-Signature": "invalid"})
+        
+        response = client.get("/metrics")
+        
+        # 驗證結果
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('webhook_handling_seconds_count{outcome="invalid_signature"}', response.text)
+        self.assertIn('dedup_entries{cache="webhook"}', response.text)
+
+class TestStructuredLog(unittest.TestCase):
+    """
+    結構化日誌測試
+    """
+    def make_record(self, level, message, **fields):
+        """
+        建立日誌記錄
+        """
+        record = logging.LogRecord("lineswift.test", level, __file__, 1, message, (), None)
+        record.__dict__.update(fields)
+        return record
+    
+    def test_json_format_with_correlation_id(self):
+        """
+        測試日誌以 JSON 輸出關聯 ID 與結構化欄位
+        """
+        handler = NonBlockingQueueHandler(queue.Queue())
+        
+        with bind_correlation_id("webhook-event-1"):
+            record = handler.prepare(self.make_record(logging.INFO, "新事件創建成功", date="20250530"))
+        entry = json.loads(JsonFormatter().format(record))
+        
+        # 驗證結果
+        self.assertEqual(entry["msg"], "新事件創建成功")
+        self.assertEqual(entry["correlation_id"], "webhook-event-1")
+        self.assertEqual(entry["date"], "20250530")
+    
+    def test_sampling_keeps_info(self):
+        """
+        測試取樣只丟棄 DEBUG 日誌
+        """
+        sampler = SamplingFilter(rate=0)
+        
+        # 驗證結果
+        self.assertFalse(sampler.filter(self.make_record(logging.DEBUG, "找到日曆事件")))
+        self.assertTrue(sampler.filter(self.make_record(logging.INFO, "收到 webhook 請求")))
+    
+    def test_full_queue_does_not_block(self):
+        """
+        測試佇列已滿時丟棄日誌而不等待
+        """
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        
+        handler.emit(self.make_record(logging.INFO, "第一筆"))
+        handler.emit(self.make_record(logging.INFO, "第二筆"))
+        
+        # 驗證結果
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 1)
+    
+    def test_setup_after_shutdown(self):
+        """
+        測試停止日誌後可以重新設定，重複停止不會出錯
+        """
+        logger = logging.getLogger(structured_log.ROOT_LOGGER)
+        original = (logger.handlers, logger.level, logger.propagate)
+        first, second = io.StringIO(), io.StringIO()
+        
+        try:
+            with patch.object(structured_log, "_listener", None), patch("structured_log.atexit.register"):
+                structured_log.setup_logging("INFO", stream=first).info("第一次設定")
+                structured_log.shutdown_logging()
+                structured_log.setup_logging("INFO", stream=second).info("重新設定")
+                structured_log.shutdown_logging()
+                structured_log.shutdown_logging()
+                listener = structured_log._listener
+        finally:
+            logger.handlers, logger.level, logger.propagate = original
+        
+        # 驗證結果
+        self.assertIsNone(listener)
+        self.assertEqual(json.loads(first.getvalue())["msg"], "第一次設定")
+        self.assertEqual(json.loads(second.getvalue())["msg"], "重新設定")
+
+class TestTracing(unittest.TestCase):
+    """
+    追蹤測試
+    """
+    def setUp(self):
+        """
+        測試前準備
+        """
+        self.exporter = InMemoryExporter()
+        self.tracer = Tracer(SimpleSpanProcessor(self.exporter))
+    
+    def test_nested_spans(self):
+        """
+        測試子 span 繼承 trace ID 並記錄錯誤
+        """
+        with self.tracer.start_span("POST /webhook") as root:
+            with self.assertRaises(ValueError):
+                with self.tracer.start_span("swap_shifts"):
+                    raise ValueError("換班失敗")
+        
+        child, parent = self.exporter.spans
+        
+        # 驗證結果
+        self.assertEqual(child.trace_id, root.trace_id)
+        self.assertEqual(child.parent_span_id, root.span_id)
+        self.assertEqual(child.status, STATUS_ERROR)
+        self.assertIsNone(parent.parent_span_id)
+    
+    def test_jsonl_export(self):
+        """
+        測試以 OTLP/JSON 格式輸出到 JSONL 檔案
+        """
+        path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+        tracer = Tracer(SimpleSpanProcessor(JsonlFileExporter(path)))
+        
+        with tracer.start_span("line push", attributes={"attempt": 1}):
+            pass
+        
+        with open(path, encoding="utf-8") as f:
+            entry = json.loads(f.readline())
+        
+        # 驗證結果
+        self.assertEqual(entry["name"], "line push")
+        self.assertEqual(len(entry["traceId"]), 32)
+        self.assertEqual(entry["attributes"], [{"key": "attempt", "value": {"intValue": "1"}}])
+    
+    def test_calendar_calls_are_child_spans(self):
+        """
+        測試日曆寫入流程的 Google Calendar 請求記錄為子 span
+        """
+        import main
+        
+        service = MagicMock()
+        service.events.return_value.list.return_value.methodId = "calendar.events.list"
+        service.events.return_value.list.return_value.execute.return_value = {"items": []}
+        service.events.return_value.insert.return_value.methodId = "calendar.events.insert"
+        service.events.return_value.insert.return_value.execute.return_value = {"id": "new1"}
+        tenant = Tenant("store_tracing", "calendar_tracing", {"用戶A": "user_a"}, lambda: service)
+        main.setup_tenant(tenant)
+        tenant.mirror.sync_token = "sync1"
+        tenant.mirror.synced_at = time.time()
+        
+        with patch("tracing.tracer", self.tracer):
+            success, _ = main.create_or_update_event("20250601", "09:00", "用戶A", tenant=tenant)
+        
+        spans = {span.name: span for span in self.exporter.spans}
+        
+        # 驗證結果
+        self.assertTrue(success)
+        self.assertIn("calendar events.insert", spans)
+        self.assertEqual(spans["calendar events.insert"].parent_span_id, spans["create_or_update_event"].span_id)
+        self.assertEqual(spans["calendar events.list"].attributes["tenant"], "store_tracing")
+
+class TestBenchmarkHarness(unittest.TestCase):
+    """
+    壓力測試工具測試
+    """
+    def test_signed_webhook_payload(self):
+        """
+        測試產生的 webhook 請求可通過簽名驗證
+        """
+        from linebot import WebhookParser
+        generator = WebhookPayloadGenerator("bench_secret", {"用戶A": "user_a"}, seed=1)
+        
+        kinds, body, headers = generator.request(batch_size=3)
+        events = WebhookParser("bench_secret").parse(body, headers["X-Line-Signature"])
+        
+        # 驗證結果
+        self.assertEqual(len(events), 3)
+        self.assertEqual(len(kinds), 3)
+        self.assertTrue(all(event.webhook_event_id for event in events))
+    
+    def test_fake_calendar_list_and_sync(self):
+        """
+        測試模擬日曆的時間範圍查詢與 syncToken 增量同步
+        """
+        calendar = FakeCalendarService()
+        events = calendar.events()
+        events.insert(calendarId="c1", body={
+            "summary": "班表: 用戶A",
+            "start": {"dateTime": "2025-05-30T08:00:00", "timeZone": "Asia/Taipei"},
+            "end": {"dateTime": "2025-05-30T12:00:00", "timeZone": "Asia/Taipei"}
+        }).execute()
+        
+        in_range = events.list(calendarId="c1", timeMin="2025-05-30T00:00:00Z", timeMax="2025-05-30T02:00:00Z").execute()
+        out_of_range = events.list(calendarId="c1", timeMin="2025-05-30T04:00:00Z", timeMax="2025-05-30T05:00:00Z").execute()
+        created = events.insert(calendarId="c1", body={"summary": "班表: 用戶B", "start": {"dateTime": "2025-05-31T08:00:00+08:00"}}).execute()
+        changes = events.list(calendarId="c1", syncToken=in_range["nextSyncToken"]).execute()
+        
+        # 驗證結果
+        self.assertEqual(len(in_range["items"]), 1)
+        self.assertEqual(in_range["items"][0]["start"]["dateTime"], "2025-05-30T08:00:00+08:00")
+        self.assertEqual(out_of_range["items"], [])
+        self.assertEqual([item["id"] for item in changes["items"]], [created["id"]])
+        self.assertEqual(calendar.calls["calendar.events.list"], 3)
+    
+    def test_fake_calendar_failure_injection(self):
+        """
+        測試模擬日曆依失敗率回傳錯誤
+        """
+        from googleapiclient.errors import HttpError
+        calendar = FakeCalendarService(failure_rate=1.0)
+        
+        with self.assertRaises(HttpError) as context:
+            calendar.events().list(calendarId="c1").execute()
+        
+        # 驗證結果
+        self.assertEqual(context.exception.resp.status, 503)
+        self.assertEqual(calendar.failures, 1)
+    
+    def test_find_regressions(self):
+        """
+        測試與上一次結果比較時找出退步項目
+        """
+        previous = {
+            "webhook": {"p50_ms": 10, "p95_ms": 20, "p99_ms": 30},
+            "commands": {"help": {"p50_ms": 5, "p95_ms": 8, "p99_ms": 9}},
+            "events_per_second": 100
+        }
+        current = {
+            "webhook": {"p50_ms": 10, "p95_ms": 30, "p99_ms": 31},
+            "commands": {"help": {"p50_ms": 5, "p95_ms": 8, "p99_ms": 9}},
+            "events_per_second": 70
+        }
+        
+        regressions = find_regressions(previous, current, max_regression=20)
+        
+        # 驗證結果
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("webhook p95_ms"))
+        self.assertTrue(regressions[1].startswith("events_per_second"))
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+    
+    def test_micro_benchmark_compare(self):
+        """
+        測試微基準測試與基準比較，指令處理以 main.handle_text_command 執行
+        """
+        import main
+        stats = micro.measure(lambda: main.generate_hash("測試"), repeat=2, min_time=0.001)
+        baseline = {"generate_hash[str]": {"median_us": 1.0}, "command_label": {"median_us": 10.0}}
+        results = {"generate_hash[str]": {"median_us": 1.5}, "command_label": {"median_us": 10.5}}
+        tenant = micro.command_tenant(main)
+        replies = [micro.command_dispatch(main, tenant, text) for text in micro.sample_texts(main)]
+        
+        # 驗證結果
+        self.assertGreater(stats["median_us"], 0)
+        self.assertIn("peak_kb", stats)
+        self.assertEqual(micro.compare(baseline, results, max_regression=25), ["generate_hash[str]: 1.0us -> 1.5us (+50.0%)"])
+        self.assertEqual(len(replies), len(micro.SAMPLE_TEXTS))
+        self.assertTrue(all(replies))
+        self.assertIn("您已批准換班請求，Google Calendar 已更新", replies[1])
+        self.assertEqual(replies[-1], ["未知指令，請輸入「幫助」查看可用指令"])
+
+class TestFakeCalendar(unittest.TestCase):
+    """
+    模擬 Google Calendar 後端的測試
+    """
+    def setUp(self):
+        """
+        測試前的準備工作
+        """
+        self.calendar = FakeCalendarService()
+        self.events = self.calendar.events()
+        self.event = self.events.insert(calendarId="c1", body={
+            "summary": "班表: 用戶A",
+            "description": "用戶 ID: U123",
+            "start": {"dateTime": "2025-05-30T08:00:00+08:00"},
+            "end": {"dateTime": "2025-05-30T12:00:00+08:00"}
+        }).execute()
+    
+    def test_patch_with_etag(self):
+        """
+        測試 patch 只更新指定欄位，ETag 不符時回傳 412
+        """
+        from googleapiclient.errors import HttpError
+        request = self.events.patch(calendarId="c1", eventId=self.event["id"], body={"summary": "班表: 用戶B"})
+        request.headers["If-Match"] = self.event["etag"]
+        patched = request.execute()
+        
+        stale = self.events.patch(calendarId="c1", eventId=self.event["id"], body={"summary": "班表: 用戶C"})
+        stale.headers["If-Match"] = self.event["etag"]
+        with self.assertRaises(HttpError) as context:
+            stale.execute()
+        
+        # 驗證結果
+        self.assertEqual(patched["summary"], "班表: 用戶B")
+        self.assertEqual(patched["description"], "用戶 ID: U123")
+        self.assertNotEqual(patched["etag"], self.event["etag"])
+        self.assertEqual(context.exception.resp.status, 412)
+    
+    def test_query_and_delete(self):
+        """
+        測試 q 參數搜尋，以及刪除已刪除的事件時回傳 410
+        """
+        from googleapiclient.errors import HttpError
+        matched = self.events.list(calendarId="c1", q="u123").execute()
+        missed = self.events.list(calendarId="c1", q="U999").execute()
+        self.events.delete(calendarId="c1", eventId=self.event["id"]).execute()
+        with self.assertRaises(HttpError) as context:
+            self.events.delete(calendarId="c1", eventId=self.event["id"]).execute()
+        
+        # 驗證結果
+        self.assertEqual([item["id"] for item in matched["items"]], [self.event["id"]])
+        self.assertEqual(missed["items"], [])
+        self.assertEqual(context.exception.resp.status, 410)
+        self.assertEqual(self.calendar.all_events("c1"), [])
+    
+    def test_batch_request(self):
+        """
+        測試批次請求逐一回呼，且只計算一次延遲
+        """
+        results = {}
+        batch = self.calendar.new_batch_http_request(
+            callback=lambda request_id, response, exception: results.update({request_id: (response, exception)}))
+        batch.add(self.events.get(calendarId="c1", eventId=self.event["id"]), request_id="found")
+        batch.add(self.events.get(calendarId="c1", eventId="missing"), request_id="missing")
+        self.calendar.latency = 0.05
+        started = time.time()
+        batch.execute()
+        elapsed = time.time() - started
+        
+        # 驗證結果
+        self.assertEqual(results["found"][0]["id"], self.event["id"])
+        self.assertEqual(results["missing"][1].resp.status, 404)
+        self.assertEqual(self.calendar.batches, 1)
+        self.assertLess(elapsed, 0.1)
+    
+    def test_expired_sync_token(self):
+        """
+        測試 syncToken 失效時回傳 410，需重新完整同步
+        """
+        from googleapiclient.errors import HttpError
+        sync_token = self.events.list(calendarId="c1").execute()["nextSyncToken"]
+        self.calendar.expire_sync_tokens()
+        
+        with self.assertRaises(HttpError) as context:
+            self.events.list(calendarId="c1", syncToken=sync_token).execute()
+        full = self.events.list(calendarId="c1").execute()
+        changes = self.events.list(calendarId="c1", syncToken=full["nextSyncToken"]).execute()
+        
+        # 驗證結果
+        self.assertEqual(context.exception.resp.status, 410)
+        self.assertEqual(changes["items"], [])
+    
+    def test_calendar_manager_uses_fake_backend(self):
+        """
+        測試 CALENDAR_BACKEND=fake 時 CalendarManager 與 main.py 共用模擬日曆
+        """
+        import main
+        with patch("fake_calendar.CALENDAR_BACKEND", "fake"), patch("fake_calendar._shared_service", self.calendar):
+            manager = CalendarManager(calendar_id="c1")
+            event_id = manager.create_shift("U456", "20250531", "早上", "09:00", "班表: 用戶B")
+            service = main.build_calendar_service()
+        
+        # 驗證結果
+        self.assertIs(manager.service, self.calendar)
+        self.assertIs(service, self.calendar)
+        self.assertEqual(len(self.calendar.all_events("c1")), 2)
+        self.assertTrue(manager.delete_shift(event_id))
+        self.assertEqual(len(self.calendar.all_events("c1")), 1)
+
+class TestColdStart(unittest.TestCase):
+    """
+    冷啟動延遲載入的測試
+    """
+    def test_import_defers_google_api(self):
+        """
+        測試匯入 main 時不載入 Google API 的 discovery 與憑證模組
+        """
+        result = measure_import("main", repeat=1)
+        
+        # 驗證結果
+        self.assertGreater(result["total_ms"], 0)
+        for name in DEFERRED_MODULES:
+            self.assertNotIn(name, result["modules"])
+    
+    def test_import_line_bot_defers_sdk(self):
+        """
+        測試匯入 line_bot 時不載入 line-bot-sdk 與 Google API 模組
+        """
+        result = measure_import("src.line_bot", repeat=1)
+        
+        # 驗證結果
+        for name in DEFERRED_MODULES:
+            self.assertNotIn(name, result["modules"])
+    
+    @patch("src.calendar_manager.load_credentials")
+    @patch("src.calendar_manager.build")
+    def test_calendar_manager_builds_service_on_first_use(self, mock_build, mock_credentials):
+        """
+        測試 CalendarManager 在第一次使用時才建立 Google Calendar 服務
+        """
+        manager = CalendarManager()
+        self.assertEqual(mock_build.call_count, 0)
+        
+        service = manager.service
+        manager.service
+        
+        # 驗證結果
+        self.assertIs(service, mock_build.return_value)
+        self.assertEqual(mock_build.call_count, 1)
+    
+    def test_user_manager_creates_schema_on_first_use(self):
+        """
+        測試 UserManager 在第一次查詢時才建立資料表
+        """
+        path = os.path.join(tempfile.mkdtemp(), "users.db")
+        manager = UserManager(db_path=path)
+        self.assertFalse(os.path.exists(path))
+        
+        # 驗證結果
+        self.assertFalse(manager.user_exists("user_a"))
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(manager.add_user("user_a", "用戶A"))
+        self.assertEqual(manager.get_user_name("user_a"), "用戶A")
+    
+    def test_user_manager_init_db(self):
+        """
+        測試 UserManager.init_db 可預先建立資料表，重複執行不影響已有的資料
+        """
+        path = os.path.join(tempfile.mkdtemp(), "users.db")
+        manager = UserManager(db_path=path)
+        manager.init_db()
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(manager.add_user("user_a", "用戶A"))
+        UserManager(db_path=path).init_db()
+        
+        # 驗證結果
+        self.assertEqual(manager.get_user_name("user_a"), "用戶A")
+    
+    def test_lazy_client_builds_once(self):
+        """
+        測試 LazyClient 在第一次存取屬性時才建立物件，之後取得的方法為同一個物件
+        """
+        factory = MagicMock(return_value=MagicMock())
+        client = LazyClient(factory)
+        self.assertFalse(client.created)
+        
+        method = client.reply_message
+        
+        # 驗證結果
+        self.assertIs(client.reply_message, method)
+        self.assertIs(client.resolve(), factory.return_value)
+        self.assertTrue(client.created)
+        factory.assert_called_once_with()
+    
+    def test_warm_up_builds_tenant_clients(self):
+        """
+        測試啟動預熱為每間店家建立 Google Calendar 客戶端，失敗時不中斷
+        """
+        import main
+        factory = MagicMock(return_value=MagicMock())
+        failing = MagicMock(side_effect=RuntimeError("無法連線"))
+        tenants = [Tenant("store_a", "calendar_a", {}, failing), Tenant("store_b", "calendar_b", {}, factory)]
+        
+        with patch.object(main.tenant_registry, "all", return_value=tenants), patch.object(main, "health", HealthMonitor()):
+            main.warm_up()
+            steps = main.health.readiness()["warm_up"]
+        
+        # 驗證結果
+        self.assertFalse(steps["store_a:calendar_client"]["ok"])
+        self.assertTrue(steps["store_b:calendar_client"]["ok"])
+        self.assertEqual(factory.call_count, 1)
+        self.assertIs(tenants[1].get_service(), factory.return_value)
+
+class TestHealth(unittest.TestCase):
+    """
+    存活與就緒檢查的測試
+    """
+    def test_readyz_after_warm_up(self):
+        """
+        測試啟動預熱完成前 /readyz 回傳 503，完成後回傳 200 並列出預熱步驟
+        """
+        import main
+        calendar = FakeCalendarService()
+        tenant = Tenant("store_health", "calendar_health", {"用戶A": "user_a"}, lambda: calendar)
+        main.setup_tenant(tenant)
+        client = TestClient(app)
+        
+        with patch.object(main.tenant_registry, "all", return_value=[tenant]), patch.object(main, "health", HealthMonitor()):
+            warming = client.get("/readyz")
+            main.warm_up()
+            ready = client.get("/readyz")
+        live = client.get("/healthz")
+        
+        # 驗證結果
+        self.assertEqual(warming.status_code, 503)
+        self.assertEqual(warming.json()["status"], "warming_up")
+        self.assertEqual(ready.status_code, 200)
+        self.assertTrue(all(step["ok"] for step in ready.json()["warm_up"].values()))
+        self.assertIn("store_health:week_events", ready.json()["warm_up"])
+        self.assertEqual(calendar.calls["calendar.events.list"], 1)
+        self.assertEqual(live.json()["status"], "ok")
+    
+    def test_probe_failure_is_reported(self):
+        """
+        測試外部服務探測失敗時回報為 degraded，但不影響就緒狀態
+        """
+        from health import PROBE_UP
+        monitor = HealthMonitor()
+        monitor.add_probe("test_ok", lambda: None)
+        monitor.add_probe("test_down", MagicMock(side_effect=RuntimeError("逾時")))
+        monitor.mark_warm()
+        
+        dependencies = monitor.probe_all()
+        readiness = monitor.readiness()
+        
+        # 驗證結果
+        self.assertTrue(monitor.is_ready)
+        self.assertTrue(dependencies["test_ok"]["ok"])
+        self.assertEqual(dependencies["test_down"]["error"], "逾時")
+        self.assertEqual(readiness["degraded"], ["test_down"])
+        self.assertEqual(PROBE_UP.value(dependency="test_down"), 0)
+    
+    def test_tenant_directory(self):
+        """
+        測試人員索引以 LINE ID 查詢名稱，同一 ID 取名單中的第一個名稱
+        """
+        tenant = Tenant("store_directory", "calendar", {"用戶A": "user_a", "用戶B": "user_b", "別名A": "user_a"}, MagicMock())
+        
+        # 驗證結果
+        self.assertEqual(tenant.user_name("user_a"), "用戶A")
+        self.assertEqual(tenant.user_name("user_b"), "用戶B")
+        self.assertIsNone(tenant.user_name("user_c"))
+        self.assertIs(tenant.directory(), tenant.directory())
+
+class TestCalendarClient(unittest.TestCase):
+    """
+    以內附 discovery 文件建立 Google Calendar 客戶端的測試
+    """
+    def test_build_from_bundled_document(self):
+        """
+        測試以內附的 discovery 文件建立客戶端，文件只解析一次
+        """
+        import httplib2
+        with patch("googleapiclient.discovery.build", side_effect=AssertionError("不應下載 discovery 文件")):
+            service = calendar_client.build("calendar", "v3", http=httplib2.Http())
+        request = service.events().list(calendarId="c1", maxResults=1)
+        
+        # 驗證結果
+        self.assertIs(calendar_client.discovery_document(), calendar_client.discovery_document())
+        self.assertEqual(request.methodId, "calendar.events.list")
+        self.assertTrue(request.uri.startswith("https://www.googleapis.com/calendar/v3/calendars/c1/events?"))
+    
+    def test_resources_are_reused(self):
+        """
+        測試子資源物件重複使用，各客戶端各自持有
+        """
+        import httplib2
+        first = calendar_client.build("calendar", "v3", http=httplib2.Http())
+        second = calendar_client.build("calendar", "v3", http=httplib2.Http())
+        
+        # 驗證結果
+        self.assertIs(first.events(), first.events())
+        self.assertIsNot(first.events(), second.events())
+        self.assertEqual(first.channels().stop(body={"id": "channel"}).methodId, "calendar.channels.stop")
+    
+    def test_main_builds_offline_client(self):
+        """
+        測試 main.py 以內附的 discovery 文件建立服務帳號客戶端
+        """
+        import main
+        from google.auth.credentials import AnonymousCredentials
+        with patch.dict(os.environ, {"GOOGLE_SERVICE_ACCOUNT_JSON": '{"type": "service_account"}'}), \
+                patch("google.oauth2.service_account.Credentials.from_service_account_info", return_value=AnonymousCredentials()), \
+                patch("googleapiclient.discovery.build", side_effect=AssertionError("不應下載 discovery 文件")):
+            service = main.build_calendar_service()
+        
+        # 驗證結果
+        self.assertIsNotNone(service)
+        self.assertEqual(service.events().get(calendarId="c1", eventId="e1").methodId, "calendar.events.get")
+
+class TestSharedState(unittest.TestCase):
+    """
+    多個 worker 共用狀態的測試
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "shared_state.db")
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_claim_across_workers(self):
+        """
+        測試兩個 worker (各自的資料庫連線) 同時記錄同一個 webhook 時只有一個成功，過期後可再次記錄
+        """
+        first = SQLiteStore(SQLiteDatabase(self.path), "webhook_requests")
+        second = SQLiteStore(SQLiteDatabase(self.path), "webhook_requests")
+        
+        # 驗證結果
+        self.assertTrue(first.claim("hash1", 10, now=1000.0))
+        self.assertFalse(second.claim("hash1", 10, now=1005.0))
+        self.assertTrue(second.claim("hash1", 10, now=1011.0))
+        self.assertTrue(second.claim("hash2", 10, now=1011.0))
+        self.assertEqual(first["hash1"], 1011.0)
+    
+    def test_release_claim(self):
+        """
+        測試釋放記錄後同一個 key 可以再次記錄，兩種後端行為相同
+        """
+        for store in (MemoryStore(), SQLiteStore(SQLiteDatabase(self.path), "approval_tokens")):
+            store.claim("nonce1", 60, now=1000.0)
+            blocked = store.claim("nonce1", 60, now=1001.0)
+            store.release("nonce1")
+            store.release("missing")
+            
+            # 驗證結果
+            self.assertFalse(blocked)
+            self.assertTrue(store.claim("nonce1", 60, now=1002.0))
+    
+    def test_purge_expired_records(self):
+        """
+        測試清除過期記錄，距離上次清除未滿間隔時略過
+        """
+        for store in (MemoryStore(), SQLiteStore(SQLiteDatabase(self.path), "sent_messages")):
+            store.claim("old", 60, now=1000.0)
+            store.claim("new", 60, now=1100.0)
+            
+            # 驗證結果
+            self.assertEqual(store.purge(60, now=1120.0), 1)
+            self.assertEqual(list(store), ["new"])
+            store.claim("old", 60, now=1120.0)
+            self.assertEqual(store.purge(0, now=1130.0), 0)
+            self.assertEqual(store.purge(0, now=1130.0, force=True), 2)
+    
+    def test_sqlite_cache(self):
+        """
+        測試共享快取的存活時間、失效與容量上限，其他 worker 可看到寫入與失效
+        """
+        cache = SQLiteCache(SQLiteDatabase(self.path), "cache:store_a", max_entries=2)
+        other = SQLiteCache(SQLiteDatabase(self.path), "cache:store_a", max_entries=2)
+        cache.set("week", {"events": [1]}, ttl=30)
+        cache.set("expired", [1], ttl=-1)
+        
+        # 驗證結果
+        self.assertEqual(other.get("week"), {"events": [1]})
+        self.assertIsNone(other.get("expired"))
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(len(other), 2)
+        self.assertIsNone(other.get("week"))
+        other.invalidate("b")
+        self.assertIsNone(cache.get("b"))
+    
+    def test_main_dedup_uses_store(self):
+        """
+        測試 main.py 的去重以共享記錄判斷
+        """
+        import main
+        with patch.object(main, "processed_webhook_requests", MemoryStore()), patch.object(main, "sent_messages", MemoryStore()):
+            first = main.is_duplicate_webhook("req_shared", '{"events": []}')
+            second = main.is_duplicate_webhook("req_shared", '{"events": []}')
+            message = main.is_duplicate_message("user_a", "已成功新增排班")
+            
+            # 驗證結果
+            self.assertFalse(first)
+            self.assertTrue(second)
+            self.assertFalse(message)
+            self.assertEqual(len(main.sent_messages), 1)
+
+class TestApprovalTokens(unittest.TestCase):
+    """
+    換班確認權杖的測試
+    """
+    def setUp(self):
+        self.signer = ApprovalSigner("test_secret", ttl=3600)
+    
+    def test_issue_and_verify(self):
+        """
+        測試權杖可還原換班請求內容，LINE ID 以精簡格式儲存，每次簽發的 nonce 不同
+        """
+        requester = "U0c63e33715aebc37754bc2cf522ab6fa"
+        token = self.signer.issue("store_a", requester, "eva700802", "20250530", "08:00", now=1000.0)
+        approval = self.signer.verify(token, now=2000.0)
+        
+        # 驗證結果
+        self.assertEqual(approval[:6], ("store_a", requester, "eva700802", "20250530", "08:00", 4600))
+        self.assertLess(len(f"action=approve_shift&token={token}"), 140)
+        self.assertNotEqual(approval.nonce, self.signer.verify(self.signer.issue("store_a", requester, "eva700802", "20250530", "08:00")).nonce)
+    
+    def test_reject_invalid_tokens(self):
+        """
+        測試竄改、過期、其他金鑰簽發與格式錯誤的權杖皆無法通過驗證
+        """
+        token = self.signer.issue("store_a", "user_a", "user_b", "20250530", "08:00", now=1000.0)
+        tampered = token[:10] + ("A" if token[10] != "A" else "B") + token[11:]
+        
+        # 驗證結果
+        for bad_token, now in ((tampered, 1000.0), (token, 5000.0), ("U123_20250530_08_00_用戶B", 1000.0), ("", 1000.0)):
+            with self.assertRaises(InvalidApprovalToken):
+                self.signer.verify(bad_token, now=now)
+        with self.assertRaises(InvalidApprovalToken):
+            ApprovalSigner("other_secret").verify(token, now=1000.0)
+    
+    def test_shift_request_sends_signed_postback(self):
+        """
+        測試換班請求的確認按鈕帶有簽名權杖，不需儲存換班請求
+        """
+        import main
+        event = MagicMock()
+        event.message.text = "我希望在20250530 08:00跟你換班 @Eva-家萍"
+        event.source.user_id = "kent1027"
+        with patch.object(main, "safe_send_message") as send, patch.object(main, "validate_swap", return_value=[]), \
+                patch.object(main, "recent_shift_requests", MemoryStore()), \
+                patch.object(main.tenant_registry, "resolve", return_value=main.default_tenant):
+            main.handle_text_command(event)
+        template = send.call_args_list[-1].args[2].template
+        token = parse_qs(template.actions[0].data)["token"][0]
+        approval = main.approval_signer.verify(token)
+        
+        # 驗證結果
+        self.assertEqual([action.data.split("&")[0] for action in template.actions], ["action=approve_shift", "action=reject_shift"])
+        self.assertEqual((approval.requester_id, approval.target_id, approval.date, approval.slot), ("kent1027", "eva700802", "20250530", "08:00"))
+    
+    def test_postback_approves_once(self):
+        """
+        測試以按鈕批准換班只執行一次，其他用戶無權回應
+        """
+        import main
+        token = main.approval_signer.issue(main.default_tenant.tenant_id, "kent1027", "eva700802", "20250530", "08:00")
+        
+        def postback(user_id):
+            event = MagicMock()
+            event.source.user_id = user_id
+            event.postback.data = f"action=approve_shift&token={token}"
+            event.webhook_event_id = None
+            main.handle_postback(event)
+        
+        with patch.object(main, "safe_send_message") as send, patch.object(main, "validate_swap", return_value=[]), \
+                patch.object(main, "swap_shifts", return_value=True) as swap, \
+                patch.object(main, "used_approval_tokens", MemoryStore()):
+            postback("kent1027")
+            postback("eva700802")
+            postback("eva700802")
+        replies = [call.args[2].text for call in send.call_args_list if call.args[0] is main.line_bot_api.reply_message]
+        
+        # 驗證結果
+        swap.assert_called_once()
+        self.assertEqual(swap.call_args.args, ("20250530", "08:00", "張書豪-Ragic Customize!", "Eva-家萍"))
+        self.assertIs(swap.call_args.kwargs["tenant"], main.default_tenant)
+        self.assertEqual(replies, ["您無權回應此換班請求", "您已批准換班請求，Google Calendar 已更新", "此換班請求已經被處理，無法重複處理"])
+    
+    def test_failed_swap_releases_token(self):
+        """
+        測試寫入日曆失敗時釋放權杖，批准者再按一次即可完成換班
+        """
+        import main
+        token = main.approval_signer.issue(main.default_tenant.tenant_id, "kent1027", "eva700802", "20250530", "08:00")
+        event = MagicMock()
+        event.source.user_id = "eva700802"
+        event.postback.data = f"action=approve_shift&token={token}"
+        event.webhook_event_id = None
+        
+        with patch.object(main, "safe_send_message") as send, patch.object(main, "validate_swap", return_value=[]), \
+                patch.object(main, "swap_shifts", side_effect=[False, ConnectionError("timeout"), True]) as swap, \
+                patch.object(main, "used_approval_tokens", MemoryStore()):
+            for _ in range(4):
+                main.handle_postback(event)
+        replies = [call.args[2].text for call in send.call_args_list if call.args[0] is main.line_bot_api.reply_message]
+        
+        # 驗證結果
+        self.assertEqual(swap.call_count, 3)
+        self.assertEqual(replies, [
+            "Google Calendar 更新失敗，換班尚未完成，請稍後再按一次批准",
+            "您已批准換班請求，Google Calendar 已更新",
+            "此換班請求已經被處理，無法重複處理",
+        ])
+    
+    def test_failed_swap_is_written_on_retry(self):
+        """
+        測試第一次寫入日曆失敗時釋放換班操作記錄，再按一次批准時實際更新事件，不被當作重複操作略過
+        """
+        import main
+        calendar = FakeCalendarService()
+        tenant = Tenant("retry", "calendar_retry", {"用戶A": "user_a", "用戶B": "user_b"}, lambda: calendar)
+        main.setup_tenant(tenant)
+        calendar.seed_events(tenant.calendar_id, [{
+            "id": "e1", "summary": "班表: 用戶A", "description": "排班人員: 用戶A",
+            "start": {"dateTime": "2025-06-02T08:00:00+08:00"}, "end": {"dateTime": "2025-06-02T12:00:00+08:00"}
+        }])
+        event = MagicMock()
+        event.source.user_id = "user_b"
+        event.postback.data = f"action=approve_shift&token={main.approval_signer.issue('retry', 'user_a', 'user_b', '20250602', '08:00')}"
+        event.webhook_event_id = None
+        get_description = main.get_event_description
+        attempts = []
+        
+        def flaky_description(*args):
+            # 第一次讀取事件描述時逾時，之後正常
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise RuntimeError("timeout")
+            return get_description(*args)
+        
+        with patch.object(main, "safe_send_message") as send, patch.object(main, "tenant_registry", TenantRegistry(tenant)), \
+                patch.object(main, "used_approval_tokens", MemoryStore()), \
+                patch.object(main, "processed_calendar_operations", MemoryStore()), \
+                patch.object(main, "get_event_description", side_effect=flaky_description):
+            main.handle_postback(event)
+            main.handle_postback(event)
+        replies = [call.args[2].text for call in send.call_args_list if call.args[0] is main.line_bot_api.reply_message]
+        
+        # 驗證結果
+        self.assertEqual(replies, [
+            "Google Calendar 更新失敗，換班尚未完成，請稍後再按一次批准",
+            "您已批准換班請求，Google Calendar 已更新",
+        ])
+        self.assertEqual(calendar.all_events(tenant.calendar_id)[0]["summary"], "班表: 用戶B")
+        self.assertEqual(calendar.calls.get("calendar.events.patch"), 1)
+    
+    def test_postback_rejects_unknown_tenant(self):
+        """
+        測試權杖所屬的店家已不存在時拒絕批准，不寫入預設店家的日曆，也不消耗權杖
+        """
+        import main
+        token = main.approval_signer.issue("removed_store", "kent1027", "eva700802", "20250530", "08:00")
+        event = MagicMock()
+        event.source.user_id = "eva700802"
+        event.postback.data = f"action=approve_shift&token={token}"
+        event.webhook_event_id = None
+        store = MemoryStore()
+        
+        with patch.object(main, "safe_send_message") as send, patch.object(main, "swap_shifts") as swap, \
+                patch.object(main, "used_approval_tokens", store):
+            main.handle_postback(event)
+        
+        # 驗證結果
+        swap.assert_not_called()
+        self.assertEqual(send.call_args.args[2].text, "找不到對應的換班請求，可能已過期或已處理")
+        self.assertTrue(store.claim(main.approval_signer.verify(token).nonce, 60))
+    
+    @patch("src.line_bot.line_bot_api")
+    @patch("src.line_bot.user_manager")
+    @patch("src.line_bot.calendar_manager")
+    def test_line_bot_postback_token(self, mock_calendar_manager, mock_user_manager, mock_line_bot_api):
+        """
+        測試 line_bot.handle_postback 以確認權杖處理換班，不查詢換班請求暫存
+        """
+        from src import line_bot
+        mock_user_manager.get_user_name.return_value = "用戶"
+        token = line_bot.approval_signer.issue("", "user_a", "user_b", "20250530", "早上 08:00")
+        event = MagicMock()
+        event.source.user_id = "user_b"
+        event.postback.data = f"action=approve&token={token}"
+        
+        with patch.object(line_bot, "used_approval_tokens", MemoryStore()):
+            line_bot.handle_postback(event)
+            line_bot.handle_postback(event)
+        
+        # 驗證結果
+        mock_calendar_manager.swap_shifts.assert_called_once_with("user_a", "user_b", "20250530", "早上", "08:00")
+        self.assertEqual(mock_line_bot_api.reply_message.call_args.args[1].text, "此換班請求已經處理過。")
+
+class TestReplyManager(unittest.TestCase):
+    """
+    reply token 期限管理的測試
+    """
+    def setUp(self):
+        self.api = MagicMock()
+        self.api.http_client.timeout = 5
+        self.manager = ReplyManager(self.api, budget=10, max_age=50, ack_text="處理中")
+    
+    def make_event(self, reply_token, source_type="group", timestamp=1000.0):
+        event = MagicMock()
+        event.reply_token = reply_token
+        event.timestamp = int(timestamp * 1000)
+        event.source.type = source_type
+        event.source.user_id = "user_a"
+        event.source.group_id = "group_a" if source_type == "group" else None
+        return event
+    
+    def test_estimator(self):
+        """
+        測試預估處理時間隨實際處理時間調整，沒有紀錄時為 0
+        """
+        estimator = CommandEstimator(alpha=0.5)
+        estimator.observe("week_calendar", 2.0)
+        estimator.observe("week_calendar", 4.0)
+        
+        # 驗證結果
+        self.assertEqual(estimator.estimate("help"), 0.0)
+        self.assertEqual(estimator.estimate("week_calendar"), 3.0 + 2 * 1.0)
+    
+    def test_fast_command_replies_directly(self):
+        """
+        測試預估可在預算內完成時直接回覆，並記錄回覆方式
+        """
+        before = REPLY_PATHS.value(command="rm_fast", path="reply")
+        state = self.manager.begin(self.make_event("token_fast"), "rm_fast", now=1001.0)
+        
+        # 驗證結果
+        self.assertEqual(state.mode, "direct")
+        self.assertIsNone(self.manager.redirect("token_fast", now=1003.0))
+        self.assertIsNone(self.manager.redirect("token_fast", now=1003.0))
+        self.assertEqual(REPLY_PATHS.value(command="rm_fast", path="reply") - before, 1)
+        self.api.reply_message.assert_not_called()
+    
+    def test_slow_command_in_group_acks_then_pushes(self):
+        """
+        測試群組中預估超過預算的指令先回覆處理中訊息，結果改以 push 送回群組
+        """
+        self.manager.estimator.observe("rm_slow", 12.0)
+        state = self.manager.begin(self.make_event("token_slow"), "rm_slow", now=1001.0)
+        
+        # 驗證結果
+        self.assertEqual(state.mode, "ack")
+        self.assertEqual(self.api.reply_message.call_args.args[0], "token_slow")
+        self.assertEqual(self.api.reply_message.call_args.args[1].text, "處理中")
+        self.assertEqual(self.manager.redirect("token_slow", now=1013.0), "group_a")
+        self.assertEqual(REPLY_PATHS.value(command="rm_slow", path="ack_push"), 1)
+    
+    def test_user_chat_shows_loading(self):
+        """
+        測試一對一聊天顯示載入動畫，reply token 仍有效時回覆，失效時改用 push
+        """
+        self.manager.estimator.observe("rm_loading", 7.0)
+        self.manager.begin(self.make_event("token_a", "user"), "rm_loading", now=1004.0)
+        self.manager.begin(self.make_event("token_b", "user"), "rm_loading", now=1004.0)
+        path, = self.api._post.call_args.args
+        
+        # 驗證結果
+        self.assertEqual(path, "/v2/bot/chat/loading/start")
+        self.assertEqual(json.loads(self.api._post.call_args.kwargs["data"]), {"chatId": "user_a", "loadingSeconds": 15})
+        self.api.reply_message.assert_not_called()
+        self.assertIsNone(self.manager.redirect("token_a", now=1020.0))
+        self.assertEqual(self.manager.redirect("token_b", now=1060.0), "user_a")
+        self.assertEqual(REPLY_PATHS.value(command="rm_loading", path="loading_push"), 1)
+    
+    def test_safe_send_message_uses_push_after_ack(self):
+        """
+        測試 main.safe_send_message 在 reply token 已用於處理中訊息後改用 push message
+        """
+        import main
+        manager = ReplyManager(main.line_bot_api, budget=10, max_age=50)
+        manager.estimator.observe("rm_main", 30.0)
+        event = self.make_event("token_main", timestamp=time.time())
+        with patch.object(main, "reply_manager", manager), \
+                patch.object(main.line_bot_api, "reply_message") as reply, patch.object(main.line_bot_api, "push_message") as push, \
+                patch.object(main, "sent_messages", MemoryStore()):
+            with manager.track(event, "rm_main"):
+                main.safe_send_message(main.line_bot_api.reply_message, "token_main", TextSendMessage(text="本週排班"), event_source=event.source)
+        
+        # 驗證結果
+        reply.assert_called_once()
+        push.assert_called_once()
+        self.assertEqual(push.call_args.args[0], "group_a")
+        self.assertEqual(push.call_args.args[1].text, "本週排班")
+        self.assertIsNone(manager.redirect("token_main"))
+
+class TestReminders(unittest.TestCase):
+    """
+    排班提醒與時間輪的測試
+    """
+    START = 1_700_000_000
+    USER_A = "U" + "a" * 32
+    USER_B = "U" + "b" * 32
+    
+    def setUp(self):
+        self.sent = []
+        self.store = MemoryStore()
+        self.sent_store = MemoryStore()
+        self.scheduler = self.make_scheduler()
+    
+    def make_scheduler(self):
+        return ShiftReminderScheduler(lambda to, text: self.sent.append((to, text)), self.store, self.sent_store,
+                                      hours=[2], wheel=TimerWheel(now=self.START))
+    
+    def shift(self, event_id, staff, start):
+        return IndexedShift(start, start + 4 * 3600, staff, event_id, 0, 0)
+    
+    def test_timer_wheel_fires_on_time(self):
+        """
+        測試各層與超過時間輪範圍的計時器都在到期的那一秒取出，不會提早
+        """
+        wheel = TimerWheel(slots=8, levels=3, now=self.START)
+        delays = [1, 7, 8, 9, 63, 64, 65, 200, 511, 512, 600, 1500]
+        for delay in delays:
+            wheel.schedule(f"t{delay}", self.START + delay, delay)
+        fired = {}
+        for second in range(1, 1501):
+            for key, due_at, delay in wheel.advance(self.START + second):
+                fired[delay] = second
+        
+        # 驗證結果
+        self.assertEqual(fired, {delay: delay for delay in delays})
+        self.assertEqual(len(wheel), 0)
+
+    def test_timer_wheel_fires_exactly_across_boundaries(self):
+        """
+        測試從各種起始位置排程 (跨越各層與最上層一圈的邊界)，每個計時器都剛好在到期的那一格取出
+        """
+        slots, levels = 4, 3
+        rotation = slots ** levels
+        late = []
+        for start in range(rotation * 1000, rotation * 1002 + 1):
+            wheel = TimerWheel(slots=slots, levels=levels, now=start)
+            for delay in range(1, 2 * rotation + 3):
+                wheel.schedule(f"t{delay}", start + delay, delay)
+            for tick in range(start + 1, start + 2 * rotation + 3):
+                for key, due_at, delay in wheel.advance(tick):
+                    if due_at != tick or start + delay != tick:
+                        late.append((start, delay, tick))
+            if len(wheel):
+                late.append((start, "remaining", wheel.keys()))
+
+        # 驗證結果
+        self.assertEqual(late, [])
+
+    def test_timer_wheel_near_top_level_boundary(self):
+        """
+        測試預設設定下，目前時間在最上層邊界前一小時時，兩小時後的計時器準時取出
+        """
+        now = 64 ** 4 * 10 - 3600
+        wheel = TimerWheel(now=now)
+        wheel.schedule("reminder", now + 7200)
+
+        # 驗證結果
+        self.assertEqual(wheel.advance(now + 7199), [])
+        self.assertEqual([key for key, _, _ in wheel.advance(now + 7200)], ["reminder"])
+
+    def test_timer_wheel_cancel_and_reschedule(self):
+        """
+        測試取消與重新排程計時器，跳過多秒推進時一次取出所有到期的計時器
+        """
+        wheel = TimerWheel(now=self.START)
+        wheel.schedule("a", self.START + 100)
+        wheel.schedule("b", self.START + 100)
+        wheel.schedule("a", self.START + 5000)
+        
+        # 驗證結果
+        self.assertTrue(wheel.cancel("b"))
+        self.assertFalse(wheel.cancel("b"))
+        self.assertEqual(wheel.advance(self.START + 4999), [])
+        self.assertEqual([key for key, _, _ in wheel.advance(self.START + 6000)], ["a"])
+        wheel.schedule("late", self.START - 10)
+        self.assertEqual([key for key, _, _ in wheel.advance(self.START + 6000)], ["late"])
+    
+    def test_sync_replaces_changed_shifts(self):
+        """
+        測試從排班計算提醒，班次時間變更或刪除時取消舊的提醒
+        """
+        roster = {"用戶A": self.USER_A, "用戶B": self.USER_B}
+        local_time = lambda epoch: datetime.fromtimestamp(epoch)
+        shifts = [self.shift("e1", "用戶A", self.START + 3 * 3600), self.shift("e2", "用戶B", self.START + 3600),
+                  self.shift("e3", "未知", self.START + 5 * 3600)]
+        first = self.scheduler.sync("store_a", self.scheduler.plan("store_a", shifts, roster.get, local_time, now=self.START))
+        again = self.scheduler.sync("store_a", self.scheduler.plan("store_a", shifts, roster.get, local_time, now=self.START))
+        moved = [self.shift("e1", "用戶A", self.START + 6 * 3600)]
+        changed = self.scheduler.sync("store_a", self.scheduler.plan("store_a", moved, roster.get, local_time, now=self.START))
+        
+        # 驗證結果 (e2 兩小時前已過，未知人員不提醒)
+        self.assertEqual(first, (1, 0))
+        self.assertEqual(again, (0, 0))
+        self.assertEqual(changed, (1, 0))
+        self.assertEqual(list(self.store), [f"store_a:e1:{self.USER_A}:2"])
+        self.assertEqual(self.store[f"store_a:e1:{self.USER_A}:2"]["due_at"], self.START + 4 * 3600)
+        self.assertEqual(self.scheduler.sync("store_a", {}), (0, 1))
+        self.assertEqual(len(self.store), 0)
+    
+    def test_deliver_batches_same_second(self):
+        """
+        測試同一秒到期的相同提醒合併為一次發送，非 LINE ID 略過，其他 worker 已送出的不重複發送
+        """
+        due_at = self.START + 60
+        text = "提醒：您在 2023/11/15 08:00 的班次將於 2 小時後開始"
+        for key, to in (("k1", self.USER_A), ("k2", self.USER_B), ("k3", "eva700802")):
+            self.scheduler.sync("store_a", {**{k: v for k, v in self.store.items()}, key: {"due_at": due_at, "to": to, "text": text}})
+        self.scheduler.sync("store_b", {"k4": {"due_at": due_at, "to": self.USER_A, "text": "其他提醒"}})
+        other_worker = self.make_scheduler()
+        other_worker.restore(now=self.START)
+        
+        sends = self.scheduler.deliver(self.scheduler.pop_due(due_at))
+        duplicate = other_worker.deliver(other_worker.pop_due(due_at))
+        
+        # 驗證結果
+        self.assertEqual(sends, 2)
+        self.assertEqual(duplicate, 0)
+        self.assertEqual(sorted(self.sent), [([self.USER_A], "其他提醒"), ([self.USER_A, self.USER_B], text)])
+        self.assertEqual(len(self.store), 0)
+    
+    def test_restore_after_restart(self):
+        """
+        測試重新啟動後從儲存恢復排程，逾期太久的提醒不再發送
+        """
+        self.store["store_a:e1:u:2"] = {"due_at": self.START + 600, "to": self.USER_A, "text": "提醒"}
+        self.store["store_a:e0:u:2"] = {"due_at": self.START - 3600, "to": self.USER_A, "text": "過期"}
+        scheduler = self.make_scheduler()
+        
+        # 驗證結果
+        self.assertEqual(scheduler.restore(now=self.START), 1)
+        self.assertEqual(list(self.store), ["store_a:e1:u:2"])
+        self.assertEqual(scheduler.pop_due(self.START + 599), [])
+        self.assertEqual(scheduler.deliver(scheduler.pop_due(self.START + 600)), 1)
+
+class TestWriteCoalescer(unittest.TestCase):
+    """
+    同一時段寫入合併的測試
+    """
+    NOW = 1_700_000_000
+    SLOT = ("default", "calendar", "20250602", "08:00")
+    
+    def setUp(self):
+        self.writes = []
+        self.results = []
+        self.buffer = CalendarWriteBuffer(self.write, window=2)
+    
+    def write(self, slot, merged):
+        self.writes.append((slot, merged))
+        return True, "事件更新成功"
+    
+    def submit(self, staff, slot=SLOT, now=NOW, **kwargs):
+        mutation = SlotMutation(staff, f"更新為 {staff}", **kwargs)
+        self.buffer.submit(slot, mutation, lambda success, message: self.results.append((staff, success, message)), now=now)
+    
+    def test_merge_keeps_last_staff_and_all_history(self):
+        """
+        測試合併後排班人員以最後一次為準，換班歷史依序保留，未指定結束時間的變更不覆蓋先前的結束時間
+        """
+        merged = merge_mutations([
+            SlotMutation("A", "更新為 A", description="排班人員: A", end_time="2025-06-02T16:00:00"),
+            SlotMutation("B", "從 A 換班給 B", description="排班人員: B"),
+            SlotMutation("B", "從 A 換班給 B"),
+        ])
+        
+        # 驗證結果
+        self.assertEqual(merged.staff, "B")
+        self.assertEqual(merged.history, ["更新為 A", "從 A 換班給 B"])
+        self.assertEqual(merged.description, "排班人員: A")
+        self.assertEqual(merged.end_time, "2025-06-02T16:00:00")
+        self.assertEqual(merged.mutations, 3)
+    
+    def test_mutations_within_window_become_one_write(self):
+        """
+        測試等待時間內的多次變更只寫入一次，每個指令都收到寫入結果，並記錄省下的寫入數
+        """
+        self.submit("A")
+        self.submit("B", now=self.NOW + 1)
+        self.submit("C", now=self.NOW + 1.5)
+        
+        # 驗證結果
+        self.assertEqual(self.buffer.flush_due(now=self.NOW + 1.9), 0)
+        self.assertEqual(self.results, [])
+        self.assertEqual(self.buffer.flush_due(now=self.NOW + 2), 1)
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(self.writes[0][1].staff, "C")
+        self.assertEqual([staff for staff, _, _ in self.results], ["A", "B", "C"])
+        self.assertTrue(all(success for _, success, _ in self.results))
+        self.assertEqual(self.buffer.stats(), {"mutations": 3, "writes": 1, "saved": 2})
+        self.assertEqual(len(self.buffer), 0)
+    
+    def test_window_is_not_extended_by_later_mutations(self):
+        """
+        測試時段的到期時間以第一次變更為準，之後的變更不延長等待時間；到期後的變更開始新的一批
+        """
+        self.submit("A")
+        self.submit("B", now=self.NOW + 1.9)
+        self.buffer.flush_due(now=self.NOW + 2)
+        self.submit("C", now=self.NOW + 2.5)
+        
+        # 驗證結果
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(self.buffer.flush_due(now=self.NOW + 4), 0)
+        self.assertEqual(self.buffer.flush_due(now=self.NOW + 4.5), 1)
+        self.assertEqual([merged.staff for _, merged in self.writes], ["B", "C"])
+    
+    def test_slots_are_written_separately(self):
+        """
+        測試不同時段分別寫入，force 時不論是否到期全部寫入
+        """
+        other = ("default", "calendar", "20250602", "16:00")
+        self.submit("A")
+        self.submit("B", slot=other)
+        
+        # 驗證結果
+        self.assertEqual(self.buffer.flush_due(now=self.NOW, force=True), 2)
+        self.assertEqual(sorted(slot for slot, _ in self.writes), sorted([self.SLOT, other]))
+        self.assertEqual(self.buffer.stats()["saved"], 0)
+    
+    def test_write_failure_is_reported_to_every_sender(self):
+        """
+        測試寫入發生例外時每個指令都收到失敗結果
+        """
+        def failing_write(slot, merged):
+            raise RuntimeError("quota exceeded")
+        self.buffer = CalendarWriteBuffer(failing_write, window=2)
+        self.submit("A")
+        self.submit("B")
+        self.buffer.flush_due(now=self.NOW + 2)
+        
+        # 驗證結果
+        self.assertEqual(len(self.results), 2)
+        self.assertTrue(all(not success and "quota exceeded" in message for _, success, message in self.results))
+        self.assertFalse(CalendarWriteBuffer(failing_write, window=0).enabled)
+
+
+class TestOutbox(unittest.TestCase):
+    """
+    日曆寫入 outbox 的測試
+    """
+    NOW = 1_700_000_000
+    SLOT = ("default", "calendar", "20250602", "08:00")
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "shared_state.db")
+        self.outbox = CalendarOutbox(SQLiteDatabase(self.path), max_attempts=3)
+        self.writes = []
+        self.dead = []
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def dispatcher(self, write):
+        return OutboxDispatcher(self.outbox, write, on_dead=lambda batch, error: self.dead.append((batch, error)))
+    
+    def enqueue(self, staff, slot=SLOT, now=NOW, delay=2):
+        return self.outbox.enqueue(slot, SlotMutation(staff, f"更新為 {staff}"), notify=f"U-{staff}", delay=delay, now=now)
+    
+    def test_slot_mutations_merge_into_one_write(self):
+        """
+        測試同一時段在派送前的變更依序合併為一次寫入，未到派送時間的時段不派送
+        """
+        def write(slot, merged):
+            self.writes.append((slot, merged))
+            return True, "事件更新成功"
+        self.enqueue("A")
+        self.enqueue("B", now=self.NOW + 1)
+        self.enqueue("C", slot=("default", "calendar", "20250602", "16:00"), now=self.NOW + 1)
+        dispatcher = self.dispatcher(write)
+        
+        # 驗證結果
+        self.assertEqual(dispatcher.run_once(now=self.NOW + 1.5), {"ok": 0, "retry": 0, "dead": 0, "deferred": 0})
+        self.assertEqual(dispatcher.run_once(now=self.NOW + 2), {"ok": 1, "retry": 0, "dead": 0, "deferred": 0})
+        self.assertEqual(self.writes[0][0], self.SLOT)
+        self.assertEqual(self.writes[0][1].staff, "B")
+        self.assertEqual(self.writes[0][1].history, ["更新為 A", "更新為 B"])
+        self.assertEqual(self.outbox.counts(), {"pending": 1, "dead": 0})
+        self.assertEqual(dispatcher.run_once(now=self.NOW + 3)["ok"], 1)
+        self.assertEqual(self.outbox.counts(), {"pending": 0, "dead": 0})
+    
+    def test_leased_slot_is_not_claimed_twice(self):
+        """
+        測試派送中的時段不會被另一個 worker 取出，之後的變更等待前一批完成；租約到期後 (worker 停止) 可重新取出
+        """
+        other_worker = CalendarOutbox(SQLiteDatabase(self.path))
+        self.enqueue("A", delay=0)
+        batches = self.outbox.claim(now=self.NOW)
+        self.enqueue("B", now=self.NOW + 1, delay=0)
+        
+        # 驗證結果
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(other_worker.claim(now=self.NOW + 1), [])
+        retaken = other_worker.claim(now=self.NOW + self.outbox.lease + 1)
+        self.assertEqual([mutation.staff for mutation in retaken[0].mutations], ["A", "B"])
+        other_worker.complete(retaken[0])
+        self.assertEqual(self.outbox.counts()["pending"], 0)
+    
+    def test_idle_outbox_does_not_lock_database(self):
+        """
+        測試沒有到期的變更時只以唯讀查詢確認、不取得寫入鎖；沒有待派送的變更後不再輪詢，記錄新的變更時恢復
+        """
+        dispatcher = self.dispatcher(lambda slot, merged: (True, "事件更新成功"))
+        statements = []
+        self.outbox.database.connection().set_trace_callback(statements.append)
+        self.enqueue("A")
+        
+        self.assertTrue(self.outbox.active)
+        self.assertEqual(dispatcher.run_once(now=self.NOW + 1)["ok"], 0)
+        self.assertFalse(any("BEGIN" in statement for statement in statements))
+        self.assertEqual(dispatcher.run_once(now=self.NOW + 2)["ok"], 1)
+        self.assertEqual(dispatcher.run_once(now=self.NOW + 3)["ok"], 0)
+        idle = self.outbox.active
+        self.enqueue("B", now=self.NOW + 4)
+        
+        # 驗證結果
+        self.assertEqual(sum("BEGIN IMMEDIATE" in statement for statement in statements), 1)
+        self.assertFalse(idle)
+        self.assertTrue(self.outbox.active)
+        self.assertFalse(CalendarOutbox(SQLiteDatabase(os.path.join(self.temp_dir.name, "new.db"))).active)
+    
+    def test_retry_with_backoff_then_dead_letter(self):
+        """
+        測試寫入失敗時以指數退避重試，超過嘗試次數後移到 dead letter 並通知發送者，可重新排入派送
+        """
+        def write(slot, merged):
+            raise RuntimeError("backend unavailable")
+        dispatcher = self.dispatcher(write)
+        entry_id = self.enqueue("A", delay=0)
+        now = self.NOW
+        outcomes = []
+        for attempt in range(1, 4):
+            result = dispatcher.run_once(now=now)
+            outcomes.append(next(outcome for outcome, count in result.items() if count))
+            self.assertEqual(dispatcher.run_once(now=now + backoff(attempt) - 0.1), {"ok": 0, "retry": 0, "dead": 0, "deferred": 0})
+            now += backoff(attempt)
+        
+        # 驗證結果
+        self.assertEqual(outcomes, ["retry", "retry", "dead"])
+        self.assertEqual(backoff(1), 2)
+        self.assertEqual(backoff(3), 8)
+        self.assertEqual(self.dead[0][0].notify, ["U-A"])
+        self.assertIn("backend unavailable", self.dead[0][1])
+        letters = self.outbox.dead_letters()
+        self.assertEqual([letter["id"] for letter in letters], [entry_id])
+        self.assertEqual(letters[0]["attempts"], 3)
+        self.assertEqual(self.outbox.requeue([entry_id], now=now), 1)
+        self.assertEqual(self.outbox.counts(), {"pending": 1, "dead": 0})
+    
+    def test_permanent_error_is_not_retried(self):
+        """
+        測試請求本身有誤 (例如 404) 時不重試，直接移到 dead letter
+        """
+        def write(slot, merged):
+            raise fake_calendar._http_error(404, "notFound")
+        self.enqueue("A", delay=0)
+        
+        # 驗證結果
+        self.assertEqual(self.dispatcher(write).run_once(now=self.NOW), {"ok": 0, "retry": 0, "dead": 1, "deferred": 0})
+        self.assertEqual(self.outbox.counts(), {"pending": 0, "dead": 1})
+    
+    def test_pending_mutations_survive_restart(self):
+        """
+        測試服務重新啟動後 (新的資料庫連線) 繼續派送未完成的變更
+        """
+        self.enqueue("A", delay=0)
+        restarted = CalendarOutbox(SQLiteDatabase(self.path))
+        batches = restarted.claim(now=self.NOW)
+        
+        # 驗證結果
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].slot, self.SLOT)
+        self.assertEqual(batches[0].mutations[0], SlotMutation("A", "更新為 A"))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """
+    斷路器與過期資料備援的測試
+    """
+    NOW = 1_700_000_000
+    
+    def make_breaker(self):
+        return CircuitBreaker("test", failure_rate=0.5, min_calls=4, window=60, open_seconds=30)
+    
+    def test_opens_on_failure_rate(self):
+        """
+        測試統計時間內的失敗率達到門檻才斷路，請求數不足或 4xx 錯誤不會斷路
+        """
+        breaker = self.make_breaker()
+        for offset in range(3):
+            breaker.record_failure(now=self.NOW + offset)
+        self.assertEqual(breaker._state, CLOSED)
+        breaker.record_error(fake_calendar._http_error(404, "notFound"), now=self.NOW + 3)
+        self.assertEqual(breaker._state, CLOSED)
+        breaker.record_error(fake_calendar._http_error(503, "backendError"), now=self.NOW + 4)
+        
+        # 驗證結果
+        self.assertEqual(breaker._state, OPEN)
+        with self.assertRaises(CircuitOpenError) as context:
+            breaker.before_call(now=self.NOW + 10)
+        self.assertEqual(context.exception.retry_at, breaker.retry_at)
+    
+    def test_old_failures_leave_the_window(self):
+        """
+        測試超過統計時間的失敗不計入失敗率
+        """
+        breaker = self.make_breaker()
+        for offset in range(3):
+            breaker.record_failure(now=self.NOW + offset)
+        for offset in range(3):
+            breaker.record_success(now=self.NOW + 100 + offset)
+        breaker.record_failure(now=self.NOW + 103)
+        
+        # 驗證結果
+        self.assertEqual(breaker._state, CLOSED)
+    
+    def test_half_open_probe(self):
+        """
+        測試暫停時間過後只放行一個試探請求，試探成功即恢復，試探失敗則重新暫停
+        """
+        breaker = self.make_breaker()
+        for offset in range(4):
+            breaker.record_failure(now=self.NOW)
+        opened_at = self.NOW
+        
+        breaker.before_call(now=opened_at + 30)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call(now=opened_at + 30)
+        breaker.record_failure(now=opened_at + 31)
+        self.assertEqual(breaker._state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call(now=opened_at + 60)
+        breaker.before_call(now=opened_at + 61)
+        breaker.record_success(now=opened_at + 62)
+        
+        # 驗證結果
+        self.assertEqual(breaker._state, CLOSED)
+        breaker.before_call(now=opened_at + 62)
+    
+    def test_tenant_execute_fails_fast_when_open(self):
+        """
+        測試日曆斷路後店家的請求直接拋出 CircuitOpenError，不再呼叫 Google Calendar
+        """
+        tenant = Tenant("breaker", "calendar", {}, lambda: None)
+        tenant.breaker = self.make_breaker()
+        request = MagicMock()
+        request.execute.side_effect = fake_calendar._http_error(503, "backendError")
+        for _ in range(4):
+            with self.assertRaises(Exception):
+                tenant.execute(request)
+        
+        # 驗證結果
+        with self.assertRaises(CircuitOpenError):
+            tenant.execute(request)
+        self.assertEqual(request.execute.call_count, 4)
+    
+    def test_stale_fallback_and_deferred_outbox_write(self):
+        """
+        測試斷路時查詢改用最後一次的結果並附上資料時間，outbox 的寫入延後到恢復試探時且不計入嘗試次數
+        """
+        import main
+        tenant = Tenant("stale", "calendar", {}, lambda: None)
+        request = MagicMock()
+        request.execute.return_value = {"items": [{"id": "e1", "start": {"dateTime": "2025-06-02T08:00:00+08:00"}}]}
+        main.list_events_with_fallback(tenant, "events:20250602", request)
+        tenant.breaker._transition(OPEN, time.time())
+        with main.stale_data_scope():
+            events = main.list_events_with_fallback(tenant, "events:20250602", request)
+            notice = main.with_stale_notice(TextSendMessage(text="排班")).text
+        
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        outbox = CalendarOutbox(SQLiteDatabase(os.path.join(temp_dir.name, "shared_state.db")))
+        outbox.enqueue(("stale", "calendar", "20250602", "08:00"), SlotMutation("A", "更新為 A"), now=self.NOW)
+        def write(slot, merged):
+            raise CircuitOpenError("calendar:stale", self.NOW + 30)
+        result = OutboxDispatcher(outbox, write).run_once(now=self.NOW)
+        
+        # 驗證結果
+        self.assertEqual([shift.slot for shift in events], ["20250602 08:00"])
+        self.assertEqual(request.execute.call_count, 1)
+        self.assertIn("Google Calendar 暫時無法連線", notice)
+        self.assertEqual(main.stale_data_as_of.get(), None)
+        self.assertEqual(result["deferred"], 1)
+        self.assertEqual(outbox.claim(now=self.NOW + 29), [])
+        self.assertEqual(outbox.claim(now=self.NOW + 30)[0].attempts, 0)
+
+    def make_outbox_tenant(self, tenant_id):
+        import main
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        outbox = CalendarOutbox(SQLiteDatabase(os.path.join(temp_dir.name, "shared_state.db")))
+        calendar = FakeCalendarService()
+        tenant = Tenant(tenant_id, f"calendar_{tenant_id}", {}, lambda: calendar)
+        main.setup_tenant(tenant)
+        patcher = patch.multiple(main, calendar_outbox=outbox, tenant_registry=TenantRegistry(tenant))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return tenant, calendar, outbox
+
+    def test_unchecked_conflicts_defer_to_outbox(self):
+        """
+        測試鏡像尚未同步且日曆斷路時，新增排班與換班都記錄到 outbox，不因無法檢查衝突而失敗
+        """
+        import main
+        tenant, calendar, outbox = self.make_outbox_tenant("unchecked")
+        tenant.breaker._transition(OPEN, time.time())
+
+        added = main.create_or_update_event("20250602", "08:00", "用戶A", tenant=tenant)
+        swapped = main.swap_shifts("20250602", "12:00", "用戶A", "用戶B", tenant=tenant)
+
+        # 驗證結果
+        self.assertEqual(added, (True, "已記錄，稍後寫入日曆"))
+        self.assertTrue(swapped)
+        self.assertEqual(calendar.calls, {})
+        self.assertEqual(outbox.counts()["pending"], 2)
+
+    def test_outbox_checks_conflicts_when_applied(self):
+        """
+        測試延後的變更在派送時才檢查衝突，重疊的排班直接移到 dead letter，不寫入日曆
+        """
+        import main
+        tenant, calendar, outbox = self.make_outbox_tenant("apply_check")
+        calendar.seed_events(tenant.calendar_id, [{
+            "id": "e1", "summary": "班表: 用戶A",
+            "start": {"dateTime": "2025-06-02T08:00:00+08:00"}, "end": {"dateTime": "2025-06-02T12:00:00+08:00"}
+        }])
+        outbox.enqueue(("apply_check", tenant.calendar_id, "20250602", "09:00"), SlotMutation("用戶A", "更新為 用戶A"), now=self.NOW)
+        outbox.enqueue(("apply_check", tenant.calendar_id, "20250602", "13:00"), SlotMutation("用戶A", "更新為 用戶A"), now=self.NOW)
+        dead = []
+
+        result = OutboxDispatcher(outbox, main.write_slot, on_dead=lambda batch, error: dead.append(error)).run_once(now=self.NOW)
+
+        # 驗證結果
+        self.assertEqual((result["ok"], result["dead"]), (1, 1))
+        self.assertIn("用戶A 在 2025/06/02 08:00-12:00 已有排班", dead[0])
+        self.assertEqual(calendar.calls.get("calendar.events.insert"), 1)
+        self.assertEqual(len(calendar.all_events(tenant.calendar_id)), 2)
+
+
+class TestTimeModel(unittest.TestCase):
+    """
+    店家時區時間模型的測試
+    """
+    def test_day_bounds_are_local_midnights(self):
+        """
+        測試日期的查詢範圍為當地的 00:00 到隔天 00:00，並使用預先計算的邊界表
+        """
+        model = TimeModel("Asia/Taipei", precompute_days=0)
+        model.precompute("20250601", 7)
+        
+        # 驗證結果
+        self.assertEqual(len(model._days), 7)
+        self.assertEqual(model.day_bounds("20250602"), ("2025-06-02T00:00:00+08:00", "2025-06-03T00:00:00+08:00"))
+        self.assertIs(model.day_bounds("20250602"), model.day_bounds("20250602"))
+        self.assertEqual(model.week_bounds("20250602"), ("2025-06-02T00:00:00+08:00", "2025-06-10T00:00:00+08:00"))
+    
+    def test_day_bounds_follow_daylight_saving(self):
+        """
+        測試日光節約時間開始的日期只有 23 小時，邊界快取不超過上限
+        """
+        model = TimeModel("America/New_York", cache_days=3, precompute_days=0)
+        start, end = model.day_bounds("20250309")
+        model.precompute("20250310", 5)
+        
+        # 驗證結果
+        self.assertEqual((start, end), ("2025-03-09T00:00:00-05:00", "2025-03-10T00:00:00-04:00"))
+        self.assertEqual((datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds(), 23 * 3600)
+        self.assertEqual(list(model._days), ["20250312", "20250313", "20250314"])
+    
+    def test_slot_key_is_independent_of_offset_format(self):
+        """
+        測試以 Z、+08:00 或不含時差表示的同一時刻得到相同的時段 key
+        """
+        model = TimeModel("Asia/Taipei")
+        
+        # 驗證結果
+        self.assertEqual(model.slot_key("2025-06-02T00:00:00Z"), "20250602 08:00")
+        self.assertEqual(model.slot_key("2025-06-02T08:00:00+08:00"), "20250602 08:00")
+        self.assertEqual(model.slot_key("2025-06-02T08:00:00"), "20250602 08:00")
+        self.assertEqual(model.slot_key(model.localize("20250602", "8:00")), "20250602 08:00")
+        self.assertEqual(model.today(now=1748793600), "20250602")
+    
+    def test_find_slot_matches_local_date_and_time(self):
+        """
+        測試時段比對以當地的日期與時間為準，不比對 UTC 的小時，也略過全天事件
+        """
+        model = TimeModel("Asia/Taipei")
+        shifts = model.parse_shifts([
+            {"id": "all_day", "start": {"date": "2025-06-02"}},
+            {"id": "utc_eight", "start": {"dateTime": "2025-06-02T08:00:00Z"}},
+            {"id": "other_day", "start": {"dateTime": "2025-06-01T08:00:00+08:00"}},
+            {"id": "target", "start": {"dateTime": "2025-06-02T00:00:00Z"}},
+        ])
+        
+        # 驗證結果
+        self.assertEqual(len(shifts), 3)
+        self.assertEqual(model.find_slot(shifts, "20250602", "08:00").id, "target")
+        self.assertEqual(model.find_slot(shifts, "20250602", "16:00").id, "utc_eight")
+        self.assertIsNone(model.find_slot(shifts, "20250602", "09:00"))
+    
+    def test_calendar_queries_use_tenant_timezone(self):
+        """
+        測試日期查詢只涵蓋店家當地的整天，日曆以 UTC 回傳的事件也能找到並更新，不重複建立
+        """
+        import main
+        calendar = FakeCalendarService()
+        registry = TenantRegistry(Tenant("default", "calendar", {}, lambda: calendar))
+        tenant = registry.load_config({"tenants": [{
+            "id": "store_tz", "calendar_id": "calendar_tz", "roster": {"用戶A": "user_a"}, "timezone": "Asia/Taipei"
+        }]}, lambda: calendar)[0]
+        main.setup_tenant(tenant)
+        events = calendar.events()
+        for event_id, start, end in (
+            ("early", "2025-06-01T23:00:00Z", "2025-06-02T03:00:00Z"),
+            ("next_day", "2025-06-02T18:00:00Z", "2025-06-02T22:00:00Z"),
+        ):
+            events.insert(calendarId="calendar_tz", body={
+                "id": event_id, "summary": "班表: 用戶A",
+                "start": {"dateTime": start}, "end": {"dateTime": end}
+            }).execute()
+        
+        found = main.get_calendar_events("20250602", tenant)
+        success, message = main.create_or_update_event("20250602", "07:00", "用戶B", tenant=tenant)
+        listed = events.list(calendarId="calendar_tz").execute()["items"]
+        
+        # 驗證結果
+        self.assertEqual(tenant.time.name, "Asia/Taipei")
+        self.assertEqual([shift.id for shift in found], ["early"])
+        self.assertTrue(success, message)
+        self.assertEqual(len(listed), 2)
+        self.assertIn("用戶B", [event["summary"].replace("班表: ", "") for event in listed if event["id"] == "early"][0])
+
+    def test_calendar_manager_uses_local_day_bounds(self):
+        """
+        測試 CalendarManager 以當地整天查詢並比對當地時段，日曆以 UTC 回傳的事件也能找到，建立的事件含時差
+        """
+        calendar = FakeCalendarService()
+        manager = CalendarManager("calendar_local", timezone="Asia/Taipei")
+        manager.service = calendar
+        calendar.seed_events("calendar_local", [
+            {"id": "morning", "summary": "班表: user_a", "description": "user_a",
+             "start": {"dateTime": "2025-06-02T00:00:00Z"}, "end": {"dateTime": "2025-06-02T04:00:00Z"}},
+            {"id": "afternoon", "summary": "班表: user_a", "description": "user_a",
+             "start": {"dateTime": "2025-06-02T08:00:00Z"}, "end": {"dateTime": "2025-06-02T12:00:00Z"}},
+        ])
+
+        with patch.object(calendar, "_list", wraps=calendar._list) as list_events:
+            morning = manager.get_shift("user_a", "20250602", "早上", "08:00")
+            afternoon = manager.get_shift("user_a", "20250602", "下午", "4:00")
+        event_id = manager.create_shift("user_b", "20250603", "早上", "09:00", "班表: user_b")
+        created = calendar.events().get(calendarId="calendar_local", eventId=event_id).execute()
+
+        # 驗證結果
+        self.assertEqual(list_events.call_args_list[0].args[1:3], ("2025-06-02T00:00:00+08:00", "2025-06-03T00:00:00+08:00"))
+        self.assertEqual(morning["id"], "morning")
+        self.assertEqual(afternoon["id"], "afternoon")
+        self.assertEqual(created["start"], {"dateTime": "2025-06-03T09:00:00+08:00", "timeZone": "Asia/Taipei"})
+
+    def test_mirror_and_notifications_use_local_time(self):
+        """
+        測試排班異動通知以店家的當地時間顯示，鏡像查詢將未含時差的時間視為當地時間
+        """
+        notifier = RecordingNotifier()
+        mirror = EventMirror(lambda: None, "calendar_local", time_model=TimeModel("Asia/Taipei"))
+        service = CalendarNotificationService(mirror, MagicMock(), notifier, {"用戶A": "user_a"}.get)
+        utc_event = {"id": "e1", "etag": "1", "summary": "班表: 用戶A",
+                     "start": {"dateTime": "2025-06-02T00:00:00Z"}, "end": {"dateTime": "2025-06-02T04:00:00Z"}}
+        mirror.apply(utc_event)
+        mirror.apply({"id": "e2", "etag": "1", "summary": "班表: 用戶A",
+                      "start": {"dateTime": "2025-06-02T23:00:00"}, "end": {"dateTime": "2025-06-03T03:00:00"}})
+
+        service.notify_staff([(None, utc_event)])
+        listed = mirror.list_events(*mirror.time.day_bounds("20250602"))
+
+        # 驗證結果
+        self.assertIn("新增排班: 2025/06/02 08:00 用戶A", notifier.messages[0][1])
+        self.assertEqual([event["id"] for event in listed], ["e1", "e2"])
+
+
+class TestCalendarFields(unittest.TestCase):
+    """
+    日曆 API 欄位遮罩的測試
+    """
+    def make_tenant(self, calendar, tenant_id):
+        import main
+        tenant = Tenant(tenant_id, f"calendar_{tenant_id}", {"用戶A": "user_a", "用戶B": "user_b"}, lambda: calendar)
+        main.setup_tenant(tenant)
+        calendar.seed_events(tenant.calendar_id, [{
+            "id": "shift_1", "summary": "班表: 用戶A", "description": "排班人員: 用戶A", "location": "A 店",
+            "creator": {"email": "admin@example.com"}, "reminders": {"useDefault": True},
+            "start": {"dateTime": "2025-06-02T08:00:00", "timeZone": "Asia/Taipei"},
+            "end": {"dateTime": "2025-06-02T12:00:00", "timeZone": "Asia/Taipei"}
+        }])
+        return tenant
+    
+    def test_fake_calendar_applies_field_mask(self):
+        """
+        測試模擬日曆依 fields 參數只回傳遮罩內的欄位，支援巢狀與 a/b 的寫法
+        """
+        calendar = FakeCalendarService()
+        calendar.seed_events("c1", [{
+            "id": "e1", "summary": "班表: 用戶A", "description": "很長的描述",
+            "start": {"dateTime": "2025-06-02T08:00:00+08:00", "timeZone": "Asia/Taipei"}
+        }])
+        listed = calendar.events().list(calendarId="c1", fields="items(id,start/dateTime),nextPageToken").execute()
+        fetched = calendar.events().get(calendarId="c1", eventId="e1", fields="id,description").execute()
+        
+        # 驗證結果
+        self.assertEqual(listed, {"items": [{"id": "e1", "start": {"dateTime": "2025-06-02T08:00:00+08:00"}}]})
+        self.assertEqual(fetched, {"id": "e1", "description": "很長的描述"})
+        self.assertEqual(calendar.requested_fields[-1], ("calendar.events.get", "id,description"))
+    
+    def test_write_paths_use_masks_and_patch(self):
+        """
+        測試新增排班與換班的每個日曆請求都套用呼叫點的遮罩，並以 patch 只更新變更的欄位
+        """
+        import main
+        calendar = FakeCalendarService()
+        tenant = self.make_tenant(calendar, "store_fields")
+        
+        updated, _ = main.create_or_update_event("20250602", "08:00", "用戶B", admin_user_name="管理員", tenant=tenant)
+        created, _ = main.create_or_update_event("20250602", "13:00", "用戶A", admin_user_name="管理員", tenant=tenant)
+        swapped = main.swap_shifts("20250602", "08:00", "用戶B", "用戶A", tenant=tenant)
+        event = [item for item in calendar.all_events(tenant.calendar_id) if item["id"] == "shift_1"][0]
+        requests = set((method, fields) for method, fields in calendar.requested_fields)
+        
+        # 驗證結果
+        self.assertTrue(updated and created and swapped)
+        self.assertEqual(requests, {
+            ("calendar.events.list", FIELD_MASKS["mirror_sync"]),
+            ("calendar.events.list", FIELD_MASKS["slot_lookup"]),
+            ("calendar.events.get", FIELD_MASKS["event_history"]),
+            ("calendar.events.patch", FIELD_MASKS["write_result"]),
+            ("calendar.events.insert", FIELD_MASKS["write_result"]),
+        })
+        self.assertEqual(event["summary"], "班表: 用戶A")
+        self.assertEqual(event["location"], "A 店")
+        self.assertTrue(event["description"].startswith("排班人員: 用戶A\n換班歷史:"))
+        self.assertIn("從 用戶B 換班給 用戶A", event["description"])
+    
+    def test_read_paths_use_masks(self):
+        """
+        測試一週排班表、本地鏡像同步與健康檢查的查詢套用各自的遮罩
+        """
+        import main
+        calendar = FakeCalendarService()
+        tenant = self.make_tenant(calendar, "store_fields_read")
+        
+        main.get_week_calendar_events(tenant)
+        tenant.mirror.full_sync()
+        with patch.object(main, "default_tenant", tenant):
+            main.probe_google_calendar()
+        
+        # 驗證結果
+        self.assertEqual(calendar.requested_fields, [
+            ("calendar.events.list", FIELD_MASKS["week_schedule"]),
+            ("calendar.events.list", FIELD_MASKS["mirror_sync"]),
+            ("calendar.events.list", FIELD_MASKS["probe"]),
+        ])
+        self.assertEqual(set(tenant.mirror.events["shift_1"]), {"id", "status", "summary", "start", "end", "etag", "updated"})
+    
+    def test_calendar_manager_shift_lookup_mask(self):
+        """
+        測試 CalendarManager 查詢排班時只取回回傳內容用到的欄位
+        """
+        calendar = FakeCalendarService()
+        manager = CalendarManager("calendar_manager")
+        manager.service = calendar
+        calendar.seed_events("calendar_manager", [{
+            "id": "e1", "summary": "班表: user_a", "description": "用戶 ID: user_a", "location": "A 店",
+            "start": {"dateTime": "2025-06-02T00:00:00Z"}, "end": {"dateTime": "2025-06-02T01:00:00Z"}
+        }])
+        
+        shift = manager.get_shift("user_a", "20250602", "早上", "08:00")
+        
+        # 驗證結果
+        self.assertEqual(calendar.requested_fields, [("calendar.events.list", FIELD_MASKS["shift_lookup"])])
+        self.assertEqual(shift["id"], "e1")
+        self.assertEqual(shift["description"], "用戶 ID: user_a")
+    
+    def test_masked_week_payload_is_smaller(self):
+        """
+        測試描述累積換班歷史時，一週排班表的回應大小不隨描述增長
+        """
+        calendar = FakeCalendarService()
+        history = "\n".join(f"換班歷史: 2025-05-{day:02d} 10:00 - 更新為 用戶A" for day in range(1, 29))
+        calendar.seed_events("c1", [{
+            "id": f"e{hour}", "summary": "班表: 用戶A", "description": history,
+            "creator": {"email": "admin@example.com"}, "organizer": {"email": "c1"},
+            "htmlLink": "https://www.google.com/calendar/event?eid=e", "reminders": {"useDefault": True},
+            "start": {"dateTime": f"2025-06-02T{hour:02d}:00:00+08:00"}
+        } for hour in range(8, 20)])
+        full = calendar.events().list(calendarId="c1").execute()
+        masked = calendar.events().list(calendarId="c1", fields=FIELD_MASKS["week_schedule"]).execute()
+        
+        # 驗證結果
+        self.assertEqual([item["id"] for item in masked["items"]], [item["id"] for item in full["items"]])
+        self.assertLess(len(json.dumps(masked, ensure_ascii=False)) * 5, len(json.dumps(full, ensure_ascii=False)))
+
+
+class TestShiftModel(unittest.TestCase):
+    """
+    排班模型 (Shift) 的測試
+    """
+    TZ = ZoneInfo("Asia/Taipei")
+    
+    def test_from_event_parses_once(self):
+        """
+        測試事件解析為 epoch 秒與當地時段 key，已刪除與全天事件略過，沒有結束時間時使用預設長度
+        """
+        shift = Shift.from_event({
+            "id": "e1", "etag": "\"3\"", "summary": "班表: 用戶A",
+            "start": {"dateTime": "2025-06-02T00:00:00Z"}, "end": {"dateTime": "2025-06-02T12:00:00+08:00"}
+        }, self.TZ)
+        meeting = Shift.from_event({"id": "e2", "summary": "會議", "start": {"dateTime": "2025-06-02T09:00:00"}}, self.TZ)
+        
+        # 驗證結果
+        self.assertEqual((shift.start, shift.end, shift.staff, shift.slot), (1748822400, 1748836800, "用戶A", "20250602 08:00"))
+        self.assertTrue(shift.is_shift)
+        self.assertFalse(hasattr(shift, "__dict__"))
+        self.assertEqual((meeting.staff, meeting.is_shift, meeting.end - meeting.start), ("會議", False, shifts.DEFAULT_DURATION))
+        self.assertIsNone(Shift.from_event({"id": "e3", "start": {"date": "2025-06-02"}}, self.TZ))
+        self.assertIsNone(Shift.from_event({"id": "e4", "status": "cancelled"}, self.TZ))
+    
+    def test_rows_round_trip_through_json(self):
+        """
+        測試排班以列保存，經過 JSON 後還原為相同的排班
+        """
+        original = TimeModel().parse_shifts([
+            {"id": "e1", "etag": "\"1\"", "summary": "班表: 用戶A", "start": {"dateTime": "2025-06-02T08:00:00+08:00"}},
+            {"id": "e2", "summary": "班表: 用戶B", "start": {"dateTime": "2025-06-02T13:00:00+08:00"}},
+        ])
+        restored = shifts_from_rows(json.loads(json.dumps(shifts_to_rows(original), ensure_ascii=False)))
+        
+        # 驗證結果
+        self.assertEqual(restored, original)
+        self.assertIsNone(restored[1].etag)
+    
+    def test_shared_cache_stores_shifts(self):
+        """
+        測試共享狀態的查詢快取保存排班，快取命中時不再解析事件時間
+        """
+        import main
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        service = MagicMock()
+        service.events.return_value.list.return_value.execute.return_value = {"items": [
+            {"id": "e1", "summary": "班表: 用戶A", "start": {"dateTime": "2025-06-02T08:00:00+08:00"}}
+        ]}
+        tenant = Tenant("store_shift", "calendar_shift", {}, lambda: service)
+        tenant.cache = SQLiteCache(SQLiteDatabase(os.path.join(temp_dir.name, "shared_state.db")), "cache:store_shift", 16)
+        main.setup_tenant(tenant)
+        
+        first = main.get_calendar_events("20250602", tenant)
+        with patch("shifts._parse", wraps=shifts._parse) as parse:
+            second = main.get_calendar_events("20250602", tenant)
+        
+        # 驗證結果
+        self.assertEqual(second, first)
+        self.assertEqual(parse.call_count, 0)
+        service.events.return_value.list.assert_called_once()
+        self.assertEqual(tenant.cache.get("shifts:20250602"), shifts_to_rows(first))
+    
+    def test_renderer_uses_local_slot(self):
+        """
+        測試排班表以當地時間顯示，日曆以 UTC 回傳的事件也顯示在正確的日期與時間
+        """
+        renderer = WeeklyScheduleRenderer()
+        events = [
+            {"id": "e1", "etag": "\"1\"", "summary": "班表: 用戶A", "start": {"dateTime": "2025-06-01T23:00:00Z"}},
+            {"id": "e2", "etag": "\"2\"", "summary": "班表: 用戶B", "start": {"dateTime": "2025-06-02T13:00:00+08:00"}},
+        ]
+        from_shifts = renderer.build_contents(TimeModel().parse_shifts(events))
+        from_events = renderer.build_contents(events)
+        texts = json.dumps(from_shifts, ensure_ascii=False)
+        
+        # 驗證結果
+        self.assertEqual(from_shifts, from_events)
+        self.assertIn("2025/06/02", texts)
+        self.assertNotIn("2025/06/01", texts)
+        self.assertIn("07:00", texts)
+    
+    def test_schedule_index_built_from_shift(self):
+        """
+        測試排班索引與查詢快取使用相同的解析結果
+        """
+        index = ScheduleIndex()
+        event = {"id": "e1", "summary": "班表: 用戶A", "start": {"dateTime": "2025-06-02T00:00:00Z"},
+                 "end": {"dateTime": "2025-06-02T04:00:00Z"}}
+        index.rebuild([event, {"id": "e2", "summary": "會議", "start": {"dateTime": "2025-06-02T01:00:00Z"}}])
+        shift = Shift.from_event(event, index.tz)
+        indexed, = index.query()
+        
+        # 驗證結果
+        self.assertEqual((indexed.start, indexed.end, indexed.staff, indexed.event_id), (shift.start, shift.end, shift.staff, shift.id))
+        self.assertEqual((indexed.weekday, indexed.minute_of_day), (0, 8 * 60))
+
+
+class TestHttpTransport(unittest.TestCase):
+    """
+    日曆 HTTP 傳輸 (共用連線池) 的測試，以本機的模擬 Calendar REST API 執行
+    """
+    def setUp(self):
+        self.server = start_fake_calendar(seed_calendar(6, 0))
+        self.addCleanup(self.server.shutdown)
+        self.options = {"api_endpoint": api_endpoint(self.server)}
+        self.transport = PooledHttp(pool_size=4, retries=0)
+        self.addCleanup(self.transport.close)
+    
+    def test_googleapiclient_executes_through_pool(self):
+        """
+        測試 googleapiclient 經由連線池執行請求，要求 gzip 壓縮並解壓縮回應，欄位遮罩照常套用
+        """
+        service = calendar_client.build(http=self.transport, client_options=self.options)
+        result = service.events().list(calendarId=CALENDAR_ID, singleEvents=True, fields="items(id,summary)").execute()
+        
+        # 驗證結果
+        self.assertEqual([item["id"] for item in result["items"]], [f"event{index}" for index in range(6)])
+        self.assertEqual(set(result["items"][0]), {"id", "summary"})
+        self.assertEqual(self.server.stats["gzip"], 1)
+    
+    def test_error_status_maps_to_http_error(self):
+        """
+        測試錯誤狀態碼轉換為 httplib2 相容的回應，googleapiclient 照常拋出 HttpError
+        """
+        from googleapiclient.errors import HttpError
+        service = calendar_client.build(http=self.transport, client_options=self.options)
+        
+        with self.assertRaises(HttpError) as context:
+            service.events().get(calendarId=CALENDAR_ID, eventId="missing").execute()
+        
+        # 驗證結果
+        self.assertEqual(context.exception.resp.status, 404)
+    
+    def test_shared_client_across_threads(self):
+        """
+        測試多個執行緒共用同一個客戶端，連線重複使用
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        service = calendar_client.build(http=self.transport, client_options=self.options)
+        
+        def list_events(_):
+            return len(service.events().list(calendarId=CALENDAR_ID).execute()["items"])
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            counts = list(executor.map(list_events, range(40)))
+        
+        # 驗證結果
+        self.assertEqual(counts, [6] * 40)
+        self.assertEqual(self.server.stats["requests"], 40)
+        self.assertLessEqual(self.server.stats["connections"], 4)
+        self.assertEqual(self.transport.connections_created, self.server.stats["connections"])
+    
+    def test_timeout_and_connection_errors(self):
+        """
+        測試讀取逾時拋出 TimeoutError，無法連線拋出 ConnectionError，斷路器計入失敗
+        """
+        slow = start_fake_calendar(seed_calendar(1, 0.5))
+        self.addCleanup(slow.shutdown)
+        transport = PooledHttp(read_timeout=0.1, retries=0)
+        self.addCleanup(transport.close)
+        host, port = self.server.server_address[:2]
+        self.server.shutdown()
+        self.server.server_close()
+        
+        # 驗證結果
+        with self.assertRaises(TimeoutError):
+            transport.request(api_endpoint(slow) + f"calendars/{CALENDAR_ID}/events")
+        with self.assertRaises(ConnectionError):
+            transport.request(f"http://{host}:{port}/calendar/v3/calendars/{CALENDAR_ID}/events")
+        self.assertTrue(is_service_failure(TimeoutError()))
+    
+    def test_build_uses_pooled_transport_when_enabled(self):
+        """
+        測試設置 CALENDAR_HTTP_TRANSPORT=pooled 時，以憑證建立的客戶端共用同一個連線池，預設仍使用 httplib2
+        """
+        import httplib2
+        from google.auth.credentials import AnonymousCredentials
+        
+        default = calendar_client.build(credentials=AnonymousCredentials())
+        with patch.object(http_transport, "CALENDAR_HTTP_TRANSPORT", "pooled"):
+            first = calendar_client.build(credentials=AnonymousCredentials())
+            second = calendar_client.build(credentials=AnonymousCredentials())
+        
+        # 驗證結果
+        self.assertIsInstance(default._http.http, httplib2.Http)
+        self.assertIs(first._http.http, http_transport.shared_transport())
+        self.assertIs(second._http.http, first._http.http)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,150 @@
+"""
+時間模型 - 以店家的時區 (zoneinfo) 計算日期與一週的查詢範圍，並將事件開始時間轉換為當地時間的時段 key；
+日期邊界表預先計算並快取，日曆查詢只涵蓋當地的完整日期，時段比對與日曆回傳的時差格式無關
+"""
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Iterable, Tuple, Union
+from zoneinfo import ZoneInfo
+
+from shifts import Shift, SLOT_FORMAT, parse_shifts
+
+# 預設時區
+DEFAULT_TIMEZONE = "Asia/Taipei"
+# 快取的日期邊界數上限
+BOUNDARY_CACHE_DAYS = 400
+# 建立時預先計算今天起的日期邊界天數
+PRECOMPUTE_DAYS = 35
+# 一週查詢涵蓋的天數 (今天到七天後)
+WEEK_DAYS = 8
+
+
+class TimeModel:
+    """
+    店家時區的時間模型
+    """
+    def __init__(self, timezone: str = DEFAULT_TIMEZONE, cache_days: int = BOUNDARY_CACHE_DAYS,
+                 precompute_days: int = PRECOMPUTE_DAYS):
+        """
+        Args:
+            timezone: IANA 時區名稱，例如 Asia/Taipei
+            cache_days: 快取的日期邊界數上限
+            precompute_days: 建立時預先計算今天起的日期邊界天數
+        """
+        self.name = timezone
+        self.tz = ZoneInfo(timezone)
+        self.cache_days = cache_days
+        # 日期 (YYYYMMDD) -> (當地 00:00, 隔天當地 00:00)，皆為含時差的 RFC3339
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+        self.precompute(self.today(), precompute_days)
+
+    def now(self, now: Optional[float] = None) -> datetime:
+        """
+        目前的當地時間
+        """
+        return datetime.fromtimestamp(now or time.time(), self.tz)
+
+    def today(self, now: Optional[float] = None) -> str:
+        """
+        當地的今天 (YYYYMMDD)
+        """
+        return self.now(now).strftime("%Y%m%d")
+
+    def precompute(self, date_str: str, days: int):
+        """
+        預先計算從指定日期起的日期邊界
+        """
+        day = datetime.strptime(date_str, "%Y%m%d")
+        for offset in range(days):
+            self.day_bounds((day + timedelta(days=offset)).strftime("%Y%m%d"))
+
+    def day_bounds(self, date_str: str) -> Tuple[str, str]:
+        """
+        取得當地日期的查詢範圍，遇到日光節約時間時一天不一定是 24 小時
+
+        Args:
+            date_str: 日期 (YYYYMMDD)
+
+        Returns:
+            (timeMin, timeMax)，timeMax 為隔天的當地 00:00 (日曆查詢不包含 timeMax)
+        """
+        with self._lock:
+            bounds = self._days.get(date_str)
+            if bounds is not None:
+                self._days.move_to_end(date_str)
+                return bounds
+        day = datetime.strptime(date_str, "%Y%m%d")
+        following = day + timedelta(days=1)
+        bounds = (
+            day.replace(tzinfo=self.tz).isoformat(),
+            following.replace(tzinfo=self.tz).isoformat()
+        )
+        with self._lock:
+            self._days[date_str] = bounds
+            while len(self._days) > self.cache_days:
+                self._days.popitem(last=False)
+        return bounds
+
+    def week_bounds(self, date_str: Optional[str] = None, days: int = WEEK_DAYS) -> Tuple[str, str]:
+        """
+        取得從指定日期 (預設今天) 起數天的查詢範圍
+
+        Returns:
+            (timeMin, timeMax)
+        """
+        date_str = date_str or self.today()
+        last_day = (datetime.strptime(date_str, "%Y%m%d") + timedelta(days=days - 1)).strftime("%Y%m%d")
+        return self.day_bounds(date_str)[0], self.day_bounds(last_day)[1]
+
+    def localize(self, date_str: str, time_str: str) -> datetime:
+        """
+        將當地的日期與時間轉換為含時區的 datetime
+
+        Args:
+            date_str: 日期 (YYYYMMDD)
+            time_str: 時間 (HH:MM)
+        """
+        return datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H:%M").replace(tzinfo=self.tz)
+
+    def to_local(self, value: Union[str, datetime]) -> datetime:
+        """
+        將 RFC3339 字串或 datetime 轉換為當地時間，未含時差的時間視為當地時間
+        """
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if value.tzinfo is None:
+            return value.replace(tzinfo=self.tz)
+        return value.astimezone(self.tz)
+
+    def slot_key(self, value: Union[str, datetime]) -> str:
+        """
+        時段 key (當地時間的 YYYYMMDD HH:MM)，相同時刻不論以 Z 或 +08:00 表示都得到相同的 key
+        """
+        return self.to_local(value).strftime(SLOT_FORMAT)
+
+    def parse_shifts(self, events: Iterable[Dict[str, Any]]) -> List[Shift]:
+        """
+        以店家時區解析日曆事件
+        """
+        return parse_shifts(events, self.tz)
+
+    def find_slot(self, shifts: Iterable[Shift], date_str: str, time_str: str) -> Optional[Shift]:
+        """
+        找出開始於指定當地時段的排班
+
+        Args:
+            shifts: 排班列表
+            date_str: 日期 (YYYYMMDD)
+            time_str: 時間 (HH:MM)
+
+        Returns:
+            排班，沒有時為 None
+        """
+        target = self.slot_key(self.localize(date_str, time_str))
+        for shift in shifts:
+            if shift.slot == target:
+                return shift
+        return None
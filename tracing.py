@@ -0,0 +1,331 @@
+"""
+追蹤模組 - 與 OpenTelemetry 相容的 span 模型，可輸出到本地 JSONL 檔案或 OTLP/HTTP 收集器
+"""
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import functools
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Callable
+
+# 追蹤輸出方式: 空字串 (停用)、jsonl (本地檔案)、otlp (OTLP/HTTP JSON 收集器)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_ENDPOINT = os.getenv("TRACING_ENDPOINT", "http://localhost:4318/v1/traces")
+# 追蹤的取樣比例 (0-1)，以 trace 為單位決定
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "lineswift")
+
+# span 種類 (與 OpenTelemetry SpanKind 數值一致)
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+# span 狀態 (與 OpenTelemetry StatusCode 數值一致)
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# 批次輸出設定
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL_SECONDS = 2.0
+EXPORT_QUEUE_SIZE = 4096
+
+# 目前的 span
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    追蹤區段 - 記錄一個處理階段的開始、結束時間與屬性
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "sampled")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None, sampled: bool = True):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = str(error)
+        self.attributes["exception.type"] = type(error).__name__
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        轉換為 OTLP/JSON 的 span 格式
+        """
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status_message else {"code": self.status},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+class InMemoryExporter:
+    """
+    記憶體輸出 - 保留已結束的 span，用於測試
+    """
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans: List[Span]):
+        self.spans.extend(spans)
+
+    def clear(self):
+        self.spans = []
+
+    def names(self) -> List[str]:
+        return [span.name for span in self.spans]
+
+
+class JsonlFileExporter:
+    """
+    JSONL 檔案輸出 - 每個 span 一行 OTLP/JSON
+    """
+    def __init__(self, path: str = TRACING_FILE, service_name: str = TRACING_SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                entry = span.to_otlp()
+                entry["service"] = self.service_name
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class OtlpHttpExporter:
+    """
+    OTLP/HTTP 輸出 - 以 JSON 格式送到 OpenTelemetry 收集器
+    """
+    def __init__(self, endpoint: str = TRACING_ENDPOINT, service_name: str = TRACING_SERVICE_NAME, timeout: float = 5):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans: List[Span]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "lineswift.tracing"}, "spans": [span.to_otlp() for span in spans]}]
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """
+    批次處理器 - 由背景執行緒批次輸出 span，請求路徑上只需放入佇列
+    """
+    def __init__(self, exporter: Any, batch_size: int = EXPORT_BATCH_SIZE,
+                 interval: float = EXPORT_INTERVAL_SECONDS, queue_size: int = EXPORT_QUEUE_SIZE):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self):
+        self._stopped.set()
+        self._thread.join(timeout=self.interval + 1)
+        self._flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._stopped.wait(self.interval)
+            self._flush()
+
+    def _flush(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                self.exporter.export(batch)
+            except Exception:
+                # 追蹤輸出失敗不影響服務，丟棄此批次
+                self.dropped += len(batch)
+
+
+class SimpleSpanProcessor:
+    """
+    同步處理器 - span 結束時立即輸出，用於測試
+    """
+    def __init__(self, exporter: Any):
+        self.exporter = exporter
+
+    def on_end(self, span: Span):
+        self.exporter.export([span])
+
+    def shutdown(self):
+        pass
+
+
+class Tracer:
+    """
+    追蹤器 - 建立 span 並維護目前 span 的上下文
+    """
+    def __init__(self, processor: Any = None, sample_rate: float = TRACING_SAMPLE_RATE):
+        self.processor = processor
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self) -> bool:
+        return self.processor is not None
+
+    @contextmanager
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        """
+        開始一個 span 並設為目前 span，區塊結束時記錄結束時間
+
+        Example:
+            with tracer.start_span("swap_shifts", attributes={"date": date_str}) as span:
+                ...
+        """
+        if self.processor is None:
+            yield None
+            return
+
+        parent = _current_span.get()
+        if parent is not None:
+            span = Span(name, parent.trace_id, parent.span_id, kind, attributes, parent.sampled)
+        else:
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+            span = Span(name, "%032x" % random.getrandbits(128), None, kind, attributes, sampled)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if span.sampled:
+                self.processor.on_end(span)
+
+    def shutdown(self):
+        if self.processor is not None:
+            self.processor.shutdown()
+
+
+def start_span(name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+    """
+    以應用程式共用的追蹤器開始 span
+    """
+    return tracer.start_span(name, kind, attributes)
+
+
+def current_span() -> Optional[Span]:
+    """
+    取得目前的 span
+    """
+    return _current_span.get()
+
+
+def create_tracer(exporter_name: str = TRACING_EXPORTER) -> Tracer:
+    """
+    依設定建立追蹤器
+
+    Args:
+        exporter_name: jsonl、otlp 或空字串 (停用)
+    """
+    if exporter_name == "jsonl":
+        return Tracer(BatchSpanProcessor(JsonlFileExporter()))
+    if exporter_name == "otlp":
+        return Tracer(BatchSpanProcessor(OtlpHttpExporter()))
+    return Tracer()
+
+
+# 應用程式共用的追蹤器
+tracer = create_tracer()
+atexit.register(lambda: tracer.shutdown())
+
+
+def traced(name: Optional[str] = None, kind: int = KIND_INTERNAL) -> Callable:
+    """
+    以 span 包裝函數的裝飾器
+
+    Example:
+        @traced("swap_shifts")
+        def swap_shifts(...):
+            ...
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # 停用追蹤時直接呼叫，不產生額外負擔
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.start_span(span_name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
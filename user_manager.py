@@ -15,11 +15,12 @@ class UserManager:
     """
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
-        self._init_db()
+        # 第一次查詢時才建立資料表，避免匯入時執行 DDL
+        self._initialized = False
     
-    def _init_db(self):
+    def init_db(self):
         """
-        初始化資料庫
+        建立資料表 (已存在時不變更)，一般在第一次查詢時自動呼叫，部署時可預先執行
         """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -36,13 +37,22 @@ class UserManager:
         
         conn.commit()
         conn.close()
+        self._initialized = True
+    
+    def _connect(self) -> sqlite3.Connection:
+        """
+        連線資料庫，第一次連線前先初始化資料表
+        """
+        if not self._initialized:
+            self.init_db()
+        return sqlite3.connect(self.db_path)
     
     def add_user(self, user_id: str, display_name: str, is_admin: bool = False) -> bool:
         """
         添加新用戶
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
@@ -62,7 +72,7 @@ class UserManager:
         設置用戶管理員權限
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
@@ -86,7 +96,7 @@ class UserManager:
         檢查用戶是否為管理員
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
@@ -107,7 +117,7 @@ class UserManager:
         檢查用戶是否存在
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
@@ -128,7 +138,7 @@ class UserManager:
         獲取用戶顯示名稱
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
@@ -149,7 +159,7 @@ class UserManager:
         通過顯示名稱獲取用戶 ID
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
@@ -170,7 +180,7 @@ class UserManager:
         獲取所有管理員
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute(
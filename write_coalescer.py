@@ -0,0 +1,171 @@
+"""
+日曆寫入合併模組 - 同一店家同一時段在短時間內的多次寫入 (連續新增排班、新增後立即批准換班) 先放入緩衝，
+到期時合併為一次日曆寫入，再將寫入結果分別通知每個指令的發送者
+"""
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Any, Callable, Hashable, NamedTuple, Tuple
+
+from metrics import registry
+from structured_log import get_logger
+
+# 合併寫入的等待時間（秒），0 表示不合併，每個指令立即寫入
+CALENDAR_WRITE_COALESCE_WINDOW = float(os.getenv("CALENDAR_WRITE_COALESCE_WINDOW", "0"))
+
+COALESCED_MUTATIONS = registry.counter("calendar_write_mutations_total", "放入寫入緩衝的時段變更數")
+COALESCED_WRITES = registry.counter("calendar_coalesced_writes_total", "合併後實際送出的日曆寫入數", ("outcome",))
+WRITES_SAVED = registry.counter("calendar_writes_saved_total", "因合併而省下的日曆寫入數")
+
+logger = get_logger("write_coalescer")
+
+
+class SlotMutation(NamedTuple):
+    """
+    單一指令對時段的變更
+    """
+    # 變更後的排班人員
+    staff: str
+    # 附加到事件描述的換班歷史
+    history: str
+    # 時段沒有事件時使用的描述
+    description: Optional[str] = None
+    # 結束時間 (ISO 格式)，None 表示維持原事件的結束時間
+    end_time: Optional[str] = None
+
+
+class SlotWrite(NamedTuple):
+    """
+    合併後的時段寫入
+    """
+    staff: str
+    history: List[str]
+    description: Optional[str]
+    end_time: Optional[str]
+    mutations: int
+
+
+def merge_mutations(mutations: List[SlotMutation]) -> SlotWrite:
+    """
+    依序合併同一時段的變更 - 排班人員與結束時間以最後一次為準，換班歷史全部保留
+
+    Args:
+        mutations: 依提交順序排列的變更
+
+    Returns:
+        合併後的寫入
+    """
+    history = []
+    description = None
+    end_time = None
+    for mutation in mutations:
+        if mutation.history not in history:
+            history.append(mutation.history)
+        if description is None:
+            description = mutation.description
+        if mutation.end_time is not None:
+            end_time = mutation.end_time
+    return SlotWrite(mutations[-1].staff, history, description, end_time, len(mutations))
+
+
+class _PendingSlot:
+    __slots__ = ("due_at", "mutations", "callbacks")
+
+    def __init__(self, due_at: float):
+        self.due_at = due_at
+        self.mutations = []
+        self.callbacks = []
+
+
+class CalendarWriteBuffer:
+    """
+    時段寫入緩衝 - 時段第一次變更後 window 秒到期，期間的變更合併為一次寫入；
+    等待時間不因後續變更延長，指令的回覆最多延遲 window 秒
+    """
+    def __init__(self, write: Callable[[Hashable, SlotWrite], Tuple[bool, str]],
+                 window: float = CALENDAR_WRITE_COALESCE_WINDOW):
+        """
+        Args:
+            write: 寫入函數 (時段, 合併後的寫入)，回傳 (是否成功, 訊息)
+            window: 合併寫入的等待時間（秒）
+        """
+        self.write = write
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+        # 累計的變更數、實際寫入數與省下的寫入數
+        self._stats = {"mutations": 0, "writes": 0, "saved": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def submit(self, slot: Hashable, mutation: SlotMutation, on_done: Callable[[bool, str], Any],
+               now: Optional[float] = None):
+        """
+        將變更放入緩衝
+
+        Args:
+            slot: 時段，例如 (店家 ID, 日曆 ID, 日期, 時間)
+            mutation: 變更
+            on_done: 寫入後以 (是否成功, 訊息) 呼叫
+        """
+        now = now or time.time()
+        with self._lock:
+            pending = self._pending.get(slot)
+            if pending is None:
+                pending = self._pending[slot] = _PendingSlot(now + self.window)
+            pending.mutations.append(mutation)
+            pending.callbacks.append(on_done)
+            self._stats["mutations"] += 1
+        COALESCED_MUTATIONS.inc()
+
+    def flush_due(self, now: Optional[float] = None, force: bool = False) -> int:
+        """
+        寫入到期的時段
+
+        Args:
+            force: 不論是否到期全部寫入 (服務關閉時使用)
+
+        Returns:
+            寫入的時段數
+        """
+        now = now or time.time()
+        with self._lock:
+            due = [slot for slot, pending in self._pending.items() if force or pending.due_at <= now]
+            flushing = [(slot, self._pending.pop(slot)) for slot in due]
+        for slot, pending in flushing:
+            self._flush(slot, pending)
+        return len(flushing)
+
+    def _flush(self, slot: Hashable, pending: _PendingSlot):
+        merged = merge_mutations(pending.mutations)
+        try:
+            success, message = self.write(slot, merged)
+        except Exception as e:
+            logger.error("合併寫入日曆時發生錯誤: %s", e, extra={"slot": str(slot)})
+            success, message = False, f"寫入日曆時發生錯誤: {str(e)}"
+        COALESCED_WRITES.inc(outcome="ok" if success else "error")
+        WRITES_SAVED.inc(merged.mutations - 1)
+        with self._lock:
+            self._stats["writes"] += 1
+            self._stats["saved"] += merged.mutations - 1
+        if merged.mutations > 1:
+            logger.info("已合併時段寫入", extra={"slot": str(slot), "mutations": merged.mutations,
+                                             "saved": merged.mutations - 1})
+        for on_done in pending.callbacks:
+            try:
+                on_done(success, message)
+            except Exception as e:
+                logger.error("通知寫入結果時發生錯誤: %s", e, extra={"slot": str(slot)})
+
+    def stats(self) -> Dict[str, int]:
+        """
+        累計的變更數、實際寫入數與省下的寫入數
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)